@@ -1,33 +1,49 @@
 from __future__ import annotations
 
+import asyncio
+import copy
 import json
 import os
 import shutil
 import uuid
 import hashlib
-from typing import Optional
+from typing import BinaryIO, Optional
 
-from fastapi import APIRouter, HTTPException, Request, UploadFile, File, Form
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, HTTPException, Request, Response, UploadFile, File, Form
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, StreamingResponse
 
 from .schemas import (
     VoiceChangerRequest,
     VoiceChangerResponse,
+    VoiceChangerBatchRequest,
+    VoiceChangerBatchItem,
+    VoiceChangerBatchResponse,
     VoiceInfo,
     VoicesResponse,
     CapabilitiesResponse,
     TaskInfoResponse,
+    TaskStatus,
 )
 
 from app.config.settings import RUNS_BASE_DIR
 from app.config.settings import OUTPUTS_DIR
 from app.core.artifacts import Artifact, TaskContext
-from app.core.pipeline import Pipeline
+from app.core.cancellation import CLIENT_DISCONNECTED, DEADLINE_EXCEEDED, CancelToken, TaskCancelled
+from app.core.executors import get_executor
+from app.core.jobs import JobQueueFull, async_enabled, get_job_runner, get_job_store, valid_task_id
+from app.core.pipeline import Pipeline, async_pipeline_enabled
+from app.core.progress import ProgressReporter
+from app.core.profiling import PROFILE_TOKEN_HEADER, profile_requested, profiling_allowed
 from app.steps.standardize import StandardizeStep
 from app.steps.voice_change import VoiceChangeStep
 from app.steps.export import ExportStep
-from app.services.media_probe import probe_duration_seconds, MediaProbeError
+from app.services.media_probe import probe_media, MediaInfo, MediaProbeError
 from app.services.providers.funny_voice import FunnyVoiceProvider
+from app.services import input_store
+from app.services.audio_formats import OUTPUT_FORMATS, QUALITY_PRESETS, available_formats, resolve_bitrate
+from app.services.capabilities import get_capabilities
+from app.services.result_cache import cache_enabled, cache_key, get_result_cache
 from app.api.voice_library.routes import record_voice_used
 from app.voice_library.user_voices import get_user_voices_by_ids
 
@@ -95,6 +111,73 @@ def _get_upload_limits() -> tuple[int, float, float]:
     return max_bytes, min_dur, max_dur
 
 
+def _check_duration(ctx: TaskContext, dur: Optional[float], min_dur: float, max_dur: float) -> None:
+    """Record the probed duration and enforce strict bounds (min_dur < dur < max_dur)."""
+    # Require duration to be known to enforce limits.
+    if dur is None:
+        raise HTTPException(
+            status_code=400,
+            detail="Cannot determine media duration. Please upload a valid audio file.",
+        )
+
+    ctx.debug.setdefault("probe", {})
+    ctx.debug["probe"].update(
+        {
+            "duration_sec": dur,
+            "min_duration_sec": min_dur,
+            "max_duration_sec": max_dur,
+        }
+    )
+
+    # Enforce strict bounds: duration must be > 5s and < 5min.
+    if dur <= min_dur:
+        raise HTTPException(
+            status_code=400,
+            detail=f"File too short: {dur:.2f}s. Min is {min_dur:g}s (must be greater than {min_dur:g}s).",
+        )
+
+    if dur >= max_dur:
+        raise HTTPException(
+            status_code=400,
+            detail=f"File too long: {dur:.2f}s. Max is {max_dur:g}s (must be less than {max_dur:g}s).",
+        )
+
+
+def _save_upload(src: BinaryIO, in_path: str, max_bytes: int) -> tuple[int, str]:
+    """
+    Stream an upload to disk in chunks, enforcing max_bytes.
+    Returns (bytes written, sha256 hex of the content) — the hash feeds the result cache.
+    """
+    total = 0
+    digest = hashlib.sha256()
+    chunk_size = 1024 * 1024
+    with open(in_path, "wb") as out_f:
+        while True:
+            chunk = src.read(chunk_size)
+            if not chunk:
+                break
+            total += len(chunk)
+            if total > max_bytes:
+                out_f.close()
+                # Clean up partial file
+                try:
+                    os.remove(in_path)
+                except Exception:
+                    pass
+                raise HTTPException(
+                    status_code=413,
+                    detail={
+                        "error": "file_too_large",
+                        "received_bytes": total,
+                        "max_bytes": max_bytes,
+                        "suggestion": "Reduce file size or increase UPLOAD_MAX_BYTES",
+                    },
+                )
+            digest.update(chunk)
+            out_f.write(chunk)
+    return total, digest.hexdigest()
+
+
 def _funny_voice_infos() -> list[VoiceInfo]:
     # Keep this aligned with the React UI defaults.
     catalog: dict[str, dict[str, str]] = {
@@ -152,46 +235,90 @@ async def capabilities() -> CapabilitiesResponse:
     max_bytes, min_dur, max_dur = _get_upload_limits()
     return CapabilitiesResponse(
         voices=_funny_voice_infos(),
-        output_formats=["mp3", "wav"],
+        output_formats=available_formats(),
+        audio_quality_presets=list(QUALITY_PRESETS),
         upload_max_bytes=max_bytes,
         allowed_content_types=_get_allowed_content_types(),
         upload_min_duration_sec=min_dur,
         upload_max_duration_sec=max_dur,
-        async_mode=False,
+        async_mode=async_enabled(),
+        media_tools=get_capabilities().snapshot(),
     )
 
 
 @router.get("/tasks/{task_id}", response_model=TaskInfoResponse)
 async def get_task(task_id: str) -> TaskInfoResponse:
-    # Synchronous pipeline publishes outputs named {task_id}.(mp3|wav) in OUTPUTS_DIR.
-    mp3_path = os.path.join(OUTPUTS_DIR, f"{task_id}.mp3")
-    wav_path = os.path.join(OUTPUTS_DIR, f"{task_id}.wav")
-
-    if os.path.isfile(mp3_path):
-        return TaskInfoResponse(task_id=task_id, status="success", output_url=f"/outputs/{task_id}.mp3")
-    if os.path.isfile(wav_path):
-        return TaskInfoResponse(task_id=task_id, status="success", output_url=f"/outputs/{task_id}.wav")
-    return TaskInfoResponse(task_id=task_id, status="not_found", output_url=None)
+    _require_task_id(task_id)
+    return _task_info(task_id)
 
 
-@router.post("", response_model=VoiceChangerResponse)
-async def voice_changer(
-    request: Request,
-    file: Optional[UploadFile] = File(default=None),
-    payload: Optional[str] = Form(default=None),
-) -> VoiceChangerResponse:
+def _task_events_poll_seconds() -> float:
+    try:
+        return max(0.05, float(os.getenv("VC_TASK_EVENTS_POLL_SEC", "0.5")))
+    except Exception:
+        return 0.5
+
+
+@router.get("/tasks/{task_id}/events")
+async def task_events(task_id: str, request: Request) -> StreamingResponse:
     """
-    Synchronous endpoint supporting two input modes:
-    - JSON body: VoiceChangerRequest
-    - multipart/form-data: fields 'file' (UploadFile) + 'payload' (JSON string)
+    Server-Sent Events stream of the task status: one `status` event (the same JSON as
+    GET /voice-changer/tasks/{task_id}) whenever the record changes, including progress
+    updates, until the task succeeds, fails or turns out not to exist.
     """
-    task_id = str(uuid.uuid4())
+    _require_task_id(task_id)
+    interval = _task_events_poll_seconds()
 
-    # Build task context early
+    async def _events():
+        last = None
+        idle_sec = 0.0
+        while True:
+            info = _task_info(task_id)
+            data = info.model_dump_json()
+            if data != last:
+                last, idle_sec = data, 0.0
+                yield f"event: status\ndata: {data}\n\n"
+            elif idle_sec >= 15.0:
+                # Comment line: keeps proxies from closing an idle stream.
+                idle_sec = 0.0
+                yield ": keep-alive\n\n"
+            if info.status in {TaskStatus.SUCCESS, TaskStatus.FAILED, "not_found"}:
+                return
+            if await request.is_disconnected():
+                return
+            await asyncio.sleep(interval)
+            idle_sec += interval
+
+    return StreamingResponse(
+        _events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def _require_task_id(task_id: str) -> None:
+    # The id is joined into runs/<id>/ and outputs/<id>.<fmt>: only accept the uuids we hand out.
+    if not valid_task_id(task_id):
+        raise HTTPException(status_code=404, detail="Task not found")
+
+
+def _task_info(task_id: str) -> TaskInfoResponse:
+    # Async jobs keep a status record in their task directory.
+    record = get_job_store().get(task_id)
+    if record is not None:
+        return TaskInfoResponse.model_validate(record)
+
+    # Synchronous pipeline publishes outputs named {task_id}.<format> in OUTPUTS_DIR.
+    for fmt in OUTPUT_FORMATS:
+        if os.path.isfile(os.path.join(OUTPUTS_DIR, f"{task_id}.{fmt}")):
+            return TaskInfoResponse(task_id=task_id, status=TaskStatus.SUCCESS, output_url=f"/outputs/{task_id}.{fmt}")
+    return TaskInfoResponse(task_id=task_id, status="not_found", output_url=None)
+
+
+def _new_task_context(task_id: str) -> TaskContext:
     task_dir = os.path.join(RUNS_BASE_DIR, task_id)
     os.makedirs(task_dir, exist_ok=True)
-
-    ctx = TaskContext(
+    return TaskContext(
         task_id=task_id,
         task_dir=task_dir,
         voice_id="",
@@ -205,143 +332,105 @@ async def voice_changer(
         cleanup_mode="none",  # keep outputs by default (you can change later)
     )
 
-    # Parse input according to content type
-    parsed: VoiceChangerRequest
-    initial_artifact = Artifact(path="", mime="application/octet-stream", meta={"source": "none"})
 
-    try:
-        if file is not None or payload is not None:
-            # multipart mode
-            if not payload:
-                raise HTTPException(status_code=400, detail="Missing payload in form data")
+def _stored_or_probed(in_path: str, content_sha256: str) -> tuple[Optional[MediaInfo], Optional[float], bool]:
+    """
+    (media, duration, from input store). Content seen before reuses its probed duration instead
+    of spawning ffprobe; otherwise probe once. Both touch the disk: call it on the pipeline executor.
+    """
+    stored = input_store.get(content_sha256)
+    if stored is not None and stored.duration_sec is not None:
+        return MediaInfo.from_dict(stored.meta.get("media")), stored.duration_sec, True
+    media = probe_media(in_path)
+    return media, media.duration_sec, False
 
-            data = json.loads(payload)
-            parsed = VoiceChangerRequest.model_validate(data)
 
-            if file is not None:
-                ext = os.path.splitext(file.filename or "")[1].lower() or ".bin"
-                in_path = os.path.join(task_dir, f"input{ext}")
-                # Validate content type against whitelist
-                allowed_set = set(_get_allowed_content_types())
-
-                content_type = (file.content_type or "").lower()
-                if content_type not in allowed_set:
-                    raise HTTPException(
-                        status_code=415,
-                        detail={
-                            "error": "unsupported_media_type",
-                            "content_type": content_type or None,
-                            "allowed": sorted(list(allowed_set)),
-                            "suggestion": "Use audio/wav or audio/mpeg, or set ALLOWED_CONTENT_TYPES",
-                        },
-                    )
-                # Stream save with size limit to avoid large memory usage
-                max_bytes, min_dur, max_dur = _get_upload_limits()
-
-                total = 0
-                chunk_size = 1024 * 1024
-                with open(in_path, "wb") as out_f:
-                    # Use underlying spooled file for efficient streaming
-                    while True:
-                        chunk = file.file.read(chunk_size)
-                        if not chunk:
-                            break
-                        total += len(chunk)
-                        if total > max_bytes:
-                            # Clean up partial file
-                            try:
-                                os.remove(in_path)
-                            except Exception:
-                                pass
-                            raise HTTPException(
-                                status_code=413,
-                                detail={
-                                    "error": "file_too_large",
-                                    "received_bytes": total,
-                                    "max_bytes": max_bytes,
-                                    "suggestion": "Reduce file size or increase UPLOAD_MAX_BYTES",
-                                },
-                            )
-                        out_f.write(chunk)
-
-                # ---- duration limit (<= 5 min) ----
-                try:
-                    dur = probe_duration_seconds(in_path)
-                except MediaProbeError as e:
-                    raise HTTPException(status_code=400, detail=f"Cannot read media duration: {e}")
-
-                # Require duration to be known to enforce limits.
-                if dur is None:
-                    raise HTTPException(
-                        status_code=400,
-                        detail="Cannot determine media duration. Please upload a valid audio file.",
-                    )
+async def _receive_upload(ctx: TaskContext, file: UploadFile) -> Artifact:
+    """Validate + save an uploaded file into the task dir and enforce size/duration limits."""
+    ext = os.path.splitext(file.filename or "")[1].lower() or ".bin"
+    in_path = os.path.join(ctx.task_dir, f"input{ext}")
+    # Validate content type against whitelist
+    allowed_set = set(_get_allowed_content_types())
 
-                ctx.debug.setdefault("probe", {})
-                ctx.debug["probe"].update(
-                    {
-                        "duration_sec": dur,
-                        "min_duration_sec": min_dur,
-                        "max_duration_sec": max_dur,
-                    }
-                )
+    content_type = (file.content_type or "").lower()
+    if content_type not in allowed_set:
+        raise HTTPException(
+            status_code=415,
+            detail={
+                "error": "unsupported_media_type",
+                "content_type": content_type or None,
+                "allowed": sorted(list(allowed_set)),
+                "suggestion": "Use audio/wav or audio/mpeg, or set ALLOWED_CONTENT_TYPES",
+            },
+        )
+    # Stream save with size limit to avoid large memory usage
+    max_bytes, min_dur, max_dur = _get_upload_limits()
 
-                # Enforce strict bounds: duration must be > 5s and < 5min.
-                if dur <= min_dur:
-                    raise HTTPException(
-                        status_code=400,
-                        detail=f"File too short: {dur:.2f}s. Min is {min_dur:g}s (must be greater than {min_dur:g}s).",
-                    )
+    # Disk I/O runs off the event loop (Starlette threadpool).
+    total, content_sha256 = await run_in_threadpool(_save_upload, file.file, in_path, max_bytes)
 
-                if dur >= max_dur:
-                    raise HTTPException(
-                        status_code=400,
-                        detail=f"File too long: {dur:.2f}s. Max is {max_dur:g}s (must be less than {max_dur:g}s).",
-                    )
+    # ---- duration limit (<= 5 min) ----
+    # The MediaInfo travels in Artifact.meta["media"] for later steps.
+    try:
+        media, dur, from_store = await get_executor("pipeline").run(_stored_or_probed, in_path, content_sha256)
+    except MediaProbeError as e:
+        raise HTTPException(status_code=400, detail=f"Cannot read media duration: {e}")
+    if from_store:
+        ctx.debug.setdefault("probe", {})["source"] = "input_store"
+    _check_duration(ctx, dur, min_dur, max_dur)
+    if media is not None:
+        ctx.debug["input_media"] = {**media.to_dict(), "duration_seconds": media.duration_sec}
 
-                # register input as artifact
-                ctx.register(in_path)
-                initial_artifact = Artifact(
-                    path=in_path,
-                    mime=(file.content_type or "application/octet-stream"),
-                    meta={"source": "upload", "filename": file.filename, "size": total},
-                )
+    # register input as artifact
+    ctx.register(in_path)
 
-                ctx.debug.setdefault("upload", {})
-                ctx.debug["upload"].update(
-                    {
-                        "filename": file.filename,
-                        "size": total,
-                        "content_type": file.content_type,
-                        "max_bytes": max_bytes,
-                        "allowed_content_types": sorted(list(allowed_set)),
-                    }
-                )
-            else:
-                # payload only (no file) - allow for debug usage
-                ctx.debug.setdefault("upload", {})
-                ctx.debug["upload"].update({"note": "payload provided but file missing"})
-        else:
-            # JSON mode
-            data = await request.json()
-            parsed = VoiceChangerRequest.model_validate(data)
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Invalid request: {e}")
+    ctx.debug.setdefault("upload", {})
+    ctx.debug["upload"].update(
+        {
+            "filename": file.filename,
+            "size": total,
+            "sha256": content_sha256,
+            "content_type": file.content_type,
+            "max_bytes": max_bytes,
+            "allowed_content_types": sorted(list(allowed_set)),
+        }
+    )
+    return Artifact(
+        path=in_path,
+        mime=(file.content_type or "application/octet-stream"),
+        meta={
+            "source": "upload",
+            "filename": file.filename,
+            "size": total,
+            "sha256": content_sha256,
+            "media": media.to_dict() if media is not None else None,
+        },
+    )
 
-    # Fill ctx from parsed
-    selected_voice_id = str(parsed.voice_id or "")
-    ctx.voice_id = selected_voice_id
-    ctx.stability = int(parsed.stability)
-    ctx.similarity = int(parsed.similarity)
-    ctx.output_format = str(parsed.output_format).lower().strip()
-    ctx.preset_id = parsed.preset_id
-    ctx.webhook_url = parsed.webhook_url
-    ctx.options = parsed.options or {}
 
-    # Identify user once (used by recent-used + resolving user voices)
-    user_id: Optional[str] = None
+def _artifact_from_input_id(ctx: TaskContext, input_id: str) -> Artifact:
+    """Reuse a previous upload's standardized audio (no re-upload / re-probe / re-transcode). Reads the store: run off the loop."""
+    stored = input_store.get(str(input_id).strip().lower())
+    if stored is None:
+        raise HTTPException(
+            status_code=404,
+            detail="Unknown or expired input_id. Please upload the file again.",
+        )
+    _, min_dur, max_dur = _get_upload_limits()
+    ctx.debug.setdefault("probe", {})["source"] = "input_store"
+    _check_duration(ctx, stored.duration_sec, min_dur, max_dur)
+    ctx.debug.setdefault("upload", {}).update({"input_id": stored.input_id, "note": "reused stored input"})
+    return Artifact(
+        path=stored.wav_path,
+        mime="audio/wav",
+        meta={"source": "input_store", "sha256": stored.input_id, "size": stored.meta.get("size")},
+    )
+
+
+def _user_id_from_request(request: Request) -> Optional[str]:
+    # Supported headers:
+    # - Authorization: Bearer <user_id>
+    # - X-User-Id: <user_id>
     try:
         user_id = request.headers.get("x-user-id")
         if not user_id:
@@ -350,9 +439,110 @@ async def voice_changer(
                 parts = auth.split()
                 if len(parts) == 2 and parts[0].lower() == "bearer":
                     user_id = parts[1].strip() or None
+        return user_id or None
+    except Exception:
+        return None
+
+
+def _apply_request(ctx: TaskContext, parsed: VoiceChangerRequest) -> None:
+    """Fill ctx from parsed request params."""
+    ctx.voice_id = str(parsed.voice_id or "")
+    ctx.stability = int(parsed.stability)
+    ctx.similarity = int(parsed.similarity)
+    ctx.output_format = str(parsed.output_format).lower().strip()
+    if parsed.output_formats:
+        formats = [str(f).lower().strip() for f in parsed.output_formats]
+        if "output_format" not in parsed.model_fields_set:
+            ctx.output_format = formats[0]
+        ctx.output_formats = list(dict.fromkeys([ctx.output_format] + formats))
+    ctx.preset_id = parsed.preset_id
+    ctx.webhook_url = parsed.webhook_url
+    ctx.options = parsed.options or {}
+
+    # Option key compatibility: frontend uses remove_noise; ElevenLabs provider uses remove_background_noise.
+    # Keep both accepted.
+    if isinstance(ctx.options, dict):
+        if "remove_background_noise" not in ctx.options and "remove_noise" in ctx.options:
+            ctx.options["remove_background_noise"] = ctx.options.get("remove_noise")
+
+    if ctx.output_format not in OUTPUT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Invalid output_format: {ctx.output_format}. Must be one of {'/'.join(OUTPUT_FORMATS)}.")
+    try:
+        for fmt in ctx.output_formats or [ctx.output_format]:
+            resolve_bitrate(fmt, ctx.options.get("audio_quality"), ctx.options.get("bitrate"))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid options: {e}")
+
+
+def _apply_deadline(ctx: TaskContext, options: Optional[dict]) -> None:
+    """
+    options.deadline_ms: abandon the task (HTTP 504) if it isn't done this long after the request
+    was parsed. Queued jobs restart it when a worker picks them up (see _run_queued).
+    """
+    raw = options.get("deadline_ms") if isinstance(options, dict) else None
+    if raw is None:
+        return
+    try:
+        deadline_ms = int(raw)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail=f"Invalid options.deadline_ms: {raw!r}")
+    if deadline_ms <= 0:
+        raise HTTPException(status_code=400, detail="options.deadline_ms must be a positive integer")
+    ctx.cancel_token.set_deadline(deadline_ms / 1000.0)
+    ctx.debug["deadline_ms"] = deadline_ms
+
+
+def _disconnect_poll_seconds() -> float:
+    try:
+        return max(0.05, float(os.getenv("VC_DISCONNECT_POLL_SEC", "0.5")))
     except Exception:
-        user_id = None
+        return 0.5
+
+
+async def _watch_disconnect(request: Request, token: CancelToken) -> None:
+    """Fire token when the client goes away, so the pipeline stops and kills its ffmpeg children."""
+    interval = _disconnect_poll_seconds()
+    while not token.cancelled:
+        if await request.is_disconnected():
+            token.cancel(CLIENT_DISCONNECTED)
+            return
+        await asyncio.sleep(interval)
 
+
+async def _run_cancellable(request: Request, token: CancelToken, fn, *args, **kwargs):
+    """Run fn on the pipeline executor (or await it, for a coroutine function) while watching for a client disconnect."""
+    watcher = asyncio.ensure_future(_watch_disconnect(request, token))
+    try:
+        if asyncio.iscoroutinefunction(fn):
+            return await fn(*args, **kwargs)
+        return await get_executor("pipeline").run(fn, *args, **kwargs)
+    except asyncio.CancelledError:
+        token.cancel(CLIENT_DISCONNECTED)
+        raise
+    finally:
+        watcher.cancel()
+
+
+def _cancelled_http_error(ctx: TaskContext, e: TaskCancelled) -> HTTPException:
+    ctx.debug["cancelled"] = {"reason": e.reason}
+    if e.reason == DEADLINE_EXCEEDED:
+        return HTTPException(status_code=504, detail="Deadline exceeded (options.deadline_ms)")
+    # nginx's "client closed request"; nobody reads it, but it keeps logs/metrics honest.
+    return HTTPException(status_code=499, detail="Client disconnected")
+
+
+def _apply_profiling(ctx: TaskContext, request: Request) -> None:
+    """options.debug.profile=true profiles the pipeline, for callers presenting VC_PROFILE_TOKEN only."""
+    if not profile_requested(ctx.options):
+        return
+    if profiling_allowed(request.headers.get(PROFILE_TOKEN_HEADER)):
+        ctx.profile = True
+    else:
+        ctx.debug["profile"] = {"enabled": False, "reason": "missing or wrong X-Profile-Token"}
+
+
+def _resolve_voice(ctx: TaskContext, selected_voice_id: str, user_id: Optional[str]) -> None:
+    """Resolve the selected voice id (user voices, demo mapping) into ctx.voice_id, or raise."""
     # If frontend selects a user-created voice (user_*), resolve it to a real conversion voice.
     # Keep the selected id for recent-used tracking.
     if selected_voice_id.startswith("user_"):
@@ -381,26 +571,6 @@ async def voice_changer(
         ctx.debug["voice_resolution"].update({"selected": selected_voice_id, "resolved": base_voice_id})
         ctx.voice_id = base_voice_id
 
-    # Best-effort recent-used tracking (only if caller provides an identity).
-    # Supported headers:
-    # - Authorization: Bearer <user_id>
-    # - X-User-Id: <user_id>
-    try:
-        if user_id:
-            # Track what the user actually selected (user_* id), not the resolved base id.
-            await record_voice_used(user_id, selected_voice_id)
-    except Exception:
-        pass
-
-    # Option key compatibility: frontend uses remove_noise; ElevenLabs provider uses remove_background_noise.
-    # Keep both accepted.
-    if isinstance(ctx.options, dict):
-        if "remove_background_noise" not in ctx.options and "remove_noise" in ctx.options:
-            ctx.options["remove_background_noise"] = ctx.options.get("remove_noise")
-
-    if ctx.output_format not in ("mp3", "wav"):
-        raise HTTPException(status_code=400, detail=f"Invalid output_format: {ctx.output_format}. Must be mp3/wav.")
-
     # If the selected voice isn't one of our built-in funny voices, we usually require a real provider.
     # Otherwise the pipeline would effectively passthrough and confuse users ("voice mismatch").
     #
@@ -469,19 +639,263 @@ async def voice_changer(
                 detail="Unsupported voice_id for this backend. Choose a built-in voice or configure ELEVEN_API_KEY.",
             )
 
-    # Run pipeline
-    pipeline = Pipeline([
+
+async def _record_voice_used(user_id: Optional[str], selected_voice_id: str) -> None:
+    # Best-effort recent-used tracking (only if caller provides an identity).
+    try:
+        if user_id:
+            # Track what the user actually selected (user_* id), not the resolved base id.
+            await record_voice_used(user_id, selected_voice_id)
+    except Exception:
+        pass
+
+
+def _lookup_result_cache(
+    ctx: TaskContext,
+    initial_artifact: Artifact,
+    parsed: VoiceChangerRequest,
+) -> tuple[Optional[str], Optional[VoiceChangerResponse]]:
+    """
+    Identical upload + parameters already rendered? Returns (result_key, cached response or None).
+    result_key is None when the task can't be cached (no content hash, cache disabled/bypassed,
+    profiled run).
+    """
+    content_sha256 = (initial_artifact.meta or {}).get("sha256")
+    if not content_sha256 or not cache_enabled() or ctx.options.get("cache", True) is False or ctx.profile:
+        return None, None
+
+    result_cache = get_result_cache()
+    result_key = cache_key(str(content_sha256), _result_cache_params(ctx))
+    hit = result_cache.lookup(result_key)
+    ctx.debug["result_cache"] = {"status": "hit" if hit else "miss", **result_cache.counters()}
+    if not hit:
+        return result_key, None
+
+    artifact_meta = dict(hit.get("artifact") or {})
+    artifact_meta.update({"cache_hit": True, "source_task_id": hit.get("task_id")})
+    meta = {
+        "echo": parsed.model_dump(),
+        "artifact": artifact_meta,
+        "debug": ctx.debug,
+    }
+    if input_store.get(str(content_sha256)) is not None:
+        meta["input_id"] = content_sha256
+    return result_key, VoiceChangerResponse(
+        task_id=ctx.task_id,
+        status=TaskStatus.SUCCESS,
+        output_url=hit.get("public_url"),
+        meta=meta,
+    )
+
+
+@router.post("", response_model=VoiceChangerResponse)
+async def voice_changer(
+    request: Request,
+    response: Response,
+    file: Optional[UploadFile] = File(default=None),
+    payload: Optional[str] = Form(default=None),
+) -> VoiceChangerResponse:
+    """
+    Voice changer endpoint supporting two input modes:
+    - JSON body: VoiceChangerRequest
+    - multipart/form-data: fields 'file' (UploadFile) + 'payload' (JSON string)
+
+    Runs synchronously by default. With options.async=true the task is queued on the
+    job worker pool and the response (HTTP 202) only carries task_id; poll
+    GET /voice-changer/tasks/{task_id} for queued/processing/success/failed.
+    """
+    task_id = str(uuid.uuid4())
+
+    # Build task context early
+    ctx = _new_task_context(task_id)
+
+    # Parse input according to content type
+    parsed: VoiceChangerRequest
+    initial_artifact = Artifact(path="", mime="application/octet-stream", meta={"source": "none"})
+
+    try:
+        if file is not None or payload is not None:
+            # multipart mode
+            if not payload:
+                raise HTTPException(status_code=400, detail="Missing payload in form data")
+
+            data = json.loads(payload)
+            parsed = VoiceChangerRequest.model_validate(data)
+
+            if file is not None:
+                initial_artifact = await _receive_upload(ctx, file)
+            elif not parsed.input_id:
+                # payload only (no file) - allow for debug usage
+                ctx.debug.setdefault("upload", {})
+                ctx.debug["upload"].update({"note": "payload provided but file missing"})
+        else:
+            # JSON mode
+            data = await request.json()
+            parsed = VoiceChangerRequest.model_validate(data)
+
+        if parsed.input_id and initial_artifact.meta.get("source") == "none":
+            initial_artifact = await get_executor("pipeline").run(_artifact_from_input_id, ctx, parsed.input_id)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Invalid request: {e}")
+
+    # Identify user once (used by recent-used + resolving user voices)
+    user_id = _user_id_from_request(request)
+    selected_voice_id = str(parsed.voice_id or "")
+
+    _apply_request(ctx, parsed)
+    _apply_deadline(ctx, ctx.options)
+    _apply_profiling(ctx, request)
+    _resolve_voice(ctx, selected_voice_id, user_id)
+    await _record_voice_used(user_id, selected_voice_id)
+
+    # Reads and rewrites cache/input-store JSON: keep that disk I/O off the event loop.
+    result_key, cached = await get_executor("pipeline").run(_lookup_result_cache, ctx, initial_artifact, parsed)
+    if cached is not None:
+        return cached
+
+    if _wants_async(ctx.options):
+        if not async_enabled():
+            ctx.debug.setdefault("async", {}).update({"requested": True, "note": "async mode disabled; ran synchronously"})
+        else:
+            # Queued jobs publish per-step progress into their status record.
+            ctx.progress = ProgressReporter(task_id, get_job_store().update_progress)
+            ctx.cancel_token.deadline = None  # waiting in the queue doesn't count
+            try:
+                get_job_runner().submit(
+                    task_id,
+                    lambda: _run_queued(ctx, initial_artifact, parsed, result_key),
+                    on_success=lambda resp: {"output_url": resp.output_url, "meta": resp.meta},
+                )
+            except JobQueueFull as e:
+                raise HTTPException(status_code=503, detail=f"Server busy: {e}")
+            response.status_code = 202
+            return VoiceChangerResponse(
+                task_id=task_id,
+                status=TaskStatus.QUEUED,
+                output_url=None,
+                meta={
+                    "echo": parsed.model_dump(),
+                    "status_url": f"/voice-changer/tasks/{task_id}",
+                },
+            )
+
+    # ffmpeg/ffprobe subprocesses block; keep them on the dedicated pipeline pool
+    # so /healthz and the voice-library endpoints stay responsive. Queued (async) jobs
+    # outlive the request, so only this synchronous path stops on disconnect.
+    # With VC_ASYNC_PIPELINE (default) the pipeline is driven from the event loop: upstream
+    # conversions are awaited, ffmpeg/CPU work still runs on the pipeline pool.
+    run = _arun_pipeline if async_pipeline_enabled() else _run_pipeline
+    return await _run_cancellable(request, ctx.cancel_token, run, ctx, initial_artifact, parsed, result_key=result_key)
+
+
+def _run_queued(ctx: TaskContext, initial_artifact: Artifact, parsed: VoiceChangerRequest, result_key: Optional[str]) -> VoiceChangerResponse:
+    """Job body for options.async: options.deadline_ms counts from here, when a worker picks the job up."""
+    deadline_ms = ctx.debug.get("deadline_ms")
+    if deadline_ms:
+        ctx.cancel_token.set_deadline(deadline_ms / 1000.0)
+    return _run_pipeline(ctx, initial_artifact, parsed, result_key=result_key)
+
+
+def _wants_async(options: dict) -> bool:
+    if not isinstance(options, dict):
+        return False
+    v = options.get("async")
+    if isinstance(v, str):
+        return v.strip().lower() in {"1", "true", "yes", "on"}
+    return bool(v)
+
+
+def _result_cache_params(ctx: TaskContext) -> dict:
+    """Everything besides the input bytes that changes the rendered output."""
+    opts = ctx.options if isinstance(ctx.options, dict) else {}
+    demo = opts.get("demo") if isinstance(opts.get("demo"), dict) else {}
+    return {
+        "voice_id": ctx.voice_id,
+        "stability": ctx.stability,
+        "similarity": ctx.similarity,
+        "output_format": ctx.output_format,
+        "output_formats": ctx.output_formats,
+        "bitrate": resolve_bitrate(ctx.output_format, opts.get("audio_quality"), opts.get("bitrate")),
+        "audio_quality": opts.get("audio_quality"),
+        "preset_id": ctx.preset_id,
+        "remove_background_noise": opts.get("remove_background_noise"),
+        "force_passthrough": bool(demo.get("force_passthrough")),
+    }
+
+
+def _cacheable(ctx: TaskContext, artifact_meta: dict) -> bool:
+    """Only cache clean renders: no recorded errors, no provider fallback, requested format produced."""
+    if ctx.debug.get("errors"):
+        return False
+    provider = ctx.debug.get("provider") if isinstance(ctx.debug.get("provider"), dict) else {}
+    if provider.get("status") in {"error", "no_input"}:
+        return False
+    if artifact_meta.get("skipped_outputs"):
+        return False
+    return artifact_meta.get("produced_format") == ctx.output_format
+
+
+def _pipeline_for(steps: Optional[list]) -> Pipeline:
+    """steps defaults to the full standardize -> voice_change -> export chain."""
+    return Pipeline(steps if steps is not None else [
         StandardizeStep(),
         VoiceChangeStep(),
         ExportStep(),
     ])
 
+
+def _pipeline_failed(ctx: TaskContext, e: Exception) -> HTTPException:
+    if isinstance(e, TaskCancelled):
+        # Stopped between steps or mid-ffmpeg: nothing was published or cached.
+        return _cancelled_http_error(ctx, e)
+    # Keep details in debug; return sanitized error
+    ctx.debug.setdefault("errors", []).append({"where": "pipeline.run", "error": str(e)})
+    return HTTPException(status_code=500, detail="Pipeline failed")
+
+
+def _run_pipeline(
+    ctx: TaskContext,
+    initial_artifact: Artifact,
+    parsed: VoiceChangerRequest,
+    result_key: Optional[str] = None,
+    steps: Optional[list] = None,
+) -> VoiceChangerResponse:
+    """
+    Run the conversion pipeline for a prepared task and build the API response.
+    steps defaults to the full standardize -> voice_change -> export chain.
+    """
     try:
-        final_artifact = pipeline.run(initial_artifact, ctx)
+        final_artifact = _pipeline_for(steps).run(initial_artifact, ctx)
     except Exception as e:
-        # Keep details in debug; return sanitized error
-        ctx.debug.setdefault("errors", []).append({"where": "pipeline.run", "error": str(e)})
-        raise HTTPException(status_code=500, detail="Pipeline failed")
+        raise _pipeline_failed(ctx, e)
+    return _pipeline_response(ctx, final_artifact, parsed, result_key)
+
+
+async def _arun_pipeline(
+    ctx: TaskContext,
+    initial_artifact: Artifact,
+    parsed: VoiceChangerRequest,
+    result_key: Optional[str] = None,
+    steps: Optional[list] = None,
+) -> VoiceChangerResponse:
+    """_run_pipeline on the event loop (Pipeline.arun): async providers are awaited, other steps use the executor."""
+    try:
+        final_artifact = await _pipeline_for(steps).arun(initial_artifact, ctx)
+    except Exception as e:
+        raise _pipeline_failed(ctx, e)
+    # Cache store + response building touch disk; keep them off the event loop.
+    return await get_executor("pipeline").run(_pipeline_response, ctx, final_artifact, parsed, result_key)
+
+
+def _pipeline_response(
+    ctx: TaskContext,
+    final_artifact: Artifact,
+    parsed: VoiceChangerRequest,
+    result_key: Optional[str],
+) -> VoiceChangerResponse:
+    task_id = ctx.task_id
 
     # Respect ExportStep's produced format and published outputs
     produced_format = (final_artifact.meta or {}).get("produced_format", ctx.output_format)
@@ -499,18 +913,165 @@ async def voice_changer(
         }
     )
 
+    if result_key and _cacheable(ctx, artifact_meta):
+        try:
+            get_result_cache().store(result_key, task_id=task_id, artifact_meta=artifact_meta)
+            ctx.debug.setdefault("result_cache", {})["stored"] = True
+        except Exception as e:
+            ctx.debug.setdefault("result_cache", {})["store_error"] = str(e)
+
+    meta = {
+        "echo": parsed.model_dump(),
+        "artifact": artifact_meta,
+        "debug": ctx.debug,
+    }
+    # Clients can pass this back as input_id to try other voices without re-uploading.
+    input_id = (ctx.debug.get("standardize") or {}).get("input_id")
+    if input_id:
+        meta["input_id"] = input_id
+
     return VoiceChangerResponse(
         task_id=task_id,
-        status="success",
+        status=TaskStatus.SUCCESS,
         output_url=output_url,
-        meta={
-            "echo": parsed.model_dump(),
-            "artifact": artifact_meta,
-            "debug": ctx.debug,
-        },
+        meta=meta,
     )
 
 
+def _batch_max_voices() -> int:
+    try:
+        return max(1, int(os.getenv("VC_BATCH_MAX_VOICES", "8")))
+    except Exception:
+        return 8
+
+
+@router.post("/batch", response_model=VoiceChangerBatchResponse)
+async def voice_changer_batch(
+    request: Request,
+    file: Optional[UploadFile] = File(default=None),
+    payload: Optional[str] = Form(default=None),
+) -> VoiceChangerBatchResponse:
+    """
+    Render one input with several voices ("compare voices").
+
+    Same input modes as POST /voice-changer (multipart file + payload, or JSON with input_id).
+    The input is uploaded, probed and standardized once; VoiceChangeStep + ExportStep then run
+    for every voice concurrently on the pipeline executor, each as its own task.
+    """
+    batch_id = str(uuid.uuid4())
+    ctx = _new_task_context(batch_id)
+
+    parsed: VoiceChangerBatchRequest
+    initial_artifact = Artifact(path="", mime="application/octet-stream", meta={"source": "none"})
+
+    try:
+        if file is not None or payload is not None:
+            if not payload:
+                raise HTTPException(status_code=400, detail="Missing payload in form data")
+            parsed = VoiceChangerBatchRequest.model_validate(json.loads(payload))
+            if file is not None:
+                initial_artifact = await _receive_upload(ctx, file)
+        else:
+            parsed = VoiceChangerBatchRequest.model_validate(await request.json())
+
+        if parsed.input_id and initial_artifact.meta.get("source") == "none":
+            initial_artifact = await get_executor("pipeline").run(_artifact_from_input_id, ctx, parsed.input_id)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Invalid request: {e}")
+
+    if initial_artifact.meta.get("source") == "none":
+        raise HTTPException(status_code=400, detail="A file or input_id is required")
+
+    voice_ids = list(dict.fromkeys(str(v).strip() for v in parsed.voice_ids if str(v).strip()))
+    if not voice_ids:
+        raise HTTPException(status_code=400, detail="voice_ids must not be empty")
+    if len(voice_ids) > _batch_max_voices():
+        raise HTTPException(
+            status_code=400,
+            detail=f"Too many voices: {len(voice_ids)}. Max is {_batch_max_voices()} (VC_BATCH_MAX_VOICES).",
+        )
+
+    executor = get_executor("pipeline")
+    # One token for the whole batch: every child render stops on disconnect / deadline.
+    _apply_deadline(ctx, parsed.options)
+    try:
+        standardized = await _run_cancellable(request, ctx.cancel_token, Pipeline([StandardizeStep()]).run, initial_artifact, ctx)
+    except TaskCancelled as e:
+        raise _cancelled_http_error(ctx, e)
+    except Exception as e:
+        ctx.debug.setdefault("errors", []).append({"where": "batch.standardize", "error": str(e)})
+        raise HTTPException(status_code=500, detail="Pipeline failed")
+
+    user_id = _user_id_from_request(request)
+
+    async def _render(voice_id: str) -> VoiceChangerBatchItem:
+        child = _new_task_context(str(uuid.uuid4()))
+        child.cancel_token = ctx.cancel_token
+        child.debug["batch"] = {"batch_id": batch_id}
+        try:
+            child_req = VoiceChangerRequest(
+                voice_id=voice_id,
+                stability=parsed.stability,
+                similarity=parsed.similarity,
+                output_format=(
+                    parsed.output_formats[0]
+                    if parsed.output_formats and "output_format" not in parsed.model_fields_set
+                    else parsed.output_format
+                ),
+                output_formats=parsed.output_formats,
+                preset_id=parsed.preset_id,
+                options=copy.deepcopy(parsed.options or {}),
+            )
+            _apply_request(child, child_req)
+            _apply_profiling(child, request)
+            _resolve_voice(child, voice_id, user_id)
+            await _record_voice_used(user_id, voice_id)
+
+            result_key, resp = await executor.run(_lookup_result_cache, child, initial_artifact, child_req)
+            if resp is None and async_pipeline_enabled():
+                resp = await _arun_pipeline(child, standardized, child_req, result_key=result_key, steps=[VoiceChangeStep(), ExportStep()])
+            elif resp is None:
+                resp = await executor.run(
+                    _run_pipeline,
+                    child,
+                    standardized,
+                    child_req,
+                    result_key=result_key,
+                    steps=[VoiceChangeStep(), ExportStep()],
+                )
+            return VoiceChangerBatchItem(
+                voice_id=voice_id,
+                task_id=child.task_id,
+                status=resp.status,
+                output_url=resp.output_url,
+                meta=resp.meta,
+            )
+        except HTTPException as e:
+            return VoiceChangerBatchItem(
+                voice_id=voice_id,
+                task_id=child.task_id,
+                status=TaskStatus.FAILED,
+                error=str(e.detail),
+                meta={"debug": child.debug},
+            )
+
+    watcher = asyncio.ensure_future(_watch_disconnect(request, ctx.cancel_token))
+    try:
+        results = list(await asyncio.gather(*[_render(v) for v in voice_ids]))
+    finally:
+        watcher.cancel()
+
+    ok = sum(1 for r in results if r.status == TaskStatus.SUCCESS)
+    status = TaskStatus.SUCCESS if ok == len(results) else (TaskStatus.PARTIAL if ok else TaskStatus.FAILED)
+    meta: dict = {"debug": ctx.debug}
+    input_id = (ctx.debug.get("standardize") or {}).get("input_id")
+    if input_id:
+        meta["input_id"] = input_id
+    return VoiceChangerBatchResponse(task_id=batch_id, status=status, results=results, meta=meta)
+
+
 @router.get("/files/{task_id}/{filename}")
 async def download_file(task_id: str, filename: str):
     """
@@ -2,18 +2,27 @@ from typing import Optional, Dict, Any, Literal, List
 from pydantic import BaseModel, Field, HttpUrl
 
 
+# Output formats the export step knows (app/services/audio_formats.py); which of them a
+# given server can encode is advertised by /voice-changer/capabilities.
+OutputFormat = Literal["mp3", "wav", "opus", "ogg", "aac", "m4a", "flac"]
+
+
 # -------------------------
-# Task Status (future-proof)
+# Task Status
 # -------------------------
 
 class TaskStatus(str):
     """
     Task lifecycle status.
-    Reserved for async pipeline in future.
+    Sync requests answer with SUCCESS directly; async jobs move through
+    QUEUED -> PROCESSING -> SUCCESS | FAILED (see app/core/jobs.py).
+    Batch responses are PARTIAL when some voices rendered and others failed
+    (each results[] item is still SUCCESS or FAILED).
     """
     QUEUED = "queued"
     PROCESSING = "processing"
     SUCCESS = "success"
+    PARTIAL = "partial"
     FAILED = "failed"
 
 
@@ -46,9 +55,15 @@ class VoiceChangerRequest(BaseModel):
         description="Voice similarity level (1-10, integer)"
     )
 
-    output_format: Literal["mp3", "wav"] = Field(
+    output_format: OutputFormat = Field(
         default="mp3",
-        description="Output audio format"
+        description="Output audio format (opus/ogg/aac/m4a/flac need a matching ffmpeg encoder, otherwise WAV is produced)"
+    )
+
+    output_formats: Optional[List[OutputFormat]] = Field(
+        default=None,
+        description="Encode the render in several formats at once (meta.artifact.outputs maps format -> URL); "
+                    "output_url is output_format if given, else the first entry"
     )
 
     preset_id: Optional[str] = Field(
@@ -63,7 +78,12 @@ class VoiceChangerRequest(BaseModel):
 
     options: Dict[str, Any] = Field(
         default_factory=dict,
-        description="Reserved extensible options (noise, chunking, debug, etc.)"
+        description="Reserved extensible options (noise, chunking, debug, audio_quality/bitrate, etc.)"
+    )
+
+    input_id: Optional[str] = Field(
+        default=None,
+        description="meta.input_id from an earlier response; reuses that upload's standardized audio instead of a new file"
     )
 
 
@@ -75,7 +95,8 @@ class VoiceChangerResponse(BaseModel):
     """
     Response for voice changer task.
     In sync mode, output is returned immediately.
-    In async mode, only task_id will be returned.
+    In async mode (options.async=true), only task_id + status "queued" is returned;
+    poll GET /voice-changer/tasks/{task_id} for the result.
     """
 
     task_id: str = Field(
@@ -99,6 +120,47 @@ class VoiceChangerResponse(BaseModel):
     )
 
 
+# -------------------------
+# Multi-voice fan-out
+# -------------------------
+
+class VoiceChangerBatchRequest(BaseModel):
+    """
+    One input rendered with several voices.
+    Shares every parameter of VoiceChangerRequest except voice_id -> voice_ids.
+    """
+
+    voice_ids: List[str] = Field(
+        ...,
+        min_length=1,
+        description="Target voice IDs; one output per voice"
+    )
+
+    stability: int = Field(default=7, ge=1, le=10, description="Voice stability level (1-10, integer)")
+    similarity: int = Field(default=8, ge=1, le=10, description="Voice similarity level (1-10, integer)")
+    output_format: OutputFormat = Field(default="mp3", description="Output audio format")
+    output_formats: Optional[List[OutputFormat]] = Field(default=None, description="Same as VoiceChangerRequest.output_formats")
+    preset_id: Optional[str] = Field(default=None, description="Optional voice effect preset ID")
+    options: Dict[str, Any] = Field(default_factory=dict, description="Same options as VoiceChangerRequest")
+    input_id: Optional[str] = Field(default=None, description="Reuse a stored input instead of uploading a file")
+
+
+class VoiceChangerBatchItem(BaseModel):
+    voice_id: str = Field(..., description="Requested voice ID")
+    task_id: str = Field(..., description="Per-voice task identifier")
+    status: str = Field(default="success", description="success|failed")
+    output_url: Optional[str] = None
+    error: Optional[str] = None
+    meta: Dict[str, Any] = Field(default_factory=dict)
+
+
+class VoiceChangerBatchResponse(BaseModel):
+    task_id: str = Field(..., description="Batch identifier (owns the shared standardized input)")
+    status: str = Field(default="success", description="success|partial|failed: partial = some results[] failed")
+    results: List[VoiceChangerBatchItem] = Field(default_factory=list)
+    meta: Dict[str, Any] = Field(default_factory=dict)
+
+
 # -------------------------
 # Discovery / Capabilities
 # -------------------------
@@ -124,7 +186,8 @@ class CapabilitiesResponse(BaseModel):
     """Backend self-description so frontends can adapt dynamically."""
 
     voices: List[VoiceInfo] = Field(default_factory=list)
-    output_formats: List[Literal["mp3", "wav"]] = Field(default_factory=lambda: ["mp3", "wav"])
+    output_formats: List[OutputFormat] = Field(default_factory=lambda: ["mp3", "wav"], description="Formats this server can encode")
+    audio_quality_presets: List[str] = Field(default_factory=list, description="Accepted options.audio_quality values")
 
     # Upload constraints / limits (mirrors server-side enforcement)
     upload_max_bytes: int = Field(..., description="Max allowed upload size in bytes")
@@ -133,10 +196,28 @@ class CapabilitiesResponse(BaseModel):
     upload_max_duration_sec: float = Field(..., description="Max duration (strictly less than)")
 
     # Execution model
-    async_mode: bool = Field(default=False, description="Whether jobs are async")
+    async_mode: bool = Field(default=False, description="Whether async jobs (options.async=true) are accepted")
+
+    # Media tooling on this server: {"ffmpeg": {available, path, version, encoders, filters, ...}, "ffprobe": {...}}
+    media_tools: Dict[str, Any] = Field(default_factory=dict)
 
 
 class TaskInfoResponse(BaseModel):
     task_id: str
-    status: str = Field(..., description="success|not_found")
-    output_url: Optional[str] = None
\ No newline at end of file
+    status: str = Field(..., description="queued|processing|success|failed|not_found")
+    output_url: Optional[str] = None
+    error: Optional[str] = Field(default=None, description="Failure reason (status=failed)")
+
+    # Unix timestamps (seconds); only known for async jobs
+    created_at: Optional[float] = None
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    timings: Dict[str, float] = Field(
+        default_factory=dict,
+        description="queue_wait_sec / run_sec / total_sec for async jobs",
+    )
+    progress: Dict[str, Any] = Field(
+        default_factory=dict,
+        description="Async jobs: current step, percent of the input duration, audio_sec, speed (audio sec / wall sec) and per-step history",
+    )
+    meta: Dict[str, Any] = Field(default_factory=dict)
\ No newline at end of file
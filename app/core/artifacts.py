@@ -1,10 +1,13 @@
 from __future__ import annotations
 
 from dataclasses import dataclass, field
-from typing import Any, Dict, Optional, Set
+from typing import Any, Dict, List, Optional, Set
 import os
 import shutil
 
+from app.core.cancellation import CancelToken
+from app.core.progress import ProgressReporter
+
 
 @dataclass
 class Artifact:
@@ -26,6 +29,8 @@ class TaskContext:
     - Stable request parameters (voice_id, stability/similarity, output_format, preset_id, webhook_url)
     - Unified file path helpers (ctx.path(...))
     - Track generated files for cleanup (ctx.register / ctx.register_output)
+    - Cooperative cancellation (ctx.cancel_token: client disconnect, deadline)
+    - Optional live progress reporting (ctx.progress, set for async jobs)
     - Extensible fields for future features (options, debug)
     """
 
@@ -37,13 +42,17 @@ class TaskContext:
     voice_id: str
     stability: int                 # 1-10 integer (step=1)
     similarity: int                # 1-10 integer (step=1)
-    output_format: str             # "mp3" | "wav"
+    output_format: str             # primary format, see app/services/audio_formats.py
     preset_id: Optional[str] = None
     webhook_url: Optional[str] = None
+    output_formats: List[str] = field(default_factory=list)  # every format to encode (primary first); empty = output_format only
 
     # extensibility hooks
     options: Dict[str, Any] = field(default_factory=dict)   # future: noise, chunking, provider, etc.
     debug: Dict[str, Any] = field(default_factory=dict)     # future: metrics, timing, request ids, etc.
+    profile: bool = False                                   # run the pipeline under the profiler (options.debug.profile)
+    cancel_token: CancelToken = field(default_factory=CancelToken, repr=False, compare=False)  # disconnect / options.deadline_ms
+    progress: Optional[ProgressReporter] = field(default=None, repr=False, compare=False)     # per-step progress -> task status record
 
     # cleanup policy
     cleanup_mode: str = "none"
@@ -143,6 +152,7 @@ class TaskContext:
             "stability": self.stability,
             "similarity": self.similarity,
             "output_format": self.output_format,
+            "output_formats": self.output_formats,
             "preset_id": self.preset_id,
             "webhook_url": self.webhook_url,
             "options": self.options,
@@ -0,0 +1,136 @@
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Awaitable, Iterator, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+CLIENT_DISCONNECTED = "client_disconnected"
+DEADLINE_EXCEEDED = "deadline_exceeded"
+
+
+class TaskCancelled(RuntimeError):
+    """Raised where a task stops early because its CancelToken fired."""
+
+    def __init__(self, reason: str) -> None:
+        super().__init__(f"Task cancelled: {reason}")
+        self.reason = reason
+
+
+class CancelToken:
+    """
+    Per-task cancellation flag with an optional deadline.
+
+    Set by the API layer (client disconnected, options.deadline_ms) and polled by the
+    pipeline between steps, by ffmpeg subprocess waits (which kill the child) and around
+    provider calls. A passed deadline counts as a cancellation.
+    """
+
+    def __init__(self, deadline_sec: Optional[float] = None) -> None:
+        self._event = threading.Event()
+        self.reason: Optional[str] = None
+        self.deadline: Optional[float] = None
+        if deadline_sec is not None:
+            self.set_deadline(deadline_sec)
+
+    def set_deadline(self, seconds: float) -> None:
+        self.deadline = time.monotonic() + max(0.0, float(seconds))
+
+    def cancel(self, reason: str = "cancelled") -> None:
+        if not self._event.is_set():
+            self.reason = reason
+            self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        if self._event.is_set():
+            return True
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            self.cancel(DEADLINE_EXCEEDED)
+            return True
+        return False
+
+    def remaining(self) -> Optional[float]:
+        """Seconds until the deadline (None = no deadline)."""
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    def timeout(self, timeout_sec: float) -> float:
+        """timeout_sec capped by the time left until the deadline."""
+        remaining = self.remaining()
+        return timeout_sec if remaining is None else min(float(timeout_sec), remaining)
+
+    def raise_if_cancelled(self) -> None:
+        if self.cancelled:
+            raise TaskCancelled(self.reason or "cancelled")
+
+    def sleep(self, seconds: float) -> None:
+        """time.sleep that wakes up (and raises TaskCancelled) as soon as the token fires."""
+        self._event.wait(self.timeout(seconds))
+        self.raise_if_cancelled()
+
+
+# The token of the task running on this thread. Pipeline.run sets it; BoundedExecutor
+# copies the context into its workers, so chunk/segment threads see the same token.
+_current: contextvars.ContextVar[Optional[CancelToken]] = contextvars.ContextVar("vc_cancel_token", default=None)
+
+
+def current_token() -> Optional[CancelToken]:
+    return _current.get()
+
+
+@contextmanager
+def use_token(token: Optional[CancelToken]) -> Iterator[Optional[CancelToken]]:
+    reset = _current.set(token)
+    try:
+        yield token
+    finally:
+        _current.reset(reset)
+
+
+def check_cancelled() -> None:
+    token = _current.get()
+    if token is not None:
+        token.raise_if_cancelled()
+
+
+def cancellable_sleep(seconds: float) -> None:
+    token = _current.get()
+    if token is None:
+        time.sleep(seconds)
+    else:
+        token.sleep(seconds)
+
+
+# How often await_cancellable checks the token; asyncio code can't block on its threading.Event.
+_ASYNC_POLL_SEC = 0.05
+
+
+async def await_cancellable(aw: Awaitable[T]) -> T:
+    """
+    Await aw, but stop it (and raise TaskCancelled) as soon as the current token fires:
+    the asyncio counterpart of cancellable_sleep/ffmpeg's kill-on-cancel for provider calls
+    running on the event loop.
+    """
+    token = _current.get()
+    if token is None:
+        return await aw
+    token.raise_if_cancelled()
+    task = asyncio.ensure_future(aw)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=_ASYNC_POLL_SEC)
+            if done:
+                return task.result()
+            if token.cancelled:
+                task.cancel()
+                raise TaskCancelled(token.reason or "cancelled")
+    except asyncio.CancelledError:
+        task.cancel()
+        raise
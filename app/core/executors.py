@@ -0,0 +1,138 @@
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+def _cpu_count() -> int:
+    return max(1, os.cpu_count() or 1)
+
+
+def _default_workers(name: str) -> int:
+    if name == "pipeline":
+        # ffmpeg/ffprobe subprocesses dominate; one pipeline per core is a safe default.
+        return min(8, _cpu_count())
+    if name == "chunks":
+        # Segments of one long input rendered in parallel (one ffmpeg per core).
+        return _cpu_count()
+    if name == "provider_segments":
+        # Network-bound upstream calls; the per-key limit (ELEVEN_MAX_CONCURRENCY) caps requests in flight.
+        return 16
+    return 2
+
+
+def _env_workers(name: str, default: int) -> int:
+    env_name = f"VC_{name.upper()}_WORKERS"
+    try:
+        return max(1, int(os.getenv(env_name, str(default))))
+    except Exception:
+        return max(1, default)
+
+
+class BoundedExecutor:
+    """
+    Named ThreadPoolExecutor that keeps queue-depth metrics.
+
+    Separate from Starlette's default threadpool (used for sync endpoints and
+    run_in_threadpool) so long CPU/subprocess work can't starve short requests.
+    """
+
+    def __init__(self, name: str, max_workers: int) -> None:
+        self.name = name
+        self.max_workers = max_workers
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"vc-{name}")
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._running = 0
+        self._completed = 0
+        self._failed = 0
+        self._max_queued = 0
+        self._wait_sec_total = 0.0
+
+    def submit(self, fn: Callable[..., T], *args: Any, **kwargs: Any) -> "Future[T]":
+        submitted_at = time.perf_counter()
+        with self._lock:
+            self._queued += 1
+            self._max_queued = max(self._max_queued, self._queued)
+
+        def _wrapped() -> T:
+            with self._lock:
+                self._queued -= 1
+                self._running += 1
+                self._wait_sec_total += time.perf_counter() - submitted_at
+            ok = False
+            try:
+                result = fn(*args, **kwargs)
+                ok = True
+                return result
+            finally:
+                with self._lock:
+                    self._running -= 1
+                    if ok:
+                        self._completed += 1
+                    else:
+                        self._failed += 1
+
+        try:
+            # Run in a copy of the caller's context so per-task contextvars (the cancel token) follow the work.
+            future = self._pool.submit(contextvars.copy_context().run, _wrapped)
+        except Exception:
+            with self._lock:
+                self._queued -= 1
+            raise
+        future.add_done_callback(self._on_done)
+        return future
+
+    def _on_done(self, future: "Future[Any]") -> None:
+        # A future cancelled while queued never reaches _wrapped.
+        if future.cancelled():
+            with self._lock:
+                self._queued -= 1
+
+    async def run(self, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """Await fn(*args, **kwargs) executed on this pool."""
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            done = self._completed + self._failed
+            return {
+                "max_workers": self.max_workers,
+                "queued": self._queued,
+                "running": self._running,
+                "completed": self._completed,
+                "failed": self._failed,
+                "max_queued": self._max_queued,
+                "avg_queue_wait_sec": (self._wait_sec_total / done) if done else 0.0,
+            }
+
+
+_executors: Dict[str, BoundedExecutor] = {}
+_executors_lock = threading.Lock()
+
+
+def get_executor(name: str, max_workers: Optional[int] = None) -> BoundedExecutor:
+    """
+    Return the process-wide executor for a given pool name (created on first use).
+    Unless max_workers is given, size comes from VC_<NAME>_WORKERS, e.g. VC_PIPELINE_WORKERS.
+    """
+    with _executors_lock:
+        ex = _executors.get(name)
+        if ex is None:
+            size = max(1, max_workers) if max_workers is not None else _env_workers(name, _default_workers(name))
+            ex = BoundedExecutor(name, size)
+            _executors[name] = ex
+        return ex
+
+
+def executor_stats() -> Dict[str, Dict[str, Any]]:
+    with _executors_lock:
+        items = list(_executors.items())
+    return {name: ex.stats() for name, ex in items}
@@ -0,0 +1,188 @@
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, Optional
+
+from app.config.settings import RUNS_BASE_DIR
+from app.core.executors import BoundedExecutor, get_executor
+
+
+STATUS_FILENAME = "task.json"
+
+
+class JobQueueFull(RuntimeError):
+    pass
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)))
+    except Exception:
+        return default
+
+
+def async_workers() -> int:
+    """Number of background workers for async jobs (0 disables async mode)."""
+    return max(0, _env_int("VC_ASYNC_WORKERS", 2))
+
+
+def async_max_pending() -> int:
+    """Max jobs accepted (queued + processing) before new submissions are rejected."""
+    return max(1, _env_int("VC_ASYNC_MAX_PENDING", 32))
+
+
+def async_enabled() -> bool:
+    return async_workers() > 0
+
+
+def valid_task_id(task_id: str) -> bool:
+    """Task ids are uuid4 strings; anything else (e.g. "../x") must never become a path."""
+    try:
+        return str(uuid.UUID(task_id)) == task_id
+    except (ValueError, TypeError, AttributeError):
+        return False
+
+
+def _status_path(task_id: str) -> str:
+    if not valid_task_id(task_id):
+        raise ValueError(f"Invalid task id: {task_id!r}")
+    return os.path.join(RUNS_BASE_DIR, task_id, STATUS_FILENAME)
+
+
+def _write_json(path: str, data: Dict[str, Any]) -> None:
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+class JobStore:
+    """
+    File-backed task status records (runs/<task_id>/task.json).
+
+    Records live next to the task workspace so every gunicorn worker can answer
+    GET /voice-changer/tasks/{task_id}, not only the one that accepted the job.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+
+    def get(self, task_id: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(_status_path(task_id), "r", encoding="utf-8") as f:
+                data = json.load(f)
+            return data if isinstance(data, dict) else None
+        except Exception:
+            return None
+
+    def _update(self, task_id: str, **fields: Any) -> Dict[str, Any]:
+        with self._lock:
+            record = self.get(task_id) or {"task_id": task_id}
+            record.update(fields)
+            os.makedirs(os.path.dirname(_status_path(task_id)), exist_ok=True)
+            _write_json(_status_path(task_id), record)
+            return record
+
+    def create(self, task_id: str) -> Dict[str, Any]:
+        return self._update(task_id, status="queued", created_at=time.time(), timings={})
+
+    def mark_processing(self, task_id: str) -> Dict[str, Any]:
+        record = self.get(task_id) or {}
+        now = time.time()
+        timings = dict(record.get("timings") or {})
+        if record.get("created_at"):
+            timings["queue_wait_sec"] = now - float(record["created_at"])
+        return self._update(task_id, status="processing", started_at=now, timings=timings)
+
+    def update_progress(self, task_id: str, progress: Dict[str, Any]) -> Dict[str, Any]:
+        """Live progress of a running job (see app.core.progress.ProgressReporter)."""
+        return self._update(task_id, progress=progress)
+
+    def _finish(self, task_id: str, status: str, **fields: Any) -> Dict[str, Any]:
+        record = self.get(task_id) or {}
+        now = time.time()
+        timings = dict(record.get("timings") or {})
+        if record.get("started_at"):
+            timings["run_sec"] = now - float(record["started_at"])
+        if record.get("created_at"):
+            timings["total_sec"] = now - float(record["created_at"])
+        return self._update(task_id, status=status, finished_at=now, timings=timings, **fields)
+
+    def mark_success(self, task_id: str, *, output_url: Optional[str], meta: Dict[str, Any]) -> Dict[str, Any]:
+        return self._finish(task_id, "success", output_url=output_url, meta=meta)
+
+    def mark_failed(self, task_id: str, *, error: str) -> Dict[str, Any]:
+        return self._finish(task_id, "failed", error=error)
+
+
+class JobRunner:
+    """
+    Bounded worker pool for async voice changer jobs.
+
+    - At most async_workers() jobs run concurrently
+    - At most async_max_pending() jobs are accepted at once (queued + processing);
+      beyond that submit() raises JobQueueFull so the API can answer 503
+    """
+
+    def __init__(self, store: JobStore) -> None:
+        self.store = store
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> BoundedExecutor:
+        return get_executor("jobs", max_workers=async_workers())
+
+    def pending(self) -> int:
+        return self._pending
+
+    def submit(self, task_id: str, fn: Callable[[], Any], on_success: Callable[[Any], Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Queue fn() for background execution.
+        on_success maps fn's return value to {"output_url": ..., "meta": ...} for the status record.
+        """
+        with self._lock:
+            if self._pending >= async_max_pending():
+                raise JobQueueFull(f"Too many pending jobs ({self._pending})")
+            self._pending += 1
+
+        record = self.store.create(task_id)
+
+        def _run() -> None:
+            try:
+                self.store.mark_processing(task_id)
+                result = fn()
+                done = on_success(result)
+                self.store.mark_success(task_id, output_url=done.get("output_url"), meta=done.get("meta") or {})
+            except Exception as e:
+                detail = getattr(e, "detail", None)
+                self.store.mark_failed(task_id, error=str(detail or e))
+            finally:
+                with self._lock:
+                    self._pending -= 1
+
+        try:
+            self._get_executor().submit(_run)
+        except Exception:
+            with self._lock:
+                self._pending -= 1
+            raise
+        return record
+
+
+_store = JobStore()
+_runner: Optional[JobRunner] = None
+
+
+def get_job_store() -> JobStore:
+    return _store
+
+
+def get_job_runner() -> JobRunner:
+    global _runner
+    if _runner is None:
+        _runner = JobRunner(_store)
+    return _runner
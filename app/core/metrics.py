@@ -0,0 +1,417 @@
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from app.config.settings import RUNS_BASE_DIR
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - no flock(): concurrent scrapes may fold a dead worker twice
+    fcntl = None
+
+
+# Every worker process writes its own snapshot here (runs/metrics/<pid>.json);
+# /metrics merges all live ones so a scrape hitting any gunicorn worker sees the whole server.
+# Counters and histograms of exited workers are folded into aggregate.json (as in
+# prometheus_client's multiprocess mode), so merged totals never go down; their gauges are dropped.
+METRICS_DIR = os.getenv("VC_METRICS_DIR", os.path.join(RUNS_BASE_DIR, "metrics"))
+AGGREGATE_FILENAME = "aggregate.json"
+
+DEFAULT_BUCKETS: Tuple[float, ...] = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+SPEED_BUCKETS: Tuple[float, ...] = (0.5, 1.0, 2.0, 5.0, 10.0, 25.0, 50.0, 100.0, 250.0, 500.0, 1000.0)
+
+# name -> (type, help)
+METRICS: Dict[str, Tuple[str, str]] = {
+    "vc_step_duration_seconds": ("histogram", "Pipeline step latency (fused groups are reported as a+b+c)."),
+    "vc_provider_duration_seconds": ("histogram", "Voice conversion latency by provider and provider status."),
+    "vc_pipeline_duration_seconds": ("histogram", "End-to-end Pipeline.run latency."),
+    "vc_pipeline_runs_total": ("counter", "Pipeline runs by outcome."),
+    "vc_pipeline_cancelled_seconds": ("histogram", "Time spent in pipeline runs that were cancelled (disconnect/deadline)."),
+    "vc_step_speed": ("histogram", "Audio seconds processed per wall second, by step (input duration / step latency)."),
+    "vc_step_errors_total": ("counter", "Errors recorded in ctx.debug[\"errors\"] by step."),
+    "vc_fallbacks_total": ("counter", "Fallback paths taken (fused ffmpeg run, provider error)."),
+    "vc_standardize_total": ("counter", "StandardizeStep runs by path (input_store/passthrough/numpy/fused/ffmpeg/skipped)."),
+    "vc_pipelines_in_flight": ("gauge", "Pipeline runs currently executing."),
+    "vc_executor_queued": ("gauge", "Tasks waiting in a bounded executor."),
+    "vc_executor_running": ("gauge", "Tasks running in a bounded executor."),
+    "vc_ffmpeg_queue_seconds": ("histogram", "Time an ffmpeg call waited for a concurrency slot."),
+    "vc_ffmpeg_run_seconds": ("histogram", "ffmpeg process wall time by outcome."),
+    "vc_ffmpeg_running": ("gauge", "ffmpeg processes currently running."),
+    "vc_ffmpeg_queued": ("gauge", "ffmpeg calls waiting for a concurrency slot."),
+}
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def metrics_enabled() -> bool:
+    return str(os.getenv("VC_METRICS", "1")).strip().lower() not in {"0", "false", "no", "off"}
+
+
+def _key(labels: Optional[Dict[str, Any]]) -> LabelKey:
+    return tuple(sorted((str(k), str(v)) for k, v in (labels or {}).items()))
+
+
+class Registry:
+    """
+    Minimal in-process metrics registry (counters, gauges, histograms with fixed buckets).
+
+    Values are kept per process and persisted with flush(); collect() merges the
+    snapshots of all live worker processes into the Prometheus text format.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._counters: Dict[Tuple[str, LabelKey], float] = {}
+        self._gauges: Dict[Tuple[str, LabelKey], float] = {}
+        # (name, labels) -> [bucket bounds, bucket counts, sum, count]
+        self._hists: Dict[Tuple[str, LabelKey], List[Any]] = {}
+
+    def inc(self, name: str, labels: Optional[Dict[str, Any]] = None, value: float = 1.0) -> None:
+        k = (name, _key(labels))
+        with self._lock:
+            self._counters[k] = self._counters.get(k, 0.0) + value
+            self._dirty = True
+
+    def gauge_add(self, name: str, value: float, labels: Optional[Dict[str, Any]] = None) -> None:
+        k = (name, _key(labels))
+        with self._lock:
+            self._gauges[k] = self._gauges.get(k, 0.0) + value
+            self._dirty = True
+
+    def gauge_set(self, name: str, value: float, labels: Optional[Dict[str, Any]] = None) -> None:
+        with self._lock:
+            self._gauges[(name, _key(labels))] = float(value)
+            self._dirty = True
+
+    def observe(self, name: str, value: float, labels: Optional[Dict[str, Any]] = None, buckets: Iterable[float] = DEFAULT_BUCKETS) -> None:
+        k = (name, _key(labels))
+        with self._lock:
+            h = self._hists.get(k)
+            if h is None:
+                bounds = list(buckets)
+                h = [bounds, [0] * len(bounds), 0.0, 0]
+                self._hists[k] = h
+            for i, bound in enumerate(h[0]):
+                if value <= bound:
+                    h[1][i] += 1
+            h[2] += value
+            h[3] += 1
+            self._dirty = True
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            self._dirty = False
+            return {
+                "pid": os.getpid(),
+                "updated_at": time.time(),
+                "counters": [[n, dict(lk), v] for (n, lk), v in self._counters.items()],
+                "gauges": [[n, dict(lk), v] for (n, lk), v in self._gauges.items()],
+                "histograms": [[n, dict(lk), list(h[0]), list(h[1]), h[2], h[3]] for (n, lk), h in self._hists.items()],
+            }
+
+    def flush(self) -> None:
+        """Persist this process' snapshot for cross-worker aggregation (never raises)."""
+        try:
+            os.makedirs(METRICS_DIR, exist_ok=True)
+            _write_snapshot(os.path.join(METRICS_DIR, f"{os.getpid()}.json"), self.snapshot())
+        except Exception:
+            pass
+
+    def flush_if_dirty(self) -> None:
+        """flush() when anything changed since the last snapshot."""
+        if self._dirty:
+            self.flush()
+
+
+def _flush_interval() -> float:
+    try:
+        return max(0.1, float(os.getenv("VC_METRICS_FLUSH_SEC", "5")))
+    except ValueError:
+        return 5.0
+
+
+def _flush_loop(registry: Registry) -> None:
+    while True:
+        time.sleep(_flush_interval())
+        registry.flush_if_dirty()
+
+
+def _write_snapshot(path: str, snapshot: Dict[str, Any]) -> None:
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(snapshot, f)
+    os.replace(tmp, path)
+
+
+def _read_snapshot(path: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            snapshot = json.load(f)
+    except Exception:
+        return None
+    return snapshot if isinstance(snapshot, dict) else None
+
+
+@contextmanager
+def _dir_lock() -> Iterator[None]:
+    """Serialize folding (and reading) snapshots across the workers of one METRICS_DIR."""
+    fd = None
+    if fcntl is not None:
+        try:
+            fd = os.open(os.path.join(METRICS_DIR, ".lock"), os.O_RDWR | os.O_CREAT, 0o644)
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        except OSError:
+            if fd is not None:
+                os.close(fd)
+            fd = None
+    try:
+        yield
+    finally:
+        if fd is not None:
+            os.close(fd)
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    except Exception:
+        return True
+
+
+def _load_snapshots() -> List[Dict[str, Any]]:
+    snapshots: List[Dict[str, Any]] = []
+    if not os.path.isdir(METRICS_DIR):
+        return snapshots
+    aggregate_path = os.path.join(METRICS_DIR, AGGREGATE_FILENAME)
+    with _dir_lock():
+        aggregate = _read_snapshot(aggregate_path)
+        dead: List[str] = []
+        for name in os.listdir(METRICS_DIR):
+            if not name.endswith(".json") or name == AGGREGATE_FILENAME:
+                continue
+            path = os.path.join(METRICS_DIR, name)
+            try:
+                pid = int(name[:-5])
+            except ValueError:
+                continue
+            snapshot = _read_snapshot(path)
+            if pid != os.getpid() and not _pid_alive(pid):
+                # Worker exited (restart/scale-down): keep its counters and histograms, which would
+                # otherwise go down in the merged totals (a reset to Prometheus), and drop its gauges.
+                if snapshot is not None:
+                    aggregate = _fold(aggregate, snapshot)
+                dead.append(path)
+            elif snapshot is not None:
+                snapshots.append(snapshot)
+        if dead:
+            try:
+                _write_snapshot(aggregate_path, aggregate or {})
+            except Exception:
+                dead = []  # leave them for the next scrape rather than lose their totals
+            for path in dead:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+    if aggregate:
+        snapshots.append(aggregate)
+    return snapshots
+
+
+def _fold(aggregate: Optional[Dict[str, Any]], snapshot: Dict[str, Any]) -> Dict[str, Any]:
+    """aggregate plus the counters and histograms of a dead worker's snapshot (no gauges)."""
+    merged = merge([aggregate or {}, dict(snapshot, gauges=[])])
+    return {
+        "updated_at": time.time(),
+        "counters": [[n, dict(lk), v] for (n, lk), v in merged["counters"].items()],
+        "gauges": [],
+        "histograms": [[n, dict(lk), list(h[0]), list(h[1]), h[2], h[3]] for (n, lk), h in merged["histograms"].items()],
+    }
+
+
+def merge(snapshots: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Sum counters, gauges and histogram buckets across process snapshots."""
+    counters: Dict[Tuple[str, LabelKey], float] = {}
+    gauges: Dict[Tuple[str, LabelKey], float] = {}
+    hists: Dict[Tuple[str, LabelKey], List[Any]] = {}
+    for snap in snapshots:
+        for n, labels, v in snap.get("counters") or []:
+            k = (n, _key(labels))
+            counters[k] = counters.get(k, 0.0) + float(v)
+        for n, labels, v in snap.get("gauges") or []:
+            k = (n, _key(labels))
+            gauges[k] = gauges.get(k, 0.0) + float(v)
+        for n, labels, bounds, counts, total, count in snap.get("histograms") or []:
+            k = (n, _key(labels))
+            h = hists.get(k)
+            if h is None:
+                h = [list(bounds), [0] * len(bounds), 0.0, 0]
+                hists[k] = h
+            elif h[0] != list(bounds):
+                continue  # bucket layout changed between deploys; keep the first one seen
+            h[1] = [a + b for a, b in zip(h[1], counts)]
+            h[2] += float(total)
+            h[3] += int(count)
+    return {"counters": counters, "gauges": gauges, "histograms": hists}
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _labels(lk: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    items = list(lk) + ([extra] if extra else [])
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in items) + "}"
+
+
+def _fmt(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if not float(v).is_integer() else str(int(v))
+
+
+def render(merged: Dict[str, Any]) -> str:
+    """Prometheus text exposition format (version 0.0.4)."""
+    by_name: Dict[str, List[str]] = {}
+    for (n, lk), v in sorted(merged["counters"].items()):
+        by_name.setdefault(n, []).append(f"{n}{_labels(lk)} {_fmt(v)}")
+    for (n, lk), v in sorted(merged["gauges"].items()):
+        by_name.setdefault(n, []).append(f"{n}{_labels(lk)} {_fmt(v)}")
+    for (n, lk), (bounds, counts, total, count) in sorted(merged["histograms"].items()):
+        lines = by_name.setdefault(n, [])
+        for bound, c in zip(bounds, counts):
+            lines.append(f"{n}_bucket{_labels(lk, ('le', _fmt(bound)))} {c}")
+        lines.append(f"{n}_bucket{_labels(lk, ('le', '+Inf'))} {count}")
+        lines.append(f"{n}_sum{_labels(lk)} {_fmt(total)}")
+        lines.append(f"{n}_count{_labels(lk)} {count}")
+
+    out: List[str] = []
+    for n in sorted(by_name):
+        mtype, help_text = METRICS.get(n, ("untyped", n))
+        out.append(f"# HELP {n} {help_text}")
+        out.append(f"# TYPE {n} {mtype}")
+        out.extend(by_name[n])
+    return "\n".join(out) + "\n"
+
+
+def collect() -> str:
+    """Flush this process, then merge and render every live worker's metrics."""
+    registry = get_registry()
+    # Executor/ffmpeg queue depth is sampled at scrape time rather than on every submit.
+    from app.core.executors import executor_stats
+    for pool, stats in executor_stats().items():
+        registry.gauge_set("vc_executor_queued", stats.get("queued", 0), {"pool": pool})
+        registry.gauge_set("vc_executor_running", stats.get("running", 0), {"pool": pool})
+    from app.services.ffmpeg import ffmpeg_stats
+    limiter = ffmpeg_stats()
+    registry.gauge_set("vc_ffmpeg_running", limiter.get("running", 0))
+    registry.gauge_set("vc_ffmpeg_queued", limiter.get("queued", 0))
+    registry.flush()
+    return render(merge(_load_snapshots()))
+
+
+_registry: Optional[Registry] = None
+_registry_lock = threading.Lock()
+_flusher_pid: Optional[int] = None
+
+
+def get_registry() -> Registry:
+    """The process registry. Recording never touches the disk (see start_flusher())."""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = Registry()
+        return _registry
+
+
+def start_flusher() -> None:
+    """
+    Persist the snapshot every VC_METRICS_FLUSH_SEC (default 5) when something changed, from a
+    daemon thread; collect() also flushes before every scrape. Called from the app's startup, which
+    runs in each worker (gunicorn --preload workers don't inherit the parent's thread).
+    """
+    global _flusher_pid
+    if not metrics_enabled():
+        return
+    registry = get_registry()
+    with _registry_lock:
+        if _flusher_pid == os.getpid():
+            return
+        _flusher_pid = os.getpid()
+    threading.Thread(target=_flush_loop, args=(registry,), name="vc-metrics-flush", daemon=True).start()
+
+
+def record_pipeline_run(
+    ctx_debug: Dict[str, Any],
+    timing: Dict[str, float],
+    elapsed_sec: float,
+    ok: bool,
+    errors_before: int = 0,
+    cancelled: bool = False,
+) -> None:
+    """
+    Feed one finished Pipeline.run into the registry: `timing` holds the steps it ran,
+    provider/errors come from ctx.debug (errors past index errors_before are new).
+    """
+    if not metrics_enabled():
+        return
+    registry = get_registry()
+    try:
+        audio_sec = (ctx_debug.get("input_media") or {}).get("duration_seconds")
+        for step, sec in timing.items():
+            registry.observe("vc_step_duration_seconds", float(sec), {"step": step})
+            if audio_sec and float(sec) > 0:
+                registry.observe("vc_step_speed", float(audio_sec) / float(sec), {"step": step}, buckets=SPEED_BUCKETS)
+
+        provider = ctx_debug.get("provider") or {}
+        if provider.get("name"):
+            sec = next((float(v) for k, v in timing.items() if "voice_change" in k.split("+")), None)
+            if sec is not None:
+                registry.observe(
+                    "vc_provider_duration_seconds",
+                    sec,
+                    {"provider": provider.get("name"), "status": provider.get("status") or "unknown"},
+                )
+            if str(provider.get("status") or "").startswith("error"):
+                registry.inc("vc_fallbacks_total", {"kind": "provider", "provider": provider.get("name")})
+
+        for err in (ctx_debug.get("errors") or [])[errors_before:]:
+            registry.inc("vc_step_errors_total", {"step": err.get("step") or "unknown"})
+            if "fused" in str(err.get("note") or ""):
+                registry.inc("vc_fallbacks_total", {"kind": "fusion", "provider": provider.get("name") or "none"})
+
+        standardize_path = (ctx_debug.get("standardize") or {}).get("path")
+        if standardize_path and any("standardize" in k.split("+") for k in timing):
+            registry.inc("vc_standardize_total", {"path": standardize_path})
+
+        registry.observe("vc_pipeline_duration_seconds", elapsed_sec)
+        status = "success" if ok else ("cancelled" if cancelled else "failed")
+        registry.inc("vc_pipeline_runs_total", {"status": status})
+        if cancelled:
+            # Work thrown away (client gone / deadline passed): how much CPU was spent on it.
+            registry.observe("vc_pipeline_cancelled_seconds", elapsed_sec)
+    except Exception:
+        pass
+
+
+def pipeline_started() -> None:
+    if metrics_enabled():
+        get_registry().gauge_add("vc_pipelines_in_flight", 1)
+
+
+def pipeline_finished() -> None:
+    if metrics_enabled():
+        get_registry().gauge_add("vc_pipelines_in_flight", -1)
@@ -1,15 +1,40 @@
 from __future__ import annotations
 
-from typing import List, Protocol
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Protocol, Tuple
+import hashlib
+import inspect
+import os
 import time
 import traceback
 
+from app.core import metrics, profiling
 from app.core.artifacts import Artifact, TaskContext
+from app.core.cancellation import TaskCancelled, use_token
+from app.core.executors import get_executor
+from app.core.progress import use_progress
+from app.services.ffmpeg import (
+    FFmpegError,
+    FfmpegRun,
+    transcode_audio,
+    transcode_audio_async,
+    transcode_audio_multi,
+    transcode_audio_multi_async,
+)
+from app.services.result_cache import cache_key
+from app.services.singleflight import get_singleflight, singleflight_enabled
 
 
 class Step(Protocol):
     """
     All pipeline steps must implement this interface.
+
+    Steps that are pure ffmpeg filter stages may additionally implement
+    `ffmpeg_stage(artifact, ctx) -> Optional[FfmpegStage]` so the pipeline can
+    fuse consecutive stages into one ffmpeg process (see Pipeline._plan_fused).
+
+    Network-bound steps may implement `async arun(artifact, ctx) -> Artifact`;
+    Pipeline.arun awaits it on the event loop instead of holding a worker thread.
     """
 
     name: str
@@ -18,6 +43,40 @@ class Step(Protocol):
         ...
 
 
+@dataclass
+class FfmpegStage:
+    """
+    Description of a step as an ffmpeg filter stage.
+
+    - filters: audio filters this step applies (appended to the fused filtergraph)
+    - output_name/output_format/bitrate/mime: what the step would write if it were
+      the last stage of a fused group (intermediate stages' outputs are skipped
+      unless keep_output is set, in which case the graph is split to also write it)
+    - extra_outputs: [(output_name, output_format, bitrate)] further encodes of the
+      last stage's result, written by the same ffmpeg process (asplit + one output each)
+    - finalize: bookkeeping run after the fused ffmpeg call (debug, publishing, meta);
+      receives the fused output artifact and returns the step's resulting artifact
+    """
+    filters: List[str] = field(default_factory=list)
+    output_name: str = "output.wav"
+    output_format: str = "wav"
+    bitrate: Optional[str] = None
+    mime: str = "audio/wav"
+    timeout_sec: int = 60
+    keep_output: bool = False
+    extra_outputs: List[Tuple[str, str, Optional[str]]] = field(default_factory=list)
+    finalize: Optional[Callable[[Artifact, TaskContext], Artifact]] = None
+
+
+def fusion_enabled() -> bool:
+    return str(os.getenv("VC_FFMPEG_FUSION", "1")).strip().lower() not in {"0", "false", "no", "off"}
+
+
+def async_pipeline_enabled() -> bool:
+    """VC_ASYNC_PIPELINE: run API requests with Pipeline.arun (default on; 0 = whole pipeline on a worker thread)."""
+    return str(os.getenv("VC_ASYNC_PIPELINE", "1")).strip().lower() not in {"0", "false", "no", "off"}
+
+
 class Pipeline:
     """
     Linear execution pipeline.
@@ -25,36 +84,340 @@ class Pipeline:
     Responsibilities:
     - Execute steps sequentially
     - Pass Artifact between steps
-    - Record timing/debug info
+    - Fuse runs of consecutive ffmpeg filter stages into a single ffmpeg process (coalesced
+      with identical in-flight runs through app/services/singleflight.py)
+    - arun(): await steps with an async arun() and fused ffmpeg runs on the event loop, others on the pipeline executor
+    - Stop between steps once ctx.cancel_token fires (raises TaskCancelled)
+    - Report per-step progress to ctx.progress (when set)
+    - Record timing/debug info (and feed it to the /metrics registry)
     - Let caller decide cleanup strategy
     """
 
     def __init__(self, steps: List[Step]):
         self.steps = steps
 
+    def _plan_fused(self, start: int, artifact: Artifact, ctx: TaskContext) -> List[Tuple[Step, FfmpegStage]]:
+        """
+        Collect the longest run of ffmpeg stages starting at steps[start].
+        Returns [] unless at least two steps can be fused.
+        """
+        if not fusion_enabled() or not artifact.path or not os.path.isfile(artifact.path):
+            return []
+
+        group: List[Tuple[Step, FfmpegStage]] = []
+        for step in self.steps[start:]:
+            planner = getattr(step, "ffmpeg_stage", None)
+            if planner is None:
+                break
+            try:
+                stage = planner(artifact, ctx)
+            except Exception:
+                stage = None
+            if stage is None:
+                break
+            group.append((step, stage))
+
+        return group if len(group) >= 2 else []
+
+    def _fused_call(self, group: List[Tuple[Step, FfmpegStage]], artifact: Artifact, ctx: TaskContext) -> Tuple[bool, Dict[str, Any]]:
+        """(multi, kwargs): one ffmpeg call for the whole group, for transcode_audio[_multi][_async]."""
+        last = group[-1][1]
+        timeout_sec = max(stage.timeout_sec for _, stage in group)
+        if last.extra_outputs or any(stage.keep_output for _, stage in group[:-1]):
+            filter_complex, outputs = self._split_graph(group, ctx)
+            return True, {"in_path": artifact.path, "filter_complex": filter_complex, "outputs": outputs, "timeout_sec": timeout_sec}
+        return False, {
+            "in_path": artifact.path,
+            "out_path": ctx.path(last.output_name),
+            "output_format": last.output_format,
+            "bitrate": last.bitrate,
+            "extra_afilters": self._fused_filters(group),
+            "timeout_sec": timeout_sec,
+        }
+
+    @staticmethod
+    def _fused_filters(group: List[Tuple[Step, FfmpegStage]]) -> List[str]:
+        return [f for _, stage in group for f in stage.filters if f]
+
+    def _finish_fused(self, group: List[Tuple[Step, FfmpegStage]], artifact: Artifact, ctx: TaskContext, run: FfmpegRun) -> Artifact:
+        """Let each step of a fused group finalize the shared output."""
+        last = group[-1][1]
+        current = Artifact(path=ctx.path(last.output_name), mime=last.mime, meta=dict(artifact.meta or {}))
+        for step, stage in group:
+            if stage.finalize is not None:
+                current = stage.finalize(current, ctx)
+
+        ctx.debug.setdefault("fused", []).append({
+            "steps": [getattr(step, "name", step.__class__.__name__) for step, _ in group],
+            "filters": self._fused_filters(group),
+            "output": last.output_name,
+            "ffmpeg_queue_sec": run.queue_sec,
+            "ffmpeg_run_sec": run.run_sec,
+        })
+        return current
+
+    def _fused_key(self, group: List[Tuple[Step, FfmpegStage]], artifact: Artifact, multi: bool, kwargs: Dict[str, Any]) -> Optional[str]:
+        """Singleflight key of a fused run: input content hash + the ffmpeg call, with output file names instead of paths."""
+        if not singleflight_enabled():
+            return None
+        content = (artifact.meta or {}).get("sha256") if group[0][0] is self.steps[0] else None
+        if not content:
+            # Mid-pipeline the input is an intermediate file the upload hash doesn't describe.
+            digest = hashlib.sha256()
+            with open(artifact.path, "rb") as f:
+                for block in iter(lambda: f.read(1024 * 1024), b""):
+                    digest.update(block)
+            content = digest.hexdigest()
+        params = {k: v for k, v in kwargs.items() if k not in ("in_path", "out_path", "outputs", "timeout_sec")}
+        if multi:
+            params["outputs"] = [(label, os.path.basename(path), fmt, bitrate) for label, path, fmt, bitrate in kwargs["outputs"]]
+        else:
+            params["output"] = os.path.basename(kwargs["out_path"])
+        return cache_key(str(content), params)
+
+    @staticmethod
+    def _fused_paths(multi: bool, kwargs: Dict[str, Any]) -> List[str]:
+        return [path for _, path, _, _ in kwargs["outputs"]] if multi else [kwargs["out_path"]]
+
+    def _run_fused(self, group: List[Tuple[Step, FfmpegStage]], artifact: Artifact, ctx: TaskContext) -> Artifact:
+        """
+        Run a fused group as one ffmpeg process, then let each step finalize. An identical
+        group already running (same input, same ffmpeg call) is awaited through singleflight
+        and its files reused; finalizers still run for this task.
+        """
+        multi, kwargs = self._fused_call(group, artifact, ctx)
+        transcode = transcode_audio_multi if multi else transcode_audio
+        run = get_singleflight().share(
+            self._fused_key(group, artifact, multi, kwargs), ctx, self._fused_paths(multi, kwargs), lambda: transcode(**kwargs)
+        )
+        return self._finish_fused(group, artifact, ctx, run or FfmpegRun())
+
+    async def _arun_fused(self, group: List[Tuple[Step, FfmpegStage]], artifact: Artifact, ctx: TaskContext) -> Artifact:
+        """_run_fused with ffmpeg awaited on the loop (no worker thread held while it runs); finalizers use the executor."""
+        multi, kwargs = self._fused_call(group, artifact, ctx)
+        transcode = transcode_audio_multi_async if multi else transcode_audio_async
+        key = await get_executor("singleflight").run(self._fused_key, group, artifact, multi, kwargs)
+        run = await get_singleflight().ashare(key, ctx, self._fused_paths(multi, kwargs), lambda: transcode(**kwargs))
+        return await get_executor("pipeline").run(self._finish_fused, group, artifact, ctx, run or FfmpegRun())
+
+    def _split_graph(self, group: List[Tuple[Step, FfmpegStage]], ctx: TaskContext) -> Tuple[str, List[Tuple[str, str, str, Optional[str]]]]:
+        """
+        Build a filter_complex that asplits after every intermediate stage with keep_output,
+        e.g. [0:a]aresample,aformat,asplit=2[keep0][s0];[s0]<effects>[out], and after the
+        last stage once per extra output ([s0]<effects>,asplit=3[out][x0][x1]).
+        """
+        parts: List[str] = []
+        outputs: List[Tuple[str, str, str, Optional[str]]] = []
+        label = "0:a"
+        chain: List[str] = []
+        for i, (_, stage) in enumerate(group[:-1]):
+            chain.extend(f for f in stage.filters if f)
+            if not stage.keep_output:
+                continue
+            parts.append(f"[{label}]{','.join(chain + ['asplit=2'])}[keep{i}][s{i}]")
+            outputs.append((f"[keep{i}]", ctx.path(stage.output_name), stage.output_format, stage.bitrate))
+            label, chain = f"s{i}", []
+
+        last = group[-1][1]
+        chain.extend(f for f in last.filters if f)
+        if last.extra_outputs:
+            extra_labels = "".join(f"[x{j}]" for j in range(len(last.extra_outputs)))
+            parts.append(f"[{label}]{','.join(chain + [f'asplit={len(last.extra_outputs) + 1}'])}[out]{extra_labels}")
+        else:
+            parts.append(f"[{label}]{','.join(chain or ['anull'])}[out]")
+        outputs.append(("[out]", ctx.path(last.output_name), last.output_format, last.bitrate))
+        for j, (name, output_format, bitrate) in enumerate(last.extra_outputs):
+            outputs.append((f"[x{j}]", ctx.path(name), output_format, bitrate))
+        return ";".join(parts), outputs
+
+    def _run_step(self, step: Step, current: Artifact, ctx: TaskContext) -> Artifact:
+        step_name = getattr(step, "name", step.__class__.__name__)
+        start_ts = time.perf_counter()
+
+        try:
+            result = step.run(current, ctx)
+            if not isinstance(result, Artifact):
+                raise TypeError(f"Step '{step_name}' returned {type(result).__name__}, expected Artifact")
+        except Exception as e:
+            # record failure context
+            ctx.debug.setdefault("errors", []).append({
+                "step": step_name,
+                "error": str(e),
+                "type": e.__class__.__name__,
+                "traceback": traceback.format_exc(),
+            })
+            raise
+
+        elapsed = time.perf_counter() - start_ts
+        ctx.debug.setdefault("timing", {})[step_name] = elapsed
+        return result
+
+    async def _arun_step(self, step: Step, current: Artifact, ctx: TaskContext) -> Artifact:
+        arun = getattr(step, "arun", None)
+        if arun is None or not inspect.iscoroutinefunction(arun):
+            return await get_executor("pipeline").run(self._run_step, step, current, ctx)
+
+        step_name = getattr(step, "name", step.__class__.__name__)
+        start_ts = time.perf_counter()
+        try:
+            result = await arun(current, ctx)
+            if not isinstance(result, Artifact):
+                raise TypeError(f"Step '{step_name}' returned {type(result).__name__}, expected Artifact")
+        except Exception as e:
+            ctx.debug.setdefault("errors", []).append({
+                "step": step_name,
+                "error": str(e),
+                "type": e.__class__.__name__,
+                "traceback": traceback.format_exc(),
+            })
+            raise
+
+        ctx.debug.setdefault("timing", {})[step_name] = time.perf_counter() - start_ts
+        return result
+
     def run(self, initial_artifact: Artifact, ctx: TaskContext) -> Artifact:
+        timing_before = dict(ctx.debug.get("timing") or {})
+        errors_before = len(ctx.debug.get("errors") or [])
+        start_ts = time.perf_counter()
+        ok = False
+        cancelled = False
+        metrics.pipeline_started()
+        try:
+            # Subprocess waits and provider calls further down pick the token up from the context.
+            with use_token(ctx.cancel_token), use_progress(ctx.progress):
+                if ctx.profile:
+                    result = profiling.profile_call(ctx, self._run_steps, initial_artifact, ctx)
+                else:
+                    result = self._run_steps(initial_artifact, ctx)
+            ok = True
+            return result
+        except TaskCancelled as e:
+            cancelled = True
+            ctx.debug["cancelled"] = {"reason": e.reason}
+            raise
+        finally:
+            metrics.pipeline_finished()
+            timing = {k: v for k, v in (ctx.debug.get("timing") or {}).items() if timing_before.get(k) != v}
+            metrics.record_pipeline_run(ctx.debug, timing, time.perf_counter() - start_ts, ok, errors_before, cancelled=cancelled)
+
+    async def arun(self, initial_artifact: Artifact, ctx: TaskContext) -> Artifact:
+        """
+        Same as run(), driven from the event loop: steps with an async arun() are awaited
+        directly (upstream conversions don't hold a thread while waiting on the network),
+        so is the ffmpeg process of a fused group, and plain steps run on the "pipeline" executor. Profiled tasks run
+        entirely on the executor, since the profiler samples one thread.
+        """
+        if ctx.profile:
+            return await get_executor("pipeline").run(self.run, initial_artifact, ctx)
+
+        timing_before = dict(ctx.debug.get("timing") or {})
+        errors_before = len(ctx.debug.get("errors") or [])
+        start_ts = time.perf_counter()
+        ok = False
+        cancelled = False
+        metrics.pipeline_started()
+        try:
+            # The executor copies this context into its workers, so sync steps see the token too.
+            with use_token(ctx.cancel_token), use_progress(ctx.progress):
+                result = await self._arun_steps(initial_artifact, ctx)
+            ok = True
+            return result
+        except TaskCancelled as e:
+            cancelled = True
+            ctx.debug["cancelled"] = {"reason": e.reason}
+            raise
+        finally:
+            metrics.pipeline_finished()
+            timing = {k: v for k, v in (ctx.debug.get("timing") or {}).items() if timing_before.get(k) != v}
+            metrics.record_pipeline_run(ctx.debug, timing, time.perf_counter() - start_ts, ok, errors_before, cancelled=cancelled)
+
+    def _start_progress(self, name: str, ctx: TaskContext) -> None:
+        if ctx.progress is not None:
+            # Percent is relative to the probed input; every step processes the whole clip.
+            ctx.progress.start_step(name, (ctx.debug.get("input_media") or {}).get("duration_seconds"))
+
+    def _try_fused(self, group: List[Tuple[Step, FfmpegStage]], current: Artifact, ctx: TaskContext) -> Optional[Artifact]:
+        """Run a fused group with timing/progress; None if it failed and the steps should run one by one."""
+        group_name = "+".join(getattr(step, "name", step.__class__.__name__) for step, _ in group)
+        start_ts = time.perf_counter()
+        self._start_progress(group_name, ctx)
+        try:
+            result = self._run_fused(group, current, ctx)
+        except FFmpegError as e:
+            self._fused_failed(group_name, e, ctx)
+            return None
+        self._fused_done(group_name, start_ts, ctx)
+        return result
+
+    async def _atry_fused(self, group: List[Tuple[Step, FfmpegStage]], current: Artifact, ctx: TaskContext) -> Optional[Artifact]:
+        """_try_fused for the event loop (see _arun_fused)."""
+        group_name = "+".join(getattr(step, "name", step.__class__.__name__) for step, _ in group)
+        start_ts = time.perf_counter()
+        self._start_progress(group_name, ctx)
+        try:
+            result = await self._arun_fused(group, current, ctx)
+        except FFmpegError as e:
+            self._fused_failed(group_name, e, ctx)
+            return None
+        self._fused_done(group_name, start_ts, ctx)
+        return result
+
+    def _fused_failed(self, group_name: str, e: Exception, ctx: TaskContext) -> None:
+        # Fall back to running the steps one by one.
+        ctx.debug.setdefault("errors", []).append({
+            "step": group_name,
+            "error": str(e),
+            "type": e.__class__.__name__,
+            "note": "fused ffmpeg run failed; falling back to per-step execution",
+        })
+
+    def _fused_done(self, group_name: str, start_ts: float, ctx: TaskContext) -> None:
+        ctx.debug.setdefault("timing", {})[group_name] = time.perf_counter() - start_ts
+        if ctx.progress is not None:
+            ctx.progress.finish_step()
+
+    def _run_steps(self, initial_artifact: Artifact, ctx: TaskContext) -> Artifact:
         current = initial_artifact
+        index = 0
 
-        for step in self.steps:
-            step_name = getattr(step, "name", step.__class__.__name__)
-            start_ts = time.perf_counter()
+        while index < len(self.steps):
+            ctx.cancel_token.raise_if_cancelled()
+            group = self._plan_fused(index, current, ctx)
+            if group:
+                fused = self._try_fused(group, current, ctx)
+                if fused is not None:
+                    current = fused
+                    index += len(group)
+                    continue
 
-            try:
-                result = step.run(current, ctx)
-                if not isinstance(result, Artifact):
-                    raise TypeError(f"Step '{step_name}' returned {type(result).__name__}, expected Artifact")
-                current = result
-            except Exception as e:
-                # record failure context
-                ctx.debug.setdefault("errors", []).append({
-                    "step": step_name,
-                    "error": str(e),
-                    "type": e.__class__.__name__,
-                    "traceback": traceback.format_exc(),
-                })
-                raise
-
-            elapsed = time.perf_counter() - start_ts
-            ctx.debug.setdefault("timing", {})[step_name] = elapsed
-
-        return current
\ No newline at end of file
+            self._start_progress(getattr(self.steps[index], "name", self.steps[index].__class__.__name__), ctx)
+            current = self._run_step(self.steps[index], current, ctx)
+            if ctx.progress is not None:
+                ctx.progress.finish_step()
+            index += 1
+
+        return current
+
+    async def _arun_steps(self, initial_artifact: Artifact, ctx: TaskContext) -> Artifact:
+        executor = get_executor("pipeline")
+        current = initial_artifact
+        index = 0
+
+        while index < len(self.steps):
+            ctx.cancel_token.raise_if_cancelled()
+            # Planners touch the disk (input store lookups, maybe ffprobe): keep them off the loop.
+            group = await executor.run(self._plan_fused, index, current, ctx)
+            if group:
+                fused = await self._atry_fused(group, current, ctx)
+                if fused is not None:
+                    current = fused
+                    index += len(group)
+                    continue
+
+            self._start_progress(getattr(self.steps[index], "name", self.steps[index].__class__.__name__), ctx)
+            current = await self._arun_step(self.steps[index], current, ctx)
+            if ctx.progress is not None:
+                ctx.progress.finish_step()
+            index += 1
+
+        return current
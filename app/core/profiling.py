@@ -0,0 +1,135 @@
+from __future__ import annotations
+
+import cProfile
+import hmac
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, TypeVar
+
+from app.core.artifacts import TaskContext
+
+T = TypeVar("T")
+
+PROFILE_TOKEN_HEADER = "x-profile-token"
+PSTATS_NAME = "profile.pstats"
+COLLAPSED_NAME = "profile.collapsed.txt"
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, str(default)))
+    except Exception:
+        return default
+
+
+def profile_requested(options: Optional[Dict[str, Any]]) -> bool:
+    """options.debug.profile=true"""
+    debug = (options or {}).get("debug") if isinstance(options, dict) else None
+    return bool(isinstance(debug, dict) and debug.get("profile"))
+
+
+def profiling_allowed(token: Optional[str]) -> bool:
+    """
+    VC_PROFILE_TOKEN gates profiling: unset (default) = disabled, otherwise the caller must send
+    the same secret in the X-Profile-Token header. X-User-Id / Bearer <user_id> are chosen by the
+    client, so they can't grant access to the task dir's profiles.
+    """
+    secret = os.getenv("VC_PROFILE_TOKEN", "")
+    if not secret or not token:
+        return False
+    return hmac.compare_digest(token.encode("utf-8"), secret.encode("utf-8"))
+
+
+class StackSampler:
+    """
+    Samples one thread's Python stack at a fixed interval and counts collapsed stacks
+    ("file:func;file:func" root first), the input format of flamegraph.pl / speedscope.
+    """
+
+    def __init__(self, thread_id: int, interval_sec: float) -> None:
+        self.thread_id = thread_id
+        self.interval_sec = max(0.001, interval_sec)
+        self.counts: Dict[str, int] = {}
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name="vc-profile-sampler", daemon=True)
+
+    def _loop(self) -> None:
+        while not self._stop.wait(self.interval_sec):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            names: List[str] = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            key = ";".join(reversed(names))
+            self.counts[key] = self.counts.get(key, 0) + 1
+            self.samples += 1
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {n}\n" for stack, n in sorted(self.counts.items()))
+
+
+def _top_functions(profiler: cProfile.Profile, limit: int = 10) -> List[Dict[str, Any]]:
+    stats = pstats.Stats(profiler, stream=io.StringIO())
+    rows = []
+    for (filename, line, func), (_, ncalls, tottime, cumtime, _) in stats.stats.items():  # type: ignore[attr-defined]
+        rows.append({
+            "function": f"{os.path.basename(filename)}:{line}:{func}",
+            "calls": ncalls,
+            "tottime_sec": round(tottime, 6),
+            "cumtime_sec": round(cumtime, 6),
+        })
+    rows.sort(key=lambda r: r["cumtime_sec"], reverse=True)
+    return rows[:limit]
+
+
+def profile_call(ctx: TaskContext, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """
+    Run fn under cProfile (deterministic) plus a stack sampler (wall clock, includes time
+    blocked on ffmpeg/HTTP), then save both into the task dir as downloadable outputs:
+    /voice-changer/files/{task_id}/profile.pstats and .../profile.collapsed.txt.
+    Only the calling thread is profiled (not the chunk/provider executors it fans out to).
+    """
+    sampler = StackSampler(threading.get_ident(), _env_float("VC_PROFILE_INTERVAL_MS", 5.0) / 1000.0)
+    profiler = cProfile.Profile()
+    start_ts = time.perf_counter()
+    sampler.start()
+    profiler.enable()
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        profiler.disable()
+        sampler.stop()
+        wall_sec = time.perf_counter() - start_ts
+        info: Dict[str, Any] = {"enabled": True, "wall_sec": wall_sec, "samples": sampler.samples}
+        try:
+            ctx.ensure_dirs()
+            pstats_path = ctx.path(PSTATS_NAME)
+            profiler.dump_stats(pstats_path)
+            collapsed_path = ctx.path(COLLAPSED_NAME)
+            with open(collapsed_path, "w", encoding="utf-8") as f:
+                f.write(sampler.collapsed())
+            for path in (pstats_path, collapsed_path):
+                ctx.register_output(path)
+            info.update({
+                "pstats_url": f"/voice-changer/files/{ctx.task_id}/{PSTATS_NAME}",
+                "collapsed_url": f"/voice-changer/files/{ctx.task_id}/{COLLAPSED_NAME}",
+                "top": _top_functions(profiler),
+            })
+        except Exception as e:
+            info["error"] = str(e)
+        ctx.debug["profile"] = info
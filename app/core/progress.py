@@ -0,0 +1,121 @@
+from __future__ import annotations
+
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, str(default)))
+    except Exception:
+        return default
+
+
+def publish_interval_seconds() -> float:
+    """VC_PROGRESS_INTERVAL_SEC: min seconds between two progress writes to the task record (default 0.5)."""
+    return max(0.0, _env_float("VC_PROGRESS_INTERVAL_SEC", 0.5))
+
+
+class ProgressReporter:
+    """
+    Live per-step progress of one task, published to its status record.
+
+    The pipeline calls start_step/finish_step around every step (or fused group); ffmpeg
+    runs started meanwhile report how much audio they have written (-progress out_time),
+    chunked renders report finished segments. Percent is relative to the probed input
+    duration, speed is audio seconds per wall second of the current step.
+
+    publish(task_id, progress) receives a JSON-friendly dict; writes are throttled to
+    publish_interval_seconds() except at step boundaries.
+    """
+
+    def __init__(self, task_id: str, publish: Callable[[str, Dict[str, Any]], Any]) -> None:
+        self.task_id = task_id
+        self._publish = publish
+        self._lock = threading.Lock()
+        self._step: Optional[str] = None
+        self._duration: Optional[float] = None
+        self._started_at = 0.0
+        self._done_sec = 0.0
+        self._last_publish = 0.0
+        self._steps: Dict[str, Dict[str, Any]] = {}
+
+    def start_step(self, step: str, duration_sec: Optional[float]) -> None:
+        with self._lock:
+            self._step = step
+            self._duration = float(duration_sec) if duration_sec else None
+            self._started_at = time.perf_counter()
+            self._done_sec = 0.0
+        self._emit(force=True)
+
+    def update(self, out_sec: float) -> None:
+        """Audio written so far by the current step (seconds from the start of the output)."""
+        with self._lock:
+            self._done_sec = max(self._done_sec, float(out_sec))
+        self._emit()
+
+    def add(self, seconds: float) -> None:
+        """Another `seconds` of audio finished (parallel segments of the current step)."""
+        with self._lock:
+            self._done_sec += float(seconds)
+        self._emit()
+
+    def finish_step(self) -> None:
+        with self._lock:
+            if self._duration:
+                self._done_sec = self._duration
+        self._emit(force=True, finished=True)
+
+    def _snapshot(self, finished: bool) -> Dict[str, Any]:
+        wall = max(1e-9, time.perf_counter() - self._started_at)
+        done = self._done_sec if not self._duration else min(self._done_sec, self._duration)
+        step = {
+            "status": "done" if finished else "running",
+            "percent": round(100.0 * done / self._duration, 1) if self._duration else None,
+            "audio_sec": round(done, 3),
+            "wall_sec": round(wall, 3),
+            "speed": round(done / wall, 2) if done else None,
+        }
+        self._steps[str(self._step)] = step
+        return {
+            "step": self._step,
+            "duration_sec": self._duration,
+            **{k: step[k] for k in ("percent", "audio_sec", "speed")},
+            "steps": {name: dict(info) for name, info in self._steps.items()},
+            "updated_at": time.time(),
+        }
+
+    def _emit(self, force: bool = False, finished: bool = False) -> None:
+        now = time.perf_counter()
+        with self._lock:
+            if self._step is None or (not force and now - self._last_publish < publish_interval_seconds()):
+                return
+            self._last_publish = now
+            progress = self._snapshot(finished)
+        try:
+            self._publish(self.task_id, progress)
+        except Exception:
+            # Progress is best effort; never fail the task over a status write.
+            pass
+
+
+# The reporter of the task running on this thread (set by Pipeline.run, copied into
+# executor workers like the cancel token), so ffmpeg calls don't need it passed in.
+_current: contextvars.ContextVar[Optional[ProgressReporter]] = contextvars.ContextVar("vc_progress", default=None)
+
+
+def current_progress() -> Optional[ProgressReporter]:
+    return _current.get()
+
+
+@contextmanager
+def use_progress(reporter: Optional[ProgressReporter]) -> Iterator[Optional[ProgressReporter]]:
+    reset = _current.set(reporter)
+    try:
+        yield reporter
+    finally:
+        _current.reset(reset)
@@ -1,16 +1,37 @@
 from dotenv import load_dotenv
 load_dotenv()  # 加载 .env 文件
 
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from app.api.routes import router as api_router
 from app.api.voice_library.routes import router as voice_library_router
 from app.config.settings import OUTPUTS_DIR
+from app.core.executors import executor_stats
+from app.core.metrics import collect as collect_metrics, start_flusher as start_metrics_flusher
+from app.services.capabilities import get_capabilities
+from app.services.ffmpeg import ffmpeg_stats
+from app.services.providers.registry import get_provider_registry, provider_stats
+from app.services.singleflight import singleflight_stats
 import os
 
 
-app = FastAPI(title="Voice Changer API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+	# Probe ffmpeg/ffprobe (version, encoders, filters) once instead of per request.
+	await run_in_threadpool(get_capabilities().refresh)
+	# Build providers up front; ELEVEN_WARMUP_CONNECTIONS pre-opens upstream keep-alive connections.
+	await run_in_threadpool(get_provider_registry().warmup)
+	# Persist this worker's /metrics snapshot in the background (recording itself never writes).
+	start_metrics_flusher()
+	yield
+
+
+app = FastAPI(title="Voice Changer API", lifespan=lifespan)
 
 # CORS 配置
 allowed_origins = [o.strip() for o in os.getenv("ALLOWED_ORIGINS", "*").split(",") if o.strip()]
@@ -32,4 +53,11 @@ app.mount("/outputs", StaticFiles(directory=OUTPUTS_DIR), name="outputs")
 
 @app.get("/healthz")
 async def healthz():
-	return {"status": "ok"}
+	# Per-pool queue depth (pipeline/jobs executors), ffmpeg limiter slots, provider health and coalesced conversions for load diagnostics.
+	return {"status": "ok", "executors": executor_stats(), "ffmpeg": ffmpeg_stats(), "providers": provider_stats(), "singleflight": singleflight_stats()}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+	# Prometheus text format, merged across all worker processes (sync: runs in the threadpool).
+	return PlainTextResponse(collect_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
@@ -3,11 +3,20 @@ from .ffmpeg import (
 	FFmpegError,
 	standardize_to_wav,
 	convert_wav_to_mp3,
+	transcode_audio_async,
+	ffmpeg_stats,
+)
+
+from .capabilities import (
+	get_capabilities,
+	ToolInfo,
 )
 
 from .media_probe import (
 	is_ffprobe_available,
 	probe_duration_seconds,
+	probe_media,
+	MediaInfo,
 	MediaProbeError,
 )
 
@@ -17,8 +26,15 @@ __all__ = [
 	"FFmpegError",
 	"standardize_to_wav",
 	"convert_wav_to_mp3",
+	"transcode_audio_async",
+	"ffmpeg_stats",
 	# ffprobe helpers
 	"is_ffprobe_available",
 	"probe_duration_seconds",
+	"probe_media",
+	"MediaInfo",
 	"MediaProbeError",
+	# cached ffmpeg/ffprobe capabilities
+	"get_capabilities",
+	"ToolInfo",
 ]
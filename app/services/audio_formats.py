@@ -0,0 +1,133 @@
+from __future__ import annotations
+
+import mimetypes
+import os
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from app.services.capabilities import get_capabilities
+
+
+# Quality presets accepted in options.audio_quality, smallest first. Lossy formats map
+# them to a target bitrate; lossless formats (wav, flac) ignore them.
+QUALITY_PRESETS: Tuple[str, ...] = ("voice", "standard", "high")
+DEFAULT_QUALITY = "standard"
+
+_BITRATE_RE = re.compile(r"^\d{1,3}k$")
+
+
+@dataclass(frozen=True)
+class AudioFormat:
+    """
+    One output_format the export step can produce.
+
+    - name: the API value, also used as the file extension
+    - muxer: ffmpeg -f container
+    - encoders: ffmpeg encoders in order of preference; the first one this host has is used
+    - bitrates: quality preset -> target bitrate (empty for lossless formats)
+    - encoder_args: extra args per encoder (VBR mode, experimental flags)
+    - muxer_args: extra container args
+    """
+    name: str
+    mime: str
+    muxer: str
+    encoders: Tuple[str, ...]
+    bitrates: Dict[str, str] = field(default_factory=dict)
+    encoder_args: Dict[str, Tuple[str, ...]] = field(default_factory=dict)
+    muxer_args: Tuple[str, ...] = ()
+
+    @property
+    def lossless(self) -> bool:
+        return not self.bitrates
+
+    def encoder(self) -> Optional[str]:
+        """The encoder to use on this host, or None if ffmpeg has none of them."""
+        if self.name == "wav":
+            return self.encoders[0]
+        caps = get_capabilities()
+        return next((enc for enc in self.encoders if caps.has_encoder(enc)), None)
+
+
+_OPUS = dict(
+    mime="audio/ogg",
+    muxer="ogg",
+    # The native encoder is experimental and 48kHz-only, which is what standardize produces.
+    encoders=("libopus", "opus"),
+    bitrates={"voice": "24k", "standard": "48k", "high": "96k"},
+    encoder_args={"libopus": ("-vbr", "on"), "opus": ("-strict", "-2")},
+)
+_AAC = dict(
+    encoders=("libfdk_aac", "aac"),
+    bitrates={"voice": "48k", "standard": "96k", "high": "160k"},
+)
+
+FORMATS: Dict[str, AudioFormat] = {
+    f.name: f
+    for f in (
+        AudioFormat("mp3", "audio/mpeg", "mp3", ("libmp3lame",), {"voice": "64k", "standard": "192k", "high": "256k"}),
+        AudioFormat("wav", "audio/wav", "wav", ("pcm_s16le",)),
+        AudioFormat("opus", **_OPUS),
+        AudioFormat("ogg", **_OPUS),
+        AudioFormat("aac", "audio/aac", "adts", **_AAC),
+        AudioFormat("m4a", "audio/mp4", "ipod", muxer_args=("-movflags", "+faststart"), **_AAC),
+        AudioFormat("flac", "audio/flac", "flac", ("flac",), encoder_args={"flac": ("-compression_level", "8")}),
+    )
+}
+
+OUTPUT_FORMATS: Tuple[str, ...] = tuple(FORMATS)
+
+# /outputs is served by StaticFiles, which picks Content-Type from the extension.
+for _f in FORMATS.values():
+    mimetypes.add_type(_f.mime, f".{_f.name}")
+
+
+def get_format(name: str) -> AudioFormat:
+    fmt = FORMATS.get((name or "").lower().strip())
+    if fmt is None:
+        raise ValueError(f"output_format must be one of {', '.join(OUTPUT_FORMATS)}, got: {name!r}")
+    return fmt
+
+
+def available_formats() -> List[str]:
+    """Formats this host can actually produce (wav always: it needs no encoder)."""
+    if not get_capabilities().get("ffmpeg").available:
+        return ["wav"]
+    return [name for name, fmt in FORMATS.items() if fmt.encoder() is not None]
+
+
+def default_quality() -> str:
+    """VC_AUDIO_QUALITY: preset used when the request has no options.audio_quality (default standard)."""
+    value = str(os.getenv("VC_AUDIO_QUALITY", DEFAULT_QUALITY)).strip().lower()
+    return value if value in QUALITY_PRESETS else DEFAULT_QUALITY
+
+
+def resolve_bitrate(name: str, quality: Optional[str] = None, bitrate: Optional[str] = None) -> Optional[str]:
+    """
+    Target bitrate for a lossy format: an explicit bitrate ("48k") wins over the quality
+    preset. Returns None for lossless formats; raises ValueError on unknown values.
+    """
+    fmt = get_format(name)
+    if bitrate is not None:
+        bitrate = str(bitrate).strip().lower()
+        if not _BITRATE_RE.match(bitrate):
+            raise ValueError(f"bitrate must look like '48k', got: {bitrate!r}")
+    if quality is not None:
+        quality = str(quality).strip().lower()
+        if quality not in QUALITY_PRESETS:
+            raise ValueError(f"audio_quality must be one of {', '.join(QUALITY_PRESETS)}, got: {quality!r}")
+    if fmt.lossless:
+        return None
+    return bitrate or fmt.bitrates[quality or default_quality()]
+
+
+def encoder_args(name: str, bitrate: Optional[str] = None) -> List[str]:
+    """ffmpeg output args (codec, bitrate, container) for an output file of this format."""
+    fmt = get_format(name)
+    # No usable encoder: keep the preferred name so ffmpeg fails with a clear message.
+    encoder = fmt.encoder() or fmt.encoders[0]
+    args = ["-codec:a", encoder]
+    if not fmt.lossless:
+        args += ["-b:a", bitrate or fmt.bitrates[DEFAULT_QUALITY]]
+    args += list(fmt.encoder_args.get(encoder, ()))
+    return args + ["-f", fmt.muxer] + list(fmt.muxer_args)
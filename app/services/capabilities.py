@@ -0,0 +1,146 @@
+from __future__ import annotations
+
+import os
+import re
+import shutil
+import subprocess
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)))
+    except Exception:
+        return default
+
+
+def capabilities_ttl_seconds() -> int:
+    return max(0, _env_int("VC_CAPABILITIES_TTL_SEC", 300))
+
+
+@dataclass
+class ToolInfo:
+    """What one media binary (ffmpeg/ffprobe) on this host can do."""
+    name: str
+    available: bool = False
+    path: Optional[str] = None
+    version: Optional[str] = None
+    # Audio encoders/filters only (ffmpeg); empty when unknown.
+    encoders: List[str] = field(default_factory=list)
+    filters: List[str] = field(default_factory=list)
+    probed_at: float = 0.0
+    error: Optional[str] = None
+
+
+_FLAGS_RE = re.compile(r"^[A-Z.|]+$")
+
+
+def _run_text(cmd: List[str], timeout_sec: int = 10) -> str:
+    p = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout_sec, check=True)
+    return p.stdout
+
+
+def _parse_listing(text: str, *, audio: Callable[[List[str]], bool]) -> List[str]:
+    """
+    Parse `ffmpeg -encoders` / `ffmpeg -filters` tables: " <flags> <name> <...>" rows after the legend.
+    """
+    names: List[str] = []
+    for line in text.splitlines():
+        parts = line.split()
+        if len(parts) < 3 or parts[1] == "=" or parts[2] == "=" or not _FLAGS_RE.match(parts[0]):
+            continue
+        if audio(parts):
+            names.append(parts[1])
+    return sorted(set(names))
+
+
+def _probe_tool(name: str) -> ToolInfo:
+    info = ToolInfo(name=name, probed_at=time.time())
+    path = shutil.which(name)
+    if not path:
+        info.error = f"{name} not found on PATH"
+        return info
+    info.path = path
+    try:
+        first = (_run_text([path, "-hide_banner", "-version"]).splitlines() or [""])[0]
+        m = re.match(rf"{re.escape(name)} version (\S+)", first)
+        info.version = m.group(1) if m else first.strip() or None
+        info.available = True
+    except Exception as e:
+        info.error = str(e)
+        return info
+
+    if name == "ffmpeg":
+        try:
+            # " A....D libmp3lame ..." -> audio encoders
+            info.encoders = _parse_listing(
+                _run_text([path, "-hide_banner", "-encoders"]),
+                audio=lambda parts: parts[0].startswith("A"),
+            )
+            # " ..C acompressor A->A ..." -> filters with audio input or output
+            info.filters = _parse_listing(
+                _run_text([path, "-hide_banner", "-filters"]),
+                audio=lambda parts: "A" in parts[2],
+            )
+        except Exception as e:
+            info.error = f"capability listing failed: {e}"
+    return info
+
+
+class CapabilityRegistry:
+    """
+    Process-wide cache of media tool capabilities.
+
+    Probed once at startup (or on first use) instead of spawning `ffmpeg -version`
+    for every availability check; entries are re-probed after VC_CAPABILITIES_TTL_SEC
+    (0 = never) so installing/upgrading ffmpeg is picked up without a restart.
+    """
+
+    TOOLS = ("ffmpeg", "ffprobe")
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._tools: Dict[str, ToolInfo] = {}
+
+    def refresh(self) -> Dict[str, ToolInfo]:
+        tools = {name: _probe_tool(name) for name in self.TOOLS}
+        with self._lock:
+            self._tools = tools
+        return tools
+
+    def get(self, name: str) -> ToolInfo:
+        ttl = capabilities_ttl_seconds()
+        with self._lock:
+            info = self._tools.get(name)
+        if info is None or (ttl and time.time() - info.probed_at > ttl):
+            info = _probe_tool(name)
+            with self._lock:
+                self._tools[name] = info
+        return info
+
+    def has_encoder(self, encoder: str) -> bool:
+        info = self.get("ffmpeg")
+        # An empty list means the listing couldn't be read: don't block on it.
+        return info.available and (not info.encoders or encoder in info.encoders)
+
+    def has_filter(self, name: str) -> bool:
+        info = self.get("ffmpeg")
+        return info.available and (not info.filters or name in info.filters)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {name: asdict(self.get(name)) for name in self.TOOLS}
+
+
+_registry: Optional[CapabilityRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_capabilities() -> CapabilityRegistry:
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = CapabilityRegistry()
+        return _registry
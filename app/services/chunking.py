@@ -0,0 +1,236 @@
+from __future__ import annotations
+
+import os
+import shutil
+import time
+from concurrent.futures import Future, wait
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+from app.core.cancellation import check_cancelled
+from app.core.executors import get_executor
+from app.core.progress import current_progress, use_progress
+from app.services.pcm import read_wav, to_mono, write_wav
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, str(default)))
+    except Exception:
+        return default
+
+
+def chunk_seconds() -> float:
+    return max(5.0, _env_float("VC_CHUNK_SEC", 30.0))
+
+
+def chunk_search_seconds() -> float:
+    return max(0.0, _env_float("VC_CHUNK_SEARCH_SEC", 5.0))
+
+
+def crossfade_ms() -> float:
+    return max(0.0, _env_float("VC_CHUNK_CROSSFADE_MS", 50.0))
+
+
+def preroll_ms() -> float:
+    return max(0.0, _env_float("VC_CHUNK_PREROLL_MS", 250.0))
+
+
+def auto_chunk_min_seconds() -> float:
+    """Inputs at least this long are chunked automatically; 0 = only when requested."""
+    return max(0.0, _env_float("VC_CHUNK_MIN_SEC", 0.0))
+
+
+@dataclass
+class Segment:
+    """
+    One unit of parallel work, in source sample offsets.
+
+    [start, end) is the part this segment contributes; it is rendered from read_start
+    (start minus a pre-roll so filters with state such as echo/compressor are warmed up)
+    to read_end (end plus the crossfade overlap with the next segment).
+    """
+    index: int
+    start: int
+    end: int
+    read_start: int
+    read_end: int
+
+
+def find_split_points(mono: np.ndarray, sr: int, *, target_sec: float, search_sec: float, frame_ms: float = 20.0) -> List[int]:
+    """
+    Pick split offsets roughly every target_sec, each moved to the quietest frame
+    within +-search_sec so cuts land in pauses rather than mid-word.
+    """
+    n = int(mono.shape[0])
+    target = int(target_sec * sr)
+    if target <= 0 or n <= target + target // 2:
+        return []
+
+    frame = max(1, int(sr * frame_ms / 1000.0))
+    n_frames = n // frame
+    energy = np.square(mono[: n_frames * frame].astype(np.float64)).reshape(n_frames, frame).mean(axis=1)
+    search = int(search_sec * sr) // frame
+
+    points: List[int] = []
+    last = 0
+    while n - last > target + target // 2:
+        center = (last + target) // frame
+        lo = max(last // frame + 1, center - search)
+        hi = min(n_frames - 1, center + search)
+        if hi <= lo:
+            cut = last + target
+        else:
+            cut = (lo + int(np.argmin(energy[lo:hi + 1]))) * frame + frame // 2
+        points.append(cut)
+        last = cut
+    return points
+
+
+def plan_segments(n: int, split_points: List[int], *, preroll: int, overlap: int) -> List[Segment]:
+    bounds = [0] + [p for p in split_points if 0 < p < n] + [n]
+    segments: List[Segment] = []
+    for i in range(len(bounds) - 1):
+        start, end = bounds[i], bounds[i + 1]
+        is_last = i == len(bounds) - 2
+        segments.append(Segment(
+            index=i,
+            start=start,
+            end=end,
+            read_start=max(0, start - preroll),
+            read_end=end if is_last else min(n, end + overlap),
+        ))
+    return segments
+
+
+def _fit(samples: np.ndarray, length: int) -> np.ndarray:
+    """Trim/zero-pad a rendered segment to its source length (filters may add or drop a few ms)."""
+    if samples.shape[0] >= length:
+        return samples[:length]
+    pad = np.zeros((length - samples.shape[0],) + samples.shape[1:], dtype=samples.dtype)
+    return np.concatenate([samples, pad])
+
+
+def _best_lag(out: np.ndarray, rendered: np.ndarray, start: int, offset: int, max_lag: int) -> int:
+    """
+    Time-stretching filters (atempo) may shift a segment by a few ms. Match the tail of the
+    rendered pre-roll against the already stitched audio covering the same source span and
+    return the shift (in samples) that lines them up best; 0 when that span is too quiet to tell.
+    Equal-power crossfades of unaligned copies otherwise comb-filter the overlap.
+    """
+    window = (offset - max_lag) // 2
+    if window <= 0 or max_lag <= 0 or start < window:
+        return 0
+    ref = to_mono(out[start - window:start]).astype(np.float64)
+    ref_energy = float(np.dot(ref, ref))
+    if ref_energy < 1e-6 * window:
+        return 0
+    cand = to_mono(rendered[offset - window - max_lag:offset + max_lag]).astype(np.float64)
+    if cand.shape[0] < window + 2 * max_lag:
+        return 0
+    corr = np.correlate(cand, ref, mode="valid")
+    sq = np.concatenate([[0.0], np.cumsum(cand * cand)])
+    energy = sq[window:] - sq[:-window]
+    score = corr / np.sqrt(np.maximum(energy, 1e-12) * ref_energy)
+    best = int(np.argmax(score))
+    # A weak match means the pre-roll doesn't resemble the stitched audio: keep the nominal offset.
+    return best - max_lag if score[best] >= 0.5 else 0
+
+
+def stitch(rendered: List[np.ndarray], segments: List[Segment], *, overlap: int, max_lag: int = 0) -> np.ndarray:
+    """Reassemble rendered segments in order, equal-power crossfading each overlap."""
+    out: Optional[np.ndarray] = None
+    for seg, samples in zip(segments, rendered):
+        offset = seg.start - seg.read_start
+        lag = _best_lag(out, samples, seg.start, offset, max_lag) if out is not None else 0
+        samples = _fit(samples[offset + lag:], seg.read_end - seg.start)
+        if out is None:
+            out = samples
+            continue
+        xf = min(overlap, out.shape[0], samples.shape[0])
+        if xf <= 0:
+            out = np.concatenate([out, samples])
+            continue
+        t = np.linspace(0.0, np.pi / 2, xf, dtype=np.float32)
+        fade_in, fade_out = np.sin(t), np.cos(t)
+        if samples.ndim > 1:
+            fade_in, fade_out = fade_in[:, None], fade_out[:, None]
+        blended = out[-xf:] * fade_out + samples[:xf] * fade_in
+        out = np.concatenate([out[:-xf], blended, samples[xf:]])
+    return out if out is not None else np.zeros(0, dtype=np.float32)
+
+
+def run_chunked(
+    in_path: str,
+    out_path: str,
+    work_dir: str,
+    render: Callable[[str, str], None],
+    *,
+    target_sec: Optional[float] = None,
+    executor_name: str = "chunks",
+) -> Dict[str, Any]:
+    """
+    Split in_path (PCM WAV) at low-energy points, render every segment in parallel on the
+    executor_name pool via render(segment_in, segment_out), and crossfade the results into out_path.
+    The render callable must keep sample rate and duration (e.g. a pitch-preserving filter chain).
+    Returns meta describing the segmentation.
+    """
+    samples, sr = read_wav(in_path)
+    n = int(samples.shape[0])
+    overlap = int(sr * crossfade_ms() / 1000.0)
+    preroll = int(sr * preroll_ms() / 1000.0)
+    points = find_split_points(
+        to_mono(samples),
+        sr,
+        target_sec=target_sec or chunk_seconds(),
+        search_sec=chunk_search_seconds(),
+    )
+    segments = plan_segments(n, points, preroll=preroll, overlap=overlap)
+
+    os.makedirs(work_dir, exist_ok=True)
+    executor = get_executor(executor_name)
+    reporter = current_progress()
+
+    def _render_one(seg: Segment) -> np.ndarray:
+        # Queued segments of a cancelled task are skipped rather than rendered.
+        check_cancelled()
+        seg_in = os.path.join(work_dir, f"seg_{seg.index:04d}.wav")
+        seg_out = os.path.join(work_dir, f"seg_{seg.index:04d}_out.wav")
+        write_wav(seg_in, samples[seg.read_start:seg.read_end], sr)
+        # Per-segment ffmpeg out_time would be meaningless for the whole input;
+        # progress is reported per finished segment instead.
+        with use_progress(None):
+            render(seg_in, seg_out)
+        rendered, out_sr = read_wav(seg_out)
+        if out_sr != sr:
+            raise ValueError(f"Segment {seg.index} changed sample rate: {sr} -> {out_sr}")
+        if reporter is not None:
+            reporter.add((seg.end - seg.start) / sr)
+        return rendered
+
+    start_ts = time.perf_counter()
+    futures: List["Future[np.ndarray]"] = []
+    try:
+        futures = [executor.submit(_render_one, seg) for seg in segments]
+        rendered = [f.result() for f in futures]
+    finally:
+        # After a failed segment, drop the queued ones and let running ones finish
+        # before their directory goes away.
+        for f in futures:
+            f.cancel()
+        wait(futures)
+        # Segment WAVs are scratch files; only the stitched output is kept.
+        shutil.rmtree(work_dir, ignore_errors=True)
+    render_sec = time.perf_counter() - start_ts
+
+    write_wav(out_path, stitch(rendered, segments, overlap=overlap, max_lag=int(sr * 0.02)), sr)
+    return {
+        "segments": len(segments),
+        "boundaries_sec": [round(p / sr, 3) for p in points],
+        "crossfade_ms": crossfade_ms(),
+        "preroll_ms": preroll_ms(),
+        "workers": executor.max_workers,
+        "render_sec": render_sec,
+    }
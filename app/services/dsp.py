@@ -0,0 +1,231 @@
+from __future__ import annotations
+
+import math
+from typing import Any, Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from app.services.pcm import _smooth_len, resample
+
+
+# (kind, params) -- the same chain FunnyVoiceProvider renders as an ffmpeg filtergraph:
+#   ("pitch", {"factor"}), ("volume", {"gain"}), ("echo", {"in_gain", "out_gain", "delay_ms", "decay"}),
+#   ("highpass"/"lowpass", {"freq"}), ("compressor", {"threshold_db", "ratio", "attack_ms", "release_ms"}),
+#   ("tremolo", {"freq", "depth"})
+Effect = Tuple[str, Dict[str, Any]]
+
+# WSOLA analysis/synthesis window (~43ms at 48kHz: spans two periods of a low voice).
+WSOLA_WINDOW = 2048
+# Frames whose search-region spectra are computed in one vectorized FFT call.
+WSOLA_BLOCK_FRAMES = 256
+
+
+def _hann(n: int) -> np.ndarray:
+    # Periodic Hann: overlap-adds to exactly 1 at 50% overlap.
+    return (0.5 - 0.5 * np.cos(2.0 * np.pi * np.arange(n) / n)).astype(np.float64)
+
+
+def time_stretch(x: np.ndarray, factor: float, *, window: int = WSOLA_WINDOW) -> np.ndarray:
+    """
+    WSOLA time stretch (the same family as ffmpeg's atempo): returns len(x) * factor samples
+    at unchanged pitch.
+
+    Output frames are laid every window/2 samples; each one is read from the input near its
+    nominal position (k * hop / factor), shifted by up to window/4 to the offset whose
+    content best matches the natural continuation of the previous frame (FFT
+    cross-correlation), then Hann-windowed and overlap-added. Unlike a phase vocoder this
+    keeps the waveform (and level) of voiced speech intact.
+
+    The search regions only depend on the nominal positions, so their spectra are computed
+    in batches of WSOLA_BLOCK_FRAMES; only the continuation's spectrum is per frame.
+    """
+    n = int(x.shape[0])
+    target = int(round(n * factor))
+    if n == 0 or factor == 1.0:
+        return x.astype(np.float32)
+
+    hop = window // 2
+    tol = window // 4
+    hop_in = hop / factor
+    win = _hann(window)
+    pad = window + tol
+    padded = np.pad(x.astype(np.float64), (pad, pad + 2 * window + int(hop_in) + 2 * tol))
+    start = int(round(pad * factor))
+    n_frames = -(-(start + target) // hop) + 1
+    out = np.zeros(n_frames * hop + window, dtype=np.float64)
+    region_len = 2 * tol + window
+    # Lags 0..2*tol of a window-long template never wrap in a region_len-point circular correlation.
+    n_fft = _smooth_len(region_len)
+    nominal = np.round(np.arange(n_frames) * hop_in).astype(np.int64)
+    lo = np.maximum(0, nominal - tol)
+
+    prev = int(nominal[0])
+    out[:window] += padded[prev:prev + window] * win
+    for b in range(1, n_frames, WSOLA_BLOCK_FRAMES):
+        block_lo = lo[b:b + WSOLA_BLOCK_FRAMES]
+        regions = padded[block_lo[:, None] + np.arange(region_len)]
+        region_spec = np.fft.rfft(regions, n_fft, axis=1)
+        for i, k in enumerate(range(b, b + block_lo.shape[0])):
+            natural = padded[prev + hop:prev + hop + window]
+            corr = np.fft.irfft(region_spec[i] * np.conj(np.fft.rfft(natural, n_fft)), n_fft)
+            pos = int(block_lo[i]) + int(np.argmax(corr[:2 * tol + 1]))
+            out[k * hop:k * hop + window] += padded[pos:pos + window] * win
+            prev = pos
+    return out[start:start + target].astype(np.float32)
+
+
+def pitch_shift(x: np.ndarray, sr: int, factor: float) -> np.ndarray:
+    """
+    Shift pitch by factor keeping the duration, like asetrate=sr*factor,aresample=sr,atempo=1/factor:
+    stretch by factor (WSOLA), then play back at sr*factor (band-limited resample to sr).
+    """
+    if factor == 1.0:
+        return x.astype(np.float32)
+    stretched = time_stretch(x, factor)
+    y = resample(stretched, int(round(sr * factor)), sr)
+    n = int(x.shape[0])
+    if y.shape[0] >= n:
+        return y[:n]
+    return np.pad(y, (0, n - y.shape[0]))
+
+
+def _biquad_response(kind: str, freq: float, sr: int, n_fft: int, q: float = 1.0 / math.sqrt(2.0)) -> np.ndarray:
+    """Frequency response of ffmpeg's highpass/lowpass (2-pole RBJ biquad, Q=0.707) on an rfft grid."""
+    w0 = 2.0 * math.pi * freq / sr
+    cos_w0, alpha = math.cos(w0), math.sin(w0) / (2.0 * q)
+    if kind == "lowpass":
+        b = ((1.0 - cos_w0) / 2.0, 1.0 - cos_w0, (1.0 - cos_w0) / 2.0)
+    else:
+        b = ((1.0 + cos_w0) / 2.0, -(1.0 + cos_w0), (1.0 + cos_w0) / 2.0)
+    a = (1.0 + alpha, -2.0 * cos_w0, 1.0 - alpha)
+    z1 = np.exp(-1j * 2.0 * np.pi * np.arange(n_fft // 2 + 1) / n_fft)
+    z2 = z1 * z1
+    return (b[0] + b[1] * z1 + b[2] * z2) / (a[0] + a[1] * z1 + a[2] * z2)
+
+
+def biquad_filters(x: np.ndarray, sr: int, filters: Sequence[Tuple[str, float]]) -> np.ndarray:
+    """
+    Apply a cascade of highpass/lowpass biquads with one FFT: the product of their
+    (complex) responses. The signal is zero-padded by 0.1s so the decaying impulse
+    response doesn't wrap around (and rounded up to a fast FFT size).
+    """
+    if not filters or x.shape[0] == 0:
+        return x.astype(np.float32)
+    n = int(x.shape[0])
+    n_fft = _smooth_len(n + sr // 10)
+    response = np.ones(n_fft // 2 + 1, dtype=np.complex128)
+    for kind, freq in filters:
+        response *= _biquad_response(kind, float(freq), sr, n_fft)
+    return np.fft.irfft(np.fft.rfft(x.astype(np.float64), n=n_fft) * response, n=n_fft)[:n].astype(np.float32)
+
+
+def echo(x: np.ndarray, sr: int, *, in_gain: float, out_gain: float, delay_ms: float, decay: float) -> np.ndarray:
+    """aecho with one tap: (in * in_gain + in[t - delay] * decay) * out_gain; the output keeps the echo tail."""
+    d = int(sr * delay_ms / 1000.0)
+    y = np.zeros(x.shape[0] + d, dtype=np.float32)
+    y[:x.shape[0]] = x * in_gain
+    y[d:] += x * decay
+    return y * out_gain
+
+
+def _hermite(x: np.ndarray, x0: float, x1: float, p0: float, p1: float, m0: float, m1: float) -> np.ndarray:
+    width = x1 - x0
+    t = (x - x0) / width
+    m0 *= width
+    m1 *= width
+    c2 = -3.0 * p0 - 2.0 * m0 + 3.0 * p1 - m1
+    c3 = 2.0 * p0 + m0 - 2.0 * p1 + m1
+    return ((c3 * t + c2) * t + m0) * t + p0
+
+
+def compressor(
+    x: np.ndarray,
+    sr: int,
+    *,
+    threshold_db: float,
+    ratio: float,
+    attack_ms: float,
+    release_ms: float,
+    knee: float = 2.82843,
+    block_ms: float = 1.0,
+) -> np.ndarray:
+    """
+    acompressor (RMS detection, soft knee, ffmpeg's attack/release coefficients).
+
+    The attack/release envelope is a data-dependent recursion, so it runs on block_ms
+    power averages (coefficients scaled to the block length); the gain curve is then
+    computed for all blocks at once and interpolated back to samples.
+    """
+    n = int(x.shape[0])
+    if n == 0:
+        return x.astype(np.float32)
+    block = max(1, int(sr * block_ms / 1000.0))
+    n_blocks = -(-n // block)
+    power = np.zeros(n_blocks * block, dtype=np.float64)
+    power[:n] = np.square(x.astype(np.float64))
+    power = power.reshape(n_blocks, block).mean(axis=1)
+
+    attack = 1.0 - (1.0 - min(1.0, 4000.0 / (attack_ms * sr))) ** block
+    release = 1.0 - (1.0 - min(1.0, 4000.0 / (release_ms * sr))) ** block
+    env = np.empty(n_blocks, dtype=np.float64)
+    level = 0.0
+    for i, p in enumerate(power.tolist()):
+        level += (p - level) * (attack if p > level else release)
+        env[i] = level
+
+    thres = math.log(10.0 ** (threshold_db / 20.0))
+    knee_start = thres - 0.5 * math.log(knee)
+    knee_stop = thres + 0.5 * math.log(knee)
+    compressed_knee_stop = (knee_stop - thres) / ratio + thres
+
+    slope = 0.5 * np.log(np.maximum(env, 1e-30))  # log of the RMS level
+    out_log = (slope - thres) / ratio + thres
+    in_knee = slope < knee_stop
+    out_log[in_knee] = _hermite(slope[in_knee], knee_start, knee_stop, knee_start, compressed_knee_stop, 1.0, 1.0 / ratio)
+    gain = np.where(slope > knee_start, np.exp(out_log - slope), 1.0)
+
+    centers = (np.arange(n_blocks) + 0.5) * block
+    return (x * np.interp(np.arange(n), centers, gain)).astype(np.float32)
+
+
+def tremolo(x: np.ndarray, sr: int, *, freq: float, depth: float) -> np.ndarray:
+    """ffmpeg tremolo: gain = 1 - depth/2 + depth/2 * sin(2*pi*(freq*t + 1/4))."""
+    t = np.arange(x.shape[0], dtype=np.float64) / sr
+    gain = (1.0 - depth / 2.0) + (depth / 2.0) * np.sin(2.0 * np.pi * np.mod(freq * t + 0.25, 1.0))
+    return (x * gain).astype(np.float32)
+
+
+def _apply_mono(x: np.ndarray, sr: int, effects: Sequence[Effect]) -> np.ndarray:
+    y = x.astype(np.float32)
+    i = 0
+    while i < len(effects):
+        kind, params = effects[i]
+        if kind in ("highpass", "lowpass"):
+            # Consecutive biquads share one FFT.
+            cascade: List[Tuple[str, float]] = []
+            while i < len(effects) and effects[i][0] in ("highpass", "lowpass"):
+                cascade.append((effects[i][0], float(effects[i][1]["freq"])))
+                i += 1
+            y = biquad_filters(y, sr, cascade)
+            continue
+        if kind == "pitch":
+            y = pitch_shift(y, sr, float(params["factor"]))
+        elif kind == "volume":
+            y = y * float(params["gain"])
+        elif kind == "echo":
+            y = echo(y, sr, **params)
+        elif kind == "compressor":
+            y = compressor(y, sr, **params)
+        elif kind == "tremolo":
+            y = tremolo(y, sr, **params)
+        else:
+            raise ValueError(f"Unsupported effect: {kind!r}")
+        i += 1
+    return y
+
+
+def apply_effects(samples: np.ndarray, sr: int, effects: Sequence[Effect]) -> np.ndarray:
+    """Run an effect chain on float samples (mono, or (frames, channels) processed per channel)."""
+    if samples.ndim == 1:
+        return _apply_mono(samples, sr, effects)
+    return np.stack([_apply_mono(samples[:, c], sr, effects) for c in range(samples.shape[1])], axis=1)
@@ -1,23 +1,398 @@
 from __future__ import annotations
 
+import asyncio
+import os
 import subprocess
-from typing import List, Optional
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Callable, Deque, Dict, IO, List, Optional, Sequence, Tuple, Union
+
+from app.core.cancellation import CancelToken, TaskCancelled, await_cancellable, current_token
+from app.core.progress import current_progress
+from app.services import audio_formats
+from app.services.capabilities import get_capabilities
 
 
 class FfmpegError(RuntimeError):
     pass
 
 
-def is_available() -> bool:
-    """Return True if ffmpeg is available on PATH."""
+def _env_int(name: str, default: int) -> int:
     try:
-        subprocess.run(["ffmpeg", "-version"], check=True, capture_output=True)
-        return True
+        return int(os.getenv(name, str(default)))
     except Exception:
+        return default
+
+
+def _cpu_count() -> int:
+    return max(1, os.cpu_count() or 1)
+
+
+def max_concurrency() -> int:
+    """VC_FFMPEG_MAX_CONCURRENCY: ffmpeg processes allowed at once in this process (default: CPU count)."""
+    return max(1, _env_int("VC_FFMPEG_MAX_CONCURRENCY", _cpu_count()))
+
+
+def threads_per_process() -> int:
+    """VC_FFMPEG_THREADS: threads per ffmpeg (default: CPU count / max concurrency, at least 1)."""
+    return max(1, _env_int("VC_FFMPEG_THREADS", max(1, _cpu_count() // max_concurrency())))
+
+
+def is_available() -> bool:
+    """Return True if ffmpeg is available on PATH (cached, see app.services.capabilities)."""
+    return get_capabilities().get("ffmpeg").available
+
+
+@dataclass
+class FfmpegRun:
+    """Timing of one ffmpeg call: time spent waiting for a limiter slot, then running."""
+    queue_sec: float = 0.0
+    run_sec: float = 0.0
+
+
+# How often blocking waits re-check the task's cancel token.
+_POLL_SEC = 0.1
+
+_Waiter = Union[threading.Event, Tuple[asyncio.AbstractEventLoop, "asyncio.Future[None]"]]
+
+
+class FfmpegLimiter:
+    """
+    Process-wide cap on concurrent ffmpeg processes, shared by the blocking API (pipeline
+    and chunk worker threads) and the asyncio API (event loop), with one FIFO queue.
+
+    A release hands the slot straight to the oldest waiter, so a burst of uploads queues
+    up here instead of oversubscribing the CPU with ffmpeg processes.
+    """
+
+    def __init__(self, limit: int) -> None:
+        self.limit = limit
+        self._lock = threading.Lock()
+        self._active = 0
+        self._waiters: Deque[_Waiter] = deque()
+        self._calls = 0
+        self._failed = 0
+        self._queue_sec_total = 0.0
+        self._run_sec_total = 0.0
+
+    def _try_acquire(self) -> bool:
+        if self._active < self.limit and not self._waiters:
+            self._active += 1
+            return True
         return False
 
+    def acquire(self, token: Optional[CancelToken] = None) -> None:
+        with self._lock:
+            if self._try_acquire():
+                return
+            event = threading.Event()
+            self._waiters.append(event)
+        while not event.wait(_POLL_SEC if token is not None else None):
+            if token is not None and token.cancelled:
+                with self._lock:
+                    if event in self._waiters:
+                        self._waiters.remove(event)
+                        raise TaskCancelled(token.reason or "cancelled")
+                # Granted while we were giving up: hand the slot on.
+                self.release()
+                raise TaskCancelled(token.reason or "cancelled")
 
-def transcode_audio(
+    async def acquire_async(self) -> None:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._try_acquire():
+                return
+            fut: "asyncio.Future[None]" = loop.create_future()
+            waiter = (loop, fut)
+            self._waiters.append(waiter)
+        try:
+            await fut
+        except asyncio.CancelledError:
+            with self._lock:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                    owned = False
+                else:
+                    # Granted just before the cancellation landed: give the slot back.
+                    owned = fut.done() and not fut.cancelled()
+            if owned:
+                self.release()
+            raise
+
+    def _grant(self, fut: "asyncio.Future[None]") -> None:
+        if fut.done():
+            # Waiter was cancelled after the slot was handed to it.
+            self.release()
+        else:
+            fut.set_result(None)
+
+    def release(self) -> None:
+        with self._lock:
+            while self._waiters:
+                waiter = self._waiters.popleft()
+                if isinstance(waiter, threading.Event):
+                    waiter.set()
+                    return
+                loop, fut = waiter
+                if fut.done():
+                    continue
+                try:
+                    loop.call_soon_threadsafe(self._grant, fut)
+                except RuntimeError:
+                    continue  # its event loop is closed: nobody is waiting there any more
+                return
+            self._active -= 1
+
+    def record(self, run: FfmpegRun, ok: bool) -> None:
+        with self._lock:
+            self._calls += 1
+            self._failed += 0 if ok else 1
+            self._queue_sec_total += run.queue_sec
+            self._run_sec_total += run.run_sec
+        from app.core import metrics
+        if metrics.metrics_enabled():
+            registry = metrics.get_registry()
+            registry.observe("vc_ffmpeg_queue_seconds", run.queue_sec)
+            registry.observe("vc_ffmpeg_run_seconds", run.run_sec, {"status": "ok" if ok else "error"})
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "max_concurrency": self.limit,
+                "threads": threads_per_process(),
+                "running": self._active,
+                "queued": len(self._waiters),
+                "calls": self._calls,
+                "failed": self._failed,
+                "avg_queue_wait_sec": (self._queue_sec_total / self._calls) if self._calls else 0.0,
+                "avg_run_sec": (self._run_sec_total / self._calls) if self._calls else 0.0,
+            }
+
+
+_limiter: Optional[FfmpegLimiter] = None
+_limiter_lock = threading.Lock()
+
+
+def get_limiter() -> FfmpegLimiter:
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = FfmpegLimiter(max_concurrency())
+        return _limiter
+
+
+def ffmpeg_stats() -> Dict[str, Any]:
+    return get_limiter().stats()
+
+
+def _encoder_args(fmt: str, bitrate: Optional[str] = None) -> List[str]:
+    # Codec/bitrate/container per output format: see app.services.audio_formats.
+    return audio_formats.encoder_args(fmt, bitrate)
+
+
+def _base_cmd(in_path: str) -> List[str]:
+    # Thread counts are sized so max_concurrency() processes together use about one thread per core.
+    # -threads before -i only caps the decoder; encoders get their own via _output_threads().
+    threads = str(threads_per_process())
+    return [
+        "ffmpeg", "-y", "-hide_banner", "-loglevel", "error",
+        "-filter_threads", threads, "-filter_complex_threads", threads,
+        "-threads", threads, "-i", in_path,
+    ]
+
+
+def _output_threads() -> List[str]:
+    """Per-output -threads (goes right before each output path): without it encoders use every core."""
+    return ["-threads", str(threads_per_process())]
+
+
+def _kill(proc: subprocess.Popen) -> None:
+    try:
+        proc.kill()
+    except ProcessLookupError:
+        pass
+    proc.communicate()
+
+
+ProgressCallback = Callable[[float], None]
+
+
+def _with_progress(cmd: List[str]) -> List[str]:
+    # -progress writes key=value blocks (out_time_us=..., progress=continue|end) to stdout.
+    return cmd[:1] + ["-progress", "pipe:1", "-nostats"] + cmd[1:]
+
+
+def _parse_out_time(line: str) -> Optional[float]:
+    """Seconds of output written, from an `out_time_us=` / `out_time_ms=` progress line (both are microseconds)."""
+    key, _, value = line.strip().partition("=")
+    if key not in ("out_time_us", "out_time_ms"):
+        return None
+    try:
+        return max(0.0, int(value) / 1_000_000.0)
+    except ValueError:
+        return None  # "N/A" before the first frame
+
+
+def _read_progress(stream: IO[str], progress: ProgressCallback) -> None:
+    with stream:
+        for line in stream:
+            sec = _parse_out_time(line)
+            if sec is not None:
+                try:
+                    progress(sec)
+                except Exception:
+                    pass
+
+
+def _run(cmd: List[str], timeout_sec: int, progress: Optional[ProgressCallback] = None) -> FfmpegRun:
+    """
+    Run ffmpeg under the global limiter. When the calling task has a cancel token
+    (see app.core.cancellation), both the wait for a slot and the run itself are
+    interrupted as soon as it fires: the child is killed and TaskCancelled raised.
+
+    progress (default: the task's ProgressReporter, if any) is called with the seconds
+    of audio written so far, parsed from `-progress pipe:1` on a reader thread.
+    """
+    if progress is None:
+        reporter = current_progress()
+        progress = reporter.update if reporter is not None else None
+    token = current_token()
+    if token is not None:
+        token.raise_if_cancelled()
+        timeout_sec = token.timeout(timeout_sec)
+    limiter = get_limiter()
+    queued_at = time.perf_counter()
+    limiter.acquire(token)
+    run = FfmpegRun(queue_sec=time.perf_counter() - queued_at)
+    started_at = time.perf_counter()
+    ok = False
+    try:
+        reader: Optional[threading.Thread] = None
+        if progress is None:
+            proc = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        else:
+            # Progress gets its own pipe so communicate() below only collects stderr.
+            read_fd, write_fd = os.pipe()
+            try:
+                proc = subprocess.Popen(_with_progress(cmd), stdin=subprocess.DEVNULL, stdout=write_fd, stderr=subprocess.PIPE, text=True)
+            except BaseException:
+                os.close(read_fd)
+                raise
+            finally:
+                os.close(write_fd)
+            reader = threading.Thread(
+                target=_read_progress, args=(os.fdopen(read_fd, "r", encoding="utf-8", errors="replace"), progress), daemon=True
+            )
+            reader.start()
+        deadline = started_at + timeout_sec
+        while True:
+            wait = deadline - time.perf_counter()
+            if token is not None:
+                wait = min(wait, _POLL_SEC)
+            try:
+                stdout, stderr = proc.communicate(timeout=max(0.0, wait))
+                break
+            except subprocess.TimeoutExpired:
+                if token is not None and token.cancelled:
+                    _kill(proc)
+                    raise TaskCancelled(token.reason or "cancelled")
+                if time.perf_counter() >= deadline:
+                    _kill(proc)
+                    raise FfmpegError(f"ffmpeg timeout after {timeout_sec}s")
+        if reader is not None:
+            reader.join(timeout=1.0)
+        if proc.returncode != 0:
+            raise FfmpegError(f"ffmpeg failed: {stderr or stdout or f'exit code {proc.returncode}'}")
+        ok = True
+    finally:
+        limiter.release()
+        run.run_sec = time.perf_counter() - started_at
+        limiter.record(run, ok)
+    return run
+
+
+async def _apump_progress(stream: asyncio.StreamReader, progress: ProgressCallback) -> None:
+    async for raw in stream:
+        sec = _parse_out_time(raw.decode("utf-8", "replace"))
+        if sec is not None:
+            try:
+                progress(sec)
+            except Exception:
+                pass
+
+
+async def _acommunicate(proc: asyncio.subprocess.Process, progress: Optional[ProgressCallback]) -> Tuple[bytes, bytes]:
+    if progress is None:
+        return await proc.communicate()
+    assert proc.stdout is not None and proc.stderr is not None
+    pump = asyncio.ensure_future(_apump_progress(proc.stdout, progress))
+    try:
+        stderr = await proc.stderr.read()
+        await proc.wait()
+        await pump
+    finally:
+        pump.cancel()
+    return b"", stderr
+
+
+async def _run_async(cmd: List[str], timeout_sec: int, progress: Optional[ProgressCallback] = None) -> FfmpegRun:
+    """
+    asyncio counterpart of _run: waits for a limiter slot without blocking the loop and
+    kills the child if the awaiting task is cancelled (e.g. the client disconnected) or
+    the calling task's cancel token fires (timeout_sec is capped by its deadline).
+    progress defaults to the task's ProgressReporter, as in _run.
+    """
+    if progress is None:
+        reporter = current_progress()
+        progress = reporter.update if reporter is not None else None
+    token = current_token()
+    if token is not None:
+        token.raise_if_cancelled()
+        timeout_sec = token.timeout(timeout_sec)
+    limiter = get_limiter()
+    queued_at = time.perf_counter()
+    await await_cancellable(limiter.acquire_async())
+    run = FfmpegRun(queue_sec=time.perf_counter() - queued_at)
+    started_at = time.perf_counter()
+    ok = False
+    proc: Optional[asyncio.subprocess.Process] = None
+    try:
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                *(cmd if progress is None else _with_progress(cmd)),
+                stdin=asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+            )
+        except OSError as e:
+            raise FfmpegError(f"ffmpeg failed to start: {e}") from e
+        try:
+            stdout, stderr = await await_cancellable(asyncio.wait_for(_acommunicate(proc, progress), timeout=timeout_sec))
+        except asyncio.TimeoutError as e:
+            if token is not None and token.cancelled:
+                raise TaskCancelled(token.reason or "cancelled") from e  # the timeout was the deadline
+            raise FfmpegError(f"ffmpeg timeout after {timeout_sec}s") from e
+        if proc.returncode != 0:
+            detail = (stderr or stdout or b"").decode("utf-8", "replace").strip()
+            raise FfmpegError(f"ffmpeg failed: {detail or f'exit code {proc.returncode}'}")
+        ok = True
+    finally:
+        if proc is not None and proc.returncode is None:
+            # Timed out or cancelled (task or token): don't leave the encoder running after nobody waits for it.
+            try:
+                proc.kill()
+            except ProcessLookupError:
+                pass
+            await asyncio.shield(proc.wait())
+        limiter.release()
+        run.run_sec = time.perf_counter() - started_at
+        limiter.record(run, ok)
+    return run
+
+
+def _transcode_cmd(
     *,
     in_path: str,
     out_path: str,
@@ -25,18 +400,15 @@ def transcode_audio(
     sample_rate: Optional[int] = None,
     bitrate: Optional[str] = None,
     extra_afilters: Optional[List[str]] = None,
-    timeout_sec: int = 60,
-) -> None:
-    fmt = output_format.lower().strip()
-    if fmt not in ("mp3", "wav"):
-        raise ValueError(f"output_format must be mp3 or wav, got: {output_format!r}")
+) -> List[str]:
+    fmt = audio_formats.get_format(output_format).name
 
     # 音频滤镜：拼接为 -af filter1,filter2
     afilters: List[str] = []
     if extra_afilters:
         afilters.extend([f for f in extra_afilters if f])
 
-    cmd: List[str] = ["ffmpeg", "-y", "-hide_banner", "-loglevel", "error", "-i", in_path]
+    cmd: List[str] = _base_cmd(in_path)
 
     if sample_rate:
         cmd += ["-ar", str(int(sample_rate))]
@@ -44,21 +416,101 @@ def transcode_audio(
     if afilters:
         cmd += ["-af", ",".join(afilters)]
 
-    if fmt == "mp3":
-        # 默认 mp3 编码参数：先给稳妥值，后续可通过 options 调整
-        cmd += ["-codec:a", "libmp3lame"]
-        cmd += ["-b:a", bitrate or "192k"]
-        cmd += ["-f", "mp3", out_path]
-    else:
-        # wav：PCM 16-bit
-        cmd += ["-codec:a", "pcm_s16le", "-f", "wav", out_path]
+    return cmd + _encoder_args(fmt, bitrate) + _output_threads() + [out_path]
 
-    try:
-        subprocess.run(cmd, check=True, capture_output=True, text=True, timeout=timeout_sec)
-    except subprocess.TimeoutExpired as e:
-        raise FfmpegError(f"ffmpeg timeout after {timeout_sec}s: {e}") from e
-    except subprocess.CalledProcessError as e:
-        raise FfmpegError(f"ffmpeg failed: {e.stderr or e.stdout or str(e)}") from e
+
+def _transcode_multi_cmd(
+    *,
+    in_path: str,
+    filter_complex: str,
+    outputs: Sequence[Tuple[str, str, str, Optional[str]]],
+) -> List[str]:
+    if not outputs:
+        raise ValueError("outputs must not be empty")
+
+    cmd: List[str] = _base_cmd(in_path)
+    cmd += ["-filter_complex", filter_complex]
+    for label, out_path, output_format, bitrate in outputs:
+        fmt = audio_formats.get_format(output_format).name
+        cmd += ["-map", label] + _encoder_args(fmt, bitrate) + _output_threads() + [out_path]
+    return cmd
+
+
+def transcode_audio(
+    *,
+    in_path: str,
+    out_path: str,
+    output_format: str,
+    sample_rate: Optional[int] = None,
+    bitrate: Optional[str] = None,
+    extra_afilters: Optional[List[str]] = None,
+    timeout_sec: int = 60,
+    progress: Optional[ProgressCallback] = None,
+) -> FfmpegRun:
+    """
+    progress(out_sec) is fed from ffmpeg's `-progress` output while it runs; inside a
+    pipeline task it defaults to the task's ProgressReporter (see app.core.progress).
+    """
+    cmd = _transcode_cmd(
+        in_path=in_path,
+        out_path=out_path,
+        output_format=output_format,
+        sample_rate=sample_rate,
+        bitrate=bitrate,
+        extra_afilters=extra_afilters,
+    )
+    return _run(cmd, timeout_sec, progress)
+
+
+def transcode_audio_multi(
+    *,
+    in_path: str,
+    filter_complex: str,
+    outputs: Sequence[Tuple[str, str, str, Optional[str]]],
+    timeout_sec: int = 60,
+    progress: Optional[ProgressCallback] = None,
+) -> FfmpegRun:
+    """
+    Decode once, write several outputs.
+
+    filter_complex must define every label referenced in outputs;
+    outputs: [(label, out_path, output_format, bitrate)], e.g. ("[std]", "standardized.wav", "wav", None).
+    """
+    return _run(_transcode_multi_cmd(in_path=in_path, filter_complex=filter_complex, outputs=outputs), timeout_sec, progress)
+
+
+async def transcode_audio_async(
+    *,
+    in_path: str,
+    out_path: str,
+    output_format: str,
+    sample_rate: Optional[int] = None,
+    bitrate: Optional[str] = None,
+    extra_afilters: Optional[List[str]] = None,
+    timeout_sec: int = 60,
+    progress: Optional[ProgressCallback] = None,
+) -> FfmpegRun:
+    """transcode_audio for async callers; cancelling the awaiting task (or the task's cancel token) kills ffmpeg."""
+    cmd = _transcode_cmd(
+        in_path=in_path,
+        out_path=out_path,
+        output_format=output_format,
+        sample_rate=sample_rate,
+        bitrate=bitrate,
+        extra_afilters=extra_afilters,
+    )
+    return await _run_async(cmd, timeout_sec, progress)
+
+
+async def transcode_audio_multi_async(
+    *,
+    in_path: str,
+    filter_complex: str,
+    outputs: Sequence[Tuple[str, str, str, Optional[str]]],
+    timeout_sec: int = 60,
+    progress: Optional[ProgressCallback] = None,
+) -> FfmpegRun:
+    return await _run_async(_transcode_multi_cmd(in_path=in_path, filter_complex=filter_complex, outputs=outputs), timeout_sec, progress)
 
 
 # Backward-compatible API expected by steps
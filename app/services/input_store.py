@@ -0,0 +1,184 @@
+from __future__ import annotations
+
+import json
+import os
+import shutil
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.config.settings import RUNS_BASE_DIR
+
+
+# runs/inputs/<sha256>/standardized.wav + meta.json
+STORE_DIR = os.path.join(RUNS_BASE_DIR, "inputs")
+WAV_NAME = "standardized.wav"
+META_NAME = "meta.json"
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)))
+    except Exception:
+        return default
+
+
+def store_enabled() -> bool:
+    return str(os.getenv("VC_INPUT_STORE", "1")).strip().lower() not in {"0", "false", "no", "off"}
+
+
+def store_ttl_seconds() -> int:
+    return max(0, _env_int("VC_INPUT_STORE_TTL_SEC", 3600))
+
+
+def store_max_bytes() -> int:
+    return max(0, _env_int("VC_INPUT_STORE_MAX_BYTES", 512 * 1024 * 1024))
+
+
+def _valid_id(input_id: str) -> bool:
+    return bool(input_id) and len(input_id) == 64 and all(c in "0123456789abcdef" for c in input_id)
+
+
+def _entry_dir(input_id: str) -> str:
+    return os.path.join(STORE_DIR, input_id)
+
+
+def _read_meta(input_id: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(os.path.join(_entry_dir(input_id), META_NAME), "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) else None
+    except Exception:
+        return None
+
+
+def _write_meta(input_id: str, meta: Dict[str, Any]) -> None:
+    path = os.path.join(_entry_dir(input_id), META_NAME)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def link_or_copy(src: str, dst: str) -> str:
+    """Hard-link src to dst (same filesystem), else copy. Returns "link" or "copy"."""
+    try:
+        if os.path.exists(dst):
+            os.remove(dst)
+        os.link(src, dst)
+        return "link"
+    except OSError:
+        shutil.copyfile(src, dst)
+        return "copy"
+
+
+@dataclass
+class StoredInput:
+    input_id: str
+    wav_path: str
+    duration_sec: Optional[float]
+    meta: Dict[str, Any]
+
+
+def get(input_id: str) -> Optional[StoredInput]:
+    """Look up a standardized input by content hash; refreshes its TTL on hit."""
+    if not store_enabled() or not _valid_id(input_id):
+        return None
+    meta = _read_meta(input_id)
+    wav_path = os.path.join(_entry_dir(input_id), WAV_NAME)
+    if not meta or not os.path.isfile(wav_path):
+        return None
+
+    now = time.time()
+    ttl = store_ttl_seconds()
+    if ttl and now - float(meta.get("last_used_at") or meta.get("created_at") or 0) > ttl:
+        shutil.rmtree(_entry_dir(input_id), ignore_errors=True)
+        return None
+
+    meta["last_used_at"] = now
+    try:
+        _write_meta(input_id, meta)
+    except Exception:
+        pass
+    dur = meta.get("duration_sec")
+    return StoredInput(
+        input_id=input_id,
+        wav_path=wav_path,
+        duration_sec=float(dur) if dur is not None else None,
+        meta=meta,
+    )
+
+
+def put(input_id: str, wav_path: str, *, duration_sec: Optional[float] = None, extra: Optional[Dict[str, Any]] = None) -> Optional[StoredInput]:
+    """Keep a standardized WAV for later tasks (input_id = sha256 of the original upload)."""
+    if not store_enabled() or not _valid_id(input_id) or not os.path.isfile(wav_path):
+        return None
+
+    entry_dir = _entry_dir(input_id)
+    os.makedirs(entry_dir, exist_ok=True)
+    dst = os.path.join(entry_dir, WAV_NAME)
+    tmp = dst + ".tmp"
+    link_or_copy(wav_path, tmp)
+    os.replace(tmp, dst)
+
+    now = time.time()
+    meta: Dict[str, Any] = dict(extra or {})
+    meta.update({
+        "input_id": input_id,
+        "duration_sec": duration_sec,
+        "size": os.path.getsize(dst),
+        "created_at": now,
+        "last_used_at": now,
+    })
+    _write_meta(input_id, meta)
+
+    # Keep the store within budget on every insert (directory is small: one entry per upload).
+    evict(max_bytes=store_max_bytes(), max_age_seconds=store_ttl_seconds(), apply=True)
+    return StoredInput(input_id=input_id, wav_path=dst, duration_sec=duration_sec, meta=meta)
+
+
+def evict(*, max_bytes: int, max_age_seconds: int, apply: bool) -> List[Tuple[str, str]]:
+    """
+    Drop expired entries, then least-recently-used ones until the store fits max_bytes.
+    Returns [(reason, entry_dir)].
+    """
+    if not os.path.isdir(STORE_DIR):
+        return []
+
+    now = time.time()
+    removed: List[Tuple[str, str]] = []
+    live: List[Tuple[float, int, str]] = []
+    for name in os.listdir(STORE_DIR):
+        entry_dir = os.path.join(STORE_DIR, name)
+        if not os.path.isdir(entry_dir):
+            continue
+        meta = _read_meta(name)
+        wav_path = os.path.join(entry_dir, WAV_NAME)
+        if not meta or not os.path.isfile(wav_path):
+            # Half-written entries are only removed once they are clearly abandoned.
+            try:
+                age = now - os.stat(entry_dir).st_mtime
+            except FileNotFoundError:
+                continue
+            if age > 600:
+                removed.append(("incomplete", entry_dir))
+                if apply:
+                    shutil.rmtree(entry_dir, ignore_errors=True)
+            continue
+        last_used = float(meta.get("last_used_at") or meta.get("created_at") or 0)
+        if max_age_seconds and now - last_used > max_age_seconds:
+            removed.append(("expired", entry_dir))
+            if apply:
+                shutil.rmtree(entry_dir, ignore_errors=True)
+            continue
+        live.append((last_used, os.path.getsize(wav_path), entry_dir))
+
+    total = sum(size for _, size, _ in live)
+    for _, size, entry_dir in sorted(live):
+        if not max_bytes or total <= max_bytes:
+            break
+        removed.append(("over_budget", entry_dir))
+        total -= size
+        if apply:
+            shutil.rmtree(entry_dir, ignore_errors=True)
+    return removed
@@ -2,9 +2,13 @@ from __future__ import annotations
 
 import json
 import os
+import struct
 import subprocess
 import sys
-from typing import Optional
+from dataclasses import asdict, dataclass
+from typing import Any, BinaryIO, Dict, Optional, Tuple
+
+from app.services.capabilities import get_capabilities
 
 
 class MediaProbeError(RuntimeError):
@@ -12,19 +16,19 @@ class MediaProbeError(RuntimeError):
 
 
 def is_ffprobe_available() -> bool:
-    """Return True if ffprobe is available on PATH."""
-    try:
-        subprocess.run(["ffprobe", "-version"], check=True, capture_output=True)
-        return True
-    except Exception:
-        return False
+    """Return True if ffprobe is available on PATH (cached, see app.services.capabilities)."""
+    return get_capabilities().get("ffprobe").available
 
 
 def probe_duration_seconds(path: str, timeout_sec: int = 10) -> Optional[float]:
     """
     Return duration in seconds if available, else None.
-    Uses ffprobe (ffmpeg).
+    Reads WAV/MP3/MP4 headers in-process when possible, otherwise uses ffprobe (ffmpeg).
     """
+    fast = probe_header(path)
+    if fast is not None and fast.duration_sec is not None:
+        return fast.duration_sec
+
     cmd = [
         "ffprobe",
         "-v", "error",
@@ -52,6 +56,466 @@ def probe_duration_seconds(path: str, timeout_sec: int = 10) -> Optional[float]:
         return None
 
 
+@dataclass
+class MediaInfo:
+    """
+    Structured result of one ffprobe call on an input (first audio stream + container).
+    Attached to Artifact.meta["media"] so later steps don't probe again.
+    """
+    duration_sec: Optional[float] = None
+    container: Optional[str] = None      # ffprobe format_name, e.g. "wav", "mov,mp4,m4a,3gp,3g2,mj2"
+    codec: Optional[str] = None          # e.g. "pcm_s16le", "mp3", "aac"
+    sample_rate: Optional[int] = None
+    channels: Optional[int] = None
+    bit_rate: Optional[int] = None
+    sample_fmt: Optional[str] = None
+    has_audio: bool = True
+    prober: str = "ffprobe"              # "ffprobe" or "header" (in-process fast path)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: Optional[Dict[str, Any]]) -> Optional["MediaInfo"]:
+        if not isinstance(data, dict):
+            return None
+        known = {k: data.get(k) for k in cls.__dataclass_fields__ if k in data}
+        return cls(**known)
+
+    def is_pcm_wav(self, *, sample_rate: int, channels: int = 1) -> bool:
+        """True if the file already is 16-bit PCM WAV at sample_rate/channels (nothing to standardize)."""
+        return (
+            self.has_audio
+            and (self.container or "").split(",")[0] == "wav"
+            and self.codec == "pcm_s16le"
+            and self.sample_rate == sample_rate
+            and self.channels == channels
+        )
+
+
+def _to_int(v: Any) -> Optional[int]:
+    try:
+        return int(v) if v not in (None, "", "N/A") else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _to_float(v: Any) -> Optional[float]:
+    try:
+        return float(v) if v not in (None, "", "N/A") else None
+    except (TypeError, ValueError):
+        return None
+
+
+# ---------------------------------------------------------------------------
+# In-process header parsers (fast path). Each returns None when the file is not
+# that format or the header is ambiguous, in which case ffprobe decides.
+# ---------------------------------------------------------------------------
+
+def fast_probe_enabled() -> bool:
+    return str(os.getenv("VC_FAST_PROBE", "1")).strip().lower() not in {"0", "false", "no", "off"}
+
+
+def sniff_format(head: bytes) -> Optional[str]:
+    """Identify the container from magic bytes: "wav", "mp3", "mp4" or None."""
+    if len(head) >= 12 and head[:4] == b"RIFF" and head[8:12] == b"WAVE":
+        return "wav"
+    if len(head) >= 12 and head[4:8] == b"ftyp":
+        return "mp4"
+    if head[:3] == b"ID3" or (len(head) >= 2 and head[0] == 0xFF and (head[1] & 0xE0) == 0xE0):
+        return "mp3"
+    return None
+
+
+_WAV_CODECS = {
+    (1, 8): "pcm_u8",
+    (1, 16): "pcm_s16le",
+    (1, 24): "pcm_s24le",
+    (1, 32): "pcm_s32le",
+    (3, 32): "pcm_f32le",
+    (3, 64): "pcm_f64le",
+}
+
+
+def _parse_wav(f: BinaryIO, file_size: int) -> Optional[MediaInfo]:
+    f.seek(12)
+    fmt: Optional[Tuple[int, int, int, int, int]] = None
+    while True:
+        hdr = f.read(8)
+        if len(hdr) < 8:
+            return None
+        chunk_id, size = hdr[:4], struct.unpack("<I", hdr[4:])[0]
+        if chunk_id == b"fmt ":
+            body = f.read(size)
+            if len(body) < 16:
+                return None
+            audio_format, channels, sample_rate, byte_rate, _, bits = struct.unpack("<HHIIHH", body[:16])
+            if audio_format == 0xFFFE and len(body) >= 26:
+                # WAVE_FORMAT_EXTENSIBLE: the real format tag starts the SubFormat GUID
+                audio_format = struct.unpack("<H", body[24:26])[0]
+            fmt = (audio_format, channels, sample_rate, byte_rate, bits)
+        elif chunk_id == b"data":
+            if fmt is None:
+                return None
+            audio_format, channels, sample_rate, byte_rate, bits = fmt
+            codec = _WAV_CODECS.get((audio_format, bits))
+            if codec is None or not byte_rate or not sample_rate:
+                return None  # compressed/unusual WAV payload: let ffprobe handle it
+            data_start = f.tell()
+            # Streaming recorders leave size 0/0xFFFFFFFF (or larger than the file): use what's on disk.
+            if size == 0 or size == 0xFFFFFFFF or data_start + size > file_size:
+                size = file_size - data_start
+            return MediaInfo(
+                duration_sec=size / float(byte_rate),
+                container="wav",
+                codec=codec,
+                sample_rate=sample_rate,
+                channels=channels,
+                bit_rate=byte_rate * 8,
+                sample_fmt={8: "u8", 16: "s16", 24: "s32", 32: "s32" if audio_format == 1 else "flt", 64: "dbl"}.get(bits),
+                prober="header",
+            )
+        else:
+            f.seek(size + (size & 1), os.SEEK_CUR)
+
+
+# MPEG audio frame header tables
+_MP3_BITRATES = {
+    # (version_id is 3 for MPEG1, else MPEG2/2.5; layer 1..3) -> kbps by index
+    (1, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (1, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (1, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (2, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (2, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (2, 3): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+_MP3_SAMPLE_RATES = {3: [44100, 48000, 32000], 2: [22050, 24000, 16000], 0: [11025, 12000, 8000]}
+
+
+def _mp3_frame(h: bytes) -> Optional[Dict[str, int]]:
+    """Decode a 4-byte MPEG audio frame header."""
+    if len(h) < 4 or h[0] != 0xFF or (h[1] & 0xE0) != 0xE0:
+        return None
+    version_id = (h[1] >> 3) & 0x3      # 3 = MPEG1, 2 = MPEG2, 0 = MPEG2.5
+    layer = 4 - ((h[1] >> 1) & 0x3)     # 1..3
+    br_idx = (h[2] >> 4) & 0xF
+    sr_idx = (h[2] >> 2) & 0x3
+    if version_id == 1 or layer == 4 or br_idx in (0, 15) or sr_idx == 3:
+        return None
+    family = 1 if version_id == 3 else 2
+    bitrate = _MP3_BITRATES[(family, layer)][br_idx] * 1000
+    sample_rate = _MP3_SAMPLE_RATES[version_id][sr_idx]
+    padding = (h[2] >> 1) & 0x1
+    channels = 1 if ((h[3] >> 6) & 0x3) == 3 else 2
+    if layer == 1:
+        samples = 384
+        length = (12 * bitrate // sample_rate + padding) * 4
+    else:
+        samples = 1152 if (layer == 2 or family == 1) else 576
+        length = samples // 8 * bitrate // sample_rate + padding
+    return {
+        "family": family,
+        "layer": layer,
+        "bitrate": bitrate,
+        "sample_rate": sample_rate,
+        "channels": channels,
+        "samples": samples,
+        "length": length,
+    }
+
+
+def _parse_mp3(f: BinaryIO, file_size: int) -> Optional[MediaInfo]:
+    f.seek(0)
+    head = f.read(10)
+    audio_start = 0
+    if head[:3] == b"ID3" and len(head) == 10:
+        # ID3v2 size is syncsafe (7 bits per byte); footer flag adds 10 bytes
+        size = (head[6] << 21) | (head[7] << 14) | (head[8] << 7) | head[9]
+        audio_start = 10 + size + (10 if head[5] & 0x10 else 0)
+
+    f.seek(audio_start)
+    buf = f.read(64 * 1024)
+    # Allow a little padding between the tag and the first frame.
+    first = None
+    offset = 0
+    for offset in range(0, max(0, len(buf) - 4)):
+        first = _mp3_frame(buf[offset:offset + 4])
+        if first is not None:
+            # Require the next frame to line up, so random 0xFFEx bytes don't match.
+            nxt = _mp3_frame(buf[offset + first["length"]:offset + first["length"] + 4])
+            if nxt is not None and nxt["sample_rate"] == first["sample_rate"]:
+                break
+            first = None
+    if first is None:
+        return None
+    frame = buf[offset:offset + first["length"]]
+    audio_start += offset
+
+    end = file_size
+    f.seek(max(0, file_size - 128))
+    if f.read(3) == b"TAG":
+        end -= 128
+
+    info = MediaInfo(
+        container="mp3",
+        codec="mp3" if first["layer"] == 3 else f"mp{first['layer']}",
+        sample_rate=first["sample_rate"],
+        channels=first["channels"],
+        sample_fmt="fltp",
+        prober="header",
+    )
+
+    # Xing/Info tag (VBR or LAME CBR): frame count sits right after the side information.
+    side_info = (32 if first["channels"] == 2 else 17) if first["family"] == 1 else (17 if first["channels"] == 2 else 9)
+    xing_at = 4 + side_info
+    tag = frame[xing_at:xing_at + 4]
+    if tag in (b"Xing", b"Info"):
+        flags = struct.unpack(">I", frame[xing_at + 4:xing_at + 8])[0]
+        if flags & 0x1:
+            frames = struct.unpack(">I", frame[xing_at + 8:xing_at + 12])[0]
+            info.duration_sec = frames * first["samples"] / float(first["sample_rate"])
+            if flags & 0x2:
+                nbytes = struct.unpack(">I", frame[xing_at + 12:xing_at + 16])[0]
+                info.bit_rate = int(nbytes * 8 / info.duration_sec) if info.duration_sec else None
+            else:
+                info.bit_rate = first["bitrate"]
+            return info
+        return None
+
+    # VBRI (Fraunhofer) tag: fixed offset 32 after the header
+    if frame[36:40] == b"VBRI":
+        frames = struct.unpack(">I", frame[50:54])[0]
+        info.duration_sec = frames * first["samples"] / float(first["sample_rate"])
+        info.bit_rate = first["bitrate"]
+        return info
+
+    # No tag: only trust a constant bitrate, checked over the first frames.
+    pos = offset
+    for _ in range(8):
+        hdr = _mp3_frame(buf[pos:pos + 4])
+        if hdr is None:
+            break
+        if hdr["bitrate"] != first["bitrate"]:
+            return None  # VBR without a header: duration needs a full scan (ffprobe)
+        pos += hdr["length"]
+    info.bit_rate = first["bitrate"]
+    info.duration_sec = (end - audio_start) * 8 / float(first["bitrate"])
+    return info
+
+
+def _mp4_boxes(f: BinaryIO, start: int, end: int):
+    """Yield (type, payload_start, box_end) for boxes in [start, end)."""
+    pos = start
+    while pos + 8 <= end:
+        f.seek(pos)
+        hdr = f.read(8)
+        if len(hdr) < 8:
+            return
+        size, box_type = struct.unpack(">I", hdr[:4])[0], hdr[4:8]
+        header = 8
+        if size == 1:
+            size = struct.unpack(">Q", f.read(8))[0]
+            header = 16
+        elif size == 0:
+            size = end - pos
+        if size < header:
+            return
+        yield box_type, pos + header, min(pos + size, end)
+        pos += size
+
+
+# stsd sample entry -> ffprobe codec_name. "mp4a" is resolved through its esds objectTypeIndication.
+_MP4_CODECS = {b"alac": "alac", b"Opus": "opus", b"fLaC": "flac", b"ac-3": "ac3", b"ec-3": "eac3", b".mp3": "mp3"}
+_MP4A_OBJECT_TYPES = {0x40: "aac", 0x66: "aac", 0x67: "aac", 0x68: "aac", 0x69: "mp3", 0x6B: "mp3"}
+
+
+def _mp4_child(f: BinaryIO, start: int, end: int, wanted: bytes) -> Optional[Tuple[int, int]]:
+    """(payload_start, box_end) of the first `wanted` box in [start, end)."""
+    for box_type, body, box_end in _mp4_boxes(f, start, end):
+        if box_type == wanted:
+            return body, box_end
+    return None
+
+
+def _es_descriptor(data: bytes, pos: int) -> Tuple[int, int]:
+    """(tag, payload position) of the MPEG-4 descriptor at pos (size is 1-4 bytes of 7 bits)."""
+    tag = data[pos]
+    pos += 1
+    for _ in range(4):
+        more = data[pos] & 0x80
+        pos += 1
+        if not more:
+            break
+    return tag, pos
+
+
+def _mp4a_codec(f: BinaryIO, start: int, end: int) -> Optional[str]:
+    """AAC or MP3 from an esds box's DecoderConfigDescriptor; None when it says something else."""
+    esds = _mp4_child(f, start, end, b"esds")
+    if esds is None:
+        return None
+    f.seek(esds[0] + 4)  # version + flags
+    data = f.read(min(esds[1] - esds[0] - 4, 256))
+    tag, pos = _es_descriptor(data, 0)
+    if tag != 0x03:
+        return None
+    flags = data[pos + 2]
+    pos += 3
+    if flags & 0x80:
+        pos += 2
+    if flags & 0x40:
+        pos += 1 + data[pos]
+    if flags & 0x20:
+        pos += 2
+    tag, pos = _es_descriptor(data, pos)
+    return _MP4A_OBJECT_TYPES.get(data[pos]) if tag == 0x04 else None
+
+
+def _mp4_audio_track(f: BinaryIO, start: int, end: int) -> Optional[Tuple[str, int, int]]:
+    """(codec, channels, sample_rate) of a trak whose handler is "soun", else None."""
+    mdia = _mp4_child(f, start, end, b"mdia")
+    hdlr = mdia and _mp4_child(f, mdia[0], mdia[1], b"hdlr")
+    if not hdlr:
+        return None
+    f.seek(hdlr[0] + 8)  # version + flags, pre_defined
+    if f.read(4) != b"soun":
+        return None
+    minf = _mp4_child(f, mdia[0], mdia[1], b"minf")
+    stbl = minf and _mp4_child(f, minf[0], minf[1], b"stbl")
+    stsd = stbl and _mp4_child(f, stbl[0], stbl[1], b"stsd")
+    if not stsd:
+        return None
+    # stsd: version + flags, entry count, then the first sample entry (an AudioSampleEntry box).
+    for fourcc, entry, entry_end in _mp4_boxes(f, stsd[0] + 8, stsd[1]):
+        # reserved(6) data_reference_index(2) version(2) reserved(6) channels(2) sample_size(2)
+        # pre_defined(2) reserved(2) sample_rate(16.16); QuickTime v1 adds 16 bytes before child boxes.
+        f.seek(entry + 8)
+        version, _, channels, _, _, _, rate = struct.unpack(">H6sHHHHI", f.read(20))
+        if version not in (0, 1):
+            return None
+        codec = _MP4_CODECS.get(fourcc)
+        if fourcc == b"mp4a":
+            codec = _mp4a_codec(f, entry + 28 + (16 if version == 1 else 0), entry_end)
+        return (codec, channels, rate >> 16) if codec else None
+    return None
+
+
+def _parse_mp4(f: BinaryIO, file_size: int) -> Optional[MediaInfo]:
+    """
+    Duration from mvhd; codec/channels/sample_rate from the first sound track's stsd. None (=> ffprobe)
+    without a sound track or for a codec the table above doesn't know.
+    """
+    moov = _mp4_child(f, 0, file_size, b"moov")
+    if moov is None:
+        return None
+    mvhd = _mp4_child(f, moov[0], moov[1], b"mvhd")
+    if mvhd is None:
+        return None
+    f.seek(mvhd[0])
+    version = f.read(4)[0]
+    if version == 1:
+        f.seek(16, os.SEEK_CUR)
+        timescale, duration = struct.unpack(">IQ", f.read(12))
+    else:
+        f.seek(8, os.SEEK_CUR)
+        timescale, duration = struct.unpack(">II", f.read(8))
+    if not timescale or duration in (0, 0xFFFFFFFF, 0xFFFFFFFFFFFFFFFF):
+        return None
+
+    audio = None
+    for box_type, body, box_end in _mp4_boxes(f, moov[0], moov[1]):
+        if box_type == b"trak":
+            audio = _mp4_audio_track(f, body, box_end)
+            if audio is not None:
+                break
+    if audio is None:
+        return None
+    codec, channels, sample_rate = audio
+    return MediaInfo(
+        duration_sec=duration / float(timescale),
+        container="mov,mp4,m4a,3gp,3g2,mj2",
+        codec=codec,
+        sample_rate=sample_rate or None,
+        channels=channels or None,
+        bit_rate=int(file_size * 8 * timescale / duration),
+        has_audio=True,
+        prober="header",
+    )
+
+
+def probe_header(path: str) -> Optional[MediaInfo]:
+    """
+    Fast path: read WAV/MP3/MP4 duration (and stream basics where the header has them)
+    without spawning ffprobe. Returns None for unknown or ambiguous files.
+    """
+    if not fast_probe_enabled():
+        return None
+    try:
+        file_size = os.path.getsize(path)
+        with open(path, "rb") as f:
+            kind = sniff_format(f.read(12))
+            if kind == "wav":
+                return _parse_wav(f, file_size)
+            if kind == "mp3":
+                return _parse_mp3(f, file_size)
+            if kind == "mp4":
+                return _parse_mp4(f, file_size)
+    except Exception:
+        return None
+    return None
+
+
+def probe_media(path: str, timeout_sec: int = 10) -> MediaInfo:
+    """
+    Probe container + first audio stream: in-process header parse for WAV/MP3/MP4
+    (MP4 without a sound track or with an unknown codec goes to ffprobe), else a single ffprobe call.
+    Raises MediaProbeError if ffprobe is needed and missing or fails.
+    """
+    fast = probe_header(path)
+    if fast is not None and fast.duration_sec is not None:
+        return fast
+
+    cmd = [
+        "ffprobe",
+        "-v", "error",
+        "-select_streams", "a:0",
+        "-show_entries", "format=duration,bit_rate,format_name:stream=codec_name,sample_rate,channels,bit_rate,sample_fmt,duration",
+        "-of", "json",
+        path,
+    ]
+    try:
+        p = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout_sec)
+    except FileNotFoundError as e:
+        raise MediaProbeError("ffprobe not found. Please install ffmpeg.") from e
+    except subprocess.TimeoutExpired as e:
+        raise MediaProbeError("ffprobe timed out.") from e
+
+    if p.returncode != 0:
+        raise MediaProbeError(f"ffprobe failed: {p.stderr.strip() or p.stdout.strip()}")
+
+    try:
+        data = json.loads(p.stdout or "{}")
+    except Exception as e:
+        raise MediaProbeError(f"ffprobe returned invalid JSON: {e}") from e
+
+    fmt = data.get("format") or {}
+    streams = data.get("streams") or []
+    stream = streams[0] if streams else {}
+    duration = _to_float(fmt.get("duration"))
+    if duration is None:
+        duration = _to_float(stream.get("duration"))
+    return MediaInfo(
+        duration_sec=duration,
+        container=fmt.get("format_name"),
+        codec=stream.get("codec_name"),
+        sample_rate=_to_int(stream.get("sample_rate")),
+        channels=_to_int(stream.get("channels")),
+        bit_rate=_to_int(stream.get("bit_rate")) or _to_int(fmt.get("bit_rate")),
+        sample_fmt=stream.get("sample_fmt"),
+        has_audio=bool(streams),
+    )
+
+
 def _print_err(message: str) -> None:
     print(message, file=sys.stderr)
 
@@ -59,7 +523,7 @@ def _print_err(message: str) -> None:
 if __name__ == "__main__":
     import argparse
 
-    parser = argparse.ArgumentParser(description="Probe media duration using ffprobe.")
+    parser = argparse.ArgumentParser(description="Probe media info (duration, codec, sample rate, ...) using ffprobe.")
     parser.add_argument("path", help="Path to media file")
     parser.add_argument("--timeout", type=int, default=10, help="Timeout seconds for ffprobe (default: 10)")
     args = parser.parse_args()
@@ -73,14 +537,15 @@ if __name__ == "__main__":
         sys.exit(2)
 
     try:
-        duration = probe_duration_seconds(args.path, timeout_sec=args.timeout)
+        info = probe_media(args.path, timeout_sec=args.timeout)
     except MediaProbeError as exc:
         _print_err(f"Probe error: {exc}")
         sys.exit(1)
 
     result = {
         "path": args.path,
-        "duration_seconds": duration,
+        "duration_seconds": info.duration_sec,
+        **info.to_dict(),
     }
     print(json.dumps(result))
     sys.exit(0)
@@ -0,0 +1,104 @@
+from __future__ import annotations
+
+import math
+import wave
+from typing import Tuple
+
+import numpy as np
+
+
+class PcmError(RuntimeError):
+    pass
+
+
+def read_wav(path: str) -> Tuple[np.ndarray, int]:
+    """
+    Read a PCM WAV file into float32 samples in [-1, 1].
+    Returns (samples, sample_rate); samples has shape (frames,) for mono, (frames, channels) otherwise.
+    """
+    try:
+        with wave.open(path, "rb") as w:
+            channels = w.getnchannels()
+            width = w.getsampwidth()
+            sr = w.getframerate()
+            raw = w.readframes(w.getnframes())
+    except (wave.Error, EOFError) as e:
+        raise PcmError(f"Not a PCM WAV file: {path}: {e}") from e
+
+    if width == 1:
+        data = (np.frombuffer(raw, dtype=np.uint8).astype(np.float32) - 128.0) / 128.0
+    elif width == 2:
+        data = np.frombuffer(raw, dtype="<i2").astype(np.float32) / 32768.0
+    elif width == 3:
+        b = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        v = b[:, 0] | (b[:, 1] << 8) | (b[:, 2] << 16)
+        v = np.where(v >= 1 << 23, v - (1 << 24), v)
+        data = v.astype(np.float32) / float(1 << 23)
+    elif width == 4:
+        data = np.frombuffer(raw, dtype="<i4").astype(np.float32) / float(1 << 31)
+    else:
+        raise PcmError(f"Unsupported sample width: {width}")
+
+    if channels > 1:
+        data = data.reshape(-1, channels)
+    return data, sr
+
+
+def write_wav(path: str, samples: np.ndarray, sample_rate: int) -> None:
+    """Write float samples ([-1, 1], mono or (frames, channels)) as 16-bit PCM WAV."""
+    data = np.asarray(samples, dtype=np.float32)
+    channels = 1 if data.ndim == 1 else int(data.shape[1])
+    pcm = (np.clip(data, -1.0, 1.0) * 32767.0).round().astype("<i2")
+    with wave.open(path, "wb") as w:
+        w.setnchannels(channels)
+        w.setsampwidth(2)
+        w.setframerate(int(sample_rate))
+        w.writeframes(pcm.tobytes())
+
+
+def to_mono(samples: np.ndarray) -> np.ndarray:
+    if samples.ndim == 1:
+        return samples
+    return samples.mean(axis=1).astype(np.float32)
+
+
+def _smooth_len(n: int) -> int:
+    """Smallest 2/3/5-smooth integer >= n (fast FFT size)."""
+    best = 1 << max(0, (n - 1).bit_length())
+    p5 = 1
+    while p5 < best:
+        p35 = p5
+        while p35 < best:
+            m = p35
+            while m < n:
+                m *= 2
+            best = min(best, m)
+            p35 *= 3
+        p5 *= 5
+    return best
+
+
+def resample(samples: np.ndarray, sr_in: int, sr_out: int) -> np.ndarray:
+    """
+    Band-limited resampling of a mono signal via FFT (truncate/zero-pad the spectrum).
+
+    The input is zero-padded (at least 0.1s, so the end doesn't wrap into the start) to
+    down * m samples with m 2/3/5-smooth; the output FFT is then up * m long, which keeps
+    both transforms fast for rate pairs like 44100 -> 48000 (down=147, up=160).
+    """
+    if sr_in == sr_out or samples.shape[0] == 0:
+        return samples.astype(np.float32)
+    g = math.gcd(int(sr_in), int(sr_out))
+    down, up = int(sr_in) // g, int(sr_out) // g
+    n = int(samples.shape[0])
+    m = _smooth_len(-(-(n + sr_in // 10) // down))
+    n_in, n_out_full = down * m, up * m
+
+    spectrum = np.fft.rfft(samples.astype(np.float64), n=n_in)
+    bins = n_out_full // 2 + 1
+    if bins <= spectrum.shape[0]:
+        spectrum = spectrum[:bins]
+    else:
+        spectrum = np.concatenate([spectrum, np.zeros(bins - spectrum.shape[0], dtype=spectrum.dtype)])
+    out = np.fft.irfft(spectrum, n=n_out_full) * (n_out_full / float(n_in))
+    return out[:int(round(n * up / float(down)))].astype(np.float32)
@@ -7,11 +7,19 @@ from typing import Any, Dict, Optional, Protocol, Literal
 OutputFormat = Literal["mp3", "wav"]
 
 
+class ProviderError(RuntimeError):
+    """
+    A conversion the provider couldn't do (upstream error, render failure). VoiceChangeStep
+    answers it with the provider's error_fallback; anything else fails the task.
+    """
+
+
 @dataclass
 class VoiceChangeResult:
-    audio_bytes: bytes
+    audio_bytes: bytes              # empty when the audio was written to `path`
     mime: str
     meta: Dict[str, Any] = field(default_factory=dict)
+    path: Optional[str] = None      # set when convert(out_path=...) wrote the audio to disk
 
 
 class VoiceChangerProvider(Protocol):
@@ -29,5 +37,7 @@ class VoiceChangerProvider(Protocol):
         # 扩展位：先不启用，但预留
         remove_background_noise: Optional[bool] = None,
         extra: Optional[Dict[str, Any]] = None,
+        # 给定时直接写入该路径（分块流式），返回的 result.path 指向它，audio_bytes 为空
+        out_path: Optional[str] = None,
     ) -> VoiceChangeResult:
         ...
\ No newline at end of file
@@ -1,25 +1,94 @@
 from __future__ import annotations
 
 import os
+import shutil
 import time
 import json
-from typing import Any, Dict, Optional, Tuple
+import tempfile
+import threading
+import wave
+from typing import Any, Dict, List, Optional, Tuple
 
 import requests
 
 try:
-    from app.services.providers.base import VoiceChangeResult, OutputFormat
+    from app.services.providers.base import ProviderError, VoiceChangeResult, OutputFormat
 except ModuleNotFoundError:
     # Allow running this file directly: add project/app dir to sys.path
     import sys
     _app_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", ".."))
     if _app_dir not in sys.path:
         sys.path.insert(0, _app_dir)
-    from app.services.providers.base import VoiceChangeResult, OutputFormat
+    from app.services.providers.base import ProviderError, VoiceChangeResult, OutputFormat
 
+from app.core.cancellation import current_token
+from app.services.providers.http_pool import AsyncPooledClient, PooledSession, httpx
 
-class ElevenLabsProviderError(RuntimeError):
-    pass
+
+class ElevenLabsProviderError(ProviderError):
+    def __init__(self, message: str, status_code: Optional[int] = None) -> None:
+        super().__init__(message)
+        self.status_code = status_code
+
+    @property
+    def retryable(self) -> bool:
+        # No status = network error/timeout; 429 and 5xx are transient upstream conditions.
+        return self.status_code is None or self.status_code == 429 or self.status_code >= 500
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)))
+    except Exception:
+        return default
+
+
+def max_concurrency() -> int:
+    """Concurrent upstream requests allowed per API key (segmented mode)."""
+    return max(1, _env_int("ELEVEN_MAX_CONCURRENCY", 4))
+
+
+def segment_retries() -> int:
+    return max(0, _env_int("ELEVEN_SEGMENT_RETRIES", 2))
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, str(default)))
+    except Exception:
+        return default
+
+
+def request_retries() -> int:
+    """ELEVEN_RETRIES: retries of 429/5xx/network failures for a single (unsegmented) request."""
+    return max(0, _env_int("ELEVEN_RETRIES", 2))
+
+
+def pool_size() -> int:
+    """ELEVEN_POOL_SIZE: keep-alive connections per provider instance; more concurrent requests wait."""
+    return max(1, _env_int("ELEVEN_POOL_SIZE", 10))
+
+
+def warmup_connections() -> int:
+    """ELEVEN_WARMUP_CONNECTIONS: connections opened at startup (default 0 = connect on first use)."""
+    return max(0, _env_int("ELEVEN_WARMUP_CONNECTIONS", 0))
+
+
+# Response bodies are copied to disk in pieces of this size instead of being held in memory.
+STREAM_CHUNK_BYTES = 64 * 1024
+
+_key_limits: Dict[str, threading.BoundedSemaphore] = {}
+_key_limits_lock = threading.Lock()
+
+
+def _key_limit(api_key: str) -> threading.BoundedSemaphore:
+    """Process-wide semaphore per API key, shared by every task using that key."""
+    with _key_limits_lock:
+        sem = _key_limits.get(api_key)
+        if sem is None:
+            sem = threading.BoundedSemaphore(max_concurrency())
+            _key_limits[api_key] = sem
+        return sem
 
 
 def _map_ui_1_10_to_0_1_1_0(v: int) -> float:
@@ -38,6 +107,8 @@ def _map_output_format(fmt: OutputFormat) -> Tuple[str, str]:
 
 class ElevenLabsVoiceChangerHTTP:
     name = "elevenlabs"
+    # A failed upstream call yields a placeholder tone, so the output is never mistaken for a conversion.
+    error_fallback = "synthesize"
 
     def __init__(
         self,
@@ -55,6 +126,30 @@ class ElevenLabsVoiceChangerHTTP:
         # default speech-to-speech model
         self.default_model_id = os.getenv("ELEVEN_STS_MODEL_ID", "eleven_multilingual_sts_v2")
 
+        # One keep-alive pool per instance; the registry keeps a single instance per process.
+        pool_args = dict(
+            pool_size=pool_size(),
+            retries=request_retries(),
+            backoff_sec=_env_float("ELEVEN_RETRY_BACKOFF_SEC", 0.5),
+            max_wait_sec=_env_float("ELEVEN_RETRY_MAX_SEC", 30.0),
+        )
+        self.http = PooledSession(**pool_args)
+        # aconvert() needs httpx; without it the step runs convert() on a worker thread.
+        self.ahttp = AsyncPooledClient(**pool_args) if httpx is not None else None
+
+    def warmup(self) -> Dict[str, Any]:
+        """Pre-open ELEVEN_WARMUP_CONNECTIONS connections to the API host."""
+        n = warmup_connections()
+        if not n:
+            return {"connections": 0}
+        return self.http.warmup(self.base_url, n)
+
+    def pool_stats(self) -> Dict[str, Any]:
+        stats = self.http.stats()
+        if self.ahttp is not None:
+            stats["async"] = self.ahttp.stats()
+        return stats
+
     def convert(
         self,
         *,
@@ -66,7 +161,33 @@ class ElevenLabsVoiceChangerHTTP:
         output_format: OutputFormat,
         remove_background_noise: Optional[bool] = None,
         extra: Optional[Dict[str, Any]] = None,
+        out_path: Optional[str] = None,
     ) -> VoiceChangeResult:
+        """out_path: stream the converted audio there (result.path) instead of returning audio_bytes."""
+        return self._convert(
+            voice_id=voice_id,
+            audio_path=audio_path,
+            model_id=model_id,
+            stability=stability,
+            similarity=similarity,
+            output_format=output_format,
+            remove_background_noise=remove_background_noise,
+            extra=extra,
+            retries=None,
+            out_path=out_path,
+        )
+
+    def _request_parts(
+        self,
+        voice_id: str,
+        model_id: Optional[str],
+        stability: int,
+        similarity: int,
+        output_format: OutputFormat,
+        remove_background_noise: Optional[bool],
+        extra: Optional[Dict[str, Any]],
+    ) -> Tuple[str, Dict[str, str], Dict[str, str], Dict[str, Any], str]:
+        """(url, headers, form fields, result meta, mime) of one convert request; shared by convert and aconvert."""
         model_id = model_id or self.default_model_id
 
         # map UI params
@@ -99,30 +220,258 @@ class ElevenLabsVoiceChangerHTTP:
             for k, v in extra.items():
                 fields[k] = json.dumps(v) if isinstance(v, (dict, list)) else str(v)
 
+        meta = {
+            "provider": self.name,
+            "model_id": model_id,
+            "output_format": out_fmt,
+            "stability": stability_f,
+            "similarity_boost": similarity_f,
+        }
+        return url, headers, fields, meta, mime
+
+    def _convert(
+        self,
+        *,
+        voice_id: str,
+        audio_path: str,
+        model_id: Optional[str],
+        stability: int,
+        similarity: int,
+        output_format: OutputFormat,
+        remove_background_noise: Optional[bool],
+        extra: Optional[Dict[str, Any]],
+        retries: Optional[int],
+        out_path: Optional[str] = None,
+    ) -> VoiceChangeResult:
+        """One conversion over the pooled session; retries=None uses ELEVEN_RETRIES."""
+        url, headers, fields, meta, mime = self._request_parts(
+            voice_id, model_id, stability, similarity, output_format, remove_background_noise, extra,
+        )
+
         start = time.time()
 
+        # A cancelled task doesn't start new upstream requests (or retries); a deadline also
+        # caps each attempt's timeout.
+        token = current_token()
         with open(audio_path, "rb") as f:
             files = {
                 "audio": (os.path.basename(audio_path), f, "application/octet-stream")
             }
-            resp = requests.post(url, headers=headers, data=fields, files=files, timeout=self.timeout_sec)
+            try:
+                resp, http_meta = self.http.request(
+                    "POST", url, headers=headers, data=fields, files=files,
+                    timeout=self.timeout_sec, retries=retries, stream=True,
+                )
+            except requests.RequestException as e:
+                raise ElevenLabsProviderError(f"ElevenLabs convert failed: {e}") from e
 
-        if not resp.ok:
-            raise ElevenLabsProviderError(
-                f"ElevenLabs convert failed: HTTP {resp.status_code}\n{resp.text}"
-            )
+        try:
+            if token is not None:
+                # The response of a task cancelled mid-request is dropped.
+                token.raise_if_cancelled()
+
+            if not resp.ok:
+                raise ElevenLabsProviderError(
+                    f"ElevenLabs convert failed: HTTP {resp.status_code}\n{resp.text}",
+                    status_code=resp.status_code,
+                )
+
+            audio_bytes = b""
+            if out_path:
+                with open(out_path, "wb") as out:
+                    for chunk in resp.iter_content(chunk_size=STREAM_CHUNK_BYTES):
+                        if token is not None:
+                            token.raise_if_cancelled()
+                        out.write(chunk)
+            else:
+                audio_bytes = resp.content
+        except requests.RequestException as e:
+            raise ElevenLabsProviderError(f"ElevenLabs convert failed: {e}") from e
+        finally:
+            resp.close()
 
         latency_ms = int((time.time() - start) * 1000)
 
+        meta.update({"latency_ms": latency_ms, "http": http_meta})
+        return VoiceChangeResult(audio_bytes=audio_bytes, mime=mime, meta=meta, path=out_path or None)
+
+    @property
+    def supports_async(self) -> bool:
+        return self.ahttp is not None
+
+    async def aconvert(
+        self,
+        *,
+        voice_id: str,
+        audio_path: str,
+        model_id: Optional[str],
+        stability: int,
+        similarity: int,
+        output_format: OutputFormat,
+        remove_background_noise: Optional[bool] = None,
+        extra: Optional[Dict[str, Any]] = None,
+        out_path: Optional[str] = None,
+    ) -> VoiceChangeResult:
+        """
+        convert() on the event loop (httpx): no thread is held while the upstream works.
+        Same request, retry policy and result; cancellation comes from the awaiting task.
+        """
+        if self.ahttp is None:
+            raise ElevenLabsProviderError("httpx is not installed; async conversion unavailable.")
+        url, headers, fields, meta, mime = self._request_parts(
+            voice_id, model_id, stability, similarity, output_format, remove_background_noise, extra,
+        )
+        start = time.time()
+        with open(audio_path, "rb") as f:
+            files = {
+                "audio": (os.path.basename(audio_path), f, "application/octet-stream")
+            }
+            try:
+                resp, http_meta = await self.ahttp.send(
+                    "POST", url, headers=headers, data=fields, files=files, timeout=self.timeout_sec,
+                )
+            except httpx.HTTPError as e:
+                raise ElevenLabsProviderError(f"ElevenLabs convert failed: {e}") from e
+
+        audio_bytes = b""
+        try:
+            if not resp.is_success:
+                body = (await resp.aread()).decode("utf-8", "replace")
+                raise ElevenLabsProviderError(
+                    f"ElevenLabs convert failed: HTTP {resp.status_code}\n{body}",
+                    status_code=resp.status_code,
+                )
+            if out_path:
+                # Chunk-sized local writes; the wait is on the network, not the disk.
+                with open(out_path, "wb") as out:
+                    async for chunk in resp.aiter_bytes(STREAM_CHUNK_BYTES):
+                        out.write(chunk)
+            else:
+                audio_bytes = await resp.aread()
+        except httpx.HTTPError as e:
+            raise ElevenLabsProviderError(f"ElevenLabs convert failed: {e}") from e
+        finally:
+            await resp.aclose()
+
+        meta.update({"latency_ms": int((time.time() - start) * 1000), "http": http_meta})
+        return VoiceChangeResult(audio_bytes=audio_bytes, mime=mime, meta=meta, path=out_path or None)
+
+    def convert_segmented(
+        self,
+        *,
+        voice_id: str,
+        audio_path: str,
+        model_id: Optional[str],
+        stability: int,
+        similarity: int,
+        remove_background_noise: Optional[bool] = None,
+        extra: Optional[Dict[str, Any]] = None,
+        out_path: Optional[str] = None,
+    ) -> VoiceChangeResult:
+        """
+        Long-input mode: split the (standardized, PCM WAV) input at pauses, convert the
+        segments concurrently (at most ELEVEN_MAX_CONCURRENCY requests in flight per API key),
+        retry transient failures, and crossfade the converted segments back in order.
+        Always returns WAV at the input's sample rate, written to out_path when given.
+        """
+        # Imported here: the chunking helpers pull in numpy and the executors, which the
+        # single-request path doesn't need.
+        from app.services import chunking
+        from app.services.ffmpeg import transcode_audio
+
+        try:
+            with wave.open(audio_path, "rb"):
+                pass
+        except (wave.Error, EOFError):
+            # Not a PCM WAV (standardize was skipped): nothing to split, send it whole.
+            return self.convert(
+                voice_id=voice_id,
+                audio_path=audio_path,
+                model_id=model_id,
+                stability=stability,
+                similarity=similarity,
+                output_format="wav",
+                remove_background_noise=remove_background_noise,
+                extra=extra,
+                out_path=out_path,
+            )
+
+        retries = segment_retries()
+        limit = _key_limit(self.api_key)
+        seg_stats: Dict[str, Dict[str, Any]] = {}
+        stats_lock = threading.Lock()
+
+        def _render(seg_in: str, seg_out: str) -> None:
+            with wave.open(seg_in, "rb") as w:
+                sample_rate = w.getframerate()
+                seg_sec = w.getnframes() / float(sample_rate)
+
+            start = time.time()
+            raw_path = seg_out + ".raw"
+            # Transient failures are retried by the pooled session (ELEVEN_SEGMENT_RETRIES per segment).
+            with limit:
+                result = self._convert(
+                    voice_id=voice_id,
+                    audio_path=seg_in,
+                    model_id=model_id,
+                    stability=stability,
+                    similarity=similarity,
+                    output_format="wav",
+                    remove_background_noise=remove_background_noise,
+                    extra=extra,
+                    retries=retries,
+                    out_path=raw_path,
+                )
+            http_meta = (result.meta or {}).get("http") or {}
+
+            # Normalize whatever the upstream returned to PCM WAV at the segment's rate for stitching.
+            try:
+                transcode_audio(in_path=raw_path, out_path=seg_out, output_format="wav", sample_rate=sample_rate)
+            finally:
+                os.unlink(raw_path)
+
+            with stats_lock:
+                seg_stats[os.path.basename(seg_in)] = {
+                    "duration_sec": round(seg_sec, 3),
+                    "latency_ms": int((time.time() - start) * 1000),
+                    "upstream_latency_ms": (result.meta or {}).get("latency_ms"),
+                    "attempts": http_meta.get("attempts", 1),
+                    "retries": http_meta.get("retries", 0),
+                    "handshake_ms": http_meta.get("handshake_ms"),
+                    "pool_wait_ms": http_meta.get("pool_wait_ms"),
+                }
+
+        work_dir = tempfile.mkdtemp(prefix="eleven_segments_")
+        stitched_path = out_path or os.path.join(work_dir, "converted.wav")
+        audio_bytes = b""
+        try:
+            chunk_meta = chunking.run_chunked(
+                audio_path,
+                stitched_path,
+                os.path.join(work_dir, "segments"),
+                _render,
+                executor_name="provider_segments",
+            )
+            if not out_path:
+                with open(stitched_path, "rb") as f:
+                    audio_bytes = f.read()
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+        segments: List[Dict[str, Any]] = [dict(seg_stats[k], index=i) for i, k in enumerate(sorted(seg_stats))]
         return VoiceChangeResult(
-            audio_bytes=resp.content,
-            mime=mime,
+            audio_bytes=audio_bytes,
+            mime="audio/wav",
             meta={
                 "provider": self.name,
-                "model_id": model_id,
-                "output_format": out_fmt,
-                "stability": stability_f,
-                "similarity_boost": similarity_f,
-                "latency_ms": latency_ms,
+                "model_id": model_id or self.default_model_id,
+                "output_format": "wav",
+                "stability": _map_ui_1_10_to_0_1_1_0(stability),
+                "similarity_boost": _map_ui_1_10_to_0_1_1_0(similarity),
+                "latency_ms": int(chunk_meta.get("render_sec", 0.0) * 1000),
+                "max_concurrency": max_concurrency(),
+                "segmentation": chunk_meta,
+                "segments": segments,
             },
-        )
\ No newline at end of file
+            path=out_path or None,
+        )
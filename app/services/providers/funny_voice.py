@@ -11,33 +11,59 @@
 from __future__ import annotations
 import os
 import tempfile
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from typing import Optional
 
+from app.services import dsp
 from app.services.ffmpeg import FFmpegError, is_available as ffmpeg_available, transcode_audio
+from app.services.pcm import PcmError, read_wav, resample, write_wav
+from app.services.providers.base import ProviderError
+
+
+def funny_voice_backend() -> str:
+    """
+    VC_FUNNY_VOICE_BACKEND: "ffmpeg" (default; filter chains, fusable with the other steps)
+    or "numpy" (app.services.dsp in-process on PCM WAV input, no ffmpeg spawn).
+    """
+    value = str(os.getenv("VC_FUNNY_VOICE_BACKEND", "ffmpeg")).strip().lower()
+    return "numpy" if value == "numpy" else "ffmpeg"
 
 
 @dataclass
 class FunnyVoiceResult:
-    audio_bytes: bytes
-    meta: dict
+    audio_bytes: bytes = b""          # empty when rendered straight to `path`
+    meta: dict = field(default_factory=dict)
+    path: Optional[str] = None
 
 
 class FunnyVoiceProvider:
     """本地搞怪音色处理 provider - 美国热搜榜音色"""
-    
+
+    name = "funny_voice"
+    # On failure the step keeps the unchanged input rather than a placeholder tone.
+    error_fallback = "copy_input"
+
     # 支持的音色 ID 列表
     SUPPORTED_VOICES = ['anime_uncle', 'uwu_anime', 'gender_swap', 'mamba', 'nerd_bro']
+
+    # 统一采样率，便于 pitch shift 表达式稳定
+    SAMPLE_RATE = 48000
     
     @classmethod
     def is_funny_voice(cls, voice_id: str) -> bool:
         """检查是否是搞怪音色"""
         return voice_id in cls.SUPPORTED_VOICES
     
+    def can_fuse(self) -> bool:
+        """Whether ffmpeg_filters() can join a fused ffmpeg run (the numpy backend renders in-process)."""
+        return funny_voice_backend() == "ffmpeg"
+
     def convert(
         self,
         voice_id: str,
         audio_path: str,
         output_format: str = "wav",
+        out_path: Optional[str] = None,
         **kwargs
     ) -> FunnyVoiceResult:
         """
@@ -47,9 +73,10 @@ class FunnyVoiceProvider:
             voice_id: 音色ID (chipmunk/robot/ghost/giant/helium)
             audio_path: 输入音频路径
             output_format: 输出格式
+            out_path: 直接渲染到该路径（不经过内存），否则返回 audio_bytes
             
         Returns:
-            FunnyVoiceResult with audio bytes and metadata
+            FunnyVoiceResult with audio bytes (or path) and metadata
         """
         if not os.path.isfile(audio_path):
             raise FileNotFoundError(f"Audio file not found: {audio_path}")
@@ -57,47 +84,88 @@ class FunnyVoiceProvider:
         if voice_id not in self.SUPPORTED_VOICES:
             raise ValueError(f"Unsupported funny voice: {voice_id}")
 
-        if not ffmpeg_available():
-            raise RuntimeError("ffmpeg is required for funny voice effects. Please install ffmpeg.")
-
-        # 统一采样率，便于 pitch shift 表达式稳定
-        sample_rate = 48000
-
-        # 根据音色 ID 应用不同效果 - 美国热搜榜音色
-        afilters = self._get_ffmpeg_filters(voice_id=voice_id, sample_rate=sample_rate)
+        backend = funny_voice_backend()
+        if backend == "ffmpeg" and not ffmpeg_available():
+            raise ProviderError("ffmpeg is required for funny voice effects. Please install ffmpeg.")
 
-        with tempfile.NamedTemporaryFile(suffix=f".{output_format}", delete=False) as tmp:
-            tmp_path = tmp.name
+        if out_path:
+            target = out_path
+        else:
+            with tempfile.NamedTemporaryFile(suffix=f".{output_format}", delete=False) as tmp:
+                target = tmp.name
 
+        audio_bytes = b""
         try:
-            transcode_audio(
-                in_path=audio_path,
-                out_path=tmp_path,
-                output_format=output_format,
-                sample_rate=sample_rate,
-                extra_afilters=afilters,
-                timeout_sec=120,
-            )
-            with open(tmp_path, "rb") as f:
-                audio_bytes = f.read()
+            if output_format == "wav":
+                backend = self.render_wav(voice_id, audio_path, target)
+            else:
+                self._render_ffmpeg(voice_id, audio_path, target, output_format)
+                backend = "ffmpeg"
+            if not out_path:
+                with open(target, "rb") as f:
+                    audio_bytes = f.read()
         except FFmpegError as e:
-            raise RuntimeError(str(e)) from e
+            raise ProviderError(str(e)) from e
         finally:
             try:
-                if os.path.exists(tmp_path):
-                    os.unlink(tmp_path)
+                if not out_path and os.path.exists(target):
+                    os.unlink(target)
             except Exception:
                 pass
         
+        meta = self.effect_meta(voice_id)
+        meta["backend"] = backend
         return FunnyVoiceResult(
             audio_bytes=audio_bytes,
-            meta={
-                "voice_id": voice_id,
-                "effect": self._get_effect_name(voice_id),
-                "filters": afilters,
-            }
+            meta=meta,
+            path=out_path or None,
         )
+
+    def _render_ffmpeg(self, voice_id: str, in_path: str, out_path: str, output_format: str = "wav") -> None:
+        transcode_audio(
+            in_path=in_path,
+            out_path=out_path,
+            output_format=output_format,
+            sample_rate=self.SAMPLE_RATE,
+            extra_afilters=self.ffmpeg_filters(voice_id),
+            timeout_sec=120,
+        )
+
+    def render_wav(self, voice_id: str, in_path: str, out_path: str) -> str:
+        """
+        Render voice_id into a SAMPLE_RATE WAV at out_path and return the backend used.
+        The numpy backend needs PCM WAV input (the standardized file); anything else goes to ffmpeg.
+        """
+        if funny_voice_backend() == "numpy":
+            try:
+                samples, sr = read_wav(in_path)
+            except PcmError:
+                samples, sr = None, 0
+            if samples is not None:
+                if sr != self.SAMPLE_RATE:
+                    if samples.ndim > 1:
+                        samples = samples.mean(axis=1)
+                    samples = resample(samples, sr, self.SAMPLE_RATE)
+                write_wav(out_path, dsp.apply_effects(samples, self.SAMPLE_RATE, self.effects(voice_id)), self.SAMPLE_RATE)
+                return "numpy"
+        self._render_ffmpeg(voice_id, in_path, out_path)
+        return "ffmpeg"
     
+    def ffmpeg_filters(self, voice_id: str) -> list[str]:
+        """
+        音色对应的 ffmpeg 滤镜链（输入需为 SAMPLE_RATE 采样率）
+        供 pipeline 融合执行时直接拼接到同一个 filtergraph 中
+        """
+        # 根据音色 ID 应用不同效果 - 美国热搜榜音色
+        return self._get_ffmpeg_filters(voice_id=voice_id, sample_rate=self.SAMPLE_RATE)
+
+    def effect_meta(self, voice_id: str) -> dict:
+        return {
+            "voice_id": voice_id,
+            "effect": self._get_effect_name(voice_id),
+            "filters": self.ffmpeg_filters(voice_id),
+        }
+
     def _get_effect_name(self, voice_id: str) -> str:
         """获取效果名称"""
         names = {
@@ -109,6 +177,37 @@ class FunnyVoiceProvider:
         }
         return names.get(voice_id, voice_id)
     
+    # 每个音色的效果链；ffmpeg 后端渲染为滤镜链，numpy 后端由 app.services.dsp 直接执行
+    VOICE_EFFECTS: dict[str, list[dsp.Effect]] = {
+        # 低沉 + 轻微回声
+        "anime_uncle": [
+            ("pitch", {"factor": 0.75}),
+            ("volume", {"gain": 1.4}),
+            ("echo", {"in_gain": 0.8, "out_gain": 0.88, "delay_ms": 80, "decay": 0.25}),
+        ],
+        "uwu_anime": [
+            ("pitch", {"factor": 1.4}),
+            ("volume", {"gain": 1.2}),
+        ],
+        "gender_swap": [
+            ("pitch", {"factor": 1.25}),
+            ("highpass", {"freq": 120}),
+            ("lowpass", {"freq": 12000}),
+        ],
+        "mamba": [
+            ("pitch", {"factor": 0.9}),
+            ("volume", {"gain": 1.5}),
+            ("compressor", {"threshold_db": -18, "ratio": 3, "attack_ms": 20, "release_ms": 200}),
+        ],
+        "nerd_bro": [
+            ("pitch", {"factor": 1.1}),
+            ("tremolo", {"freq": 120, "depth": 0.15}),
+        ],
+    }
+
+    def effects(self, voice_id: str) -> list[dsp.Effect]:
+        return list(self.VOICE_EFFECTS.get(voice_id, []))
+
     def _pitch_shift_filters(self, *, sample_rate: int, factor: float) -> list[str]:
         # 说明：asetrate 会同时改变 pitch+速度；再用 atempo 纠正速度，从而近似“只变调”。
         # atempo 支持 0.5~2.0，本项目 factor 都落在可用范围。
@@ -118,39 +217,26 @@ class FunnyVoiceProvider:
             f"atempo={1.0/factor:.6f}",
         ]
 
-    def _get_ffmpeg_filters(self, *, voice_id: str, sample_rate: int) -> list[str]:
-        if voice_id == "anime_uncle":
-            # 低沉 + 轻微回声
-            return [
-                *self._pitch_shift_filters(sample_rate=sample_rate, factor=0.75),
-                "volume=1.4",
-                "aecho=0.8:0.88:80:0.25",
-            ]
-
-        if voice_id == "uwu_anime":
-            return [
-                *self._pitch_shift_filters(sample_rate=sample_rate, factor=1.4),
-                "volume=1.2",
-            ]
-
-        if voice_id == "gender_swap":
-            return [
-                *self._pitch_shift_filters(sample_rate=sample_rate, factor=1.25),
-                "highpass=f=120",
-                "lowpass=f=12000",
-            ]
-
-        if voice_id == "mamba":
+    def _effect_filters(self, kind: str, params: dict, *, sample_rate: int) -> list[str]:
+        if kind == "pitch":
+            return self._pitch_shift_filters(sample_rate=sample_rate, factor=params["factor"])
+        if kind == "volume":
+            return [f"volume={params['gain']:g}"]
+        if kind == "echo":
+            return [f"aecho={params['in_gain']:g}:{params['out_gain']:g}:{params['delay_ms']:g}:{params['decay']:g}"]
+        if kind in ("highpass", "lowpass"):
+            return [f"{kind}=f={params['freq']:g}"]
+        if kind == "compressor":
             return [
-                *self._pitch_shift_filters(sample_rate=sample_rate, factor=0.9),
-                "volume=1.5",
-                "acompressor=threshold=-18dB:ratio=3:attack=20:release=200",
+                f"acompressor=threshold={params['threshold_db']:g}dB:ratio={params['ratio']:g}"
+                f":attack={params['attack_ms']:g}:release={params['release_ms']:g}"
             ]
+        if kind == "tremolo":
+            return [f"tremolo=f={params['freq']:g}:d={params['depth']:g}"]
+        raise ValueError(f"Unsupported effect: {kind!r}")
 
-        if voice_id == "nerd_bro":
-            return [
-                *self._pitch_shift_filters(sample_rate=sample_rate, factor=1.1),
-                "tremolo=f=120:d=0.15",
-            ]
-
-        return []
+    def _get_ffmpeg_filters(self, *, voice_id: str, sample_rate: int) -> list[str]:
+        filters: list[str] = []
+        for kind, params in self.effects(voice_id):
+            filters.extend(self._effect_filters(kind, params, sample_rate=sample_rate))
+        return filters
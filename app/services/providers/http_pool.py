@@ -0,0 +1,382 @@
+from __future__ import annotations
+
+import asyncio
+import random
+import threading
+import time
+import weakref
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from app.core.cancellation import cancellable_sleep, current_token
+
+try:
+    import httpx
+except ImportError:  # optional: only the async provider path (aconvert) needs it
+    httpx = None
+
+
+# Per-thread record of what the current request did at the connection level; set by
+# PooledSession.request, filled in by the pool/connection classes below.
+_local = threading.local()
+
+
+def _note(key: str, value: float) -> None:
+    events = getattr(_local, "events", None)
+    if events is not None:
+        events.setdefault(key, []).append(value)
+
+
+class _TimedHTTPConnection(HTTPConnection):
+    def connect(self) -> None:
+        start = time.perf_counter()
+        super().connect()
+        _note("handshake_ms", (time.perf_counter() - start) * 1000.0)
+
+
+class _TimedHTTPSConnection(HTTPSConnection):
+    def connect(self) -> None:
+        # TCP connect + TLS handshake: what a reused keep-alive connection saves.
+        start = time.perf_counter()
+        super().connect()
+        _note("handshake_ms", (time.perf_counter() - start) * 1000.0)
+
+
+class _TimedHTTPPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+    def _get_conn(self, timeout: Optional[float] = None):
+        # With block=True this waits for a free connection once the pool is exhausted.
+        start = time.perf_counter()
+        conn = super()._get_conn(timeout=timeout)
+        _note("pool_wait_ms", (time.perf_counter() - start) * 1000.0)
+        return conn
+
+
+class _TimedHTTPSPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+    def _get_conn(self, timeout: Optional[float] = None):
+        start = time.perf_counter()
+        conn = super()._get_conn(timeout=timeout)
+        _note("pool_wait_ms", (time.perf_counter() - start) * 1000.0)
+        return conn
+
+
+class _TimedAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args: Any, **kwargs: Any) -> None:
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {"http": _TimedHTTPPool, "https": _TimedHTTPSPool}
+
+
+def retry_after_seconds(value: Optional[str]) -> Optional[float]:
+    """Retry-After header as seconds to wait: delta-seconds or an HTTP date; None if absent/invalid."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when is None:
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+
+def backoff_seconds(attempt: int, base_sec: float, cap_sec: float) -> float:
+    """Exponential backoff with equal jitter: half fixed, half random, so bursts of retries spread out."""
+    delay = min(cap_sec, base_sec * 2 ** max(0, attempt - 1))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def _retryable_status(status: int) -> bool:
+    return status == 429 or status >= 500
+
+
+def _retry_wait(attempt: int, retry_after: Optional[str], backoff_sec: float, max_wait_sec: float) -> Optional[float]:
+    """Seconds to wait before the next attempt, or None to stop retrying."""
+    wait = retry_after_seconds(retry_after)
+    if wait is None:
+        wait = backoff_seconds(attempt, backoff_sec, max_wait_sec)
+    elif wait > max_wait_sec:
+        return None
+    token = current_token()
+    remaining = token.remaining() if token is not None else None
+    if remaining is not None and wait >= remaining:
+        return None
+    return wait
+
+
+class PooledSession:
+    """
+    A requests.Session for one provider instance: keep-alive connections from a bounded
+    pool (callers wait for a free connection instead of opening more), plus bounded
+    retries of network errors, 429 and 5xx with jittered exponential backoff. A
+    Retry-After header replaces the backoff; if it asks for more than max_wait_sec (or
+    more than the task's deadline leaves) the response is returned as is.
+
+    request() returns the response plus what it cost at the connection level: attempts,
+    retry waits, new connections and their handshake time, and time spent waiting for
+    the pool.
+    """
+
+    def __init__(self, *, pool_size: int = 10, retries: int = 2, backoff_sec: float = 0.5, max_wait_sec: float = 30.0) -> None:
+        self.pool_size = max(1, int(pool_size))
+        self.retries = max(0, int(retries))
+        self.backoff_sec = max(0.0, float(backoff_sec))
+        self.max_wait_sec = max(0.0, float(max_wait_sec))
+
+        self.session = requests.Session()
+        adapter = _TimedAdapter(pool_connections=4, pool_maxsize=self.pool_size, pool_block=True)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._totals = {"requests": 0, "attempts": 0, "retries": 0, "new_connections": 0, "saturated": 0}
+
+    def _retry_wait(self, attempt: int, resp: Optional[requests.Response]) -> Optional[float]:
+        retry_after = resp.headers.get("Retry-After") if resp is not None else None
+        return _retry_wait(attempt, retry_after, self.backoff_sec, self.max_wait_sec)
+
+    def request(self, method: str, url: str, *, timeout: float, retries: Optional[int] = None, **kwargs: Any) -> Tuple[requests.Response, Dict[str, Any]]:
+        """
+        Send with retries. Returns the last response (which may still be an error status
+        once retries are exhausted); raises the last requests.RequestException on network
+        failure. File objects in `files` are rewound before every attempt.
+        """
+        retries = self.retries if retries is None else max(0, int(retries))
+        with self._lock:
+            self._in_flight += 1
+            in_flight = self._in_flight
+        events: Dict[str, List[float]] = {}
+        _local.events = events
+        attempts = 0
+        waited = 0.0
+        statuses: List[int] = []
+        try:
+            while True:
+                attempts += 1
+                token = current_token()
+                attempt_timeout = timeout
+                if token is not None:
+                    token.raise_if_cancelled()
+                    attempt_timeout = max(1.0, token.timeout(timeout))
+                for value in (kwargs.get("files") or {}).values():
+                    fileobj = value[1] if isinstance(value, tuple) else value
+                    if hasattr(fileobj, "seek"):
+                        fileobj.seek(0)
+                resp: Optional[requests.Response] = None
+                try:
+                    resp = self.session.request(method, url, timeout=attempt_timeout, **kwargs)
+                except requests.RequestException:
+                    if attempts > retries:
+                        raise
+                    wait = self._retry_wait(attempts, None)
+                    if wait is None:
+                        raise
+                else:
+                    if resp.ok or not _retryable_status(resp.status_code) or attempts > retries:
+                        break
+                    statuses.append(resp.status_code)
+                    wait = self._retry_wait(attempts, resp)
+                    if wait is None:
+                        break
+                    # Read the (small) error body so the connection goes back to the pool instead of
+                    # being closed, then release it before sleeping.
+                    resp.content
+                    resp.close()
+                cancellable_sleep(wait)
+                waited += wait
+        finally:
+            _local.events = None
+            with self._lock:
+                self._in_flight -= 1
+                self._totals["requests"] += 1
+                self._totals["attempts"] += attempts
+                self._totals["retries"] += attempts - 1
+                self._totals["new_connections"] += len(events.get("handshake_ms", []))
+                self._totals["saturated"] += int(in_flight > self.pool_size)
+
+        handshakes = events.get("handshake_ms", [])
+        meta = {
+            "attempts": attempts,
+            "retries": attempts - 1,
+            "retry_statuses": statuses,
+            "retry_wait_ms": int(waited * 1000),
+            "new_connections": len(handshakes),
+            "handshake_ms": round(sum(handshakes), 1),
+            "pool_size": self.pool_size,
+            "pool_in_flight": in_flight,
+            "pool_saturated": in_flight > self.pool_size,
+            "pool_wait_ms": round(sum(events.get("pool_wait_ms", [])), 1),
+        }
+        return resp, meta
+
+    def warmup(self, url: str, connections: int, timeout: float = 5.0) -> Dict[str, Any]:
+        """Open up to `connections` keep-alive connections in parallel (HEAD url) so first requests skip the handshake."""
+        connections = min(max(0, int(connections)), self.pool_size)
+        results: List[Dict[str, Any]] = []
+        lock = threading.Lock()
+
+        def _open() -> None:
+            events: Dict[str, List[float]] = {}
+            _local.events = events
+            try:
+                self.session.head(url, timeout=timeout).close()
+                outcome: Dict[str, Any] = {"handshake_ms": round(sum(events.get("handshake_ms", [])), 1)}
+            except requests.RequestException as e:
+                outcome = {"error": str(e)}
+            finally:
+                _local.events = None
+            with lock:
+                results.append(outcome)
+
+        threads = [threading.Thread(target=_open, daemon=True) for _ in range(connections)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return {
+            "connections": sum(1 for r in results if "error" not in r),
+            "handshake_ms": [r["handshake_ms"] for r in results if "handshake_ms" in r],
+            "errors": [r["error"] for r in results if "error" in r],
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._totals, pool_size=self.pool_size, in_flight=self._in_flight)
+
+    def close(self) -> None:
+        self.session.close()
+
+
+class AsyncPooledClient:
+    """
+    httpx counterpart of PooledSession for providers' aconvert(): the same bounded
+    keep-alive pool, retry policy and per-request meta, without holding a thread while
+    the upstream works. One httpx.AsyncClient per event loop (a client is bound to the
+    loop it was first used on). Requires httpx (see requirements.txt).
+    """
+
+    def __init__(self, *, pool_size: int = 10, retries: int = 2, backoff_sec: float = 0.5, max_wait_sec: float = 30.0) -> None:
+        if httpx is None:
+            raise RuntimeError("httpx is not installed")
+        self.pool_size = max(1, int(pool_size))
+        self.retries = max(0, int(retries))
+        self.backoff_sec = max(0.0, float(backoff_sec))
+        self.max_wait_sec = max(0.0, float(max_wait_sec))
+        self._clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Any]" = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._totals = {"requests": 0, "attempts": 0, "retries": 0, "new_connections": 0, "saturated": 0}
+
+    def _client(self) -> "httpx.AsyncClient":
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None:
+            limits = httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size)
+            client = httpx.AsyncClient(limits=limits)
+            self._clients[loop] = client
+        return client
+
+    async def send(self, method: str, url: str, *, timeout: float, retries: Optional[int] = None, **kwargs: Any) -> Tuple["httpx.Response", Dict[str, Any]]:
+        """
+        Send with retries and return the last response unread (stream it, then aclose()).
+        Raises the last httpx.HTTPError on network failure.
+        """
+        retries = self.retries if retries is None else max(0, int(retries))
+        client = self._client()
+        with self._lock:
+            self._in_flight += 1
+            in_flight = self._in_flight
+        handshakes: List[float] = []
+        started: Dict[str, float] = {}
+
+        async def _trace(event: str, info: Dict[str, Any]) -> None:
+            # httpcore connection events: TCP connect and TLS handshake of new connections.
+            if event in ("connection.connect_tcp.started", "connection.start_tls.started"):
+                started[event.rsplit(".", 1)[0]] = time.perf_counter()
+            elif event in ("connection.connect_tcp.complete", "connection.start_tls.complete"):
+                begin = started.pop(event.rsplit(".", 1)[0], None)
+                if begin is not None:
+                    if event.startswith("connection.connect_tcp"):
+                        handshakes.append(0.0)
+                    handshakes[-1] += (time.perf_counter() - begin) * 1000.0
+
+        attempts = 0
+        waited = 0.0
+        statuses: List[int] = []
+        try:
+            while True:
+                attempts += 1
+                token = current_token()
+                attempt_timeout = timeout
+                if token is not None:
+                    token.raise_if_cancelled()
+                    attempt_timeout = max(1.0, token.timeout(timeout))
+                for value in (kwargs.get("files") or {}).values():
+                    fileobj = value[1] if isinstance(value, tuple) else value
+                    if hasattr(fileobj, "seek"):
+                        fileobj.seek(0)
+                request = client.build_request(
+                    method, url,
+                    # pool=None: wait for a free connection like the blocking sync pool does.
+                    timeout=httpx.Timeout(attempt_timeout, pool=None),
+                    extensions={"trace": _trace},
+                    **kwargs,
+                )
+                try:
+                    resp = await client.send(request, stream=True)
+                except httpx.HTTPError:
+                    wait = _retry_wait(attempts, None, self.backoff_sec, self.max_wait_sec) if attempts <= retries else None
+                    if wait is None:
+                        raise
+                else:
+                    if resp.is_success or not _retryable_status(resp.status_code) or attempts > retries:
+                        break
+                    statuses.append(resp.status_code)
+                    wait = _retry_wait(attempts, resp.headers.get("Retry-After"), self.backoff_sec, self.max_wait_sec)
+                    if wait is None:
+                        break
+                    await resp.aread()
+                    await resp.aclose()
+                await asyncio.sleep(wait)
+                waited += wait
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+                self._totals["requests"] += 1
+                self._totals["attempts"] += attempts
+                self._totals["retries"] += attempts - 1
+                self._totals["new_connections"] += len(handshakes)
+                self._totals["saturated"] += int(in_flight > self.pool_size)
+
+        meta = {
+            "attempts": attempts,
+            "retries": attempts - 1,
+            "retry_statuses": statuses,
+            "retry_wait_ms": int(waited * 1000),
+            "new_connections": len(handshakes),
+            "handshake_ms": round(sum(handshakes), 1),
+            "pool_size": self.pool_size,
+            "pool_in_flight": in_flight,
+            "pool_saturated": in_flight > self.pool_size,
+            "async": True,
+        }
+        return resp, meta
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._totals, pool_size=self.pool_size, in_flight=self._in_flight)
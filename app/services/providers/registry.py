@@ -0,0 +1,256 @@
+from __future__ import annotations
+
+import fnmatch
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from app.services.providers.base import VoiceChangerProvider
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)))
+    except Exception:
+        return default
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, str(default)))
+    except Exception:
+        return default
+
+
+def unhealthy_after() -> int:
+    """VC_PROVIDER_UNHEALTHY_AFTER: consecutive failures before a provider is skipped (default 3)."""
+    return max(1, _env_int("VC_PROVIDER_UNHEALTHY_AFTER", 3))
+
+
+def cooldown_seconds() -> float:
+    """VC_PROVIDER_COOLDOWN_SEC: how long an unhealthy provider is skipped before it is tried again (default 30)."""
+    return max(0.0, _env_float("VC_PROVIDER_COOLDOWN_SEC", 30.0))
+
+
+def routing_mode() -> str:
+    """VC_PROVIDER_ROUTING: "order" (default; first healthy provider of the route) or "latency" (fastest healthy one)."""
+    value = str(os.getenv("VC_PROVIDER_ROUTING", "order")).strip().lower()
+    return "latency" if value == "latency" else "order"
+
+
+@dataclass
+class ProviderStats:
+    """Health and latency of one provider, as seen by this process."""
+    calls: int = 0
+    errors: int = 0
+    consecutive_errors: int = 0
+    latency_ms_ewma: Optional[float] = None
+    last_error: Optional[str] = None
+    last_error_at: Optional[float] = None
+
+    # Weight of the newest sample in the moving average.
+    ALPHA = 0.2
+
+    def record(self, ok: bool, latency_sec: float, error: Optional[str] = None) -> None:
+        self.calls += 1
+        if ok:
+            self.consecutive_errors = 0
+            ms = latency_sec * 1000.0
+            self.latency_ms_ewma = ms if self.latency_ms_ewma is None else (1 - self.ALPHA) * self.latency_ms_ewma + self.ALPHA * ms
+        else:
+            self.errors += 1
+            self.consecutive_errors += 1
+            self.last_error = error
+            self.last_error_at = time.time()
+
+    @property
+    def healthy(self) -> bool:
+        if self.consecutive_errors < unhealthy_after():
+            return True
+        # Half-open: after the cooldown the provider gets another chance.
+        return self.last_error_at is not None and time.time() - self.last_error_at >= cooldown_seconds()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "consecutive_errors": self.consecutive_errors,
+            "healthy": self.healthy,
+            "latency_ms_ewma": round(self.latency_ms_ewma, 1) if self.latency_ms_ewma is not None else None,
+            "last_error": self.last_error,
+        }
+
+
+@dataclass
+class Route:
+    """Voice ids matching `pattern` (fnmatch, e.g. "eleven_*") go to the first usable provider of `providers`."""
+    pattern: str
+    providers: List[str] = field(default_factory=list)
+
+
+class ProviderRegistry:
+    """
+    Long-lived voice changer providers plus the routing table that picks one per voice id.
+
+    - Providers are registered as factories and built once, on first use; a factory that
+      raises (e.g. ElevenLabs without ELEVEN_API_KEY) marks the provider unavailable
+      until the next attempt after VC_PROVIDER_COOLDOWN_SEC.
+    - Routes are checked in order; the first matching one lists candidate providers.
+      Unavailable providers are skipped, and so are unhealthy ones (consecutive failures)
+      while another candidate is left. VC_PROVIDER_ROUTING=latency prefers the candidate
+      with the lowest measured latency instead of the listed order.
+    - Callers report every conversion with record(), which feeds health and latency.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._factories: Dict[str, Callable[[], VoiceChangerProvider]] = {}
+        self._instances: Dict[str, VoiceChangerProvider] = {}
+        self._unavailable: Dict[str, Tuple[str, float]] = {}  # name -> (reason, when)
+        self._stats: Dict[str, ProviderStats] = {}
+        self.routes: List[Route] = []
+
+    def register(self, name: str, factory: Callable[[], VoiceChangerProvider]) -> None:
+        with self._lock:
+            self._factories[name] = factory
+            self._instances.pop(name, None)
+            self._unavailable.pop(name, None)
+            self._stats.setdefault(name, ProviderStats())
+
+    def add_route(self, pattern: str, providers: List[str], *, first: bool = False) -> None:
+        route = Route(pattern=pattern, providers=list(providers))
+        with self._lock:
+            if first:
+                self.routes.insert(0, route)
+            else:
+                self.routes.append(route)
+
+    def get(self, name: str) -> Optional[VoiceChangerProvider]:
+        """The provider's singleton, or None when it isn't registered or can't be built."""
+        with self._lock:
+            if name in self._instances:
+                return self._instances[name]
+            factory = self._factories.get(name)
+            if factory is None:
+                return None
+            failed = self._unavailable.get(name)
+            if failed is not None and time.time() - failed[1] < cooldown_seconds():
+                return None
+            try:
+                provider = factory()
+            except Exception as e:
+                # Retried after the cooldown, so e.g. a newly configured API key is picked up.
+                self._unavailable[name] = (str(e), time.time())
+                return None
+            self._unavailable.pop(name, None)
+            self._instances[name] = provider
+            return provider
+
+    def candidates(self, voice_id: str) -> List[str]:
+        with self._lock:
+            routes = list(self.routes)
+        for route in routes:
+            if fnmatch.fnmatchcase(voice_id or "", route.pattern):
+                return list(route.providers)
+        return []
+
+    def route(self, voice_id: str) -> Optional[Tuple[str, VoiceChangerProvider]]:
+        """(name, provider) to use for voice_id, or None when no provider of its route is usable."""
+        usable = [(name, p) for name in self.candidates(voice_id) for p in [self.get(name)] if p is not None]
+        if not usable:
+            return None
+        with self._lock:
+            healthy = [(name, p) for name, p in usable if self._stats.setdefault(name, ProviderStats()).healthy]
+            pool = healthy or usable
+            if routing_mode() == "latency":
+                # Providers without a sample yet sort first so they get measured.
+                pool = sorted(pool, key=lambda item: self._stats[item[0]].latency_ms_ewma or 0.0)
+        return pool[0]
+
+    def record(self, name: str, ok: bool, latency_sec: float, error: Optional[str] = None) -> None:
+        with self._lock:
+            self._stats.setdefault(name, ProviderStats()).record(ok, latency_sec, error)
+
+    def warmup(self) -> Dict[str, Any]:
+        """Build every registered provider and run its optional warmup() (e.g. pre-opened connections)."""
+        with self._lock:
+            names = list(self._factories)
+        results: Dict[str, Any] = {}
+        for name in names:
+            provider = self.get(name)
+            warmup = getattr(provider, "warmup", None)
+            if warmup is None:
+                continue
+            try:
+                results[name] = warmup()
+            except Exception as e:
+                results[name] = {"error": str(e)}
+        return results
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            names = sorted(set(self._factories) | set(self._stats))
+            pools = {
+                name: provider.pool_stats()
+                for name, provider in self._instances.items()
+                if hasattr(provider, "pool_stats")
+            }
+            return {
+                "routing": routing_mode(),
+                "routes": [{"pattern": r.pattern, "providers": list(r.providers)} for r in self.routes],
+                "providers": {
+                    name: {
+                        "available": name not in self._unavailable,
+                        "loaded": name in self._instances,
+                        "unavailable_reason": (self._unavailable.get(name) or (None, 0.0))[0],
+                        **self._stats.setdefault(name, ProviderStats()).to_dict(),
+                        **({"pool": pools[name]} if name in pools else {}),
+                    }
+                    for name in names
+                },
+            }
+
+
+def _parse_routes(spec: str) -> List[Route]:
+    """VC_PROVIDER_ROUTES: "pattern=provider[,provider...];..." e.g. "eleven_*=elevenlabs;demo_*=funny_voice"."""
+    routes: List[Route] = []
+    for part in (spec or "").split(";"):
+        pattern, sep, providers = part.partition("=")
+        names = [p.strip() for p in providers.split(",") if p.strip()]
+        if sep and pattern.strip() and names:
+            routes.append(Route(pattern=pattern.strip(), providers=names))
+    return routes
+
+
+def _build_default() -> ProviderRegistry:
+    # Imported here: provider modules pull in ffmpeg/numpy/requests.
+    from app.services.providers.elevenlabs import ElevenLabsVoiceChangerHTTP
+    from app.services.providers.funny_voice import FunnyVoiceProvider
+
+    registry = ProviderRegistry()
+    registry.register("funny_voice", FunnyVoiceProvider)
+    registry.register("elevenlabs", ElevenLabsVoiceChangerHTTP)
+    # Custom routes win over the built-in ones: local funny voices, everything else upstream.
+    registry.routes.extend(_parse_routes(os.getenv("VC_PROVIDER_ROUTES", "")))
+    for voice_id in FunnyVoiceProvider.SUPPORTED_VOICES:
+        registry.add_route(voice_id, ["funny_voice"])
+    registry.add_route("*", ["elevenlabs"])
+    return registry
+
+
+_registry: Optional[ProviderRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_provider_registry() -> ProviderRegistry:
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = _build_default()
+        return _registry
+
+
+def provider_stats() -> Dict[str, Any]:
+    return get_provider_registry().stats()
@@ -0,0 +1,223 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.config.settings import OUTPUTS_DIR, RUNS_BASE_DIR
+
+
+# Index entries live under runs/result_cache/<key>.json; the cached audio itself is the
+# already-published file in OUTPUTS_DIR (no extra copy).
+CACHE_DIR = os.path.join(RUNS_BASE_DIR, "result_cache")
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)))
+    except Exception:
+        return default
+
+
+def cache_enabled() -> bool:
+    return str(os.getenv("VC_RESULT_CACHE", "1")).strip().lower() not in {"0", "false", "no", "off"}
+
+
+def cache_ttl_seconds() -> int:
+    return max(0, _env_int("VC_RESULT_CACHE_TTL_SEC", 24 * 3600))
+
+
+def cache_max_bytes() -> int:
+    return max(0, _env_int("VC_RESULT_CACHE_MAX_BYTES", 1024 * 1024 * 1024))
+
+
+def cache_key(content_sha256: str, params: Dict[str, Any]) -> str:
+    """Stable key: uploaded bytes hash + every parameter that changes the rendered output."""
+    raw = json.dumps({"content": content_sha256, "params": params}, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _entry_path(key: str) -> str:
+    safe = "".join(c for c in key if c.isalnum())
+    return os.path.join(CACHE_DIR, f"{safe}.json")
+
+
+def _read_json(path: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) else None
+    except Exception:
+        return None
+
+
+def _write_json(path: str, data: Dict[str, Any]) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def _remove(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _last_used(entry: Dict[str, Any]) -> float:
+    """Age basis for both TTL expiry (lookup) and eviction: the last hit, else creation."""
+    return float(entry.get("last_hit_at") or entry.get("created_at") or 0)
+
+
+def _output_paths(entry: Dict[str, Any]) -> List[str]:
+    """Every published file of the entry: the primary output plus the extra formats (meta.outputs)."""
+    names = entry.get("output_names") or [entry.get("public_name")]
+    return [os.path.join(OUTPUTS_DIR, os.path.basename(str(name or ""))) for name in names]
+
+
+def _output_names(artifact_meta: Dict[str, Any]) -> List[str]:
+    public_name = str(artifact_meta.get("public_name") or "")
+    names = [public_name]
+    for url in (artifact_meta.get("outputs") or {}).values():
+        name = os.path.basename(str(url or ""))
+        if name and name not in names:
+            names.append(name)
+    return names
+
+
+class ResultCache:
+    """
+    Content-addressed cache of finished conversions.
+
+    A hit returns the artifact meta of an earlier task whose published output still
+    exists in OUTPUTS_DIR, so the caller can answer without running the Pipeline.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def counters(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses}
+
+    def lookup(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = _read_json(_entry_path(key))
+        out_paths = _output_paths(entry) if entry else []
+        now = time.time()
+
+        # Every format of a multi-output render must still be there, or the hit would return dead URLs.
+        fresh = bool(entry) and all(os.path.isfile(p) for p in out_paths)
+        if fresh and cache_ttl_seconds() and now - _last_used(entry) > cache_ttl_seconds():
+            fresh = False
+
+        if not fresh:
+            if entry:
+                # Output was cleaned up or entry expired: drop the stale index entry.
+                _remove(_entry_path(key))
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        entry["last_hit_at"] = now
+        entry["hit_count"] = int(entry.get("hit_count") or 0) + 1
+        try:
+            _write_json(_entry_path(key), entry)
+            # Keep hot outputs from being removed by age-based cleanup (scripts/cleanup_runs.py).
+            for out_path in out_paths:
+                os.utime(out_path, None)
+        except Exception:
+            pass
+        return entry
+
+    def store(self, key: str, *, task_id: str, artifact_meta: Dict[str, Any]) -> None:
+        public_name = str(artifact_meta.get("public_name") or "")
+        names = _output_names(artifact_meta)
+        out_paths = [os.path.join(OUTPUTS_DIR, os.path.basename(name)) for name in names]
+        if not public_name or not all(os.path.isfile(p) for p in out_paths):
+            return
+        _write_json(_entry_path(key), {
+            "key": key,
+            "task_id": task_id,
+            "public_name": public_name,
+            "public_url": artifact_meta.get("public_url") or f"/outputs/{public_name}",
+            "produced_format": artifact_meta.get("produced_format"),
+            "output_names": names,
+            "size": sum(os.path.getsize(p) for p in out_paths),
+            "created_at": time.time(),
+            "artifact": artifact_meta,
+        })
+
+
+def evict(*, max_bytes: int, max_age_seconds: int, apply: bool) -> List[Tuple[str, str]]:
+    """
+    Enforce cache budget. Returns [(reason, entry_path)] for removed (or would-be removed) entries.
+
+    - entries with any output file gone (primary or extra format) are dropped with the rest
+    - entries not created/hit within max_age_seconds are dropped (with their output)
+    - then least-recently-used entries are dropped until outputs fit in max_bytes
+    """
+    if not os.path.isdir(CACHE_DIR):
+        return []
+
+    now = time.time()
+    removed: List[Tuple[str, str]] = []
+    live: List[Tuple[float, int, str, str]] = []
+
+    for name in os.listdir(CACHE_DIR):
+        if not name.endswith(".json"):
+            continue
+        path = os.path.join(CACHE_DIR, name)
+        entry = _read_json(path)
+        if not entry:
+            removed.append(("corrupt", path))
+            if apply:
+                _remove(path)
+            continue
+        out_paths = _output_paths(entry)
+        if not all(os.path.isfile(p) for p in out_paths):
+            removed.append(("missing_output", path))
+            if apply:
+                _remove(path)
+                for out_path in out_paths:
+                    _remove(out_path)
+            continue
+        last_used = _last_used(entry)
+        if max_age_seconds and now - last_used > max_age_seconds:
+            removed.append(("expired", path))
+            if apply:
+                _remove(path)
+                for out_path in out_paths:
+                    _remove(out_path)
+            continue
+        live.append((last_used, sum(os.path.getsize(p) for p in out_paths), path, out_paths))
+
+    total = sum(size for _, size, _, _ in live)
+    for last_used, size, path, out_paths in sorted(live):
+        if not max_bytes or total <= max_bytes:
+            break
+        removed.append(("over_budget", path))
+        total -= size
+        if apply:
+            _remove(path)
+            for out_path in out_paths:
+                _remove(out_path)
+
+    return removed
+
+
+_cache: Optional[ResultCache] = None
+
+
+def get_result_cache() -> ResultCache:
+    global _cache
+    if _cache is None:
+        _cache = ResultCache()
+    return _cache
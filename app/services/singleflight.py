@@ -0,0 +1,572 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import threading
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar
+
+from app.config.settings import RUNS_BASE_DIR
+from app.core.artifacts import Artifact, TaskContext
+from app.core.cancellation import cancellable_sleep, check_cancelled, current_token
+from app.core.executors import get_executor
+from app.services.input_store import link_or_copy
+from app.voice_library.state import redis_url
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - no flock(): coalescing stays in-process
+    fcntl = None
+
+try:
+    import redis as _redis
+except Exception:  # pragma: no cover
+    _redis = None
+
+
+# Identical conversions that overlap in time (same input content, provider and voice parameters)
+# run once: the first caller leads, the others wait and reuse its converted.wav.
+#
+# In-process, callers join the leader's flight. Across workers, the leader holds a short-lived
+# lock — SET NX in Redis when VOICE_LIBRARY_REDIS_URL / REDIS_URL is configured, else a flock()ed
+# runs/singleflight/<key>.lock — and publishes its result there for the others to poll. The
+# published audio is a file under runs/singleflight/, so sharing across workers assumes they
+# share RUNS_BASE_DIR. A leader that fails (or falls back) publishes nothing and its followers
+# convert on their own.
+SF_DIR = os.path.join(RUNS_BASE_DIR, "singleflight")
+_LOCK_PREFIX = "vc:sf:lock:"
+_DONE_PREFIX = "vc:sf:done:"
+# Compare-and-delete: never release a lock that expired and was taken by another worker.
+_RELEASE_SCRIPT = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end return 0"
+# share()'s marker for "this task adopted the leader's files".
+_ADOPTED = object()
+
+T = TypeVar("T")
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, str(default)))
+    except Exception:
+        return default
+
+
+def singleflight_enabled() -> bool:
+    return str(os.getenv("VC_SINGLEFLIGHT", "1")).strip().lower() not in {"0", "false", "no", "off"}
+
+
+def lock_ttl_seconds() -> float:
+    """Expiry of a leader's Redis lock, so a worker that died mid-conversion doesn't block the key."""
+    return max(1.0, _env_float("VC_SINGLEFLIGHT_LOCK_TTL_SEC", 300.0))
+
+
+def wait_seconds() -> float:
+    """How long a follower waits for the leader before converting on its own (capped by the task's deadline)."""
+    return max(0.0, _env_float("VC_SINGLEFLIGHT_WAIT_SEC", 300.0))
+
+
+def _wait_deadline() -> float:
+    """
+    monotonic() time at which a follower stops waiting: wait_seconds() from now, or the task's
+    deadline when that comes first (there is no point waiting for a result the task can't use).
+    """
+    token = current_token()
+    budget = wait_seconds() if token is None else token.timeout(wait_seconds())
+    return time.monotonic() + budget
+
+
+def result_ttl_seconds() -> float:
+    """How long a published result stays readable for followers in other workers."""
+    return max(1.0, _env_float("VC_SINGLEFLIGHT_RESULT_TTL_SEC", 60.0))
+
+
+def poll_seconds() -> float:
+    return max(0.01, _env_float("VC_SINGLEFLIGHT_POLL_SEC", 0.1))
+
+
+class FileLocks:
+    """Cross-worker locks as flock()ed files; the OS drops a lock when its worker dies."""
+
+    name = "file"
+
+    def __init__(self, root: Optional[str] = None) -> None:
+        self._root = root
+        self._held: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._pruned_at = 0.0
+
+    @property
+    def root(self) -> str:
+        # Resolved per call so SF_DIR can be pointed elsewhere (tests) after the backend exists.
+        return self._root or SF_DIR
+
+    def path(self, key: str, ext: str) -> str:
+        safe = "".join(c for c in key if c.isalnum())
+        return os.path.join(self.root, f"{safe}.{ext}")
+
+    def try_acquire(self, key: str, ttl_sec: float) -> bool:
+        if fcntl is None:
+            return True
+        try:
+            os.makedirs(self.root, exist_ok=True)
+            fd = os.open(self.path(key, "lock"), os.O_RDWR | os.O_CREAT, 0o644)
+        except OSError:
+            return True  # can't coordinate: convert rather than wait
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        os.utime(fd)
+        with self._lock:
+            self._held[key] = fd
+        return True
+
+    def release(self, key: str) -> None:
+        with self._lock:
+            fd = self._held.pop(key, None)
+        if fd is not None:
+            os.close(fd)  # drops the flock; the file stays (unlinking it would race the next locker)
+
+    def publish(self, key: str, record: Dict[str, Any], ttl_sec: float) -> None:
+        path = self.path(key, "json")
+        tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(dict(record, expires_at=time.time() + ttl_sec), f, ensure_ascii=False, default=str)
+        os.replace(tmp, path)
+
+    def result(self, key: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self.path(key, "json"), "r", encoding="utf-8") as f:
+                record = json.load(f)
+        except Exception:
+            return None
+        if not isinstance(record, dict) or float(record.get("expires_at") or 0) < time.time():
+            return None
+        return record
+
+    def prune(self, max_age_sec: float) -> int:
+        """Drop published results and idle lock files older than max_age_sec (at most once a minute)."""
+        now = time.time()
+        if now - self._pruned_at < 60:
+            return 0
+        self._pruned_at = now
+        removed = 0
+        try:
+            names = os.listdir(self.root)
+        except OSError:
+            return 0
+        for fname in names:
+            path = os.path.join(self.root, fname)
+            try:
+                if now - os.path.getmtime(path) < max_age_sec:
+                    continue
+                if fname.endswith(".lock"):
+                    if fcntl is None:
+                        continue
+                    fd = os.open(path, os.O_RDWR)
+                    try:
+                        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except OSError:
+                        continue  # a leader still holds it
+                    finally:
+                        os.close(fd)
+                os.remove(path)
+                removed += 1
+            except OSError:
+                continue
+        return removed
+
+
+class RedisLocks(FileLocks):
+    """
+    Lock + published record in Redis (the server the voice library state already uses). Any
+    Redis error falls back to the file lock for that call; the audio itself is always a file.
+    """
+
+    name = "redis"
+
+    def __init__(self, url: str, root: Optional[str] = None) -> None:
+        if _redis is None:
+            raise RuntimeError("redis package not installed")
+        super().__init__(root)
+        # Sync client: the lock is taken from pipeline threads (RedisState's client is asyncio).
+        self._redis = _redis.Redis.from_url(url, decode_responses=True, socket_timeout=2.0, socket_connect_timeout=2.0)
+        self._tokens: Dict[str, Optional[str]] = {}
+
+    def try_acquire(self, key: str, ttl_sec: float) -> bool:
+        token = uuid.uuid4().hex
+        try:
+            acquired = bool(self._redis.set(_LOCK_PREFIX + key, token, nx=True, px=int(ttl_sec * 1000)))
+        except Exception:
+            acquired, token = super().try_acquire(key, ttl_sec), None
+        if acquired:
+            with self._lock:
+                self._tokens[key] = token
+        return acquired
+
+    def release(self, key: str) -> None:
+        with self._lock:
+            token = self._tokens.pop(key, None)
+        if token is None:
+            super().release(key)
+            return
+        try:
+            self._redis.eval(_RELEASE_SCRIPT, 1, _LOCK_PREFIX + key, token)
+        except Exception:
+            pass  # expires after lock_ttl_seconds()
+
+    def publish(self, key: str, record: Dict[str, Any], ttl_sec: float) -> None:
+        try:
+            self._redis.set(_DONE_PREFIX + key, json.dumps(record, ensure_ascii=False, default=str), px=int(ttl_sec * 1000))
+        except Exception:
+            super().publish(key, record, ttl_sec)
+
+    def result(self, key: str) -> Optional[Dict[str, Any]]:
+        try:
+            raw = self._redis.get(_DONE_PREFIX + key)
+        except Exception:
+            return super().result(key)
+        try:
+            record = json.loads(raw) if raw else None
+        except Exception:
+            return None
+        return record if isinstance(record, dict) else None
+
+
+def _default_backend() -> FileLocks:
+    url = redis_url()
+    if url and _redis is not None and not url.startswith("http"):
+        try:
+            return RedisLocks(url)
+        except Exception:
+            pass
+    return FileLocks()
+
+
+class _Flight:
+    def __init__(self, leader: str) -> None:
+        self.leader = leader
+        self.done = threading.Event()
+        self.record: Optional[Dict[str, Any]] = None
+        self.followers = 0
+
+
+class SingleFlight:
+    """
+    Coalesces identical in-flight conversions (see the comment at the top of this module).
+
+    run()/arun() take the flight key and a callable doing the actual conversion; it returns
+    the converted artifact (including error fallbacks, which are never shared). share()/ashare()
+    do the same for any deterministic producer of output files, e.g. a fused ffmpeg group.
+    """
+
+    def __init__(self, backend: Optional[FileLocks] = None) -> None:
+        self._backend = backend
+        self._flights: Dict[str, _Flight] = {}
+        self._lock = threading.Lock()
+        self._counts = {"leaders": 0, "followers": 0, "remote_followers": 0, "fallthrough": 0}
+
+    @property
+    def backend(self) -> FileLocks:
+        if self._backend is None:
+            self._backend = _default_backend()
+        return self._backend
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._counts[name] += 1
+
+    def _join(self, key: str, task_id: str) -> Tuple[_Flight, bool]:
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                flight.followers += 1
+                return flight, False
+            flight = self._flights[key] = _Flight(task_id)
+            return flight, True
+
+    def _finish(self, key: str, flight: _Flight, record: Optional[Dict[str, Any]]) -> None:
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        flight.record = record
+        flight.done.set()
+
+    def _share_file(self, key: str, ext: str, src: str) -> str:
+        """Hard-link src under runs/singleflight/ for followers; returns the shared path."""
+        path = self.backend.path(key, ext)
+        tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+        link_or_copy(src, tmp)
+        os.replace(tmp, path)
+        return path
+
+    def _announce(self, key: str, record: Dict[str, Any]) -> None:
+        self.backend.publish(key, record, result_ttl_seconds())
+        self.backend.prune(max(result_ttl_seconds(), lock_ttl_seconds()))
+
+    def _publish(self, key: str, ctx: TaskContext, artifact: Artifact, converted: Artifact) -> Optional[Dict[str, Any]]:
+        """Hard-link the leader's converted.wav under runs/singleflight/ and announce it."""
+        meta = converted.meta or {}
+        if meta.get("provider_status") != "ok" or not converted.path or not os.path.isfile(converted.path):
+            return None
+        try:
+            os.makedirs(self.backend.root, exist_ok=True)
+            input_keys = set(artifact.meta or {})
+            record = {
+                "path": self._share_file(key, "wav", converted.path),
+                "meta": {k: v for k, v in meta.items() if k not in input_keys and k != "converted_path"},
+                "provider": dict(ctx.debug.get("provider") or {}),
+                "chunking": ctx.debug.get("chunking"),
+                "leader": ctx.task_id,
+            }
+            self._announce(key, record)
+            return record
+        except Exception as e:
+            ctx.debug.setdefault("errors", []).append({"step": "singleflight", "error": str(e)})
+            return None
+
+    def _publish_files(self, key: str, ctx: TaskContext, paths: List[str]) -> Optional[Dict[str, Any]]:
+        """share()'s _publish: every output file, in order."""
+        if not all(os.path.isfile(p) for p in paths):
+            return None
+        try:
+            os.makedirs(self.backend.root, exist_ok=True)
+            files = [self._share_file(key, f"{i}.{os.path.basename(p)}", p) for i, p in enumerate(paths)]
+            record = {"files": files, "leader": ctx.task_id}
+            self._announce(key, record)
+            return record
+        except Exception as e:
+            ctx.debug.setdefault("errors", []).append({"step": "singleflight", "error": str(e)})
+            return None
+
+    def _followed(self, ctx: TaskContext, record: Dict[str, Any], via: str, mode: str, started: float) -> None:
+        ctx.debug["singleflight"] = {
+            "role": "follower",
+            "via": via,
+            "leader_task_id": record.get("leader"),
+            "mode": mode,
+            "wait_ms": round((time.perf_counter() - started) * 1000, 1),
+        }
+        self._count("followers" if via == "local" else "remote_followers")
+
+    def _adopt(self, record: Optional[Dict[str, Any]], artifact: Artifact, ctx: TaskContext, converted_path: str, via: str, started: float) -> Optional[Artifact]:
+        """The leader's result as this task's converted.wav, or None to convert ourselves."""
+        if not record or not os.path.isfile(str(record.get("path") or "")):
+            return None
+        try:
+            mode = link_or_copy(str(record["path"]), converted_path)
+        except OSError:
+            return None
+        ctx.register(converted_path)
+        meta = dict(artifact.meta or {})
+        meta.update(record.get("meta") or {})
+        meta["converted_path"] = converted_path
+        ctx.debug.setdefault("provider", {})
+        ctx.debug["provider"].update(record.get("provider") or {})
+        ctx.debug["provider"]["coalesced"] = True
+        if record.get("chunking"):
+            ctx.debug["chunking"] = record["chunking"]
+        self._followed(ctx, record, via, mode, started)
+        return Artifact(path=converted_path, mime="audio/wav", meta=meta)
+
+    def _adopt_files(self, record: Optional[Dict[str, Any]], ctx: TaskContext, paths: List[str], via: str, started: float) -> Any:
+        """share()'s _adopt: the leader's files at this task's paths; _ADOPTED, or None to produce them ourselves."""
+        shared = (record or {}).get("files")
+        if not isinstance(shared, list) or len(shared) != len(paths) or not all(os.path.isfile(str(p)) for p in shared):
+            return None
+        try:
+            modes = [link_or_copy(str(src), dst) for src, dst in zip(shared, paths)]
+        except OSError:
+            return None
+        for path in paths:
+            ctx.register(path)
+        self._followed(ctx, record, via, modes[0] if modes else "link", started)
+        return _ADOPTED
+
+    def _lead(self, ctx: TaskContext, flight: _Flight, locked: bool) -> None:
+        ctx.debug["singleflight"] = {"role": "leader", "lock": self.backend.name if locked else None, "followers": flight.followers}
+        self._count("leaders")
+
+    def _fallthrough(self, ctx: TaskContext, via: str) -> None:
+        ctx.debug["singleflight"] = {"role": "fallthrough", "via": via}
+        self._count("fallthrough")
+
+    def _lock_or_result(self, key: str) -> Tuple[bool, Optional[Dict[str, Any]]]:
+        """
+        Take the cross-worker lock, or wait for the worker holding it to publish. Returns
+        (locked, record); (False, None) when the wait timed out.
+        """
+        backend = self.backend
+        if backend.try_acquire(key, lock_ttl_seconds()):
+            return True, None
+        deadline = _wait_deadline()
+        while time.monotonic() < deadline:
+            cancellable_sleep(poll_seconds())
+            record = backend.result(key)
+            if record is not None:
+                return False, record
+            if backend.try_acquire(key, lock_ttl_seconds()):
+                # The leader may have published and released between the two calls.
+                record = backend.result(key)
+                if record is not None:
+                    backend.release(key)
+                    return False, record
+                return True, None
+        return False, None
+
+    async def _alock_or_result(self, key: str) -> Tuple[bool, Optional[Dict[str, Any]]]:
+        """_lock_or_result() without holding an executor thread while it waits."""
+        backend, io = self.backend, get_executor("singleflight")
+        if await io.run(backend.try_acquire, key, lock_ttl_seconds()):
+            return True, None
+        deadline = _wait_deadline()
+        while time.monotonic() < deadline:
+            await asyncio.sleep(poll_seconds())
+            check_cancelled()
+            record = await io.run(backend.result, key)
+            if record is not None:
+                return False, record
+            if await io.run(backend.try_acquire, key, lock_ttl_seconds()):
+                record = await io.run(backend.result, key)
+                if record is not None:
+                    await io.run(backend.release, key)
+                    return False, record
+                return True, None
+        return False, None
+
+    def _coalesce(self, key: str, ctx: TaskContext, produce: Callable[[], T], publish: Callable[[T], Optional[Dict[str, Any]]], adopt: Callable[[Optional[Dict[str, Any]], str, float], Optional[T]]) -> T:
+        started = time.perf_counter()
+        flight, leader = self._join(key, ctx.task_id)
+        if not leader:
+            deadline = _wait_deadline()
+            while not flight.done.wait(poll_seconds()):
+                check_cancelled()
+                if time.monotonic() >= deadline:
+                    break
+            adopted = adopt(flight.record, "local", started)
+            if adopted is not None:
+                return adopted
+            check_cancelled()  # the wait ended at the task's deadline: don't start converting now
+            self._fallthrough(ctx, "local")
+            return produce()
+
+        locked, record = False, None
+        try:
+            locked, record = self._lock_or_result(key)
+            adopted = adopt(record, self.backend.name, started)
+            if adopted is not None:
+                return adopted
+            result = produce()
+            record = publish(result)
+            self._lead(ctx, flight, locked)
+            return result
+        finally:
+            if locked:
+                self.backend.release(key)
+            self._finish(key, flight, record)
+
+    async def _acoalesce(self, key: str, ctx: TaskContext, produce: Callable[[], Awaitable[T]], publish: Callable[[T], Optional[Dict[str, Any]]], adopt: Callable[[Optional[Dict[str, Any]], str, float], Optional[T]]) -> T:
+        """_coalesce() awaiting on the event loop; publish/adopt and lock work go to a small executor."""
+        started = time.perf_counter()
+        io = get_executor("singleflight")
+        flight, leader = self._join(key, ctx.task_id)
+        if not leader:
+            deadline = _wait_deadline()
+            while not flight.done.is_set() and time.monotonic() < deadline:
+                await asyncio.sleep(poll_seconds())
+                check_cancelled()
+            adopted = await io.run(adopt, flight.record, "local", started)
+            if adopted is not None:
+                return adopted
+            check_cancelled()
+            self._fallthrough(ctx, "local")
+            return await produce()
+
+        locked, record = False, None
+        try:
+            locked, record = await self._alock_or_result(key)
+            adopted = await io.run(adopt, record, self.backend.name, started)
+            if adopted is not None:
+                return adopted
+            result = await produce()
+            record = await io.run(publish, result)
+            self._lead(ctx, flight, locked)
+            return result
+        finally:
+            if locked:
+                await io.run(self.backend.release, key)
+            self._finish(key, flight, record)
+
+    def run(self, key: Optional[str], ctx: TaskContext, artifact: Artifact, converted_path: str, convert: Callable[[], Artifact]) -> Artifact:
+        if not key or not singleflight_enabled():
+            return convert()
+        return self._coalesce(
+            key, ctx, convert,
+            lambda converted: self._publish(key, ctx, artifact, converted),
+            lambda record, via, started: self._adopt(record, artifact, ctx, converted_path, via, started),
+        )
+
+    async def arun(self, key: Optional[str], ctx: TaskContext, artifact: Artifact, converted_path: str, convert: Callable[[], Awaitable[Artifact]]) -> Artifact:
+        """run() for conversions awaited on the event loop."""
+        if not key or not singleflight_enabled():
+            return await convert()
+        return await self._acoalesce(
+            key, ctx, convert,
+            lambda converted: self._publish(key, ctx, artifact, converted),
+            lambda record, via, started: self._adopt(record, artifact, ctx, converted_path, via, started),
+        )
+
+    def share(self, key: Optional[str], ctx: TaskContext, paths: List[str], produce: Callable[[], T]) -> Optional[T]:
+        """
+        Coalesce a deterministic producer of `paths` (same key => same bytes). Returns produce()'s
+        result, or None when this task adopted another task's files instead.
+        """
+        if not key or not singleflight_enabled():
+            return produce()
+        result = self._coalesce(
+            key, ctx, produce,
+            lambda _result: self._publish_files(key, ctx, paths),
+            lambda record, via, started: self._adopt_files(record, ctx, paths, via, started),
+        )
+        return None if result is _ADOPTED else result
+
+    async def ashare(self, key: Optional[str], ctx: TaskContext, paths: List[str], produce: Callable[[], Awaitable[T]]) -> Optional[T]:
+        """share() for producers awaited on the event loop."""
+        if not key or not singleflight_enabled():
+            return await produce()
+        result = await self._acoalesce(
+            key, ctx, produce,
+            lambda _result: self._publish_files(key, ctx, paths),
+            lambda record, via, started: self._adopt_files(record, ctx, paths, via, started),
+        )
+        return None if result is _ADOPTED else result
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counts = dict(self._counts)
+            in_flight = len(self._flights)
+        return {
+            "enabled": singleflight_enabled(),
+            "backend": self.backend.name,
+            "in_flight": in_flight,
+            **counts,
+        }
+
+
+_singleflight: Optional[SingleFlight] = None
+_singleflight_lock = threading.Lock()
+
+
+def get_singleflight() -> SingleFlight:
+    global _singleflight
+    with _singleflight_lock:
+        if _singleflight is None:
+            _singleflight = SingleFlight()
+        return _singleflight
+
+
+def singleflight_stats() -> Dict[str, Any]:
+    return get_singleflight().stats()
@@ -2,85 +2,146 @@ from __future__ import annotations
 
 import os
 import shutil
+from typing import Any, Dict, List, Optional, Tuple
 
 from app.core.artifacts import Artifact, TaskContext
-from app.services.ffmpeg import convert_wav_to_mp3, is_available as ffmpeg_available, FFmpegError
+from app.core.pipeline import FfmpegStage
+from app.services.audio_formats import get_format, resolve_bitrate
+from app.services.ffmpeg import transcode_audio, transcode_audio_multi, is_available as ffmpeg_available, FFmpegError
 from app.config.settings import OUTPUTS_DIR
 
 
 class ExportStep:
 	name = "export"
 
-	def run(self, artifact: Artifact, ctx: TaskContext) -> Artifact:
-		# We only have WAV right now; if mp3 requested, still output WAV
-		requested = (ctx.output_format or "wav").lower()
-		src = os.path.abspath(artifact.path)
-		if not os.path.isfile(src):
-			raise FileNotFoundError(f"Export source missing: {src}")
-
-		if requested == "mp3":
-			out_name = "output.mp3"
-			out_path = ctx.path(out_name)
-			if not ffmpeg_available():
-				# Fallback to WAV copy if ffmpeg unavailable
-				fallback = ctx.path("output.wav")
-				shutil.copyfile(src, fallback)
-				# Also copy to public outputs directory for static serving
-				public_name = f"{ctx.task_id}.wav"
-				public_path = os.path.join(OUTPUTS_DIR, public_name)
-				shutil.copyfile(fallback, public_path)
-				ctx.register_output(fallback)
-				meta = {
-					"requested_format": requested,
-					"produced_format": "wav",
-					"note": "ffmpeg not available; produced WAV instead",
-					"public_name": public_name,
-					"public_url": f"/outputs/{public_name}",
-				}
-				return Artifact(path=fallback, mime="audio/wav", meta=meta)
-			try:
-				convert_wav_to_mp3(src, out_path)
-				# Copy final MP3 to public outputs directory
-				public_name = f"{ctx.task_id}.mp3"
-				public_path = os.path.join(OUTPUTS_DIR, public_name)
-				shutil.copyfile(out_path, public_path)
-				ctx.register_output(out_path)
-				meta = {
-					"requested_format": requested,
-					"produced_format": "mp3",
-					"public_name": public_name,
-					"public_url": f"/outputs/{public_name}",
-				}
-				return Artifact(path=out_path, mime="audio/mpeg", meta=meta)
-			except FFmpegError as e:
-				# On conversion failure, fall back to WAV
-				fallback = ctx.path("output.wav")
-				shutil.copyfile(src, fallback)
-				public_name = f"{ctx.task_id}.wav"
-				public_path = os.path.join(OUTPUTS_DIR, public_name)
-				shutil.copyfile(fallback, public_path)
-				ctx.register_output(fallback)
-				meta = {
-					"requested_format": requested,
-					"produced_format": "wav",
-					"error": str(e),
-					"public_name": public_name,
-					"public_url": f"/outputs/{public_name}",
-				}
-				return Artifact(path=fallback, mime="audio/wav", meta=meta)
-
-		# default: produce WAV
-		out_name = "output.wav"
-		out_path = ctx.path(out_name)
-		shutil.copyfile(src, out_path)
-		public_name = f"{ctx.task_id}.wav"
+	def _publish(self, out_path: str, ctx: TaskContext, *, requested: str, produced: str, mime: str, extra: Optional[Dict[str, Any]] = None) -> Artifact:
+		"""Copy a final output to the public outputs directory and register it."""
+		public_name = f"{ctx.task_id}.{produced}"
 		public_path = os.path.join(OUTPUTS_DIR, public_name)
 		shutil.copyfile(out_path, public_path)
 		ctx.register_output(out_path)
 		meta = {
 			"requested_format": requested,
-			"produced_format": "wav",
+			"produced_format": produced,
+		}
+		meta.update(extra or {})
+		meta.update({
 			"public_name": public_name,
 			"public_url": f"/outputs/{public_name}",
-		}
-		return Artifact(path=out_path, mime="audio/wav", meta=meta)
+		})
+		return Artifact(path=out_path, mime=mime, meta=meta)
+
+	def _bitrate(self, fmt: str, ctx: TaskContext) -> Optional[str]:
+		"""options.bitrate ("48k") or options.audio_quality (voice/standard/high); validated by the route."""
+		opts = ctx.options if isinstance(ctx.options, dict) else {}
+		return resolve_bitrate(fmt, opts.get("audio_quality"), opts.get("bitrate"))
+
+	def _plan(self, ctx: TaskContext) -> Tuple[str, Optional[str]]:
+		"""(requested format, reason it has to fall back to WAV or None)."""
+		requested = (ctx.output_format or "wav").lower()
+		if requested == "wav":
+			return requested, None
+		if not ffmpeg_available():
+			return requested, "ffmpeg not available"
+		fmt = get_format(requested)
+		if fmt.encoder() is None:
+			return requested, f"ffmpeg has no {'/'.join(fmt.encoders)} encoder"
+		return requested, None
+
+	def _extra_formats(self, ctx: TaskContext, primary: str) -> Tuple[List[str], Dict[str, str]]:
+		"""
+		ctx.output_formats besides the primary one: (formats to encode, {format: reason skipped}).
+		They need ffmpeg and their encoder; unlike the primary format they never fall back to WAV.
+		"""
+		extras: List[str] = []
+		skipped: Dict[str, str] = {}
+		for name in ctx.output_formats or []:
+			if name == primary or name in extras or name in skipped:
+				continue
+			if name == "wav":
+				extras.append(name)
+			elif not ffmpeg_available():
+				skipped[name] = "ffmpeg not available"
+			elif get_format(name).encoder() is None:
+				skipped[name] = f"ffmpeg has no {'/'.join(get_format(name).encoders)} encoder"
+			else:
+				extras.append(name)
+		return extras, skipped
+
+	def _publish_all(self, primary: Artifact, paths: Dict[str, str], skipped: Dict[str, str], ctx: TaskContext) -> Artifact:
+		"""Publish the extra outputs next to the primary one; meta.outputs maps format -> URL."""
+		outputs = {primary.meta["produced_format"]: primary.meta["public_url"]}
+		for name, path in paths.items():
+			outputs[name] = self._publish(path, ctx, requested=name, produced=name, mime=get_format(name).mime).meta["public_url"]
+		if len(outputs) > 1 or skipped:
+			primary.meta["outputs"] = outputs
+		if skipped:
+			primary.meta["skipped_outputs"] = skipped
+		return primary
+
+	def ffmpeg_stage(self, artifact: Artifact, ctx: TaskContext) -> Optional[FfmpegStage]:
+		"""Encoding as the tail of a fused ffmpeg run (every requested format from one decode)."""
+		requested, fallback = self._plan(ctx)
+		if fallback is not None or not ffmpeg_available():
+			return None
+		fmt = get_format(requested)
+		extras, skipped = self._extra_formats(ctx, fmt.name)
+
+		def _finalize(fused: Artifact, ctx: TaskContext) -> Artifact:
+			published = self._publish(fused.path, ctx, requested=requested, produced=fmt.name, mime=fmt.mime)
+			return self._publish_all(published, {name: ctx.path(f"output.{name}") for name in extras}, skipped, ctx)
+
+		return FfmpegStage(
+			output_name=f"output.{fmt.name}",
+			output_format=fmt.name,
+			bitrate=self._bitrate(fmt.name, ctx),
+			mime=fmt.mime,
+			extra_outputs=[(f"output.{name}", name, self._bitrate(name, ctx)) for name in extras],
+			finalize=_finalize,
+		)
+
+	def _encode(self, src: str, ctx: TaskContext, names: List[str]) -> Dict[str, str]:
+		"""Encode src into every format in names with one ffmpeg process (asplit, one output per format)."""
+		paths = {name: ctx.path(f"output.{name}") for name in names}
+		if len(names) == 1:
+			transcode_audio(in_path=src, out_path=paths[names[0]], output_format=names[0], bitrate=self._bitrate(names[0], ctx))
+			return paths
+		labels = [f"[o{i}]" for i in range(len(names))]
+		transcode_audio_multi(
+			in_path=src,
+			filter_complex=f"[0:a]asplit={len(names)}{''.join(labels)}",
+			outputs=[(label, paths[name], name, self._bitrate(name, ctx)) for label, name in zip(labels, names)],
+		)
+		return paths
+
+	def run(self, artifact: Artifact, ctx: TaskContext) -> Artifact:
+		requested, fallback = self._plan(ctx)
+		src = os.path.abspath(artifact.path)
+		if not os.path.isfile(src):
+			raise FileNotFoundError(f"Export source missing: {src}")
+
+		produced = requested if fallback is None else "wav"
+		extras, skipped = self._extra_formats(ctx, produced)
+		encoded = [name for name in [produced] + extras if name != "wav"]
+		paths: Dict[str, str] = {}
+		if encoded:
+			try:
+				paths = self._encode(src, ctx, encoded)
+			except FFmpegError as e:
+				# On conversion failure, fall back to a WAV copy (extra outputs are dropped)
+				skipped.update({name: "encode failed" for name in extras})
+				out_path = ctx.path("output.wav")
+				shutil.copyfile(src, out_path)
+				published = self._publish(
+					out_path, ctx, requested=requested, produced="wav", mime="audio/wav",
+					extra={"error": str(e)},
+				)
+				return self._publish_all(published, {}, skipped, ctx)
+		if produced == "wav" or "wav" in extras:
+			# WAV requested, or the requested encoder is unavailable (fallback to a WAV copy)
+			paths["wav"] = ctx.path("output.wav")
+			shutil.copyfile(src, paths["wav"])
+
+		extra = {"note": f"{fallback}; produced WAV instead"} if fallback else None
+		published = self._publish(paths.pop(produced), ctx, requested=requested, produced=produced, mime=get_format(produced).mime, extra=extra)
+		return self._publish_all(published, paths, skipped, ctx)
@@ -1,6 +1,12 @@
+import os
+from typing import Optional
+
 from app.core.artifacts import Artifact, TaskContext
+from app.core.pipeline import FfmpegStage
 from app.services.ffmpeg import standardize_to_wav, FFmpegError, is_available as ffmpeg_available
-from app.services.media_probe import probe_duration_seconds, is_ffprobe_available
+from app.services.media_probe import MediaInfo, MediaProbeError, probe_media, is_ffprobe_available
+from app.services import input_store
+from app.services.pcm import PcmError, read_wav, resample, to_mono, write_wav
 
 
 class StandardizeStep:
@@ -9,39 +15,211 @@ class StandardizeStep:
     - audio extracted from video if needed
     - mono channel
     - 48kHz sample rate
+
+    Results are kept in the standardized-input store (keyed by the upload's sha256),
+    so later tasks on the same content turn this step into a lookup.
+
+    ctx.debug["standardize"]["path"] records how the step ran:
+    input_store | passthrough (already 48kHz mono s16, hard-linked) | numpy (short PCM WAV
+    downmixed/resampled in-process) | fused | ffmpeg | skipped
     """
 
     name = "standardize"
 
+    SAMPLE_RATE = 48000
+
+    # Integer PCM WAV the stdlib wave module (and so the NumPy path) can read.
+    NUMPY_CODECS = {"pcm_u8", "pcm_s16le", "pcm_s24le", "pcm_s32le"}
+
+    def _media(self, artifact: Artifact, ctx: TaskContext) -> Optional[MediaInfo]:
+        """
+        MediaInfo of the input: reuse the route's probe (Artifact.meta["media"]); only probe
+        here when the artifact didn't come through the upload route.
+        """
+        media = MediaInfo.from_dict((artifact.meta or {}).get("media"))
+        if media is None:
+            try:
+                if is_ffprobe_available():
+                    media = probe_media(artifact.path)
+            except MediaProbeError:
+                # ignore probe errors; keep pipeline robust
+                media = None
+        if media is not None and "input_media" not in ctx.debug:
+            ctx.debug["input_media"] = {**media.to_dict(), "duration_seconds": media.duration_sec}
+        return media
+
+    def _conforms(self, media: Optional[MediaInfo]) -> bool:
+        return media is not None and media.is_pcm_wav(sample_rate=self.SAMPLE_RATE, channels=1)
+
+    def _numpy_max_seconds(self) -> float:
+        try:
+            return float(os.getenv("VC_STANDARDIZE_NUMPY_MAX_SEC", "30"))
+        except Exception:
+            return 30.0
+
+    def _numpy_eligible(self, media: Optional[MediaInfo]) -> bool:
+        """
+        Short integer PCM WAV only: decode + FFT resample in NumPy beats spawning ffmpeg up to
+        roughly half a minute of audio, after which ffmpeg's resampler is faster.
+        """
+        return (
+            media is not None
+            and (media.container or "").split(",")[0] == "wav"
+            and media.codec in self.NUMPY_CODECS
+            and media.duration_sec is not None
+            and media.duration_sec <= self._numpy_max_seconds()
+        )
+
+    def _standardize_numpy(self, input_path: str, output_path: str) -> dict:
+        samples, sr = read_wav(input_path)
+        channels = 1 if samples.ndim == 1 else int(samples.shape[1])
+        mono = to_mono(samples)
+        if sr != self.SAMPLE_RATE:
+            mono = resample(mono, sr, self.SAMPLE_RATE)
+        write_wav(output_path, mono, self.SAMPLE_RATE)
+        return {"downmix": channels > 1, "resample": [sr, self.SAMPLE_RATE] if sr != self.SAMPLE_RATE else None}
+
+    def _standardized_meta(self, source: str, media: Optional[MediaInfo] = None, input_id: Optional[str] = None) -> dict:
+        meta = {
+            "sample_rate": self.SAMPLE_RATE,
+            "channels": 1,
+            "source": source,
+            "media": MediaInfo(
+                duration_sec=media.duration_sec if media is not None else None,
+                container="wav",
+                codec="pcm_s16le",
+                sample_rate=self.SAMPLE_RATE,
+                channels=1,
+                bit_rate=self.SAMPLE_RATE * 16,
+                sample_fmt="s16",
+            ).to_dict(),
+        }
+        if input_id:
+            # Content hash of the upload, carried on every path: later steps key on it (singleflight).
+            meta["input_id"] = input_id
+        return meta
+
+    def _input_id(self, artifact: Artifact) -> Optional[str]:
+        input_id = (artifact.meta or {}).get("sha256")
+        return str(input_id) if input_id else None
+
+    def _from_store(self, artifact: Artifact, ctx: TaskContext) -> Optional[Artifact]:
+        input_id = self._input_id(artifact)
+        stored = input_store.get(input_id) if input_id else None
+        if stored is None:
+            return None
+
+        output_path = ctx.path("standardized.wav")
+        mode = input_store.link_or_copy(stored.wav_path, output_path)
+        ctx.register(output_path)
+        if stored.duration_sec is not None:
+            ctx.debug.setdefault("input_media", {})["duration_seconds"] = stored.duration_sec
+        ctx.debug.setdefault("standardize", {}).update({"path": "input_store", "input_store": "hit", "input_id": input_id, "mode": mode})
+
+        meta = self._standardized_meta(artifact.path, MediaInfo(duration_sec=stored.duration_sec), input_id)
+        return Artifact(path=output_path, mime="audio/wav", meta=meta)
+
+    def _to_store(self, artifact: Artifact, output_path: str, ctx: TaskContext) -> None:
+        input_id = self._input_id(artifact)
+        if not input_id:
+            return
+        duration = (ctx.debug.get("probe") or {}).get("duration_sec")
+        if duration is None:
+            duration = (ctx.debug.get("input_media") or {}).get("duration_seconds")
+        media = (artifact.meta or {}).get("media")
+        try:
+            stored = input_store.put(input_id, output_path, duration_sec=duration, extra={"media": media} if media else None)
+        except Exception as e:
+            ctx.debug.setdefault("standardize", {}).update({"input_store": "error", "input_store_error": str(e)})
+            return
+        if stored is not None:
+            ctx.debug.setdefault("standardize", {}).update({"input_store": "stored", "input_id": input_id})
+
+    def ffmpeg_stage(self, artifact: Artifact, ctx: TaskContext) -> Optional[FfmpegStage]:
+        """Resample + downmix as the head of a fused ffmpeg run."""
+        if not artifact.path or not artifact.path.strip() or not ffmpeg_available():
+            return None
+
+        input_id = self._input_id(artifact)
+        if input_id and input_store.get(input_id) is not None:
+            # Already standardized earlier: run() turns into a store lookup.
+            return None
+
+        media = self._media(artifact, ctx)
+        if self._conforms(media):
+            # Already 48kHz mono PCM WAV: run() just links the input, no ffmpeg stage needed.
+            return None
+
+        source = artifact.path
+        # Keep standardized.wav (via asplit) when it can be reused by later tasks.
+        keep = bool(input_id) and input_store.store_enabled()
+
+        def _finalize(fused: Artifact, ctx: TaskContext) -> Artifact:
+            ctx.debug.setdefault("standardize", {}).update({"path": "fused", "fused": True})
+            if keep:
+                standardized_path = ctx.path("standardized.wav")
+                ctx.register(standardized_path)
+                self._to_store(artifact, standardized_path, ctx)
+            meta = dict(fused.meta or {})
+            meta.update(self._standardized_meta(source, media, input_id))
+            return Artifact(path=fused.path, mime=fused.mime, meta=meta)
+
+        return FfmpegStage(
+            filters=[f"aresample={self.SAMPLE_RATE}", "aformat=channel_layouts=mono"],
+            output_name="standardized.wav",
+            output_format="wav",
+            mime="audio/wav",
+            keep_output=keep,
+            finalize=_finalize,
+        )
+
     def run(self, artifact: Artifact, ctx: TaskContext) -> Artifact:
         # ensure workspace exists
         ctx.ensure_dirs()
 
         # If there is no input file yet, skip and pass through
         if not artifact.path or not artifact.path.strip():
-            ctx.debug.setdefault("standardize", {}).update({"skipped": True, "reason": "no input"})
+            ctx.debug.setdefault("standardize", {}).update({"path": "skipped", "skipped": True, "reason": "no input"})
             return artifact
 
-        # Optional: probe input media duration for debugging/metrics
-        try:
-            if is_ffprobe_available():
-                dur = probe_duration_seconds(artifact.path)
-                ctx.debug.setdefault("input_media", {})["duration_seconds"] = dur
-        except Exception:
-            # ignore probe errors; keep pipeline robust
-            pass
+        cached = self._from_store(artifact, ctx)
+        if cached is not None:
+            return cached
+
+        media = self._media(artifact, ctx)
 
         output_path = ctx.path("standardized.wav")
 
+        if self._conforms(media):
+            # Input already has the target format: reuse the bytes instead of re-encoding.
+            mode = input_store.link_or_copy(artifact.path, output_path)
+            ctx.register(output_path)
+            ctx.debug.setdefault("standardize", {}).update({"path": "passthrough", "skipped": True, "reason": "already standardized", "mode": mode})
+            self._to_store(artifact, output_path, ctx)
+            return Artifact(path=output_path, mime="audio/wav", meta=self._standardized_meta(artifact.path, media, self._input_id(artifact)))
+
+        # Fused runs already standardize inside the single ffmpeg process; this path covers
+        # standalone runs (e.g. ElevenLabs next, batch, fusion disabled).
+        if self._numpy_eligible(media):
+            try:
+                details = self._standardize_numpy(artifact.path, output_path)
+                ctx.register(output_path)
+                ctx.debug.setdefault("standardize", {}).update({"path": "numpy", **details})
+                self._to_store(artifact, output_path, ctx)
+                return Artifact(path=output_path, mime="audio/wav", meta=self._standardized_meta(artifact.path, media, self._input_id(artifact)))
+            except (PcmError, ValueError, MemoryError) as e:
+                ctx.debug.setdefault("standardize", {}).update({"numpy_error": str(e)})
+
         # Run ffmpeg standardization if available; else pass through
         if not ffmpeg_available():
-            ctx.debug.setdefault("standardize", {}).update({"skipped": True, "reason": "ffmpeg unavailable"})
+            ctx.debug.setdefault("standardize", {}).update({"path": "skipped", "skipped": True, "reason": "ffmpeg unavailable"})
             return artifact
 
         try:
             standardize_to_wav(
                 input_path=artifact.path,
                 output_path=output_path,
+                sample_rate=self.SAMPLE_RATE,
             )
         except FFmpegError as e:
             ctx.debug.setdefault("errors", []).append({
@@ -54,13 +232,11 @@ class StandardizeStep:
 
         # register intermediate artifact
         ctx.register(output_path)
+        ctx.debug.setdefault("standardize", {}).update({"path": "ffmpeg"})
+        self._to_store(artifact, output_path, ctx)
 
         return Artifact(
             path=output_path,
             mime="audio/wav",
-            meta={
-                "sample_rate": 48000,
-                "channels": 1,
-                "source": artifact.path,
-            }
+            meta=self._standardized_meta(artifact.path, media, self._input_id(artifact)),
         )
\ No newline at end of file
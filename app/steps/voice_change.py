@@ -1,17 +1,45 @@
 from __future__ import annotations
 
+import asyncio
+import hashlib
 import os
 import shutil
+import time
 import wave
 import struct
 import math
+from typing import Any, Optional
 
 from app.core.artifacts import Artifact, TaskContext
-from app.services.providers.elevenlabs import ElevenLabsVoiceChangerHTTP, ElevenLabsProviderError
-from app.services.providers.funny_voice import FunnyVoiceProvider
+from app.core.cancellation import TaskCancelled, await_cancellable
+from app.core.executors import get_executor
+from app.core.pipeline import FfmpegStage
+from app.services import chunking
+from app.services.ffmpeg import is_available as ffmpeg_available
+from app.services.providers.base import ProviderError
+from app.services.providers.registry import get_provider_registry
+from app.services.result_cache import cache_key
+from app.services.singleflight import get_singleflight, singleflight_enabled
 
 
 class VoiceChangeStep:
+    """
+    Converts the standardized input with the provider the registry routes ctx.voice_id to
+    (app/services/providers/registry.py). Optional provider hooks, checked by duck typing:
+
+    - can_fuse() + ffmpeg_filters(voice_id) + effect_meta(voice_id): pure ffmpeg filter
+      chains that can join a fused ffmpeg run
+    - render_wav(voice_id, in_path, out_path): local renderer usable on chunks in parallel
+    - convert_segmented(...): remote provider that splits long inputs itself
+    - supports_async + aconvert(...): network-bound provider awaited by arun() on the event loop
+    - error_fallback: "copy_input" (default) or "synthesize" when the conversion raises ProviderError
+
+    Unfused conversions go through the singleflight layer (app/services/singleflight.py): an
+    identical conversion already in flight here or in another worker is awaited and its output
+    reused instead of calling the provider again. Fused ffmpeg stages are coalesced by the
+    Pipeline in the same way.
+    """
+
     name = "voice_change"
 
     def _synthesize_wav(self, path: str, duration_sec: float = 1.0, sr: int = 16000) -> None:
@@ -26,110 +54,264 @@ class VoiceChangeStep:
                 v = int(ampl * math.sin(2 * math.pi * freq * (i / sr)))
                 w.writeframes(struct.pack("<h", v))
 
-    def _run_funny_voice(
-        self, 
-        artifact: Artifact, 
-        ctx: TaskContext, 
-        input_path: str, 
-        converted_path: str,
-        fallback_dur: float
-    ) -> Artifact:
-        """使用本地搞怪音色处理"""
-        input_missing = not input_path or not os.path.isfile(input_path)
-        
-        if input_missing:
-            # 没有输入文件，生成一个占位音频
-            self._synthesize_wav(converted_path, duration_sec=fallback_dur)
-            ctx.register(converted_path)
-            meta = dict(artifact.meta or {})
-            meta.update({
-                "provider": "funny_voice",
-                "provider_status": "no_input",
-                "note": "No input file provided, generated placeholder.",
-            })
-            ctx.debug.setdefault("provider", {})
-            ctx.debug["provider"].update({
-                "name": "funny_voice",
-                "status": "no_input",
-            })
-            return Artifact(path=converted_path, mime="audio/wav", meta=meta)
-        
+    def _converted(self, artifact: Artifact, ctx: TaskContext, provider_name: str, converted_path: str, result_meta: dict, **debug: Any) -> Artifact:
+        """Artifact + ctx.debug["provider"] for a successful conversion."""
+        ctx.register(converted_path)
+        meta = dict(artifact.meta or {})
+        meta.update(result_meta or {})
+        meta.update({
+            "provider": provider_name,
+            "provider_status": "ok",
+            "converted_path": converted_path,
+        })
+        info = {"name": provider_name, "status": "ok"}
+        for key in ("effect", "backend"):
+            if (result_meta or {}).get(key) is not None:
+                info[key] = result_meta[key]
+        info.update(debug)
+        ctx.debug.setdefault("provider", {})
+        ctx.debug["provider"].update(info)
+        return Artifact(path=converted_path, mime="audio/wav", meta=meta)
+
+    def _store(self, result: Any, converted_path: str) -> None:
+        """Providers stream to out_path themselves (result.path); older ones still return audio_bytes."""
+        path = getattr(result, "path", None)
+        if path and os.path.abspath(path) == os.path.abspath(converted_path):
+            return
+        if path:
+            shutil.copyfile(path, converted_path)
+            return
+        with open(converted_path, "wb") as f:
+            f.write(result.audio_bytes)
+
+    def _use_chunking(self, ctx: TaskContext) -> bool:
+        """options.chunking forces chunked mode on/off; otherwise long inputs (VC_CHUNK_MIN_SEC) opt in."""
+        opts = ctx.options if isinstance(ctx.options, dict) else {}
+        if opts.get("chunking") is not None:
+            return bool(opts.get("chunking"))
+        min_sec = chunking.auto_chunk_min_seconds()
+        if not min_sec:
+            return False
+        duration = (ctx.debug.get("probe") or {}).get("duration_sec")
+        if duration is None:
+            duration = (ctx.debug.get("input_media") or {}).get("duration_seconds")
+        return duration is not None and float(duration) >= min_sec
+
+    def _run_chunked_local(self, artifact: Artifact, ctx: TaskContext, provider_name: str, provider: Any, input_path: str, converted_path: str) -> Artifact:
+        """Render the effect on silence-aligned segments in parallel, then crossfade them back together."""
+        backends = set()
+
+        def _render(seg_in: str, seg_out: str) -> None:
+            backends.add(provider.render_wav(ctx.voice_id, seg_in, seg_out))
+
+        chunk_meta = chunking.run_chunked(input_path, converted_path, ctx.path("chunks"), _render)
+        result_meta = dict(provider.effect_meta(ctx.voice_id)) if hasattr(provider, "effect_meta") else {}
+        result_meta["chunking"] = chunk_meta
+        ctx.debug["chunking"] = chunk_meta
+        converted = self._converted(artifact, ctx, provider_name, converted_path, result_meta, chunked=True)
+        ctx.debug["provider"]["backend"] = ",".join(sorted(backends))
+        return converted
+
+    def _force_passthrough(self, ctx: TaskContext) -> bool:
         try:
-            provider = FunnyVoiceProvider()
-            result = provider.convert(
-                voice_id=ctx.voice_id,
-                audio_path=input_path,
-                output_format="wav",
-            )
-            
-            with open(converted_path, "wb") as f:
-                f.write(result.audio_bytes)
-            
-            ctx.register(converted_path)
-            
-            meta = dict(artifact.meta or {})
-            meta.update(result.meta or {})
+            opts = ctx.options or {}
+            demo = opts.get("demo") if isinstance(opts, dict) else None
+            return bool(isinstance(demo, dict) and demo.get("force_passthrough"))
+        except Exception:
+            return False
+
+    def ffmpeg_stage(self, artifact: Artifact, ctx: TaskContext) -> Optional[FfmpegStage]:
+        """Filter-chain providers (funny voices) can join a fused run."""
+        if self._force_passthrough(ctx):
+            return None
+        routed = get_provider_registry().route(ctx.voice_id)
+        if routed is None:
+            return None
+        provider_name, provider = routed
+        can_fuse = getattr(provider, "can_fuse", None)
+        if can_fuse is None or not can_fuse():
+            # Remote providers, or the in-process DSP backend which renders from the standardized WAV.
+            return None
+        if not artifact.path or not os.path.isfile(artifact.path) or not ffmpeg_available():
+            return None
+        if self._use_chunking(ctx):
+            # Chunked mode needs the standardized WAV on disk to split it.
+            return None
+
+        effect_meta = provider.effect_meta(ctx.voice_id)
+        started = time.perf_counter()
+
+        def _finalize(fused: Artifact, ctx: TaskContext) -> Artifact:
+            get_provider_registry().record(provider_name, True, time.perf_counter() - started)
+            meta = dict(fused.meta or {})
+            meta.update(effect_meta)
             meta.update({
-                "provider": "funny_voice",
+                "provider": provider_name,
                 "provider_status": "ok",
-                "converted_path": converted_path,
             })
             ctx.debug.setdefault("provider", {})
             ctx.debug["provider"].update({
-                "name": "funny_voice", 
+                "name": provider_name,
                 "status": "ok",
-                "effect": result.meta.get("effect", ctx.voice_id),
+                "effect": effect_meta.get("effect", ctx.voice_id),
+                "backend": "ffmpeg",
+                "fused": True,
             })
-            
-            return Artifact(path=converted_path, mime="audio/wav", meta=meta)
-            
-        except Exception as e:
-            # 出错时直接复制原文件
+            return Artifact(path=fused.path, mime=fused.mime, meta=meta)
+
+        return FfmpegStage(
+            filters=provider.ffmpeg_filters(ctx.voice_id),
+            output_name="converted.wav",
+            output_format="wav",
+            mime="audio/wav",
+            timeout_sec=120,
+            finalize=_finalize,
+        )
+
+    def _convert_kwargs(self, ctx: TaskContext, converted_path: str) -> dict:
+        opts = ctx.options or {}
+        remove_bg = opts.get("remove_background_noise")
+        if remove_bg is None:
+            remove_bg = opts.get("remove_noise")
+        return dict(
+            voice_id=ctx.voice_id,
+            model_id=getattr(ctx, "model_id", None),
+            stability=ctx.stability,
+            similarity=ctx.similarity,
+            remove_background_noise=remove_bg if remove_bg is not None else None,
+            extra=None,
+            out_path=converted_path,
+        )
+
+    def _flight_key(self, artifact: Artifact, ctx: TaskContext, provider_name: str, input_path: str) -> Optional[str]:
+        """Input content hash + everything that changes the provider's output."""
+        if not singleflight_enabled():
+            return None
+        meta = artifact.meta or {}
+        content = meta.get("input_id") or meta.get("sha256") or (ctx.debug.get("standardize") or {}).get("input_id")
+        if not content:
+            # Standardize didn't run (or had no upload hash): hash the file. arun() calls this off the loop.
+            digest = hashlib.sha256()
+            with open(input_path, "rb") as f:
+                for block in iter(lambda: f.read(1024 * 1024), b""):
+                    digest.update(block)
+            content = digest.hexdigest()
+        params = self._convert_kwargs(ctx, "")
+        params.pop("out_path", None)
+        params.update({"provider": provider_name, "chunking": self._use_chunking(ctx)})
+        return cache_key(str(content), params)
+
+    def _convert(self, artifact: Artifact, ctx: TaskContext, provider_name: str, provider: Any, input_path: str, converted_path: str) -> Artifact:
+        kwargs = self._convert_kwargs(ctx, converted_path)
+
+        if self._use_chunking(ctx):
+            if hasattr(provider, "render_wav") and ffmpeg_available():
+                try:
+                    return self._run_chunked_local(artifact, ctx, provider_name, provider, input_path, converted_path)
+                except TaskCancelled:
+                    raise
+                except Exception as e:
+                    # Not a PCM WAV (standardize skipped) or a segment failed: render in one pass.
+                    ctx.debug.setdefault("errors", []).append({
+                        "step": self.name,
+                        "error": str(e),
+                        "note": "chunked render failed; falling back to a single ffmpeg run",
+                    })
+            elif hasattr(provider, "convert_segmented"):
+                # Long input: convert pause-aligned segments concurrently and stitch them.
+                result = provider.convert_segmented(audio_path=input_path, **kwargs)
+                self._store(result, converted_path)
+                segments = result.meta.get("segments") or []
+                return self._converted(
+                    artifact, ctx, provider_name, converted_path, result.meta,
+                    segmented=True,
+                    segments=len(segments),
+                    retries=sum(seg.get("retries", 0) for seg in segments),
+                )
+
+        result = provider.convert(audio_path=input_path, output_format="wav", **kwargs)
+        self._store(result, converted_path)
+        return self._converted(artifact, ctx, provider_name, converted_path, result.meta)
+
+    def _failed(self, artifact: Artifact, ctx: TaskContext, provider_name: str, provider: Any, input_path: str, converted_path: str, error: Exception) -> Artifact:
+        """Fallback output after a failed conversion: remote providers synthesize audio, local ones keep the input."""
+        if getattr(provider, "error_fallback", "copy_input") == "synthesize":
+            self._synthesize_wav(converted_path, duration_sec=self._fallback_duration())
+        else:
             shutil.copyfile(input_path, converted_path)
-            ctx.register(converted_path)
-            ctx.debug.setdefault("provider", {})
-            ctx.debug["provider"].update({
-                "name": "funny_voice",
-                "status": "error",
-                "error": str(e),
-            })
-            ctx.debug.setdefault("errors", []).append({
-                "step": self.name,
-                "error": str(e),
-            })
-            meta = dict(artifact.meta or {})
-            meta.update({
-                "provider": "funny_voice",
-                "provider_status": "error_fallback",
-                "note": str(e),
-            })
-            return Artifact(path=converted_path, mime="audio/wav", meta=meta)
+        ctx.register(converted_path)
+        ctx.debug.setdefault("provider", {})
+        ctx.debug["provider"].update({"name": provider_name, "status": "error", "error": str(error)})
+        ctx.debug.setdefault("errors", []).append({"step": self.name, "error": str(error)})
+        meta = dict(artifact.meta or {})
+        meta.update({
+            "provider": provider_name,
+            "provider_status": "error_fallback",
+            "note": str(error),
+        })
+        return Artifact(path=converted_path, mime="audio/wav", meta=meta)
+
+    def _fallback_duration(self) -> float:
+        try:
+            return float(os.getenv("VC_FALLBACK_DURATION", "1.0"))
+        except Exception:
+            return 1.0
+
+    async def arun(self, artifact: Artifact, ctx: TaskContext) -> Artifact:
+        """
+        Pipeline.arun entry point. Providers with aconvert() are awaited on the event loop
+        (an upstream conversion holds no thread while it waits); other providers, and chunked/
+        segmented mode, convert on the pipeline executor. Either way a singleflight follower
+        waits on the loop rather than in an executor thread.
+        """
+        routed = None if self._force_passthrough(ctx) else get_provider_registry().route(ctx.voice_id)
+        input_path = artifact.path
+        if routed is None or not input_path or not os.path.isfile(input_path):
+            return await get_executor("pipeline").run(self.run, artifact, ctx)
+
+        provider_name, provider = routed
+        ctx.ensure_dirs()
+        converted_path = ctx.path("converted.wav")
+        key = await get_executor("singleflight").run(self._flight_key, artifact, ctx, provider_name, input_path)
+        if getattr(provider, "supports_async", False) and not self._use_chunking(ctx):
+            convert = lambda: self._aconvert(artifact, ctx, provider_name, provider, input_path, converted_path)
+        else:
+            convert = lambda: get_executor("pipeline").run(
+                self._convert_recorded, artifact, ctx, provider_name, provider, input_path, converted_path
+            )
+        return await get_singleflight().arun(key, ctx, artifact, converted_path, convert)
+
+    async def _aconvert(self, artifact: Artifact, ctx: TaskContext, provider_name: str, provider: Any, input_path: str, converted_path: str) -> Artifact:
+        registry = get_provider_registry()
+        started = time.perf_counter()
+        try:
+            result = await await_cancellable(
+                provider.aconvert(audio_path=input_path, output_format="wav", **self._convert_kwargs(ctx, converted_path))
+            )
+            self._store(result, converted_path)
+            registry.record(provider_name, True, time.perf_counter() - started)
+            return self._converted(artifact, ctx, provider_name, converted_path, result.meta, transport="async")
+        except (TaskCancelled, asyncio.CancelledError):
+            raise
+        except ProviderError as e:
+            registry.record(provider_name, False, time.perf_counter() - started, str(e))
+            return self._failed(artifact, ctx, provider_name, provider, input_path, converted_path, e)
+        except Exception as e:
+            registry.record(provider_name, False, time.perf_counter() - started, str(e))
+            raise
 
     def run(self, artifact: Artifact, ctx: TaskContext) -> Artifact:
         ctx.ensure_dirs()
 
         input_path = artifact.path
         converted_path = ctx.path("converted.wav")
+        input_missing = not input_path or not os.path.isfile(input_path)
 
-        fallback_dur = 1.0
-        try:
-            fallback_dur = float(os.getenv("VC_FALLBACK_DURATION", "1.0"))
-        except Exception:
-            pass
+        fallback_dur = self._fallback_duration()
 
         # Demo mode: force passthrough for unsupported voice ids so the pipeline still produces
         # a usable output (matching duration) without requiring a real provider.
-        force_passthrough = False
-        try:
-            opts = ctx.options or {}
-            demo = opts.get("demo") if isinstance(opts, dict) else None
-            if isinstance(demo, dict) and demo.get("force_passthrough"):
-                force_passthrough = True
-        except Exception:
-            force_passthrough = False
-
-        if force_passthrough:
-            input_missing = not input_path or not os.path.isfile(input_path)
+        if self._force_passthrough(ctx):
             if input_missing:
                 self._synthesize_wav(converted_path, duration_sec=fallback_dur)
             else:
@@ -147,85 +329,48 @@ class VoiceChangeStep:
             )
             return Artifact(path=converted_path, mime="audio/wav", meta=meta)
 
-        # 检查是否是搞怪音色，优先使用本地处理
-        if FunnyVoiceProvider.is_funny_voice(ctx.voice_id):
-            return self._run_funny_voice(artifact, ctx, input_path, converted_path, fallback_dur)
-
-        # If provider disabled or input missing, synthesize a WAV fallback
-        provider_disabled = not os.getenv("ELEVEN_API_KEY")
-        input_missing = not input_path or not os.path.isfile(input_path)
+        routed = get_provider_registry().route(ctx.voice_id)
 
-        if provider_disabled or input_missing:
+        # No usable provider (e.g. ELEVEN_API_KEY unset) or no input: synthesize/copy a WAV fallback
+        if routed is None or input_missing:
             if input_missing:
                 self._synthesize_wav(converted_path, duration_sec=fallback_dur)
             else:
                 shutil.copyfile(input_path, converted_path)
             ctx.register(converted_path)
 
+            if routed is not None:
+                name, status, note = routed[0], "no_input", "No input; synthesized/used fallback."
+            elif not os.getenv("ELEVEN_API_KEY"):
+                name, status, note = "mock", "disabled_no_api_key", "ELEVEN_API_KEY not set; bypassed voice conversion."
+            else:
+                name, status, note = "mock", "no_provider", f"No provider available for voice {ctx.voice_id!r}; bypassed voice conversion."
             meta = dict(artifact.meta or {})
-            meta.update(
-                {
-                    "provider": "mock" if provider_disabled else "passthrough",
-                    "provider_status": "disabled_no_api_key" if provider_disabled else "no_input",
-                    "note": "ELEVEN_API_KEY not set; bypassed voice conversion." if provider_disabled else "No input; synthesized/used fallback.",
-                }
-            )
+            meta.update({"provider": name, "provider_status": status, "note": note})
             ctx.debug.setdefault("provider", {})
-            ctx.debug["provider"].update({
-                "name": "mock" if provider_disabled else "passthrough",
-                "status": "disabled_no_api_key" if provider_disabled else "no_input",
-            })
+            ctx.debug["provider"].update({"name": name, "status": status})
             return Artifact(path=converted_path, mime="audio/wav", meta=meta)
 
-        # Real provider path
-        try:
-            provider = ElevenLabsVoiceChangerHTTP()
-            opts = ctx.options or {}
-            remove_bg = opts.get("remove_background_noise")
-            if remove_bg is None:
-                remove_bg = opts.get("remove_noise")
-
-            result = provider.convert(
-                voice_id=ctx.voice_id,
-                audio_path=input_path,
-                model_id=getattr(ctx, "model_id", None),
-                stability=ctx.stability,
-                similarity=ctx.similarity,
-                output_format="wav",
-                remove_background_noise=remove_bg if remove_bg is not None else None,
-                extra=None,
-            )
-
-            with open(converted_path, "wb") as f:
-                f.write(result.audio_bytes)
-
-            ctx.register(converted_path)
-
-            meta = dict(artifact.meta or {})
-            meta.update(result.meta or {})
-            meta.update(
-                {
-                    "provider": "elevenlabs",
-                    "provider_status": "ok",
-                    "converted_path": converted_path,
-                }
-            )
-            ctx.debug.setdefault("provider", {})
-            ctx.debug["provider"].update({"name": "elevenlabs", "status": "ok"})
-
-            return Artifact(path=converted_path, mime="audio/wav", meta=meta)
+        provider_name, provider = routed
+        return get_singleflight().run(
+            self._flight_key(artifact, ctx, provider_name, input_path), ctx, artifact, converted_path,
+            lambda: self._convert_recorded(artifact, ctx, provider_name, provider, input_path, converted_path),
+        )
 
-        except ElevenLabsProviderError as e:
-            # Fallback to synthesized audio on provider error
-            self._synthesize_wav(converted_path, duration_sec=fallback_dur)
-            ctx.register(converted_path)
-            ctx.debug.setdefault("provider", {})
-            ctx.debug["provider"].update({"name": "elevenlabs", "status": "error", "error": str(e)})
-            ctx.debug.setdefault("errors", []).append({"step": self.name, "error": str(e)})
-            meta = dict(artifact.meta or {})
-            meta.update({
-                "provider": "elevenlabs",
-                "provider_status": "error_fallback",
-                "note": str(e),
-            })
-            return Artifact(path=converted_path, mime="audio/wav", meta=meta)
\ No newline at end of file
+    def _convert_recorded(self, artifact: Artifact, ctx: TaskContext, provider_name: str, provider: Any, input_path: str, converted_path: str) -> Artifact:
+        """_convert() with registry health/latency accounting and the error fallback for ProviderError."""
+        registry = get_provider_registry()
+        started = time.perf_counter()
+        try:
+            converted = self._convert(artifact, ctx, provider_name, provider, input_path, converted_path)
+            registry.record(provider_name, True, time.perf_counter() - started)
+            return converted
+        except TaskCancelled:
+            raise
+        except ProviderError as e:
+            registry.record(provider_name, False, time.perf_counter() - started, str(e))
+            return self._failed(artifact, ctx, provider_name, provider, input_path, converted_path, e)
+        except Exception as e:
+            # A bug or an unexpected failure: fail the task rather than hide it behind a fallback.
+            registry.record(provider_name, False, time.perf_counter() - started, str(e))
+            raise
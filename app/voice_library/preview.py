@@ -8,6 +8,7 @@ from typing import Optional
 
 from app.config.settings import OUTPUTS_DIR
 from app.services.providers.funny_voice import FunnyVoiceProvider
+from app.services.providers.registry import get_provider_registry
 from app.voice_library.user_voices import get_user_voices_by_ids
 
 
@@ -109,12 +110,9 @@ def ensure_preview_mp3(*, voice_id: str, user_id: Optional[str]) -> str:
 
     ref = _ensure_ref_wav()
 
-    provider = FunnyVoiceProvider()
-    result = provider.convert(voice_id=resolved.effect_voice_id, audio_path=ref, output_format="mp3")
-
+    provider = get_provider_registry().get("funny_voice") or FunnyVoiceProvider()
     tmp_path = out_path + ".tmp"
-    with open(tmp_path, "wb") as f:
-        f.write(result.audio_bytes)
+    provider.convert(voice_id=resolved.effect_voice_id, audio_path=ref, output_format="mp3", out_path=tmp_path)
 
     os.replace(tmp_path, out_path)
     return out_path
@@ -22,7 +22,8 @@ except Exception:  # pragma: no cover
     redis_async = None
 
 
-def _redis_url() -> Optional[str]:
+def redis_url() -> Optional[str]:
+    """Redis server for shared state (also used by app/services/singleflight.py for its locks)."""
     return (
         os.getenv("VOICE_LIBRARY_REDIS_URL")
         or os.getenv("REDIS_URL")
@@ -190,7 +191,7 @@ def get_voice_library_state() -> VoiceLibraryState:
 
     local = LocalState(_cache=TTLCache())
 
-    url = _redis_url()
+    url = redis_url()
     if url and redis_async is not None and not url.startswith("http"):
         try:
             primary = RedisState(url)
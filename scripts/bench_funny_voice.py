@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+"""
+Real-time factor of the funny-voice backends (ffmpeg filter chain vs app.services.dsp).
+
+RTF = processing wall time / audio duration (lower is better). Both paths go file to file
+(standardized 48kHz mono WAV in, WAV out), so the ffmpeg numbers include the process spawn.
+
+Usage:
+  python scripts/bench_funny_voice.py [--seconds 5 30 120] [--repeat 3]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.ffmpeg import is_available as ffmpeg_available
+from app.services.pcm import write_wav
+from app.services.providers.funny_voice import FunnyVoiceProvider
+
+
+def make_input(path: str, seconds: float, sr: int) -> None:
+    n = int(sr * seconds)
+    t = np.arange(n) / sr
+    f0 = 140.0 + 30.0 * np.sin(2 * np.pi * 0.7 * t)
+    phase = 2 * np.pi * np.cumsum(f0) / sr
+    x = sum(np.sin(k * phase) / k for k in range(1, 30)) * 0.1
+    x *= 0.3 + 0.7 * (np.sin(2 * np.pi * 2.0 * t) > 0)
+    write_wav(path, x, sr)
+
+
+def best_of(repeat: int, fn) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=float, nargs="+", default=[5.0, 30.0, 120.0])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    provider = FunnyVoiceProvider()
+    sr = FunnyVoiceProvider.SAMPLE_RATE
+    has_ffmpeg = ffmpeg_available()
+
+    print(f"{'voice':12s} {'seconds':>8s} {'ffmpeg RTF':>11s} {'numpy RTF':>10s} {'speedup':>8s}")
+    with tempfile.TemporaryDirectory() as d:
+        for seconds in args.seconds:
+            src = os.path.join(d, f"in_{seconds:g}.wav")
+            out = os.path.join(d, "out.wav")
+            make_input(src, seconds, sr)
+            for voice_id in FunnyVoiceProvider.SUPPORTED_VOICES:
+                os.environ["VC_FUNNY_VOICE_BACKEND"] = "numpy"
+                numpy_sec = best_of(args.repeat, lambda: provider.render_wav(voice_id, src, out))
+                ffmpeg_cell, speedup_cell = "-", "-"
+                if has_ffmpeg:
+                    ffmpeg_sec = best_of(args.repeat, lambda: provider._render_ffmpeg(voice_id, src, out))
+                    ffmpeg_cell = f"{ffmpeg_sec / seconds:.4f}"
+                    speedup_cell = f"{ffmpeg_sec / numpy_sec:.2f}x"
+                print(f"{voice_id:12s} {seconds:8g} {ffmpeg_cell:>11s} {numpy_sec / seconds:10.4f} {speedup_cell:>8s}")
+
+
+if __name__ == "__main__":
+    main()
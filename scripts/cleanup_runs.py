@@ -7,6 +7,9 @@ from typing import List, Tuple
 import uuid as _uuid
 
 from app.config.settings import RUNS_BASE_DIR, OUTPUTS_DIR
+from app.services import input_store
+from app.services.audio_formats import OUTPUT_FORMATS
+from app.services.result_cache import CACHE_DIR, cache_max_bytes, cache_ttl_seconds, evict as evict_result_cache
 
 
 def _iter_old_paths(base_dir: str, older_than_seconds: int) -> List[Tuple[str, float]]:
@@ -45,7 +48,14 @@ def _rm_file(path: str) -> None:
         pass
 
 
-def cleanup(older_than_seconds: int, apply: bool, runs_only: bool = False, outputs_only: bool = False) -> None:
+def cleanup(
+    older_than_seconds: int,
+    apply: bool,
+    runs_only: bool = False,
+    outputs_only: bool = False,
+    cache_budget_bytes: int | None = None,
+    cache_max_age_seconds: int | None = None,
+) -> None:
     print(f"[cleanup] RUNS_BASE_DIR={RUNS_BASE_DIR}")
     print(f"[cleanup] OUTPUTS_DIR={OUTPUTS_DIR}")
     print(f"[cleanup] older_than_seconds={older_than_seconds} apply={apply} runs_only={runs_only} outputs_only={outputs_only}")
@@ -74,7 +84,7 @@ def cleanup(older_than_seconds: int, apply: bool, runs_only: bool = False, outpu
         if skipped_runs:
             print(f"[cleanup] skipped non-UUID dirs under runs: {skipped_runs}")
 
-    # 2) cleanup outputs files (mp3/wav)
+    # 2) cleanup outputs files (every export format)
     if not runs_only:
         old_outs = _iter_old_paths(OUTPUTS_DIR, older_than_seconds)
         out_files = []
@@ -82,7 +92,7 @@ def cleanup(older_than_seconds: int, apply: bool, runs_only: bool = False, outpu
             if os.path.isfile(p):
                 ext = os.path.splitext(p)[1].lower()
                 # Only consider typical audio outputs to avoid accidental deletes
-                if ext in {".wav", ".mp3"}:
+                if ext in {f".{fmt}" for fmt in OUTPUT_FORMATS}:
                     out_files.append((p, m))
         if out_files:
             print(f"[cleanup] candidates: {len(out_files)} output files")
@@ -93,6 +103,25 @@ def cleanup(older_than_seconds: int, apply: bool, runs_only: bool = False, outpu
             if apply:
                 _rm_file(path)
 
+    # 3) result cache index (runs/result_cache): drop entries whose output is gone,
+    #    expire by age and enforce the byte budget (evicting the cached outputs too)
+    if not runs_only:
+        max_bytes = cache_max_bytes() if cache_budget_bytes is None else cache_budget_bytes
+        max_age = cache_ttl_seconds() if cache_max_age_seconds is None else cache_max_age_seconds
+        print(f"[cleanup] CACHE_DIR={CACHE_DIR} max_bytes={max_bytes} max_age_seconds={max_age}")
+        for reason, path in evict_result_cache(max_bytes=max_bytes, max_age_seconds=max_age, apply=apply):
+            print(f"  - CACHE entry: {path}  reason={reason}")
+
+    # 4) standardized-input store (runs/inputs): TTL + byte budget
+    if not outputs_only:
+        print(f"[cleanup] INPUT_STORE_DIR={input_store.STORE_DIR}")
+        for reason, path in input_store.evict(
+            max_bytes=input_store.store_max_bytes(),
+            max_age_seconds=input_store.store_ttl_seconds(),
+            apply=apply,
+        ):
+            print(f"  - INPUT entry: {path}  reason={reason}")
+
     print("[cleanup] done")
 
 
@@ -103,6 +132,8 @@ def main() -> None:
     group = parser.add_mutually_exclusive_group()
     group.add_argument("--runs-only", action="store_true", help="Only clean runs directories.")
     group.add_argument("--outputs-only", action="store_true", help="Only clean outputs files.")
+    parser.add_argument("--cache-max-mb", type=float, default=None, help="Result cache budget in MB (default: VC_RESULT_CACHE_MAX_BYTES).")
+    parser.add_argument("--cache-max-age-hours", type=float, default=None, help="Evict cache entries unused for N hours (default: VC_RESULT_CACHE_TTL_SEC).")
     args = parser.parse_args()
 
     older_than_seconds = int(args.older_than_hours * 3600)
@@ -111,6 +142,8 @@ def main() -> None:
         apply=args.apply,
         runs_only=getattr(args, "runs_only", False),
         outputs_only=getattr(args, "outputs_only", False),
+        cache_budget_bytes=int(args.cache_max_mb * 1024 * 1024) if args.cache_max_mb is not None else None,
+        cache_max_age_seconds=int(args.cache_max_age_hours * 3600) if args.cache_max_age_hours is not None else None,
     )
 
 
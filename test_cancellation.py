@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""Checks for task cancellation (app/core/cancellation.py): deadline, pipeline, ffmpeg, API, async jobs.
+
+Usage:
+  python test_cancellation.py
+"""
+
+from __future__ import annotations
+
+import atexit
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+
+from fastapi.testclient import TestClient
+
+import app.api.routes as routes
+from app.core import metrics
+from app.core.artifacts import Artifact, TaskContext
+from app.core.cancellation import DEADLINE_EXCEEDED, CancelToken, TaskCancelled, cancellable_sleep, use_token
+from app.core.jobs import async_workers, get_job_runner
+from app.core.pipeline import Pipeline
+from app.main import app
+from app.services import ffmpeg
+from app.services import input_store
+from app.services import singleflight as sf_mod
+from app.services.ffmpeg import FfmpegLimiter
+
+
+# Keep the state these checks leave behind out of the real runs/ tree.
+_SCRATCH_DIR = tempfile.mkdtemp(prefix="vc_test_")
+atexit.register(shutil.rmtree, _SCRATCH_DIR, True)
+metrics.METRICS_DIR = os.path.join(_SCRATCH_DIR, "metrics")
+sf_mod.SF_DIR = os.path.join(_SCRATCH_DIR, "singleflight")
+input_store.STORE_DIR = os.path.join(_SCRATCH_DIR, "inputs")
+
+
+class _SleepStep:
+    name = "sleep"
+
+    def __init__(self, seconds: float) -> None:
+        self.seconds = seconds
+        self.runs = 0
+
+    def run(self, artifact: Artifact, ctx: TaskContext) -> Artifact:
+        self.runs += 1
+        time.sleep(self.seconds)
+        return artifact
+
+
+def _ctx(d: str) -> TaskContext:
+    return TaskContext(task_id="t", task_dir=d, voice_id="anime_uncle", stability=5, similarity=5, output_format="wav")
+
+
+def test_deadline_stops_pipeline_between_steps() -> None:
+    with tempfile.TemporaryDirectory() as d:
+        ctx = _ctx(d)
+        ctx.cancel_token.set_deadline(0.05)
+        first, second = _SleepStep(0.1), _SleepStep(0.0)
+        try:
+            Pipeline([first, second]).run(Artifact(path=""), ctx)
+            raise AssertionError("expected TaskCancelled")
+        except TaskCancelled as e:
+            assert e.reason == DEADLINE_EXCEEDED
+        assert (first.runs, second.runs) == (1, 0)
+        assert ctx.debug["cancelled"] == {"reason": DEADLINE_EXCEEDED}
+
+
+def test_cancellable_sleep_wakes_up() -> None:
+    token = CancelToken()
+    threading.Timer(0.05, token.cancel, args=("test",)).start()
+    started = time.perf_counter()
+    with use_token(token):
+        try:
+            cancellable_sleep(5.0)
+            raise AssertionError("expected TaskCancelled")
+        except TaskCancelled as e:
+            assert e.reason == "test"
+    assert time.perf_counter() - started < 1.0
+
+
+def test_slot_wait_is_cancellable() -> None:
+    limiter = FfmpegLimiter(1)
+    limiter.acquire()
+    token = CancelToken(deadline_sec=0.05)
+    try:
+        limiter.acquire(token)
+        raise AssertionError("expected TaskCancelled")
+    except TaskCancelled:
+        pass
+    limiter.release()
+    assert limiter.stats()["running"] == 0 and limiter.stats()["queued"] == 0
+
+
+def test_cancel_kills_ffmpeg() -> None:
+    if not shutil.which("ffmpeg"):
+        print("SKIP: ffmpeg not available")
+        return
+    with tempfile.TemporaryDirectory() as d:
+        token = CancelToken()
+        threading.Timer(0.3, token.cancel, args=("test",)).start()
+        started = time.perf_counter()
+        with use_token(token):
+            try:
+                # -re paces decoding at real time, so this would run for 30s.
+                ffmpeg._run(
+                    ["ffmpeg", "-y", "-hide_banner", "-loglevel", "error", "-re", "-f", "lavfi",
+                     "-i", "sine=duration=30", os.path.join(d, "slow.wav")],
+                    60,
+                )
+                raise AssertionError("expected TaskCancelled")
+            except TaskCancelled:
+                pass
+        assert time.perf_counter() - started < 3.0
+        leftover = subprocess.run(["pgrep", "-f", os.path.join(d, "slow.wav")], capture_output=True)
+        assert leftover.returncode != 0, leftover.stdout
+
+
+def test_api_deadline_returns_504() -> None:
+    original = routes.StandardizeStep
+    routes.StandardizeStep = lambda: _SleepStep(0.2)  # type: ignore[assignment]
+    try:
+        client = TestClient(app)
+        resp = client.post("/voice-changer", json={
+            "voice_id": "anime_uncle",
+            "stability": 5,
+            "similarity": 5,
+            "output_format": "wav",
+            "options": {"deadline_ms": 50},
+        })
+        assert resp.status_code == 504, resp.text
+        bad = client.post("/voice-changer", json={
+            "voice_id": "anime_uncle",
+            "stability": 5,
+            "similarity": 5,
+            "output_format": "wav",
+            "options": {"deadline_ms": "soon"},
+        })
+        assert bad.status_code == 400, bad.text
+    finally:
+        routes.StandardizeStep = original  # type: ignore[assignment]
+
+
+def test_async_job_deadline_starts_at_pickup() -> None:
+    # Keep every job worker busy for longer than the deadline: queue time must not count against it.
+    release = threading.Event()
+    for _ in range(async_workers()):
+        get_job_runner().submit(str(uuid.uuid4()), lambda: release.wait(5), on_success=lambda _: {})
+    original = routes.StandardizeStep
+    routes.StandardizeStep = lambda: _SleepStep(0.05)  # type: ignore[assignment]
+    try:
+        client = TestClient(app)
+        resp = client.post("/voice-changer", json={
+            "voice_id": "anime_uncle",
+            "stability": 5,
+            "similarity": 5,
+            "output_format": "wav",
+            "options": {"async": True, "deadline_ms": 300, "cache": False},
+        })
+        assert resp.status_code == 202, resp.text
+        time.sleep(0.5)
+        release.set()
+        deadline = time.time() + 10
+        while True:
+            info = client.get(resp.json()["meta"]["status_url"]).json()
+            if info["status"] in ("success", "failed") or time.time() > deadline:
+                break
+            time.sleep(0.05)
+        assert info["status"] == "success", info
+    finally:
+        release.set()
+        routes.StandardizeStep = original  # type: ignore[assignment]
+
+
+def main() -> None:
+    test_deadline_stops_pipeline_between_steps()
+    test_cancellable_sleep_wakes_up()
+    test_slot_wait_is_cancellable()
+    test_cancel_kills_ffmpeg()
+    test_api_deadline_returns_504()
+    test_async_job_deadline_starts_at_pickup()
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""Checks for chunked rendering (app/services/chunking.py): split points land in pauses, crossfade
+stitching reassembles an unchanged signal, and a failed segment cleans up only after the others stop.
+
+Usage:
+  python test_chunking.py
+"""
+
+from __future__ import annotations
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from app.core.executors import get_executor
+from app.services.chunking import find_split_points, plan_segments, run_chunked, stitch
+from app.services.pcm import read_wav, write_wav
+
+SR = 16000
+
+
+def _speech_like(seconds: float, pauses_sec: list) -> np.ndarray:
+    """A tone with 200 ms silences at pauses_sec."""
+    t = np.arange(int(seconds * SR)) / SR
+    samples = (0.5 * np.sin(2 * np.pi * 220 * t)).astype(np.float32)
+    for p in pauses_sec:
+        samples[int(p * SR):int((p + 0.2) * SR)] = 0.0
+    return samples
+
+
+def test_split_points_land_in_pauses() -> None:
+    samples = _speech_like(20.0, [4.6, 11.3])
+    points = find_split_points(samples, SR, target_sec=5.0, search_sec=1.0)
+    assert points and abs(points[0] / SR - 4.7) < 0.15, [p / SR for p in points]
+    assert find_split_points(samples[: 7 * SR], SR, target_sec=5.0, search_sec=1.0) == []  # short: one segment
+
+    segments = plan_segments(len(samples), points, preroll=100, overlap=50)
+    assert segments[0].read_start == 0 and segments[-1].read_end == len(samples)
+    for a, b in zip(segments, segments[1:]):
+        assert a.end == b.start and a.read_end == a.end + 50 and b.read_start == b.start - 100
+
+
+def test_stitch_identity_render() -> None:
+    samples = _speech_like(6.0, [])
+    n, overlap = len(samples), 160
+    segments = plan_segments(n, [2 * SR, 4 * SR], preroll=400, overlap=overlap)
+    rendered = [samples[s.read_start:s.read_end] for s in segments]
+    out = stitch(rendered, segments, overlap=overlap)
+    assert out.shape[0] == n
+    # Equal-power crossfades of identical, aligned copies stay within sqrt(2) of the input.
+    assert float(np.max(np.abs(out - samples))) < 0.5 * (np.sqrt(2) - 1) + 1e-3
+    outside = np.ones(n, dtype=bool)
+    for s in segments[1:]:
+        outside[s.start:s.start + overlap] = False
+    assert np.allclose(out[outside], samples[outside], atol=1e-6)
+
+
+def test_run_chunked_roundtrip() -> None:
+    with tempfile.TemporaryDirectory() as d:
+        src, dst = os.path.join(d, "in.wav"), os.path.join(d, "out.wav")
+        write_wav(src, _speech_like(12.0, [4.8, 9.6]), SR)
+        meta = run_chunked(src, dst, os.path.join(d, "chunks"), shutil.copyfile, target_sec=5.0)
+        out, sr = read_wav(dst)
+        original, _ = read_wav(src)
+        assert sr == SR and out.shape == original.shape and meta["segments"] == 2, meta
+        assert not os.path.exists(os.path.join(d, "chunks"))
+
+
+def test_failed_segment_waits_for_the_others() -> None:
+    with tempfile.TemporaryDirectory() as d:
+        src, work_dir = os.path.join(d, "in.wav"), os.path.join(d, "chunks")
+        write_wav(src, _speech_like(30.0, []), SR)
+        started, finished = [], []
+        lock = threading.Lock()
+
+        def _render(seg_in: str, seg_out: str) -> None:
+            with lock:
+                started.append(seg_in)
+            if seg_in.endswith("seg_0000.wav"):
+                raise RuntimeError("segment failed")
+            time.sleep(0.2)
+            shutil.copyfile(seg_in, seg_out)  # would fail if work_dir were already gone
+            with lock:
+                finished.append(seg_in)
+
+        executor = get_executor("chunks_test", max_workers=2)
+        try:
+            run_chunked(src, os.path.join(d, "out.wav"), work_dir, _render, target_sec=5.0, executor_name="chunks_test")
+            raise AssertionError("expected RuntimeError")
+        except RuntimeError as e:
+            assert str(e) == "segment failed"
+        # Running segments were awaited (and completed) before the cleanup; queued ones never started.
+        assert not os.path.exists(work_dir)
+        assert len(finished) == len(started) - 1 and len(started) < 6, (started, finished)
+        stats = executor.stats()
+        assert stats["queued"] == 0 and stats["running"] == 0, stats
+
+
+def main() -> None:
+    test_split_points_land_in_pauses()
+    test_stitch_identity_render()
+    test_run_chunked_roundtrip()
+    test_failed_segment_waits_for_the_others()
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
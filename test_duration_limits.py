@@ -1,7 +1,8 @@
 #!/usr/bin/env python3
-"""Minimal self-contained checks for upload duration limits.
+"""Minimal self-contained checks for upload duration limits (and for the input store lookup
+that can skip the probe staying off the event loop).
 
-Runs without pytest: uses FastAPI TestClient and monkeypatches duration probing.
+Runs without pytest: uses FastAPI TestClient and monkeypatches media probing.
 
 Expected behavior (defaults):
 - duration <= 5s  -> 400
@@ -14,24 +15,45 @@ Usage:
 
 from __future__ import annotations
 
+import atexit
+import hashlib
 import io
 import json
-from typing import Optional
+import os
+import shutil
+import tempfile
+import threading
+from typing import List, Optional
 
 from fastapi.testclient import TestClient
 
 import app.api.routes as routes
+from app.core import metrics
 from app.main import app
+from app.services import input_store
+from app.services import singleflight as sf_mod
+from app.services.media_probe import MediaInfo
+
+
+# Keep the state these checks leave behind out of the real runs/ tree.
+_SCRATCH_DIR = tempfile.mkdtemp(prefix="vc_test_")
+atexit.register(shutil.rmtree, _SCRATCH_DIR, True)
+metrics.METRICS_DIR = os.path.join(_SCRATCH_DIR, "metrics")
+sf_mod.SF_DIR = os.path.join(_SCRATCH_DIR, "singleflight")
+input_store.STORE_DIR = os.path.join(_SCRATCH_DIR, "inputs")
+
+
+_FAKE_WAV = b"RIFF....WAVE"
 
 
 def _post_with_fake_wav(duration_sec: Optional[float]) -> int:
-    """Post multipart request while patching probe_duration_seconds to return duration_sec."""
+    """Post multipart request while patching probe_media to report duration_sec."""
 
-    def _fake_probe(_path: str, timeout_sec: int = 10) -> Optional[float]:
-        return duration_sec
+    def _fake_probe(_path: str, timeout_sec: int = 10) -> MediaInfo:
+        return MediaInfo(duration_sec=duration_sec)
 
-    original = routes.probe_duration_seconds
-    routes.probe_duration_seconds = _fake_probe  # type: ignore[assignment]
+    original = routes.probe_media
+    routes.probe_media = _fake_probe  # type: ignore[assignment]
     try:
         client = TestClient(app)
         payload = {
@@ -44,12 +66,33 @@ def _post_with_fake_wav(duration_sec: Optional[float]) -> int:
             "options": {},
         }
         files = {
-            "file": ("test.wav", io.BytesIO(b"RIFF....WAVE"), "audio/wav"),
+            "file": ("test.wav", io.BytesIO(_FAKE_WAV), "audio/wav"),
         }
         resp = client.post("/voice-changer", files=files, data={"payload": json.dumps(payload)})
         return resp.status_code
     finally:
-        routes.probe_duration_seconds = original  # type: ignore[assignment]
+        routes.probe_media = original  # type: ignore[assignment]
+
+
+def _check_store_lookups_off_loop() -> bool:
+    """Every input store lookup an upload triggers runs on an executor thread, not on the event loop."""
+    sha = hashlib.sha256(_FAKE_WAV).hexdigest()
+    threads: List[str] = []
+    original = input_store.get
+
+    def _recording_get(input_id: str):
+        if input_id == sha:
+            threads.append(threading.current_thread().name)
+        return original(input_id)
+
+    input_store.get = _recording_get  # type: ignore[assignment]
+    try:
+        status = _post_with_fake_wav(12.0)
+    finally:
+        input_store.get = original  # type: ignore[assignment]
+    ok = status == 200 and bool(threads) and all(name.startswith("vc-") for name in threads)
+    print(f"input store lookups -> status={status}, threads={sorted(set(threads))} {'OK' if ok else 'FAIL'}")
+    return ok
 
 
 def main() -> None:
@@ -71,6 +114,9 @@ def main() -> None:
         if not ok:
             failures += 1
 
+    if not _check_store_lookups_off_loop():
+        failures += 1
+
     if failures:
         raise SystemExit(1)
 
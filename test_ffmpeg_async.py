@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""Checks for the asyncio ffmpeg API and the global concurrency limiter (app/services/ffmpeg.py).
+
+Usage:
+  python test_ffmpeg_async.py
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from app.core.cancellation import CancelToken, TaskCancelled, use_token
+from app.services import ffmpeg
+from app.services.ffmpeg import FfmpegError, FfmpegLimiter, get_limiter, transcode_audio, transcode_audio_async
+
+
+def test_limiter_caps_threads_and_tasks() -> None:
+    limiter = FfmpegLimiter(2)
+    peak = {"now": 0, "max": 0}
+    lock = threading.Lock()
+
+    def _enter() -> None:
+        with lock:
+            peak["now"] += 1
+            peak["max"] = max(peak["max"], peak["now"])
+
+    def _leave() -> None:
+        with lock:
+            peak["now"] -= 1
+
+    def _sync_call() -> None:
+        limiter.acquire()
+        try:
+            _enter()
+            time.sleep(0.05)
+            _leave()
+        finally:
+            limiter.release()
+
+    async def _async_call() -> None:
+        await limiter.acquire_async()
+        try:
+            _enter()
+            await asyncio.sleep(0.05)
+            _leave()
+        finally:
+            limiter.release()
+
+    async def _main() -> None:
+        threads = [threading.Thread(target=_sync_call) for _ in range(4)]
+        for t in threads:
+            t.start()
+        await asyncio.gather(*[_async_call() for _ in range(4)])
+        for t in threads:
+            t.join()
+
+    asyncio.run(_main())
+    assert peak["max"] == 2, peak
+    stats = limiter.stats()
+    assert stats["running"] == 0 and stats["queued"] == 0, stats
+
+
+def test_cancelled_waiter_does_not_leak_a_slot() -> None:
+    limiter = FfmpegLimiter(1)
+
+    async def _main() -> None:
+        await limiter.acquire_async()
+        waiter = asyncio.ensure_future(limiter.acquire_async())
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            pass
+        limiter.release()
+        await asyncio.wait_for(limiter.acquire_async(), timeout=1.0)
+        limiter.release()
+
+    asyncio.run(_main())
+    assert limiter.stats()["running"] == 0
+
+
+def test_release_skips_waiters_on_closed_loops() -> None:
+    limiter = FfmpegLimiter(1)
+    limiter.acquire()
+    # A waiter whose event loop was closed while it queued (e.g. a finished asyncio.run()).
+    dead_loop = asyncio.new_event_loop()
+    limiter._waiters.append((dead_loop, dead_loop.create_future()))
+    dead_loop.close()
+    granted = threading.Event()
+    limiter._waiters.append(granted)
+    limiter.release()
+    assert granted.is_set() and limiter.stats()["running"] == 1  # handed past the dead waiter
+
+    limiter._waiters.append((dead_loop, asyncio.Future(loop=dead_loop)))
+    limiter.release()
+    stats = limiter.stats()
+    assert stats["running"] == 0 and stats["queued"] == 0, stats  # nobody left: the slot is freed
+
+
+def test_async_transcode_and_cancellation() -> None:
+    if not shutil.which("ffmpeg"):
+        print("SKIP: ffmpeg not available")
+        return
+
+    async def _main(d: str) -> None:
+        src = os.path.join(d, "in.wav")
+        proc = await asyncio.create_subprocess_exec(
+            "ffmpeg", "-y", "-hide_banner", "-loglevel", "error", "-f", "lavfi", "-i", "sine=duration=1", src,
+        )
+        await proc.wait()
+
+        out = os.path.join(d, "out.mp3")
+        run = await transcode_audio_async(in_path=src, out_path=out, output_format="mp3")
+        assert os.path.getsize(out) > 0 and run.run_sec > 0
+
+        try:
+            await transcode_audio_async(in_path=os.path.join(d, "missing.wav"), out_path=out, output_format="wav")
+            raise AssertionError("expected FfmpegError")
+        except FfmpegError:
+            pass
+
+        # -re paces decoding at real time: a 60s input keeps ffmpeg busy until it's cancelled.
+        slow = asyncio.ensure_future(ffmpeg._run_async(
+            ["ffmpeg", "-y", "-hide_banner", "-loglevel", "error", "-re", "-f", "lavfi", "-i", "sine=duration=60",
+             os.path.join(d, "slow.wav")],
+            120,
+        ))
+        await asyncio.sleep(0.5)
+        started = time.perf_counter()
+        slow.cancel()
+        try:
+            await slow
+        except asyncio.CancelledError:
+            pass
+        assert time.perf_counter() - started < 5.0
+        assert get_limiter().stats()["running"] == 0
+
+        # The task's cancel token reaches the async path too: a deadline kills the child.
+        slow_cmd = ["ffmpeg", "-y", "-hide_banner", "-loglevel", "error", "-re", "-f", "lavfi", "-i", "sine=duration=60",
+                    os.path.join(d, "slow.wav")]
+        started = time.perf_counter()
+        with use_token(CancelToken(deadline_sec=0.5)):
+            try:
+                await ffmpeg._run_async(slow_cmd, 120)
+                raise AssertionError("expected TaskCancelled")
+            except TaskCancelled as e:
+                assert e.reason == "deadline_exceeded"
+        assert time.perf_counter() - started < 5.0
+        assert get_limiter().stats()["running"] == 0
+
+        # Progress is parsed from -progress pipe:1 as in the blocking API.
+        seen = []
+        await transcode_audio_async(in_path=src, out_path=os.path.join(d, "progress.wav"), output_format="wav", progress=seen.append)
+        assert seen and abs(seen[-1] - 1.0) < 0.1, seen
+
+    with tempfile.TemporaryDirectory() as d:
+        asyncio.run(_main(d))
+        # The blocking API goes through the same limiter.
+        transcode_audio(in_path=os.path.join(d, "in.wav"), out_path=os.path.join(d, "sync.wav"), output_format="wav")
+    assert get_limiter().stats()["calls"] >= 4
+
+
+def _output_threads(cmd: list, out_path: str) -> str:
+    i = cmd.index(out_path)
+    assert cmd[i - 2] == "-threads", cmd
+    return cmd[i - 1]
+
+
+def test_threads_apply_to_every_output() -> None:
+    os.environ["VC_FFMPEG_THREADS"] = "3"
+    try:
+        cmd = ffmpeg._transcode_cmd(in_path="in.wav", out_path="out.opus", output_format="opus")
+        assert cmd.index("-threads") < cmd.index("-i")  # decoder
+        assert _output_threads(cmd, "out.opus") == "3"  # encoder: an output option, after -i
+        multi = ffmpeg._transcode_multi_cmd(
+            in_path="in.wav",
+            filter_complex="[0:a]asplit=3[a][b][c]",
+            outputs=[("[a]", "o.mp3", "mp3", None), ("[b]", "o.flac", "flac", None), ("[c]", "o.wav", "wav", None)],
+        )
+        for out_path in ("o.mp3", "o.flac", "o.wav"):
+            assert _output_threads(multi, out_path) == "3"
+            assert multi.index(out_path) > multi.index("-i")
+    finally:
+        os.environ.pop("VC_FFMPEG_THREADS", None)
+
+
+def main() -> None:
+    test_limiter_caps_threads_and_tasks()
+    test_threads_apply_to_every_output()
+    test_cancelled_waiter_does_not_leak_a_slot()
+    test_release_skips_waiters_on_closed_loops()
+    test_async_transcode_and_cancellation()
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
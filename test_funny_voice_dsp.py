@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""Checks for the NumPy funny-voice backend (app/services/dsp.py).
+
+Renders a synthetic voice-like signal through every funny voice with both backends and
+bounds the difference of their third-octave band spectra and overall level.
+The ffmpeg comparison is skipped when ffmpeg is not available.
+
+Usage:
+  python test_funny_voice_dsp.py
+"""
+
+from __future__ import annotations
+
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from app.services import dsp
+from app.services.pcm import read_wav, write_wav
+from app.services.providers.funny_voice import FunnyVoiceProvider
+
+
+SR = FunnyVoiceProvider.SAMPLE_RATE
+# Third-octave-ish bands over the speech range, compared in dB.
+BAND_EDGES = np.geomspace(80.0, 12000.0, 22)
+MAX_BAND_DIFF_DB = 3.0
+MAX_MEAN_BAND_DIFF_DB = 1.0
+MAX_LEVEL_DIFF_DB = 1.0
+
+
+def _voice_like(seconds: float = 4.0) -> np.ndarray:
+    """Gliding harmonic tone (f0 110-170 Hz) gated into syllables, plus a little noise."""
+    n = int(SR * seconds)
+    t = np.arange(n) / SR
+    f0 = 140.0 + 30.0 * np.sin(2 * np.pi * 0.7 * t)
+    phase = 2 * np.pi * np.cumsum(f0) / SR
+    x = sum(np.sin(k * phase) / k for k in range(1, 30)) * 0.1
+    x += 0.01 * np.random.default_rng(1).standard_normal(n)
+    x *= 0.3 + 0.7 * (np.sin(2 * np.pi * 2.0 * t) > 0)
+    return x.astype(np.float32)
+
+
+def _bands_db(y: np.ndarray) -> np.ndarray:
+    power = np.abs(np.fft.rfft(y * np.hanning(y.shape[0]))) ** 2
+    freqs = np.fft.rfftfreq(y.shape[0], 1.0 / SR)
+    return np.array([
+        10 * np.log10(power[(freqs >= lo) & (freqs < hi)].mean() + 1e-20)
+        for lo, hi in zip(BAND_EDGES[:-1], BAND_EDGES[1:])
+    ])
+
+
+def _level_db(y: np.ndarray) -> float:
+    return float(20 * np.log10(np.sqrt(np.mean(np.square(y))) + 1e-12))
+
+
+def test_numpy_backend_matches_ffmpeg() -> None:
+    if not shutil.which("ffmpeg"):
+        print("SKIP: ffmpeg not available")
+        return
+    provider = FunnyVoiceProvider()
+    with tempfile.TemporaryDirectory() as d:
+        src = os.path.join(d, "voice.wav")
+        write_wav(src, _voice_like(), SR)
+        x, _ = read_wav(src)
+        failures = []
+        for voice_id in FunnyVoiceProvider.SUPPORTED_VOICES:
+            ref_path = os.path.join(d, f"{voice_id}_ffmpeg.wav")
+            provider._render_ffmpeg(voice_id, src, ref_path)
+            ref, _ = read_wav(ref_path)
+            got = dsp.apply_effects(x, SR, provider.effects(voice_id))
+
+            # atempo/aecho may add or drop a few ms at the end.
+            assert abs(ref.shape[0] - got.shape[0]) <= SR // 50, (voice_id, ref.shape, got.shape)
+            n = min(ref.shape[0], got.shape[0])
+            diff = np.abs(_bands_db(ref[:n]) - _bands_db(got[:n]))
+            level = abs(_level_db(ref) - _level_db(got))
+            ok = diff.max() <= MAX_BAND_DIFF_DB and diff.mean() <= MAX_MEAN_BAND_DIFF_DB and level <= MAX_LEVEL_DIFF_DB
+            print(f"{voice_id:12s} band max={diff.max():.2f}dB mean={diff.mean():.2f}dB level={level:.2f}dB {'OK' if ok else 'FAIL'}")
+            if not ok:
+                failures.append(voice_id)
+        assert not failures, f"spectral mismatch: {failures}"
+
+
+def test_time_stretch_keeps_pitch_and_level() -> None:
+    t = np.arange(SR * 2) / SR
+    x = (0.5 * np.sin(2 * np.pi * 220.0 * t)).astype(np.float32)
+    for factor in (0.75, 1.4):
+        y = dsp.time_stretch(x, factor)
+        assert y.shape[0] == int(round(x.shape[0] * factor))
+        body = y[SR // 10:-SR // 10]
+        peak_hz = np.argmax(np.abs(np.fft.rfft(body))) * SR / body.shape[0]
+        assert abs(peak_hz - 220.0) < 2.0, (factor, peak_hz)
+        assert abs(_level_db(body) - _level_db(x)) < 0.5, factor
+
+
+def test_pitch_shift_moves_fundamental() -> None:
+    t = np.arange(SR * 2) / SR
+    x = (0.5 * np.sin(2 * np.pi * 200.0 * t)).astype(np.float32)
+    for factor in (0.75, 1.25):
+        y = dsp.pitch_shift(x, SR, factor)
+        assert y.shape[0] == x.shape[0]
+        body = y[SR // 10:-SR // 10]
+        peak_hz = np.argmax(np.abs(np.fft.rfft(body))) * SR / body.shape[0]
+        assert abs(peak_hz - 200.0 * factor) < 2.0, (factor, peak_hz)
+
+
+def test_render_wav_uses_numpy_backend() -> None:
+    provider = FunnyVoiceProvider()
+    previous = os.environ.get("VC_FUNNY_VOICE_BACKEND")
+    os.environ["VC_FUNNY_VOICE_BACKEND"] = "numpy"
+    try:
+        with tempfile.TemporaryDirectory() as d:
+            src = os.path.join(d, "voice.wav")
+            out = os.path.join(d, "out.wav")
+            write_wav(src, _voice_like(1.0), SR)
+            assert provider.render_wav("uwu_anime", src, out) == "numpy"
+            y, sr = read_wav(out)
+            assert sr == SR and abs(y.shape[0] - SR) <= 1
+    finally:
+        if previous is None:
+            os.environ.pop("VC_FUNNY_VOICE_BACKEND", None)
+        else:
+            os.environ["VC_FUNNY_VOICE_BACKEND"] = previous
+
+
+def main() -> None:
+    test_numpy_backend_matches_ffmpeg()
+    test_time_stretch_keeps_pitch_and_level()
+    test_pitch_shift_moves_fundamental()
+    test_render_wav_uses_numpy_backend()
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
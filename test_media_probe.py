@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""Checks for the in-process WAV/MP3/MP4 header parsers in app/services/media_probe.py
+(durations, WAV/MP4 stream fields, fallbacks).
+
+Generates a small corpus with ffmpeg and compares probe_header() against ffprobe
+(or, when ffprobe isn't installed, against the generated duration).
+Skips when ffmpeg is not available.
+
+Usage:
+  python test_media_probe.py
+"""
+
+from __future__ import annotations
+
+import os
+import shutil
+import subprocess
+import tempfile
+from typing import List, Optional, Tuple
+
+from app.services.media_probe import MediaInfo, probe_header, sniff_format
+
+
+DURATION = 7.3
+# (file name, ffmpeg output args, tolerance in seconds)
+CORPUS: List[Tuple[str, List[str], float]] = [
+    ("pcm16_48k_mono.wav", ["-ar", "48000", "-ac", "1", "-c:a", "pcm_s16le"], 0.001),
+    ("pcm16_44k_stereo.wav", ["-ar", "44100", "-ac", "2", "-c:a", "pcm_s16le"], 0.001),
+    ("pcm24_96k_stereo.wav", ["-ar", "96000", "-ac", "2", "-c:a", "pcm_s24le"], 0.001),
+    ("float32_16k_mono.wav", ["-ar", "16000", "-ac", "1", "-c:a", "pcm_f32le"], 0.001),
+    ("u8_8k_mono.wav", ["-ar", "8000", "-ac", "1", "-c:a", "pcm_u8"], 0.001),
+    ("cbr128_44k.mp3", ["-ar", "44100", "-c:a", "libmp3lame", "-b:a", "128k"], 0.06),
+    ("cbr64_22k_mono_noxing.mp3", ["-ar", "22050", "-ac", "1", "-c:a", "libmp3lame", "-b:a", "64k", "-write_xing", "0"], 0.1),
+    ("vbr_48k.mp3", ["-ar", "48000", "-c:a", "libmp3lame", "-q:a", "4"], 0.06),
+    ("vbr_id3.mp3", ["-ar", "44100", "-c:a", "libmp3lame", "-q:a", "2", "-metadata", "title=probe test", "-id3v2_version", "3"], 0.06),
+    ("aac.m4a", ["-ar", "44100", "-c:a", "aac", "-b:a", "96k"], 0.06),
+    ("aac_faststart.mp4", ["-ar", "48000", "-c:a", "aac", "-movflags", "+faststart"], 0.06),
+]
+
+
+def _ffprobe_duration(path: str) -> Optional[float]:
+    if not shutil.which("ffprobe"):
+        return None
+    p = subprocess.run(
+        ["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "default=nw=1:nk=1", path],
+        capture_output=True, text=True,
+    )
+    try:
+        return float(p.stdout.strip())
+    except ValueError:
+        return None
+
+
+def _generate(dirname: str) -> List[Tuple[str, float]]:
+    files = []
+    for name, args, tol in CORPUS:
+        path = os.path.join(dirname, name)
+        subprocess.run(
+            ["ffmpeg", "-y", "-hide_banner", "-loglevel", "error",
+             "-f", "lavfi", "-i", f"sine=frequency=440:duration={DURATION}", *args, path],
+            check=True,
+        )
+        files.append((path, tol))
+    return files
+
+
+def test_header_durations_match_reference() -> None:
+    if not shutil.which("ffmpeg"):
+        print("SKIP: ffmpeg not available")
+        return
+    with tempfile.TemporaryDirectory() as d:
+        failures = []
+        for path, tol in _generate(d):
+            info = probe_header(path)
+            reference = _ffprobe_duration(path)
+            ref = reference if reference is not None else DURATION
+            got = info.duration_sec if info is not None else None
+            ok = got is not None and abs(got - ref) <= tol
+            print(f"{os.path.basename(path):28s} header={got!r:24} reference={ref:.4f} {'OK' if ok else 'FAIL'}")
+            if not ok:
+                failures.append(os.path.basename(path))
+        assert not failures, f"duration mismatch: {failures}"
+
+
+def test_wav_stream_fields() -> None:
+    if not shutil.which("ffmpeg"):
+        return
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, "std.wav")
+        subprocess.run(
+            ["ffmpeg", "-y", "-hide_banner", "-loglevel", "error", "-f", "lavfi", "-i", "sine=duration=1",
+             "-ar", "48000", "-ac", "1", "-c:a", "pcm_s16le", path],
+            check=True,
+        )
+        info = probe_header(path)
+        assert isinstance(info, MediaInfo)
+        assert info.is_pcm_wav(sample_rate=48000, channels=1), info
+
+
+def test_mp4_stream_fields() -> None:
+    if not shutil.which("ffmpeg"):
+        return
+    cases = [
+        ("aac.m4a", ["-ar", "44100", "-ac", "2", "-c:a", "aac"], ("aac", 2, 44100)),
+        ("mp3.mp4", ["-ar", "22050", "-ac", "1", "-c:a", "libmp3lame"], ("mp3", 1, 22050)),
+        ("alac.m4a", ["-ar", "48000", "-ac", "1", "-c:a", "alac"], ("alac", 1, 48000)),
+        ("opus.mp4", ["-ar", "48000", "-ac", "2", "-c:a", "libopus", "-strict", "-2"], ("opus", 2, 48000)),
+    ]
+    with tempfile.TemporaryDirectory() as d:
+        for name, args, expected in cases:
+            path = os.path.join(d, name)
+            made = subprocess.run(
+                ["ffmpeg", "-y", "-hide_banner", "-loglevel", "error", "-f", "lavfi", "-i", "sine=duration=1", *args, path],
+                capture_output=True,
+            )
+            if made.returncode != 0:
+                continue  # encoder not built in
+            info = probe_header(path)
+            assert info is not None and (info.codec, info.channels, info.sample_rate) == expected and info.has_audio, (name, info)
+
+        # No sound track: the header can't say what ffprobe would, so it defers.
+        video = os.path.join(d, "video_only.mp4")
+        subprocess.run(
+            ["ffmpeg", "-y", "-hide_banner", "-loglevel", "error", "-f", "lavfi", "-i", "testsrc=duration=1:size=32x32",
+             "-c:v", "mpeg4", video],
+            check=True,
+        )
+        assert probe_header(video) is None
+
+
+def test_unknown_and_truncated_inputs_fall_back() -> None:
+    with tempfile.TemporaryDirectory() as d:
+        junk = os.path.join(d, "junk.bin")
+        with open(junk, "wb") as f:
+            f.write(b"\x00" * 4096)
+        assert probe_header(junk) is None
+
+        # Same bytes the upload-limit test posts: a RIFF header with no chunks.
+        stub = os.path.join(d, "stub.wav")
+        with open(stub, "wb") as f:
+            f.write(b"RIFF....WAVE")
+        assert probe_header(stub) is None
+
+    assert sniff_format(b"RIFF\x00\x00\x00\x00WAVE") == "wav"
+    assert sniff_format(b"\x00\x00\x00\x20ftypM4A ") == "mp4"
+    assert sniff_format(b"ID3\x04\x00\x00\x00\x00\x00\x00") == "mp3"
+    assert sniff_format(b"OggS\x00\x02\x00\x00\x00\x00\x00\x00") is None
+
+
+def main() -> None:
+    test_header_durations_match_reference()
+    test_wav_stream_fields()
+    test_mp4_stream_fields()
+    test_unknown_and_truncated_inputs_fall_back()
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""Checks for the /metrics registry (app/core/metrics.py): recording stays in memory, snapshots are
+written at scrape time and by the background flusher, worker snapshots merge, and the totals of
+exited workers are kept.
+
+Usage:
+  python test_metrics.py
+"""
+
+from __future__ import annotations
+
+import atexit
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from app.core import metrics
+from app.core.metrics import Registry, merge, render
+
+
+# Keep the state these checks leave behind out of the real runs/ tree.
+_SCRATCH_DIR = tempfile.mkdtemp(prefix="vc_test_")
+atexit.register(shutil.rmtree, _SCRATCH_DIR, True)
+metrics.METRICS_DIR = os.path.join(_SCRATCH_DIR, "metrics")
+
+
+def _snapshot_path() -> str:
+    return os.path.join(metrics.METRICS_DIR, f"{os.getpid()}.json")
+
+
+def test_flush_at_scrape_and_on_timer() -> None:
+    shutil.rmtree(metrics.METRICS_DIR, ignore_errors=True)
+    metrics.pipeline_started()
+    metrics.record_pipeline_run({"provider": {"name": "p", "status": "ok"}}, {"standardize": 0.1, "voice_change": 0.5}, 0.7, ok=True)
+    metrics.pipeline_finished()
+    assert not os.path.exists(_snapshot_path())  # no disk write per run
+
+    text = metrics.collect()
+    assert os.path.exists(_snapshot_path())
+    assert 'vc_pipeline_runs_total{status="success"}' in text and "vc_pipelines_in_flight 0" in text, text
+    assert 'vc_provider_duration_seconds_count{provider="p",status="ok"}' in text
+
+    # The flusher persists changes on its own, and leaves an unchanged registry alone.
+    registry = Registry()
+    registry.inc("vc_pipeline_runs_total", {"status": "failed"})
+    os.environ["VC_METRICS_FLUSH_SEC"] = "0.1"
+    try:
+        threading.Thread(target=metrics._flush_loop, args=(registry,), daemon=True).start()
+        deadline = time.time() + 5
+        while registry._dirty and time.time() < deadline:
+            time.sleep(0.05)
+        assert not registry._dirty
+        mtime = os.path.getmtime(_snapshot_path())
+        time.sleep(0.3)
+        assert os.path.getmtime(_snapshot_path()) == mtime
+    finally:
+        os.environ.pop("VC_METRICS_FLUSH_SEC", None)
+
+
+def _dead_pid() -> int:
+    proc = subprocess.Popen([sys.executable, "-c", "pass"])
+    proc.wait()
+    return proc.pid
+
+
+def test_exited_workers_keep_their_totals() -> None:
+    shutil.rmtree(metrics.METRICS_DIR, ignore_errors=True)
+    os.makedirs(metrics.METRICS_DIR)
+    for _ in range(2):
+        worker = Registry()
+        worker.inc("vc_pipeline_runs_total", {"status": "success"}, 2)
+        worker.observe("vc_pipeline_duration_seconds", 0.3)
+        worker.gauge_set("vc_pipelines_in_flight", 1)
+        snapshot = dict(worker.snapshot(), pid=_dead_pid())
+        with open(os.path.join(metrics.METRICS_DIR, f"{snapshot['pid']}.json"), "w", encoding="utf-8") as f:
+            json.dump(snapshot, f)
+
+    previous = metrics._registry
+    metrics._registry = Registry()  # this process contributes nothing
+    try:
+        for _ in range(2):  # folded once: the second scrape reports the same totals
+            text = metrics.collect()
+            assert 'vc_pipeline_runs_total{status="success"} 4' in text, text
+            assert "vc_pipeline_duration_seconds_count 2" in text and "vc_pipelines_in_flight" not in text
+    finally:
+        metrics._registry = previous
+    assert sorted(os.listdir(metrics.METRICS_DIR)) == sorted([".lock", "aggregate.json", f"{os.getpid()}.json"])
+
+
+def test_merge_workers() -> None:
+    a, b = Registry(), Registry()
+    a.inc("vc_pipeline_runs_total", {"status": "success"})
+    b.inc("vc_pipeline_runs_total", {"status": "success"}, 2)
+    a.observe("vc_pipeline_duration_seconds", 0.3)
+    b.observe("vc_pipeline_duration_seconds", 3.0)
+    text = render(merge([a.snapshot(), b.snapshot()]))
+    assert 'vc_pipeline_runs_total{status="success"} 3' in text
+    assert 'vc_pipeline_duration_seconds_bucket{le="0.5"} 1' in text and "vc_pipeline_duration_seconds_count 2" in text, text
+
+
+def main() -> None:
+    test_flush_at_scrape_and_on_timer()
+    test_exited_workers_keep_their_totals()
+    test_merge_workers()
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
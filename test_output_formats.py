@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""Checks for the export formats (app/services/audio_formats.py): opus/ogg, aac/m4a, flac next to mp3/wav,
+and for several formats encoded from one render (output_formats).
+
+Usage:
+  python test_output_formats.py
+"""
+
+from __future__ import annotations
+
+import atexit
+import json
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+from typing import Dict, List
+
+from fastapi.testclient import TestClient
+
+from app.config.settings import OUTPUTS_DIR
+from app.core import metrics
+from app.main import app
+from app.services import input_store
+from app.services import singleflight as sf_mod
+from app.services.audio_formats import OUTPUT_FORMATS, available_formats, resolve_bitrate
+from app.services.ffmpeg import get_limiter
+
+
+# Keep the state these checks leave behind out of the real runs/ tree.
+_SCRATCH_DIR = tempfile.mkdtemp(prefix="vc_test_")
+atexit.register(shutil.rmtree, _SCRATCH_DIR, True)
+metrics.METRICS_DIR = os.path.join(_SCRATCH_DIR, "metrics")
+sf_mod.SF_DIR = os.path.join(_SCRATCH_DIR, "singleflight")
+input_store.STORE_DIR = os.path.join(_SCRATCH_DIR, "inputs")
+
+CODECS = {"mp3": "mp3", "wav": "pcm_s16le", "opus": "opus", "ogg": "opus", "aac": "aac", "m4a": "aac", "flac": "flac"}
+
+
+def _sine(path: str, seconds: float) -> None:
+    subprocess.run(
+        ["ffmpeg", "-y", "-hide_banner", "-loglevel", "error", "-f", "lavfi", "-i", f"sine=frequency=300:duration={seconds}", "-ar", "48000", path],
+        check=True,
+    )
+
+
+def _codec(path: str) -> str:
+    # `ffmpeg -i` without an output prints the stream info ("Audio: opus, 48000 Hz, ...") and exits 1.
+    out = subprocess.run(["ffmpeg", "-hide_banner", "-i", path], capture_output=True, text=True)
+    match = re.search(r"Audio: (\w+)", out.stderr)
+    return match.group(1) if match else ""
+
+
+def test_resolve_bitrate() -> None:
+    assert resolve_bitrate("mp3") == "192k"
+    assert resolve_bitrate("opus") == "48k"
+    assert resolve_bitrate("opus", "voice") == "24k"
+    assert resolve_bitrate("m4a", "high", "80k") == "80k"
+    assert resolve_bitrate("flac", "high") is None
+    for bad in [("mp3", "best", None), ("mp3", None, "lots"), ("webm", None, None)]:
+        try:
+            resolve_bitrate(*bad)
+            raise AssertionError(f"expected ValueError for {bad}")
+        except ValueError:
+            pass
+
+
+def _convert(client: TestClient, src: str, fmt: str, options: Dict) -> Dict:
+    payload = {"voice_id": "anime_uncle", "stability": 5, "similarity": 5, "output_format": fmt, "options": {"cache": False, **options}}
+    with open(src, "rb") as f:
+        resp = client.post("/voice-changer", files={"file": ("in.wav", f, "audio/wav")}, data={"payload": json.dumps(payload)})
+    assert resp.status_code == 200, resp.text
+    return resp.json()
+
+
+def test_every_available_format() -> None:
+    if not shutil.which("ffmpeg"):
+        print("SKIP: ffmpeg not available")
+        return
+    client = TestClient(app)
+    caps = client.get("/voice-changer/capabilities").json()
+    assert caps["output_formats"] == available_formats() and "wav" in caps["output_formats"]
+    assert caps["audio_quality_presets"] == ["voice", "standard", "high"]
+
+    sizes: Dict[str, int] = {}
+    with tempfile.TemporaryDirectory() as d:
+        src = os.path.join(d, "in.wav")
+        _sine(src, 8)
+        for fusion in ("1", "0"):
+            os.environ["VC_FFMPEG_FUSION"] = fusion
+            try:
+                for fmt in available_formats():
+                    body = _convert(client, src, fmt, {})
+                    artifact = body["meta"]["artifact"]
+                    assert artifact["produced_format"] == fmt, (fmt, fusion, artifact)
+                    assert body["output_url"].endswith(f".{fmt}")
+                    public = os.path.join(OUTPUTS_DIR, artifact["public_name"])
+                    assert _codec(public) == CODECS[fmt], (fmt, _codec(public))
+                    sizes[fmt] = os.path.getsize(public)
+
+                    info = client.get(f"/voice-changer/tasks/{body['task_id']}").json()
+                    assert info["output_url"] == body["output_url"], info
+            finally:
+                os.environ.pop("VC_FFMPEG_FUSION", None)
+
+        if "opus" in sizes:
+            assert sizes["opus"] * 3 < sizes["mp3"], sizes
+            voice = _convert(client, src, "opus", {"audio_quality": "voice"})
+            assert os.path.getsize(os.path.join(OUTPUTS_DIR, voice["meta"]["artifact"]["public_name"])) < sizes["opus"]
+
+        with open(src, "rb") as f:
+            resp = client.post(
+                "/voice-changer",
+                files={"file": ("in.wav", f, "audio/wav")},
+                data={"payload": json.dumps({"voice_id": "anime_uncle", "output_format": "opus", "options": {"bitrate": "loud"}})},
+            )
+        assert resp.status_code == 400, resp.text
+    assert set(OUTPUT_FORMATS) == set(CODECS)
+
+
+def test_several_formats_from_one_render() -> None:
+    if not shutil.which("ffmpeg"):
+        print("SKIP: ffmpeg not available")
+        return
+    wanted = [f for f in ("opus", "wav", "flac") if f in available_formats()]
+    client = TestClient(app)
+    with tempfile.TemporaryDirectory() as d:
+        src = os.path.join(d, "in.wav")
+        _sine(src, 6)
+        for fusion in ("1", "0"):
+            os.environ["VC_FFMPEG_FUSION"] = fusion
+            try:
+                calls_before = get_limiter().stats()["calls"]
+                body = _convert_many(client, src, wanted)
+                ffmpeg_calls = get_limiter().stats()["calls"] - calls_before
+            finally:
+                os.environ.pop("VC_FFMPEG_FUSION", None)
+            artifact = body["meta"]["artifact"]
+            assert body["output_url"].endswith(f".{wanted[0]}") and artifact["produced_format"] == wanted[0]
+            assert sorted(artifact["outputs"]) == sorted(wanted), artifact
+            for fmt, url in artifact["outputs"].items():
+                assert url == f"/outputs/{body['task_id']}.{fmt}"
+                assert _codec(os.path.join(OUTPUTS_DIR, os.path.basename(url))) == CODECS[fmt]
+            # Fused: one ffmpeg for voice change + every encode; per step: one for the voice, one for all encodes.
+            assert ffmpeg_calls == (1 if fusion == "1" else 2), (fusion, ffmpeg_calls, body["meta"]["debug"].get("fused"))
+
+
+def _convert_many(client: TestClient, src: str, formats: List[str]) -> Dict:
+    payload = {"voice_id": "anime_uncle", "output_formats": formats, "options": {"cache": False}}
+    with open(src, "rb") as f:
+        resp = client.post("/voice-changer", files={"file": ("in.wav", f, "audio/wav")}, data={"payload": json.dumps(payload)})
+    assert resp.status_code == 200, resp.text
+    return resp.json()
+
+
+def main() -> None:
+    test_resolve_bitrate()
+    test_every_available_format()
+    test_several_formats_from_one_render()
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
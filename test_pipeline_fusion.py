@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""Checks for ffmpeg stage fusion in the pipeline (app/core/pipeline.py): planning, splitting at
+non-fusable steps, the per-step fallback after a failed fused run, and arun() planning off the loop.
+
+Usage:
+  python test_pipeline_fusion.py
+"""
+
+from __future__ import annotations
+
+import asyncio
+import atexit
+import os
+import shutil
+import tempfile
+import threading
+from typing import List, Optional
+
+from app.core import pipeline as pipeline_mod
+from app.core.artifacts import Artifact, TaskContext
+from app.core.pipeline import FfmpegStage, Pipeline
+from app.services import singleflight as sf_mod
+from app.services.ffmpeg import is_available as ffmpeg_available
+from app.steps.voice_change import VoiceChangeStep
+
+
+# Keep the state these checks leave behind out of the real runs/ tree.
+_SCRATCH_DIR = tempfile.mkdtemp(prefix="vc_test_")
+atexit.register(shutil.rmtree, _SCRATCH_DIR, True)
+sf_mod.SF_DIR = os.path.join(_SCRATCH_DIR, "singleflight")
+
+
+class _FilterStep:
+    """A step that can be expressed as an ffmpeg filter (or runs as a plain copy)."""
+
+    def __init__(self, name: str, filters: Optional[List[str]] = None) -> None:
+        self.name = name
+        self.filters = filters or ["volume=1.0"]
+        self.runs = 0
+        self.planned_on: List[str] = []
+
+    def ffmpeg_stage(self, artifact: Artifact, ctx: TaskContext) -> Optional[FfmpegStage]:
+        self.planned_on.append(threading.current_thread().name)
+
+        def _finalize(fused: Artifact, ctx: TaskContext) -> Artifact:
+            ctx.debug.setdefault("finalized", []).append(self.name)
+            return fused
+
+        return FfmpegStage(filters=self.filters, output_name=f"{self.name}.wav", finalize=_finalize)
+
+    def run(self, artifact: Artifact, ctx: TaskContext) -> Artifact:
+        self.runs += 1
+        out = ctx.path(f"{self.name}.wav")
+        shutil.copyfile(artifact.path, out)
+        return Artifact(path=out, mime="audio/wav")
+
+
+class _PlainStep(_FilterStep):
+    ffmpeg_stage = None  # type: ignore[assignment]
+
+
+def _setup(d: str) -> tuple:
+    src = os.path.join(d, "in.wav")
+    VoiceChangeStep()._synthesize_wav(src, duration_sec=0.2)
+    ctx = TaskContext(task_id="t", task_dir=os.path.join(d, "task"), voice_id="v", stability=5, similarity=5, output_format="wav")
+    return Artifact(path=src, mime="audio/wav"), ctx
+
+
+def test_plan_splits_at_non_fusable_steps() -> None:
+    with tempfile.TemporaryDirectory() as d:
+        artifact, ctx = _setup(d)
+        a, b, c, e = _FilterStep("a"), _FilterStep("b"), _PlainStep("c"), _FilterStep("e")
+        pipeline = Pipeline([a, b, c, e])
+        assert [s for s, _ in pipeline._plan_fused(0, artifact, ctx)] == [a, b]
+        assert pipeline._plan_fused(2, artifact, ctx) == []  # not fusable
+        assert pipeline._plan_fused(3, artifact, ctx) == []  # a single stage isn't worth fusing
+        assert pipeline._plan_fused(0, Artifact(path=os.path.join(d, "missing.wav")), ctx) == []
+        os.environ["VC_FFMPEG_FUSION"] = "0"
+        try:
+            assert pipeline._plan_fused(0, artifact, ctx) == []
+        finally:
+            os.environ.pop("VC_FFMPEG_FUSION", None)
+
+
+def test_fused_run() -> None:
+    if not ffmpeg_available():
+        print("SKIP: ffmpeg not available")
+        return
+    with tempfile.TemporaryDirectory() as d:
+        artifact, ctx = _setup(d)
+        a, b, c = _FilterStep("a"), _FilterStep("b", ["volume=0.5"]), _PlainStep("c")
+        out = Pipeline([a, b, c]).run(artifact, ctx)
+        assert ctx.debug["fused"][0]["steps"] == ["a", "b"] and ctx.debug["fused"][0]["filters"] == ["volume=1.0", "volume=0.5"]
+        assert ctx.debug["finalized"] == ["a", "b"] and (a.runs, b.runs, c.runs) == (0, 0, 1)
+        assert not os.path.exists(ctx.path("a.wav"))  # the intermediate output is skipped
+        assert out.path == ctx.path("c.wav") and os.path.getsize(out.path) > 44
+        assert "a+b" in ctx.debug["timing"] and "c" in ctx.debug["timing"]
+
+
+def test_failed_fused_run_falls_back_to_steps() -> None:
+    if not ffmpeg_available():
+        print("SKIP: ffmpeg not available")
+        return
+    with tempfile.TemporaryDirectory() as d:
+        artifact, ctx = _setup(d)
+        a, b = _FilterStep("a"), _FilterStep("b", ["no_such_filter=1"])
+        out = Pipeline([a, b]).run(artifact, ctx)
+        assert (a.runs, b.runs) == (1, 1) and "fused" not in ctx.debug
+        assert out.path == ctx.path("b.wav")
+        error = ctx.debug["errors"][0]
+        assert error["step"] == "a+b" and "falling back" in error["note"], error
+
+
+def test_arun_plans_on_the_executor() -> None:
+    with tempfile.TemporaryDirectory() as d:
+        artifact, ctx = _setup(d)
+        a, b = _PlainStep("a"), _FilterStep("b")
+        out = asyncio.run(Pipeline([a, b]).arun(artifact, ctx))
+        assert out.path == ctx.path("b.wav") and b.planned_on
+        assert all(name.startswith("vc-pipeline") for name in b.planned_on), b.planned_on
+
+
+def test_arun_awaits_fused_ffmpeg() -> None:
+    if not ffmpeg_available():
+        print("SKIP: ffmpeg not available")
+        return
+    with tempfile.TemporaryDirectory() as d:
+        artifact, ctx = _setup(d)
+        a, b = _FilterStep("a"), _FilterStep("b", ["volume=0.5"])
+        calls = []
+        transcode = pipeline_mod.transcode_audio_async
+
+        async def _recording(**kwargs):
+            calls.append(threading.current_thread().name)
+            return await transcode(**kwargs)
+
+        pipeline_mod.transcode_audio_async = _recording
+        try:
+            out = asyncio.run(Pipeline([a, b]).arun(artifact, ctx))
+        finally:
+            pipeline_mod.transcode_audio_async = transcode
+        # ffmpeg was awaited on the loop (MainThread), not run by a pipeline worker.
+        assert calls == ["MainThread"] and ctx.debug["fused"][0]["steps"] == ["a", "b"]
+        assert ctx.debug["finalized"] == ["a", "b"] and out.path == ctx.path("b.wav") and os.path.getsize(out.path) > 44
+
+
+def main() -> None:
+    test_plan_splits_at_non_fusable_steps()
+    test_fused_run()
+    test_failed_fused_run_falls_back_to_steps()
+    test_arun_plans_on_the_executor()
+    test_arun_awaits_fused_ffmpeg()
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
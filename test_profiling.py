@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""Checks for the profiling gate (app/core/profiling.py): only a request presenting the server's
+VC_PROFILE_TOKEN is profiled; a client-chosen user id doesn't count.
+
+Usage:
+  python test_profiling.py
+"""
+
+from __future__ import annotations
+
+import atexit
+import os
+import shutil
+import tempfile
+from typing import Dict, Optional
+
+from fastapi.testclient import TestClient
+
+from app.core import metrics
+from app.core.profiling import profiling_allowed
+from app.main import app
+from app.services import input_store
+from app.services import singleflight as sf_mod
+
+
+# Keep the state these checks leave behind out of the real runs/ tree.
+_SCRATCH_DIR = tempfile.mkdtemp(prefix="vc_test_")
+atexit.register(shutil.rmtree, _SCRATCH_DIR, True)
+metrics.METRICS_DIR = os.path.join(_SCRATCH_DIR, "metrics")
+sf_mod.SF_DIR = os.path.join(_SCRATCH_DIR, "singleflight")
+input_store.STORE_DIR = os.path.join(_SCRATCH_DIR, "inputs")
+
+
+def test_token_gate() -> None:
+    os.environ.pop("VC_PROFILE_TOKEN", None)
+    assert not profiling_allowed("anything") and not profiling_allowed(None)
+    os.environ["VC_PROFILE_TOKEN"] = "s3cret"
+    try:
+        assert profiling_allowed("s3cret")
+        assert not profiling_allowed("s3cre") and not profiling_allowed("") and not profiling_allowed(None)
+    finally:
+        os.environ.pop("VC_PROFILE_TOKEN", None)
+
+
+def _profile(client: TestClient, headers: Dict[str, str]) -> Optional[dict]:
+    resp = client.post(
+        "/voice-changer",
+        json={"voice_id": "anime_uncle", "output_format": "wav", "options": {"debug": {"profile": True}}},
+        headers=headers,
+    )
+    assert resp.status_code == 200, resp.text
+    return resp.json()["meta"]["debug"].get("profile")
+
+
+def test_route_needs_the_token() -> None:
+    client = TestClient(app)
+    os.environ["VC_PROFILE_TOKEN"] = "s3cret"
+    try:
+        # Any client can claim a user id; that alone must not turn profiling on.
+        for headers in ({}, {"X-User-Id": "admin"}, {"Authorization": "Bearer admin"}, {"X-Profile-Token": "guess"}):
+            profile = _profile(client, headers)
+            assert profile is not None and profile.get("enabled") is False, (headers, profile)
+        profile = _profile(client, {"X-Profile-Token": "s3cret"})
+        assert profile is not None and profile.get("enabled") is True and profile.get("pstats_url"), profile
+    finally:
+        os.environ.pop("VC_PROFILE_TOKEN", None)
+
+
+def main() -> None:
+    test_token_gate()
+    test_route_needs_the_token()
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""Checks for live task progress (app/core/progress.py): ffmpeg -progress parsing, pipeline steps, SSE.
+
+Usage:
+  python test_progress.py
+"""
+
+from __future__ import annotations
+
+import atexit
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+from typing import Any, Dict, List
+
+from fastapi.testclient import TestClient
+
+from app.core import metrics
+from app.core.artifacts import Artifact, TaskContext
+from app.core.jobs import get_job_store
+from app.core.pipeline import Pipeline
+from app.core.progress import ProgressReporter
+from app.main import app
+from app.services import ffmpeg
+from app.services import input_store
+from app.services import singleflight as sf_mod
+from app.services.ffmpeg import transcode_audio
+
+
+# Keep the state these checks leave behind out of the real runs/ tree.
+_SCRATCH_DIR = tempfile.mkdtemp(prefix="vc_test_")
+atexit.register(shutil.rmtree, _SCRATCH_DIR, True)
+metrics.METRICS_DIR = os.path.join(_SCRATCH_DIR, "metrics")
+sf_mod.SF_DIR = os.path.join(_SCRATCH_DIR, "singleflight")
+input_store.STORE_DIR = os.path.join(_SCRATCH_DIR, "inputs")
+
+
+def _sine(path: str, seconds: float) -> None:
+    subprocess.run(
+        ["ffmpeg", "-y", "-hide_banner", "-loglevel", "error", "-f", "lavfi", "-i", f"sine=duration={seconds}", "-ar", "48000", path],
+        check=True,
+    )
+
+
+class _TranscodeStep:
+    name = "transcode"
+
+    def run(self, artifact: Artifact, ctx: TaskContext) -> Artifact:
+        out = ctx.path("out.mp3")
+        transcode_audio(in_path=artifact.path, out_path=out, output_format="mp3")
+        return Artifact(path=out, mime="audio/mpeg")
+
+
+def test_parse_out_time() -> None:
+    assert ffmpeg._parse_out_time("out_time_us=2500000\n") == 2.5
+    assert ffmpeg._parse_out_time("out_time_ms=1000000") == 1.0
+    assert ffmpeg._parse_out_time("out_time_us=N/A") is None
+    assert ffmpeg._parse_out_time("out_time=00:00:02.500000") is None
+    assert ffmpeg._parse_out_time("progress=end") is None
+
+
+def test_transcode_reports_out_time() -> None:
+    if not shutil.which("ffmpeg"):
+        print("SKIP: ffmpeg not available")
+        return
+    with tempfile.TemporaryDirectory() as d:
+        _check_transcode_reports_out_time(d)
+
+
+def _check_transcode_reports_out_time(d: str) -> None:
+    src = os.path.join(d, "long.wav")
+    _sine(src, 20)
+    seen: List[float] = []
+    transcode_audio(in_path=src, out_path=os.path.join(d, "long.mp3"), output_format="mp3", progress=seen.append)
+    assert seen and seen == sorted(seen), seen
+    assert 19.0 <= seen[-1] <= 20.5, seen[-1]
+
+
+def test_pipeline_publishes_steps() -> None:
+    if not shutil.which("ffmpeg"):
+        print("SKIP: ffmpeg not available")
+        return
+    with tempfile.TemporaryDirectory() as d:
+        _check_pipeline_publishes_steps(d)
+
+
+def _check_pipeline_publishes_steps(d: str) -> None:
+    src = os.path.join(d, "in.wav")
+    _sine(src, 10)
+    published: List[Dict[str, Any]] = []
+    ctx = TaskContext(task_id="t", task_dir=os.path.join(d, "task"), voice_id="anime_uncle", stability=5, similarity=5, output_format="mp3")
+    ctx.debug["input_media"] = {"duration_seconds": 10.0}
+    ctx.progress = ProgressReporter("t", lambda _task_id, progress: published.append(progress))
+    Pipeline([_TranscodeStep()]).run(Artifact(path=src), ctx)
+
+    assert published[0]["step"] == "transcode" and published[0]["audio_sec"] == 0.0
+    final = published[-1]
+    assert final["percent"] == 100.0 and final["duration_sec"] == 10.0, final
+    assert final["steps"]["transcode"]["status"] == "done"
+    assert final["speed"] and final["speed"] > 1.0, final
+
+
+def test_async_job_streams_progress() -> None:
+    if not shutil.which("ffmpeg"):
+        print("SKIP: ffmpeg not available")
+        return
+    with tempfile.TemporaryDirectory() as d:
+        _check_async_job_streams_progress(d)
+
+
+def _check_async_job_streams_progress(d: str) -> None:
+    src = os.path.join(d, "upload.wav")
+    _sine(src, 8)
+    client = TestClient(app)
+    payload = {"voice_id": "anime_uncle", "stability": 5, "similarity": 5, "output_format": "mp3", "options": {"async": True, "cache": False}}
+    with open(src, "rb") as f:
+        resp = client.post("/voice-changer", files={"file": ("upload.wav", f, "audio/wav")}, data={"payload": json.dumps(payload)})
+    assert resp.status_code == 202, resp.text
+    task_id = resp.json()["task_id"]
+
+    events: List[Dict[str, Any]] = []
+    with client.stream("GET", f"/voice-changer/tasks/{task_id}/events") as stream:
+        assert stream.headers["content-type"].startswith("text/event-stream")
+        for line in stream.iter_lines():
+            if line.startswith("data: "):
+                events.append(json.loads(line[len("data: "):]))
+    assert events[-1]["status"] == "success", events[-1]
+    progress = events[-1]["progress"]
+    assert progress["percent"] == 100.0 and progress["duration_sec"] and progress["steps"], progress
+
+    info = client.get(f"/voice-changer/tasks/{task_id}").json()
+    assert info["progress"] == progress
+
+
+def test_task_ids_are_validated() -> None:
+    client = TestClient(app)
+    for bad in ("not-a-uuid", "%2e%2e", "..%2Foutputs", "1" * 32):
+        assert client.get(f"/voice-changer/tasks/{bad}").status_code == 404, bad
+        assert client.get(f"/voice-changer/tasks/{bad}/events").status_code == 404, bad
+    unknown = client.get("/voice-changer/tasks/00000000-0000-4000-8000-000000000000")
+    assert unknown.status_code == 200 and unknown.json()["status"] == "not_found"
+    assert get_job_store().get("../outputs") is None
+
+
+def main() -> None:
+    test_parse_out_time()
+    test_transcode_reports_out_time()
+    test_pipeline_publishes_steps()
+    test_async_job_streams_progress()
+    test_task_ids_are_validated()
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
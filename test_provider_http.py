@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+"""Checks for the pooled provider HTTP client (app/services/providers/http_pool.py) against a local
+ElevenLabs stand-in: keep-alive reuse, retries honoring Retry-After, pool saturation, warmup.
+
+Usage:
+  python test_provider_http.py
+"""
+
+from __future__ import annotations
+
+import asyncio
+import atexit
+import os
+import shutil
+import tempfile
+import threading
+import time
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+
+from app.core import metrics
+from app.core.artifacts import Artifact, TaskContext
+from app.core.cancellation import TaskCancelled
+from app.core.pipeline import Pipeline
+from app.services import singleflight as sf_mod
+from app.services.providers.elevenlabs import ElevenLabsProviderError, ElevenLabsVoiceChangerHTTP
+from app.services.providers.http_pool import PooledSession, backoff_seconds, httpx, retry_after_seconds
+from app.services.providers.registry import get_provider_registry
+from app.steps.voice_change import VoiceChangeStep
+
+
+# Keep the state these checks leave behind out of the real runs/ tree.
+_SCRATCH_DIR = tempfile.mkdtemp(prefix="vc_test_")
+atexit.register(shutil.rmtree, _SCRATCH_DIR, True)
+metrics.METRICS_DIR = os.path.join(_SCRATCH_DIR, "metrics")
+sf_mod.SF_DIR = os.path.join(_SCRATCH_DIR, "singleflight")
+
+
+class _Upstream(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+    # Status codes (and Retry-After values) to answer with before succeeding.
+    script: List[tuple] = []
+    delay_sec = 0.0
+    ports: List[int] = []
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def _reply(self, status: int, body: bytes, headers: Dict[str, str]) -> None:
+        self.send_response(status)
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_HEAD(self) -> None:
+        self._reply(200, b"", {})
+
+    def do_POST(self) -> None:
+        length = int(self.headers.get("Content-Length", "0"))
+        body = self.rfile.read(length)
+        type(self).ports.append(self.client_address[1])
+        if self.delay_sec:
+            time.sleep(self.delay_sec)
+        if type(self).script:
+            status, retry_after = type(self).script.pop(0)
+            self._reply(status, b"busy", {"Retry-After": retry_after} if retry_after is not None else {})
+            return
+        # Echo the uploaded bytes so the caller can tell the multipart body was re-sent intact.
+        self._reply(200, body, {"Content-Type": "audio/wav"})
+
+
+class _Server(ThreadingHTTPServer):
+    # The default listen backlog (5) makes bursts of new connections wait for SYN retries.
+    request_queue_size = 64
+
+
+def _server() -> ThreadingHTTPServer:
+    server = _Server(("127.0.0.1", 0), _Upstream)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def _provider(server: ThreadingHTTPServer, **env: str) -> ElevenLabsVoiceChangerHTTP:
+    os.environ.update(env)
+    try:
+        return ElevenLabsVoiceChangerHTTP(api_key="test", base_url=f"http://127.0.0.1:{server.server_port}")
+    finally:
+        for k in env:
+            os.environ.pop(k, None)
+
+
+def _convert(provider: ElevenLabsVoiceChangerHTTP, path: str):
+    return provider.convert(voice_id="v", audio_path=path, model_id=None, stability=5, similarity=5, output_format="wav")
+
+
+def test_retry_after_parsing() -> None:
+    assert retry_after_seconds("3") == 3.0
+    assert retry_after_seconds(None) is None and retry_after_seconds("soon") is None
+    future = retry_after_seconds(formatdate(time.time() + 60, usegmt=True))
+    assert future is not None and 55 <= future <= 60
+    assert retry_after_seconds(formatdate(time.time() - 60, usegmt=True)) == 0.0
+    for attempt in range(1, 6):
+        delay = backoff_seconds(attempt, 0.5, 4.0)
+        full = min(4.0, 0.5 * 2 ** (attempt - 1))
+        assert full / 2 <= delay <= full
+
+
+def _check_keepalive_and_retries(d: str, server: ThreadingHTTPServer) -> None:
+    src = os.path.join(d, "in.wav")
+    VoiceChangeStep()._synthesize_wav(src, duration_sec=0.1)
+    provider = _provider(server, ELEVEN_RETRY_BACKOFF_SEC="0.01")
+
+    _Upstream.ports.clear()
+    first = _convert(provider, src)
+    second = _convert(provider, src)
+    assert first.meta["http"]["new_connections"] == 1 and first.meta["http"]["handshake_ms"] >= 0
+    assert second.meta["http"]["new_connections"] == 0, second.meta["http"]
+    assert _Upstream.ports[0] == _Upstream.ports[1]  # same client socket
+
+    # out_path: the body is streamed to disk, nothing is buffered in the result.
+    streamed_path = os.path.join(d, "streamed.wav")
+    streamed = provider.convert(
+        voice_id="v", audio_path=src, model_id=None, stability=5, similarity=5, output_format="wav", out_path=streamed_path,
+    )
+    assert streamed.path == streamed_path and streamed.audio_bytes == b""
+    with open(streamed_path, "rb") as f, open(src, "rb") as original:
+        body = f.read()
+        assert original.read() in body and len(body) == len(second.audio_bytes)
+
+    # 503 with Retry-After: 0, then a 429 without it (jittered backoff), then success.
+    _Upstream.script[:] = [(503, "0"), (429, None)]
+    result = _convert(provider, src)
+    http = result.meta["http"]
+    assert http["attempts"] == 3 and http["retries"] == 2 and http["retry_statuses"] == [503, 429], http
+    with open(src, "rb") as f:
+        assert f.read() in result.audio_bytes  # the file was rewound for each attempt
+
+    # Non-retryable status, or a Retry-After longer than ELEVEN_RETRY_MAX_SEC: no retry.
+    for script in ([(400, None)], [(503, "120")]):
+        _Upstream.script[:] = list(script)
+        try:
+            _convert(provider, src)
+            raise AssertionError("expected ElevenLabsProviderError")
+        except ElevenLabsProviderError as e:
+            assert e.status_code == script[0][0]
+        assert not _Upstream.script
+
+    # Exhausted retries surface the last status.
+    _Upstream.script[:] = [(502, "0")] * 3
+    try:
+        _convert(provider, src)
+        raise AssertionError("expected ElevenLabsProviderError")
+    except ElevenLabsProviderError as e:
+        assert e.status_code == 502
+
+    stats = provider.pool_stats()
+    assert stats["new_connections"] == 1 and stats["retries"] == 4 and stats["in_flight"] == 0, stats
+
+
+def test_keepalive_and_retries() -> None:
+    server = _server()
+    try:
+        with tempfile.TemporaryDirectory() as d:
+            _check_keepalive_and_retries(d, server)
+    finally:
+        _Upstream.script.clear()
+        server.shutdown()
+
+
+def test_pool_is_bounded() -> None:
+    server = _server()
+    _Upstream.delay_sec = 0.2
+    try:
+        session = PooledSession(pool_size=2, retries=0)
+        url = f"http://127.0.0.1:{server.server_port}/x"
+        metas: List[Dict] = []
+        lock = threading.Lock()
+
+        def _post() -> None:
+            resp, meta = session.request("POST", url, timeout=5, data=b"x")
+            assert resp.ok
+            with lock:
+                metas.append(meta)
+
+        threads = [threading.Thread(target=_post) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert sum(m["new_connections"] for m in metas) == 2, metas
+        saturated = [m for m in metas if m["pool_saturated"]]
+        assert saturated and max(m["pool_wait_ms"] for m in saturated) >= 100, metas
+        assert session.stats()["saturated"] == len(saturated)
+    finally:
+        _Upstream.delay_sec = 0.0
+        server.shutdown()
+
+
+def test_warmup() -> None:
+    server = _server()
+    try:
+        provider = _provider(server)
+        os.environ["ELEVEN_WARMUP_CONNECTIONS"] = "3"
+        try:
+            warm = provider.warmup()
+        finally:
+            os.environ.pop("ELEVEN_WARMUP_CONNECTIONS", None)
+        assert warm["connections"] == 3 and not warm["errors"], warm
+        with tempfile.TemporaryDirectory() as d:
+            src = os.path.join(d, "in.wav")
+            VoiceChangeStep()._synthesize_wav(src, duration_sec=0.1)
+            assert _convert(provider, src).meta["http"]["new_connections"] == 0
+    finally:
+        server.shutdown()
+
+
+def _check_async(d: str, server: ThreadingHTTPServer) -> None:
+    src = os.path.join(d, "in.wav")
+    VoiceChangeStep()._synthesize_wav(src, duration_sec=0.1)
+    provider = _provider(server, ELEVEN_RETRY_BACKOFF_SEC="0.01", ELEVEN_POOL_SIZE="10")
+    assert provider.supports_async
+
+    async def _many(n: int) -> list:
+        return await asyncio.gather(*[
+            provider.aconvert(
+                voice_id="v", audio_path=src, model_id=None, stability=5, similarity=5, output_format="wav",
+                out_path=os.path.join(d, f"out{i}.wav"),
+            )
+            for i in range(n)
+        ])
+
+    # 20 conversions of 0.3s each on one thread: two waves through the 10-connection pool.
+    _Upstream.delay_sec = 0.3
+    start = time.perf_counter()
+    results = asyncio.run(_many(20))
+    elapsed = time.perf_counter() - start
+    _Upstream.delay_sec = 0.0
+    assert elapsed < 1.5, elapsed  # one at a time would take 6s
+    assert all(r.path and os.path.getsize(r.path) > 0 and r.meta["http"]["async"] for r in results)
+    assert sum(r.meta["http"]["new_connections"] for r in results) == 10
+    assert any(r.meta["http"]["pool_saturated"] for r in results)
+
+    _Upstream.script[:] = [(503, "0")]
+    retried = asyncio.run(_many(1))[0]
+    assert retried.meta["http"]["retry_statuses"] == [503]
+
+    # Pipeline.arun awaits the provider on the loop through the registry route.
+    reg = get_provider_registry()
+    reg.register("eleven_test", lambda: provider)
+    reg.add_route("async_*", ["eleven_test"], first=True)
+    try:
+        ctx = TaskContext(task_id="t", task_dir=os.path.join(d, "task"), voice_id="async_voice", stability=5, similarity=5, output_format="wav")
+        out = asyncio.run(Pipeline([VoiceChangeStep()]).arun(Artifact(path=src, mime="audio/wav"), ctx))
+        assert out.meta["provider"] == "eleven_test" and ctx.debug["provider"]["transport"] == "async", ctx.debug
+        assert out.path == ctx.path("converted.wav") and "voice_change" in ctx.debug["timing"]
+
+        # A deadline stops an in-flight upstream call instead of waiting for it.
+        _Upstream.delay_sec = 2.0
+        ctx = TaskContext(task_id="t2", task_dir=os.path.join(d, "task2"), voice_id="async_voice", stability=5, similarity=5, output_format="wav")
+        ctx.cancel_token.set_deadline(0.3)
+        start = time.perf_counter()
+        try:
+            asyncio.run(Pipeline([VoiceChangeStep()]).arun(Artifact(path=src, mime="audio/wav"), ctx))
+            raise AssertionError("expected TaskCancelled")
+        except TaskCancelled:
+            pass
+        assert time.perf_counter() - start < 1.5
+    finally:
+        _Upstream.delay_sec = 0.0
+        reg.routes[:] = [r for r in reg.routes if r.pattern != "async_*"]
+
+
+def test_async_convert() -> None:
+    if httpx is None:
+        print("SKIP: httpx not installed")
+        return
+    server = _server()
+    try:
+        with tempfile.TemporaryDirectory() as d:
+            _check_async(d, server)
+    finally:
+        _Upstream.script.clear()
+        server.shutdown()
+
+
+def main() -> None:
+    test_retry_after_parsing()
+    test_keepalive_and_retries()
+    test_pool_is_bounded()
+    test_warmup()
+    test_async_convert()
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""Checks for the provider registry (app/services/providers/registry.py): routing, health, latency mode,
+and the voice change step going through it.
+
+Usage:
+  python test_provider_registry.py
+"""
+
+from __future__ import annotations
+
+import atexit
+import os
+import shutil
+import tempfile
+import time
+
+from app.core.artifacts import Artifact, TaskContext
+from app.services import singleflight as sf_mod
+from app.services.providers import registry as registry_mod
+from app.services.providers.base import ProviderError, VoiceChangeResult
+from app.services.providers.registry import ProviderRegistry, _parse_routes, get_provider_registry
+from app.steps.voice_change import VoiceChangeStep
+
+
+# Keep the state these checks leave behind out of the real runs/ tree.
+_SCRATCH_DIR = tempfile.mkdtemp(prefix="vc_test_")
+atexit.register(shutil.rmtree, _SCRATCH_DIR, True)
+sf_mod.SF_DIR = os.path.join(_SCRATCH_DIR, "singleflight")
+
+
+class _FakeProvider:
+    name = "fake"
+
+    def __init__(self, fail: bool = False, bug: bool = False) -> None:
+        self.fail = fail
+        self.bug = bug
+        self.calls = 0
+
+    def convert(self, *, voice_id, audio_path, output_format="wav", **kwargs) -> VoiceChangeResult:
+        self.calls += 1
+        if self.fail:
+            raise ProviderError("upstream down")
+        if self.bug:
+            raise KeyError("oops")
+        with open(audio_path, "rb") as f:
+            return VoiceChangeResult(audio_bytes=f.read(), mime="audio/wav", meta={"backend": "fake"})
+
+
+def _no_provider() -> _FakeProvider:
+    raise RuntimeError("not configured")
+
+
+def test_routing_and_health() -> None:
+    a, b = _FakeProvider(), _FakeProvider()
+    reg = ProviderRegistry()
+    reg.register("a", lambda: a)
+    reg.register("b", lambda: b)
+    reg.register("missing", _no_provider)
+    reg.add_route("demo_*", ["missing", "a", "b"])
+    reg.add_route("*", ["b"])
+
+    assert reg.route("demo_x") == ("a", a)
+    assert reg.route("other") == ("b", b)
+    assert reg.route(None) == ("b", b)
+    stats = reg.stats()["providers"]
+    assert stats["missing"]["available"] is False and stats["missing"]["unavailable_reason"] == "not configured"
+
+    # Consecutive failures past VC_PROVIDER_UNHEALTHY_AFTER move traffic to the next candidate...
+    os.environ["VC_PROVIDER_UNHEALTHY_AFTER"] = "2"
+    os.environ["VC_PROVIDER_COOLDOWN_SEC"] = "0.2"
+    try:
+        reg.record("a", False, 0.1, "boom")
+        assert reg.route("demo_x")[0] == "a"
+        reg.record("a", False, 0.1, "boom")
+        assert reg.route("demo_x")[0] == "b"
+        assert reg.stats()["providers"]["a"]["healthy"] is False
+        # ...until the cooldown lets it be tried again; one success resets it.
+        time.sleep(0.25)
+        assert reg.route("demo_x")[0] == "a"
+        reg.record("a", True, 0.1)
+        assert reg.stats()["providers"]["a"]["consecutive_errors"] == 0
+    finally:
+        os.environ.pop("VC_PROVIDER_UNHEALTHY_AFTER", None)
+        os.environ.pop("VC_PROVIDER_COOLDOWN_SEC", None)
+
+
+def test_latency_mode() -> None:
+    reg = ProviderRegistry()
+    reg.register("slow", _FakeProvider)
+    reg.register("fast", _FakeProvider)
+    reg.add_route("*", ["slow", "fast"])
+    reg.record("slow", True, 0.5)
+    reg.record("fast", True, 0.05)
+    assert reg.route("v")[0] == "slow"
+    os.environ["VC_PROVIDER_ROUTING"] = "latency"
+    try:
+        assert reg.route("v")[0] == "fast"
+        assert reg.stats()["routing"] == "latency"
+    finally:
+        os.environ.pop("VC_PROVIDER_ROUTING", None)
+
+
+def test_parse_routes() -> None:
+    routes = _parse_routes("eleven_*=elevenlabs; demo_*=funny_voice,elevenlabs;bad;=x;empty=")
+    assert [(r.pattern, r.providers) for r in routes] == [
+        ("eleven_*", ["elevenlabs"]),
+        ("demo_*", ["funny_voice", "elevenlabs"]),
+    ]
+
+
+def _check_step(d: str) -> None:
+    src = os.path.join(d, "in.wav")
+    VoiceChangeStep()._synthesize_wav(src, duration_sec=0.2)
+
+    def _ctx(voice_id: str) -> TaskContext:
+        return TaskContext(task_id="t", task_dir=os.path.join(d, voice_id), voice_id=voice_id, stability=5, similarity=5, output_format="wav")
+
+    reg = get_provider_registry()
+    ok, broken, buggy = _FakeProvider(), _FakeProvider(fail=True), _FakeProvider(bug=True)
+    reg.register("fake_ok", lambda: ok)
+    reg.register("fake_broken", lambda: broken)
+    reg.register("fake_buggy", lambda: buggy)
+    reg.add_route("fake_ok_*", ["fake_ok"], first=True)
+    reg.add_route("fake_broken_*", ["fake_broken"], first=True)
+    reg.add_route("fake_buggy_*", ["fake_buggy"], first=True)
+    try:
+        step = VoiceChangeStep()
+        ctx = _ctx("fake_ok_voice")
+        assert step.ffmpeg_stage(Artifact(path=src, mime="audio/wav"), ctx) is None
+        out = step.run(Artifact(path=src, mime="audio/wav"), ctx)
+        assert out.meta["provider"] == "fake_ok" and out.meta["provider_status"] == "ok", out.meta
+        assert ctx.debug["provider"] == {"name": "fake_ok", "status": "ok", "backend": "fake"}
+        assert ok.calls == 1 and reg.stats()["providers"]["fake_ok"]["calls"] == 1
+
+        ctx = _ctx("fake_broken_voice")
+        out = step.run(Artifact(path=src, mime="audio/wav"), ctx)
+        assert out.meta["provider_status"] == "error_fallback" and out.meta["note"] == "upstream down"
+        with open(src, "rb") as a, open(out.path, "rb") as b:
+            assert a.read() == b.read()  # default fallback keeps the input
+        assert reg.stats()["providers"]["fake_broken"]["errors"] == 1
+
+        # Only ProviderError gets the fallback: anything else fails the task.
+        try:
+            step.run(Artifact(path=src, mime="audio/wav"), _ctx("fake_buggy_voice"))
+            raise AssertionError("expected KeyError")
+        except KeyError:
+            pass
+        assert reg.stats()["providers"]["fake_buggy"]["errors"] == 1
+
+        # Built-in funny voices still route locally (and fuse when ffmpeg is present).
+        routed = reg.route("anime_uncle")
+        assert routed is not None and routed[0] == "funny_voice"
+        assert reg.route("anime_uncle")[1] is routed[1]
+        if shutil.which("ffmpeg"):
+            assert step.ffmpeg_stage(Artifact(path=src, mime="audio/wav"), _ctx("anime_uncle")) is not None
+            # Unfused, the provider renders straight into converted.wav.
+            ctx = _ctx("anime_uncle")
+            out = step.run(Artifact(path=src, mime="audio/wav"), ctx)
+            assert out.meta["provider_status"] == "ok" and out.path == ctx.path("converted.wav") and os.path.getsize(out.path) > 44
+            result = routed[1].convert(voice_id="anime_uncle", audio_path=src, out_path=os.path.join(d, "direct.wav"))
+            assert result.path == os.path.join(d, "direct.wav") and result.audio_bytes == b""
+    finally:
+        reg.routes[:] = [r for r in reg.routes if not r.pattern.startswith("fake_")]
+
+
+def test_voice_change_step_uses_registry() -> None:
+    with tempfile.TemporaryDirectory() as d:
+        _check_step(d)
+
+
+def test_no_provider_keeps_mock_fallback() -> None:
+    if os.getenv("ELEVEN_API_KEY"):
+        print("SKIP: ELEVEN_API_KEY is set")
+        return
+    with tempfile.TemporaryDirectory() as d:
+        ctx = TaskContext(task_id="t", task_dir=d, voice_id="some_upstream_voice", stability=5, similarity=5, output_format="wav")
+        out = VoiceChangeStep().run(Artifact(path=os.path.join(d, "missing.wav"), mime="audio/wav"), ctx)
+        assert out.meta["provider"] == "mock" and out.meta["provider_status"] == "disabled_no_api_key", out.meta
+        assert registry_mod.provider_stats()["providers"]["elevenlabs"]["available"] is False
+
+
+def main() -> None:
+    test_routing_and_health()
+    test_latency_mode()
+    test_parse_routes()
+    test_voice_change_step_uses_registry()
+    test_no_provider_keeps_mock_fallback()
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
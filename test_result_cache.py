@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""Checks for the content-addressed result cache (app/services/result_cache.py).
+
+Usage:
+  python test_result_cache.py
+"""
+
+from __future__ import annotations
+
+import os
+import tempfile
+import time
+
+from app.services import result_cache
+from app.services.result_cache import ResultCache, cache_key, evict
+
+
+def _publish(outputs_dir: str, name: str, size: int = 100) -> None:
+    with open(os.path.join(outputs_dir, name), "wb") as f:
+        f.write(b"x" * size)
+
+
+def _isolated(d: str) -> None:
+    result_cache.CACHE_DIR = os.path.join(d, "result_cache")
+    result_cache.OUTPUTS_DIR = os.path.join(d, "outputs")
+    os.makedirs(result_cache.OUTPUTS_DIR)
+
+
+def _check_multi_format(d: str) -> None:
+    _isolated(d)
+    outputs = result_cache.OUTPUTS_DIR
+    for name in ("t1.mp3", "t1.opus", "t1.flac"):
+        _publish(outputs, name)
+    meta = {
+        "public_name": "t1.mp3",
+        "public_url": "/outputs/t1.mp3",
+        "produced_format": "mp3",
+        "outputs": {"mp3": "/outputs/t1.mp3", "opus": "/outputs/t1.opus", "flac": "/outputs/t1.flac"},
+    }
+    cache = ResultCache()
+    cache.store("k1", task_id="t1", artifact_meta=meta)
+    hit = cache.lookup("k1")
+    assert hit is not None and hit["output_names"] == ["t1.mp3", "t1.opus", "t1.flac"], hit
+    assert hit["size"] == 300
+
+    # cleanup_runs.py aged out one secondary format: not a hit any more (its URL would be dead).
+    os.remove(os.path.join(outputs, "t1.opus"))
+    assert cache.lookup("k1") is None
+    assert not os.path.exists(os.path.join(result_cache.CACHE_DIR, "k1.json"))
+
+    # Eviction removes every format of an entry.
+    for name in ("t2.mp3", "t2.opus"):
+        _publish(outputs, name)
+    cache.store("k2", task_id="t2", artifact_meta={
+        "public_name": "t2.mp3",
+        "outputs": {"mp3": "/outputs/t2.mp3", "opus": "/outputs/t2.opus"},
+    })
+    removed = evict(max_bytes=1, max_age_seconds=0, apply=True)
+    assert [reason for reason, _ in removed] == ["over_budget"], removed
+    assert not os.path.exists(os.path.join(outputs, "t2.mp3")) and not os.path.exists(os.path.join(outputs, "t2.opus"))
+
+
+def test_multi_format_entries() -> None:
+    saved = result_cache.CACHE_DIR, result_cache.OUTPUTS_DIR
+    try:
+        with tempfile.TemporaryDirectory() as d:
+            _check_multi_format(d)
+    finally:
+        result_cache.CACHE_DIR, result_cache.OUTPUTS_DIR = saved
+
+
+def test_cache_key() -> None:
+    params = {"voice_id": "v", "stability": 5, "output_format": "mp3"}
+    key = cache_key("a" * 64, params)
+    assert key == cache_key("a" * 64, dict(reversed(list(params.items()))))  # order-independent
+    assert key != cache_key("b" * 64, params)
+    assert key != cache_key("a" * 64, dict(params, stability=6))
+    assert len(key) == 64
+
+
+def _check_hit_and_ttl(d: str) -> None:
+    _isolated(d)
+    _publish(result_cache.OUTPUTS_DIR, "t.mp3")
+    cache = ResultCache()
+    assert cache.lookup("k") is None
+    cache.store("k", task_id="t", artifact_meta={"public_name": "t.mp3", "produced_format": "mp3"})
+    hit = cache.lookup("k")
+    assert hit["task_id"] == "t" and hit["public_url"] == "/outputs/t.mp3" and hit["hit_count"] == 1
+    assert cache.counters() == {"hits": 1, "misses": 1}
+
+    # Created two TTLs ago but hit just now: still served (same age basis as eviction)...
+    entry_path = os.path.join(result_cache.CACHE_DIR, "k.json")
+    entry = result_cache._read_json(entry_path)
+    entry["created_at"] = time.time() - 200
+    entry["last_hit_at"] = time.time() - 10
+    result_cache._write_json(entry_path, entry)
+    os.environ["VC_RESULT_CACHE_TTL_SEC"] = "100"
+    try:
+        assert cache.lookup("k") is not None
+        # ...and dropped once unused for longer than the TTL.
+        entry = result_cache._read_json(entry_path)
+        entry["last_hit_at"] = time.time() - 150
+        result_cache._write_json(entry_path, entry)
+        assert cache.lookup("k") is None and not os.path.exists(entry_path)
+    finally:
+        os.environ.pop("VC_RESULT_CACHE_TTL_SEC", None)
+
+
+def test_hit_and_ttl() -> None:
+    saved = result_cache.CACHE_DIR, result_cache.OUTPUTS_DIR
+    try:
+        with tempfile.TemporaryDirectory() as d:
+            _check_hit_and_ttl(d)
+    finally:
+        result_cache.CACHE_DIR, result_cache.OUTPUTS_DIR = saved
+
+
+def _check_evict(d: str) -> None:
+    _isolated(d)
+    outputs = result_cache.OUTPUTS_DIR
+    cache = ResultCache()
+    now = time.time()
+    for i, last_used in enumerate([now - 1000, now - 30, now - 20, now - 10]):
+        _publish(outputs, f"t{i}.mp3")
+        cache.store(f"k{i}", task_id=f"t{i}", artifact_meta={"public_name": f"t{i}.mp3"})
+        path = os.path.join(result_cache.CACHE_DIR, f"k{i}.json")
+        entry = result_cache._read_json(path)
+        entry["last_hit_at"] = last_used
+        result_cache._write_json(path, entry)
+    os.remove(os.path.join(outputs, "t3.mp3"))
+    with open(os.path.join(result_cache.CACHE_DIR, "bad.json"), "w") as f:
+        f.write("{")
+
+    dry = evict(max_bytes=150, max_age_seconds=500, apply=False)
+    assert os.path.exists(os.path.join(outputs, "t0.mp3"))  # dry run removes nothing
+    removed = evict(max_bytes=150, max_age_seconds=500, apply=True)
+    assert sorted(dry) == sorted(removed)
+    reasons = {os.path.basename(path): reason for reason, path in removed}
+    # k0 too old, k3 lost its output, then least recently used first until 150 bytes fit: k1 goes, k2 stays.
+    assert reasons == {"bad.json": "corrupt", "k0.json": "expired", "k3.json": "missing_output", "k1.json": "over_budget"}, reasons
+    assert sorted(os.listdir(outputs)) == ["t2.mp3"]
+    assert cache.lookup("k2") is not None
+
+
+def test_evict() -> None:
+    saved = result_cache.CACHE_DIR, result_cache.OUTPUTS_DIR
+    try:
+        with tempfile.TemporaryDirectory() as d:
+            _check_evict(d)
+    finally:
+        result_cache.CACHE_DIR, result_cache.OUTPUTS_DIR = saved
+
+
+def main() -> None:
+    test_cache_key()
+    test_hit_and_ttl()
+    test_evict()
+    test_multi_format_entries()
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
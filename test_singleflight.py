@@ -0,0 +1,361 @@
+#!/usr/bin/env python3
+"""Checks for singleflight coalescing of identical conversions (app/services/singleflight.py):
+in-process followers, different parameters, failed leaders, the async path, fused ffmpeg groups,
+the deadline-bounded follower wait and the file lock shared by workers.
+
+Usage:
+  python test_singleflight.py
+"""
+
+from __future__ import annotations
+
+import asyncio
+import atexit
+import os
+import shutil
+import tempfile
+import threading
+import time
+from typing import List
+
+from app.core import pipeline as pipeline_mod
+from app.core.artifacts import Artifact, TaskContext
+from app.core.cancellation import CancelToken, TaskCancelled, use_token
+from app.core.pipeline import FfmpegStage, Pipeline
+from app.services import singleflight as sf_mod
+from app.services.ffmpeg import FfmpegRun
+from app.services.providers.base import ProviderError, VoiceChangeResult
+from app.services.providers.registry import get_provider_registry
+from app.services.singleflight import FileLocks, SingleFlight
+from app.steps.standardize import StandardizeStep
+from app.steps.voice_change import VoiceChangeStep
+
+
+# Keep the state these checks leave behind out of the real runs/ tree.
+_SCRATCH_DIR = tempfile.mkdtemp(prefix="vc_test_")
+atexit.register(shutil.rmtree, _SCRATCH_DIR, True)
+sf_mod.SF_DIR = os.path.join(_SCRATCH_DIR, "singleflight")
+
+
+class _SlowProvider:
+    name = "slow"
+
+    def __init__(self, delay_sec: float = 0.3, fail: bool = False) -> None:
+        self.delay_sec = delay_sec
+        self.fail = fail
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _result(self, audio_path: str) -> VoiceChangeResult:
+        with self._lock:
+            self.calls += 1
+        if self.fail:
+            raise ProviderError("upstream down")
+        with open(audio_path, "rb") as f:
+            return VoiceChangeResult(audio_bytes=f.read()[::-1], mime="audio/wav", meta={"backend": "slow"})
+
+    def convert(self, *, voice_id, audio_path, output_format="wav", **kwargs) -> VoiceChangeResult:
+        time.sleep(self.delay_sec)
+        return self._result(audio_path)
+
+
+class _AsyncSlowProvider(_SlowProvider):
+    supports_async = True
+
+    async def aconvert(self, *, voice_id, audio_path, output_format="wav", **kwargs) -> VoiceChangeResult:
+        await asyncio.sleep(self.delay_sec)
+        return self._result(audio_path)
+
+
+def _ctx(d: str, task_id: str, voice_id: str, stability: int = 5) -> TaskContext:
+    return TaskContext(task_id=task_id, task_dir=os.path.join(d, task_id), voice_id=voice_id, stability=stability, similarity=5, output_format="wav")
+
+
+def _run_threads(step: VoiceChangeStep, artifact: Artifact, ctxs: List[TaskContext]) -> List[Artifact]:
+    outs: List[Artifact] = [None] * len(ctxs)  # type: ignore[list-item]
+
+    def _one(i: int) -> None:
+        outs[i] = step.run(artifact, ctxs[i])
+
+    threads = [threading.Thread(target=_one, args=(i,)) for i in range(len(ctxs))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return outs
+
+
+def _check_step(d: str) -> None:
+    src = os.path.join(d, "in.wav")
+    VoiceChangeStep()._synthesize_wav(src, duration_sec=0.2)
+    artifact = Artifact(path=src, mime="audio/wav", meta={"input_id": "a" * 64})
+    reg = get_provider_registry()
+    slow, broken, aslow = _SlowProvider(), _SlowProvider(fail=True), _AsyncSlowProvider()
+    reg.register("sf_slow", lambda: slow)
+    reg.register("sf_broken", lambda: broken)
+    reg.register("sf_async", lambda: aslow)
+    reg.add_route("sf_slow_*", ["sf_slow"], first=True)
+    reg.add_route("sf_broken_*", ["sf_broken"], first=True)
+    reg.add_route("sf_async_*", ["sf_async"], first=True)
+    step = VoiceChangeStep()
+    try:
+        # Four identical conversions at once: one provider call, three followers share it.
+        ctxs = [_ctx(d, f"t{i}", "sf_slow_voice") for i in range(4)]
+        outs = _run_threads(step, artifact, ctxs)
+        assert slow.calls == 1, slow.calls
+        roles = sorted(c.debug["singleflight"]["role"] for c in ctxs)
+        assert roles == ["follower"] * 3 + ["leader"], roles
+        leader = next(c for c in ctxs if c.debug["singleflight"]["role"] == "leader")
+        assert leader.debug["singleflight"]["followers"] == 3
+        with open(outs[0].path, "rb") as f:
+            body = f.read()
+        for ctx, out in zip(ctxs, outs):
+            assert out.path == ctx.path("converted.wav") and out.meta["provider_status"] == "ok"
+            assert out.meta["converted_path"] == out.path and out.meta["input_id"] == "a" * 64
+            with open(out.path, "rb") as f:
+                assert f.read() == body
+        follower = next(c for c in ctxs if c.debug["singleflight"]["role"] == "follower")
+        assert follower.debug["provider"]["coalesced"] and follower.debug["provider"]["name"] == "sf_slow"
+        assert follower.debug["singleflight"]["leader_task_id"] == leader.task_id
+
+        # Different parameters are different conversions.
+        _run_threads(step, artifact, [_ctx(d, "s5", "sf_slow_voice"), _ctx(d, "s7", "sf_slow_voice", stability=7)])
+        assert slow.calls == 3, slow.calls
+
+        # A failed leader shares nothing: followers convert (and fall back) on their own.
+        ctxs = [_ctx(d, f"b{i}", "sf_broken_voice") for i in range(3)]
+        outs = _run_threads(step, artifact, ctxs)
+        assert broken.calls == 3 and all(o.meta["provider_status"] == "error_fallback" for o in outs)
+
+        # Async providers awaited on the loop coalesce the same way.
+        async def _many() -> list:
+            return await asyncio.gather(*[step.arun(artifact, _ctx(d, f"a{i}", "sf_async_voice")) for i in range(4)])
+
+        outs = asyncio.run(_many())
+        assert aslow.calls == 1 and all(o.meta["provider_status"] == "ok" for o in outs), aslow.calls
+
+        # So do sync providers under arun(): the leader converts on the pipeline executor while
+        # the followers wait on the loop.
+        async def _many_sync() -> list:
+            return await asyncio.gather(*[step.arun(artifact, _ctx(d, f"y{i}", "sf_slow_voice")) for i in range(4)])
+
+        outs = asyncio.run(_many_sync())
+        assert slow.calls == 4 and all(o.meta["provider_status"] == "ok" for o in outs), slow.calls
+
+        # Batch children get the standardized artifact without an input_id: the key falls back to
+        # hashing the file, on the singleflight executor rather than the event loop, and still coalesces.
+        threads = set()
+        flight_key = step._flight_key
+
+        def _recording_key(*args):
+            threads.add(threading.current_thread().name)
+            return flight_key(*args)
+
+        step._flight_key = _recording_key
+
+        async def _children() -> list:
+            ctxs = [_ctx(d, f"c{i}", "sf_async_voice") for i in range(4)]
+            for c in ctxs:
+                c.debug["batch"] = {"batch_id": "b"}
+            return await asyncio.gather(*[step.arun(Artifact(path=src, mime="audio/wav"), c) for c in ctxs])
+
+        try:
+            outs = asyncio.run(_children())
+        finally:
+            del step._flight_key
+        assert aslow.calls == 2 and all(o.meta["provider_status"] == "ok" for o in outs), aslow.calls
+        assert threads and all(name.startswith("vc-singleflight") for name in threads), threads
+
+        # VC_SINGLEFLIGHT=0 turns it off.
+        os.environ["VC_SINGLEFLIGHT"] = "0"
+        try:
+            _run_threads(step, artifact, [_ctx(d, f"off{i}", "sf_slow_voice") for i in range(2)])
+        finally:
+            os.environ.pop("VC_SINGLEFLIGHT", None)
+        assert slow.calls == 6, slow.calls
+    finally:
+        reg.routes[:] = [r for r in reg.routes if not r.pattern.startswith("sf_")]
+
+
+def test_step_coalesces_identical_conversions() -> None:
+    previous = sf_mod._singleflight
+    with tempfile.TemporaryDirectory() as d:
+        sf_mod._singleflight = SingleFlight(FileLocks(os.path.join(d, "singleflight")))
+        try:
+            _check_step(d)
+        finally:
+            sf_mod._singleflight = previous
+
+
+class _FilterStep:
+    def __init__(self, name: str, output_name: str) -> None:
+        self.name = name
+        self.output_name = output_name
+
+    def ffmpeg_stage(self, artifact: Artifact, ctx: TaskContext) -> FfmpegStage:
+        return FfmpegStage(filters=[f"volume=1.{len(self.name)}"], output_name=self.output_name)
+
+    def run(self, artifact: Artifact, ctx: TaskContext) -> Artifact:
+        raise AssertionError("fused groups don't run steps one by one")
+
+
+def test_fused_groups_coalesce() -> None:
+    calls: List[str] = []
+
+    def _transcode(in_path: str, out_path: str, **kwargs) -> FfmpegRun:
+        calls.append(out_path)
+        time.sleep(0.3)
+        shutil.copyfile(in_path, out_path)
+        return FfmpegRun(run_sec=0.3)
+
+    async def _atranscode(in_path: str, out_path: str, **kwargs) -> FfmpegRun:
+        calls.append(out_path)
+        await asyncio.sleep(0.3)
+        shutil.copyfile(in_path, out_path)
+        return FfmpegRun(run_sec=0.3)
+
+    previous = sf_mod._singleflight, pipeline_mod.transcode_audio, pipeline_mod.transcode_audio_async
+    pipeline_mod.transcode_audio, pipeline_mod.transcode_audio_async = _transcode, _atranscode
+    with tempfile.TemporaryDirectory() as d:
+        sf_mod._singleflight = SingleFlight(FileLocks(os.path.join(d, "singleflight")))
+        try:
+            src = os.path.join(d, "in.wav")
+            VoiceChangeStep()._synthesize_wav(src, duration_sec=0.1)
+            artifact = Artifact(path=src, mime="audio/wav", meta={"sha256": "f" * 64})
+            pipeline = Pipeline([_FilterStep("a", "a.wav"), _FilterStep("bb", "out.wav")])
+
+            ctxs = [_ctx(d, f"f{i}", "v") for i in range(3)]
+            outs: List[Artifact] = [None] * len(ctxs)  # type: ignore[list-item]
+            threads = [threading.Thread(target=lambda i=i: outs.__setitem__(i, pipeline.run(artifact, ctxs[i]))) for i in range(3)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            assert len(calls) == 1, calls
+            roles = sorted(c.debug["singleflight"]["role"] for c in ctxs)
+            assert roles == ["follower", "follower", "leader"], roles
+            for ctx, out in zip(ctxs, outs):
+                assert out.path == ctx.path("out.wav") and os.path.getsize(out.path) == os.path.getsize(src)
+                assert ctx.debug["fused"][0]["steps"] == ["a", "bb"]
+
+            async def _many() -> list:
+                return await asyncio.gather(*[pipeline.arun(artifact, _ctx(d, f"g{i}", "v")) for i in range(3)])
+
+            outs = asyncio.run(_many())
+            assert len(calls) == 2 and all(os.path.isfile(o.path) for o in outs), calls
+        finally:
+            sf_mod._singleflight, pipeline_mod.transcode_audio, pipeline_mod.transcode_audio_async = previous
+
+
+def test_follower_wait_ends_at_the_deadline() -> None:
+    flight = SingleFlight(FileLocks(os.path.join(_SCRATCH_DIR, "deadline")))
+    with tempfile.TemporaryDirectory() as d:
+        src = os.path.join(d, "in.wav")
+        VoiceChangeStep()._synthesize_wav(src, duration_sec=0.1)
+        artifact = Artifact(path=src, mime="audio/wav")
+        converted: List[str] = []
+
+        def _convert(ctx: TaskContext, delay: float) -> Artifact:
+            converted.append(ctx.task_id)
+            time.sleep(delay)
+            return Artifact(path=src, mime="audio/wav", meta={"provider_status": "ok"})
+
+        leader_ctx, follower_ctx = _ctx(d, "dl", "v"), _ctx(d, "df", "v")
+        leader = threading.Thread(target=lambda: flight.run("d" * 64, leader_ctx, artifact, leader_ctx.path("c.wav"), lambda: _convert(leader_ctx, 1.5)))
+        leader.start()
+        time.sleep(0.1)
+        started = time.monotonic()
+        try:
+            with use_token(CancelToken(deadline_sec=0.3)):
+                flight.run("d" * 64, follower_ctx, artifact, follower_ctx.path("c.wav"), lambda: _convert(follower_ctx, 0))
+            raise AssertionError("expected TaskCancelled")
+        except TaskCancelled as e:
+            assert e.reason == "deadline_exceeded"
+        assert time.monotonic() - started < 1.0 and converted == ["dl"], converted
+        leader.join()
+
+
+def test_standardize_always_carries_input_id() -> None:
+    # Not only on input store hits: the upload hash rides along so the flight key needs no re-hash.
+    os.environ["VC_INPUT_STORE"] = "0"
+    try:
+        with tempfile.TemporaryDirectory() as d:
+            src = os.path.join(d, "in.wav")
+            VoiceChangeStep()._synthesize_wav(src, duration_sec=0.2)
+            media = {"duration_sec": 0.2, "container": "wav", "codec": "pcm_s16le", "sample_rate": 16000, "channels": 1}
+            artifact = Artifact(path=src, mime="audio/wav", meta={"sha256": "b" * 64, "media": media})
+            out = StandardizeStep().run(artifact, _ctx(d, "std", "v"))
+            assert out.path != src and out.meta["input_id"] == "b" * 64, out.meta
+    finally:
+        os.environ.pop("VC_INPUT_STORE", None)
+
+
+def _check_file_lock(d: str) -> None:
+    # Two SingleFlight instances over one directory stand in for two workers.
+    root = os.path.join(d, "singleflight")
+    worker_a, worker_b = SingleFlight(FileLocks(root)), SingleFlight(FileLocks(root))
+    src = os.path.join(d, "in.wav")
+    VoiceChangeStep()._synthesize_wav(src, duration_sec=0.1)
+    artifact = Artifact(path=src, mime="audio/wav")
+    calls: List[str] = []
+
+    def _convert(ctx: TaskContext) -> Artifact:
+        calls.append(ctx.task_id)
+        time.sleep(0.3)
+        with open(src, "rb") as f, open(ctx.path("converted.wav"), "wb") as out:
+            out.write(f.read())
+        ctx.debug["provider"] = {"name": "fake", "status": "ok"}
+        return Artifact(path=ctx.path("converted.wav"), mime="audio/wav", meta={"provider": "fake", "provider_status": "ok"})
+
+    ctx_a, ctx_b = _ctx(d, "wa", "v"), _ctx(d, "wb", "v")
+    leader = threading.Thread(target=lambda: worker_a.run("k" * 64, ctx_a, artifact, ctx_a.path("converted.wav"), lambda: _convert(ctx_a)))
+    leader.start()
+    time.sleep(0.1)
+    out = worker_b.run("k" * 64, ctx_b, artifact, ctx_b.path("converted.wav"), lambda: _convert(ctx_b))
+    leader.join()
+    assert calls == ["wa"], calls
+    assert ctx_b.debug["singleflight"]["role"] == "follower" and ctx_b.debug["singleflight"]["via"] == "file", ctx_b.debug
+    assert ctx_a.debug["singleflight"] == {"role": "leader", "lock": "file", "followers": 0}
+    assert out.meta["provider"] == "fake" and os.path.getsize(out.path) == os.path.getsize(src)
+
+    # Once the flight is over, the next identical request converts again.
+    ctx_c = _ctx(d, "wc", "v")
+    worker_b.run("k" * 64, ctx_c, artifact, ctx_c.path("converted.wav"), lambda: _convert(ctx_c))
+    assert calls == ["wa", "wc"] and worker_b.stats()["remote_followers"] == 1
+
+
+def test_file_lock_across_workers() -> None:
+    if sf_mod.fcntl is None:
+        print("SKIP: no fcntl")
+        return
+    with tempfile.TemporaryDirectory() as d:
+        _check_file_lock(d)
+
+
+def test_redis_errors_fall_back_to_file_lock() -> None:
+    if sf_mod._redis is None or sf_mod.fcntl is None:
+        print("SKIP: redis package or fcntl missing")
+        return
+    with tempfile.TemporaryDirectory() as d:
+        locks = sf_mod.RedisLocks("redis://127.0.0.1:1/0", root=d)  # nothing listens there
+        other = FileLocks(d)
+        assert locks.try_acquire("k", 5) and not other.try_acquire("k", 5)
+        locks.publish("k", {"path": "x"}, 5)
+        assert locks.result("k")["path"] == "x"
+        locks.release("k")
+        assert other.try_acquire("k", 5)
+        other.release("k")
+
+
+def main() -> None:
+    test_step_coalesces_identical_conversions()
+    test_fused_groups_coalesce()
+    test_follower_wait_ends_at_the_deadline()
+    test_standardize_always_carries_input_id()
+    test_file_lock_across_workers()
+    test_redis_errors_fall_back_to_file_lock()
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()